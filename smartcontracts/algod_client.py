@@ -0,0 +1,385 @@
+"""
+Asynchronous algod client for the off-chain tools of this directory: nft_client.py
+trades against the NFT sale escrows with it, and votes_lifecycle.py drives
+donation_votes challenges.
+
+Requests go over a pool of keep-alive HTTP/1.1 connections to algod, at most
+`connections` of them open. Values that only change once per round, the suggested
+params and the latest block's timestamp, are fetched once per round and shared by
+every caller. Callers waiting for a new round, to confirm a transaction or for the
+chain to reach a time, share one watcher of new blocks, so waiting takes one status
+request per round instead of one per caller.
+
+    async with algod_client.AlgodClient(address, token) as algod:
+        params = await algod.suggested_params()
+        txid = await algod.send_transactions(signed_group)
+        info = await algod.wait_for_confirmation(txid)
+
+run_concurrently() runs many such jobs with at most `concurrency` in flight. Only
+the standard library and py-algorand-sdk are used, and algod_stub.py serves the
+same endpoints locally for tests and benchmarks.
+"""
+import asyncio
+import base64
+import json
+from urllib.parse import urlencode, urlsplit
+
+from algosdk import encoding, error
+from algosdk.future.transaction import SuggestedParams
+
+# Requests to algod in flight at the same time, one keep-alive connection each.
+DEFAULT_CONNECTIONS = 8
+# Jobs run_concurrently() runs at the same time.
+DEFAULT_CONCURRENCY = 32
+# Rounds to wait for a confirmation before giving up.
+DEFAULT_WAIT_ROUNDS = 10
+# Seconds to wait for a response from algod. wait-for-block-after blocks for up to
+# a minute on algod, so it gets more.
+REQUEST_TIMEOUT = 30
+BLOCK_WAIT_TIMEOUT = 90
+
+
+class _RoundCache:
+    """
+    A value fetched at most once per round, with concurrent callers sharing the
+    request in flight.
+    :param fetch: coroutine function returning a tuple of (round, value).
+    """
+
+    def __init__(self, fetch):
+        self.fetch = fetch
+        self.value = None
+        self.round = -1
+        self._pending = None
+
+    async def get(self, current_round):
+        if self.value is not None and self.round >= current_round:
+            return self.value
+        if self._pending is None:
+            self._pending = asyncio.ensure_future(self._fetch())
+        pending = self._pending
+        try:
+            return await asyncio.shield(pending)
+        finally:
+            if self._pending is pending and pending.done():
+                self._pending = None
+
+    async def _fetch(self):
+        self.round, self.value = await self.fetch()
+        return self.value
+
+
+class _Connection:
+    """
+    A keep-alive HTTP/1.1 connection to algod.
+    """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        # Whether the connection served a request before: a server may close an
+        # idle connection, which is only noticed on the next request.
+        self.reused = False
+
+    async def exchange(self, head, body):
+        """
+        :return: tuple of (status, headers, body, keep_alive).
+        """
+        self.writer.write(head + body)
+        await self.writer.drain()
+        line = await self.reader.readline()
+        if not line:
+            raise ConnectionResetError("algod closed the connection")
+        version, status = line.split(None, 2)[:2]
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        keep_alive = (
+            version == b"HTTP/1.1" and headers.get("connection", "").lower() != "close"
+        )
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            data = await self._read_chunked()
+        elif "content-length" in headers:
+            data = await self.reader.readexactly(int(headers["content-length"]))
+        else:
+            data = await self.reader.read()
+            keep_alive = False
+        return int(status), headers, data, keep_alive
+
+    async def _read_chunked(self):
+        chunks = []
+        while True:
+            size = int((await self.reader.readline()).split(b";")[0], 16)
+            if not size:
+                # Skip the trailers up to the blank line that ends the body.
+                while (await self.reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                return b"".join(chunks)
+            chunks.append(await self.reader.readexactly(size))
+            await self.reader.readexactly(2)
+
+    def close(self):
+        self.writer.close()
+
+
+class AlgodClient:
+    """
+    The algod endpoints the tools use, over a pool of keep-alive connections.
+    Create it inside the event loop that uses it, and close it, or use it as an
+    async context manager.
+    """
+
+    def __init__(
+        self, address, token="", headers=None, connections=DEFAULT_CONNECTIONS
+    ):
+        url = urlsplit(address)
+        self.host = url.hostname
+        self.ssl = url.scheme == "https"
+        self.port = url.port or (443 if self.ssl else 80)
+        self.base_path = url.path.rstrip("/")
+        self.headers = {"X-Algo-API-Token": token} if token else {}
+        self.headers.update(headers or {})
+        self._idle = []
+        self._slots = asyncio.Semaphore(connections)
+        # Connections opened and requests sent, to check the pool is reused.
+        self.opened = 0
+        self.requests = 0
+        # Highest round seen in a response.
+        self.last_round = 0
+        self._params = _RoundCache(self._fetch_params)
+        self._timestamp = _RoundCache(self._fetch_timestamp)
+        self._block_watcher = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        if self._block_watcher is not None:
+            self._block_watcher.cancel()
+        while self._idle:
+            self._idle.pop().close()
+
+    async def _connect(self):
+        reader, writer = await asyncio.open_connection(
+            self.host, self.port, ssl=self.ssl or None
+        )
+        self.opened += 1
+        return _Connection(reader, writer)
+
+    def _head(self, method, path, params, body, content_type):
+        target = self.base_path + path
+        if params:
+            target += "?" + urlencode(params)
+        lines = [
+            "{} {} HTTP/1.1".format(method, target),
+            "Host: {}:{}".format(self.host, self.port),
+            "Content-Length: {}".format(len(body)),
+        ]
+        if content_type:
+            lines.append("Content-Type: " + content_type)
+        lines.extend("{}: {}".format(k, v) for k, v in self.headers.items())
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+    async def request(
+        self,
+        method,
+        path,
+        params=None,
+        body=b"",
+        content_type=None,
+        timeout=REQUEST_TIMEOUT,
+    ):
+        """
+        Sends a request on an idle connection of the pool, or a new one if there is
+        none, waiting for a free slot when `connections` requests are in flight.
+        :return: the decoded JSON response.
+        """
+        head = self._head(method, path, params, body, content_type)
+        async with self._slots:
+            self.requests += 1
+            while True:
+                connection = self._idle.pop() if self._idle else await self._connect()
+                try:
+                    response = await asyncio.wait_for(
+                        connection.exchange(head, body), timeout
+                    )
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    connection.close()
+                    # The server closed the connection while it sat idle in the
+                    # pool, before reading the request: retry on another one.
+                    if connection.reused:
+                        continue
+                    raise
+                except BaseException:
+                    connection.close()
+                    raise
+                break
+            status, _, data, keep_alive = response
+            if keep_alive:
+                connection.reused = True
+                self._idle.append(connection)
+            else:
+                connection.close()
+        try:
+            result = json.loads(data) if data else {}
+        except ValueError:
+            raise error.AlgodResponseError("Failed to parse JSON response from algod")
+        if status >= 400:
+            message = result.get("message", data) if isinstance(result, dict) else data
+            raise error.AlgodHTTPError(message, status)
+        if isinstance(result, dict) and "last-round" in result:
+            self.last_round = max(self.last_round, result["last-round"])
+        return result
+
+    async def status(self):
+        return await self.request("GET", "/v2/status")
+
+    async def status_after_block(self, round_num):
+        return await self.request(
+            "GET",
+            "/v2/status/wait-for-block-after/{}".format(round_num),
+            timeout=BLOCK_WAIT_TIMEOUT,
+        )
+
+    async def pending_transaction_info(self, txid):
+        return await self.request("GET", "/v2/transactions/pending/" + txid)
+
+    async def account_info(self, address):
+        return await self.request("GET", "/v2/accounts/" + address)
+
+    async def application_info(self, app_id):
+        return await self.request("GET", "/v2/applications/{}".format(app_id))
+
+    async def block_info(self, round_num):
+        return await self.request("GET", "/v2/blocks/{}".format(round_num))
+
+    async def suggested_params(self):
+        """
+        :return: the suggested params of the latest round seen. Callers in the same
+            round share one request and one SuggestedParams, which they must copy
+            before changing.
+        """
+        return await self._params.get(self.last_round)
+
+    async def _fetch_params(self):
+        res = await self.request("GET", "/v2/transactions/params")
+        params = SuggestedParams(
+            res["fee"],
+            res["last-round"],
+            res["last-round"] + 1000,
+            res["genesis-hash"],
+            res["genesis-id"],
+            False,
+            res["consensus-version"],
+            res["min-fee"],
+        )
+        return res["last-round"], params
+
+    async def latest_timestamp(self):
+        """
+        :return: the timestamp of the latest block seen, as LatestTimestamp reads it
+            in the next round.
+        """
+        if not self.last_round:
+            await self.status()
+        return await self._timestamp.get(self.last_round)
+
+    async def _fetch_timestamp(self):
+        round_num = self.last_round
+        res = await self.block_info(round_num)
+        return round_num, res["block"]["ts"]
+
+    async def wait_for_timestamp(self, timestamp):
+        """
+        Waits for a block with a timestamp past `timestamp`.
+        :return: the latest round.
+        """
+        while await self.latest_timestamp() <= timestamp:
+            await self.next_round(self.last_round)
+        return self.last_round
+
+    async def send_transactions(self, txns):
+        """
+        :param txns: signed transactions of a group, in order.
+        :return: the ID of the first transaction.
+        """
+        body = b"".join(base64.b64decode(encoding.msgpack_encode(txn)) for txn in txns)
+        res = await self.request(
+            "POST",
+            "/v2/transactions",
+            body=body,
+            content_type="application/x-binary",
+        )
+        return res["txId"]
+
+    async def next_round(self, after):
+        """
+        Waits for a block after round `after`. Every waiter shares one watcher, which
+        asks algod for the next block only while someone waits for it.
+        :return: the latest round.
+        """
+        while self.last_round <= after:
+            if self._block_watcher is None or self._block_watcher.done():
+                self._block_watcher = asyncio.ensure_future(
+                    self.status_after_block(self.last_round)
+                )
+            await asyncio.shield(self._block_watcher)
+        return self.last_round
+
+    async def wait_for_confirmation(
+        self, txid, wait_rounds=DEFAULT_WAIT_ROUNDS, last_valid=None
+    ):
+        """
+        :param last_valid: the last valid round of the transaction. Past it, the
+            transaction can no longer be confirmed, so the wait stops there instead
+            of after wait_rounds.
+        :return: the pending transaction info of the confirmed transaction.
+        """
+        if not self.last_round:
+            await self.status()
+        start = current = self.last_round
+        if last_valid is not None:
+            wait_rounds = max(last_valid - start, 0)
+        while True:
+            info = await self.pending_transaction_info(txid)
+            if info.get("confirmed-round"):
+                self.last_round = max(self.last_round, info["confirmed-round"])
+                return info
+            if info.get("pool-error"):
+                raise error.AlgodHTTPError(info["pool-error"], 400)
+            if current >= start + wait_rounds:
+                raise error.ConfirmationTimeoutError(
+                    "Wait for transaction id {} timed out".format(txid)
+                )
+            current = await self.next_round(current)
+
+
+async def run_concurrently(jobs, concurrency=DEFAULT_CONCURRENCY):
+    """
+    Runs jobs with at most `concurrency` of them in flight. The next job is taken
+    from `jobs` only when there is room for it, so a generator of jobs is never read
+    ahead of the jobs in flight.
+    :param jobs: iterable of functions without arguments returning a coroutine,
+        e.g. functools.partial(client.buy, ...).
+    :return: list of the result of every job in order, or the exception it raised.
+    """
+    results = {}
+    # Every worker takes its next job from the same iterator.
+    jobs = iter(enumerate(jobs))
+
+    async def worker():
+        for i, job in jobs:
+            try:
+                results[i] = await job()
+            except Exception as e:
+                results[i] = e
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return [results[i] for i in range(len(results))]
@@ -0,0 +1,551 @@
+"""
+A local stand-in for the algod endpoints nft_client.py uses, to test and benchmark
+clients without a node:
+
+    GET  /health
+    GET  /v2/status
+    GET  /v2/status/wait-for-block-after/{round}
+    GET  /v2/transactions/params
+    POST /v2/transactions
+    GET  /v2/transactions/pending/{txid}
+    GET  /v2/blocks/{round}
+    GET  /v2/accounts/{address}
+    GET  /v2/applications/{application-id}
+
+Rounds advance every `block_time` seconds, and each block confirms every group
+submitted since the last one. Block timestamps start at `timestamp` and advance by
+`round_seconds` per block, so a test can let hours of chain time pass in seconds.
+
+Submitted groups are checked the way algod checks them before they reach the pool:
+group ID, validity rounds, genesis hash, pooled fees, duplicate transaction IDs and
+signatures. Single signatures are verified, and a logic sig must be signed by its
+own program's address, but programs are not run and there are no balances, unless
+the stub is given an avm.Ledger. It then applies every group to the ledger as it
+accepts it, and rejects the groups the ledger rejects, with the ledger's latest
+timestamp and round following the blocks. The account and application endpoints
+read the ledger. avm.py runs TEAL source, so programs sent in transactions must be
+registered first with register_program(), which returns their bytecode. `latency`
+delays every response, to stand in for the network round trip.
+
+    python3 algod_stub.py --port 4001 --block-time 4.5
+
+or in-process:
+
+    stub = algod_stub.AlgodStub(block_time=0.1, ledger=avm.Ledger())
+    approval = stub.register_program(approval_teal)
+    address = await stub.start()
+    ...
+    await stub.close()
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import sys
+import time
+
+import msgpack
+from algosdk import encoding
+from nacl.exceptions import BadSignatureError
+from nacl.signing import VerifyKey
+
+import avm
+import teal
+
+DEFAULT_PORT = 4001
+DEFAULT_BLOCK_TIME = 4.5
+GENESIS_ID = "stub-v1"
+GENESIS_HASH = hashlib.sha256(GENESIS_ID.encode()).digest()
+CONSENSUS_VERSION = "stub-consensus-v1"
+MIN_TXN_FEE = 1000
+MAX_GROUP_SIZE = 16
+# Most bytes of a logic sig's program and args together.
+MAX_LOGICSIG_SIZE = 1000
+# Longest wait-for-block-after blocks before returning the current status, as algod.
+MAX_BLOCK_WAIT = 60
+WAIT_FOR_BLOCK = "wait-for-block-after"
+
+# Transaction fields of the msgpack encoding, by the TEAL field they hold.
+TXN_FIELDS = {
+    "snd": "Sender", "fee": "Fee", "fv": "FirstValid", "lv": "LastValid",
+    "note": "Note", "lx": "Lease", "rekey": "RekeyTo", "rcv": "Receiver",
+    "amt": "Amount", "close": "CloseRemainderTo", "xaid": "XferAsset",
+    "aamt": "AssetAmount", "asnd": "AssetSender", "arcv": "AssetReceiver",
+    "aclose": "AssetCloseTo", "apid": "ApplicationID", "apan": "OnCompletion",
+    "apaa": "ApplicationArgs", "apat": "Accounts", "apas": "Assets",
+    "apfa": "Applications",
+}  # fmt: skip
+SCHEMA_FIELDS = {
+    "apgs": ("GlobalNumUint", "GlobalNumByteSlice"),
+    "apls": ("LocalNumUint", "LocalNumByteSlice"),
+}
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed"}
+
+
+class StubError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def _sha512_256(data):
+    return hashlib.new("sha512_256", data).digest()
+
+
+def _txid(raw):
+    """
+    :return: the ID of a transaction from its msgpack encoding, as algod's base32.
+    """
+    return base64.b32encode(_sha512_256(b"TX" + raw)).decode().rstrip("=")
+
+
+def _b64(value):
+    return base64.b64encode(value).decode()
+
+
+def _state(state):
+    """
+    :return: a global or local state in algod's key-value JSON.
+    """
+    entries = []
+    for key, value in sorted(state.items()):
+        if isinstance(value, int):
+            value = {"type": 2, "bytes": "", "uint": value}
+        else:
+            value = {"type": 1, "bytes": _b64(value), "uint": 0}
+        entries.append({"key": _b64(key), "value": value})
+    return entries
+
+
+class AlgodStub:
+    def __init__(
+        self,
+        block_time=DEFAULT_BLOCK_TIME,
+        latency=0.0,
+        min_fee=MIN_TXN_FEE,
+        ledger=None,
+        timestamp=None,
+        round_seconds=None,
+    ):
+        self.block_time = block_time
+        self.latency = latency
+        self.min_fee = min_fee
+        self.ledger = ledger
+        self.round = 1
+        self.round_time = time.monotonic()
+        self.round_seconds = block_time if round_seconds is None else round_seconds
+        self.timestamp = int(time.time()) if timestamp is None else timestamp
+        # Timestamp of every block.
+        self.timestamps = {self.round: self.timestamp}
+        if ledger is not None:
+            ledger.round = self.round
+            ledger.latest_timestamp = self.timestamp
+        # TEAL source of every registered program, by bytecode.
+        self.programs = {}
+        # Transaction ID to the round that confirmed it, 0 while pending, and the
+        # created application ID and logs of the ledger's result.
+        self.transactions = {}
+        self.results = {}
+        self._pending = []
+        self._new_round = None
+        self._server = None
+        self._blocks = None
+        self._handlers = set()
+        # Connections accepted, requests served, suggested params requests served
+        # and groups accepted.
+        self.connections = 0
+        self.requests = 0
+        self.params_requests = 0
+        self.groups = 0
+
+    async def start(self, host="127.0.0.1", port=0):
+        """
+        :return: the address of the server, e.g. http://127.0.0.1:4001.
+        """
+        self._new_round = asyncio.Condition()
+        self._server = await asyncio.start_server(self._serve, host, port)
+        self._blocks = asyncio.ensure_future(self._produce_blocks())
+        port = self._server.sockets[0].getsockname()[1]
+        return "http://{}:{}".format(host, port)
+
+    async def close(self):
+        self._blocks.cancel()
+        self._server.close()
+        for handler in self._handlers:
+            handler.cancel()
+        await asyncio.gather(*self._handlers, return_exceptions=True)
+        await self._server.wait_closed()
+
+    async def _produce_blocks(self):
+        while True:
+            await asyncio.sleep(self.block_time)
+            self.round += 1
+            self.round_time = time.monotonic()
+            self.timestamps[self.round] = int(
+                self.timestamp + (self.round - 1) * self.round_seconds
+            )
+            if self.ledger is not None:
+                self.ledger.round = self.round
+                self.ledger.latest_timestamp = self.timestamps[self.round]
+            for txid in self._pending:
+                self.transactions[txid] = self.round
+            self._pending = []
+            async with self._new_round:
+                self._new_round.notify_all()
+
+    def status(self):
+        return {
+            "last-round": self.round,
+            "time-since-last-round": int((time.monotonic() - self.round_time) * 1e9),
+            "catchup-time": 0,
+            "last-version": CONSENSUS_VERSION,
+            "next-version": CONSENSUS_VERSION,
+            "next-version-round": self.round + 1,
+            "next-version-supported": True,
+            "stopped-at-unsupported-round": False,
+        }
+
+    def params(self):
+        return {
+            "consensus-version": CONSENSUS_VERSION,
+            "fee": 0,
+            "genesis-hash": base64.b64encode(GENESIS_HASH).decode(),
+            "genesis-id": GENESIS_ID,
+            "last-round": self.round,
+            "min-fee": self.min_fee,
+        }
+
+    async def wait_for_block_after(self, round_num):
+        try:
+            async with self._new_round:
+                await asyncio.wait_for(
+                    self._new_round.wait_for(lambda: self.round > round_num),
+                    MAX_BLOCK_WAIT,
+                )
+        except asyncio.TimeoutError:
+            pass
+        return self.status()
+
+    def register_program(self, source):
+        """
+        Registers TEAL source sent in transactions, for the ledger to run.
+        :return: its bytecode.
+        """
+        program = teal.assemble(source)
+        self.programs[program] = source
+        return program
+
+    def pending(self, txid):
+        if txid not in self.transactions:
+            raise StubError("txn does not exist", 404)
+        info = {"pool-error": ""}
+        if self.transactions[txid]:
+            info["confirmed-round"] = self.transactions[txid]
+            info.update(self.results.get(txid, {}))
+        return info
+
+    def block(self, round_num):
+        if round_num not in self.timestamps:
+            raise StubError("failed to retrieve information from the ledger", 404)
+        return {
+            "block": {
+                "rnd": round_num,
+                "ts": self.timestamps[round_num],
+                "gen": GENESIS_ID,
+                "gh": _b64(GENESIS_HASH),
+            }
+        }
+
+    def _ledger(self):
+        if self.ledger is None:
+            raise StubError("the stub has no ledger", 404)
+        return self.ledger
+
+    def account(self, address):
+        ledger = self._ledger()
+        raw = encoding.decode_address(address)
+        assets = ledger.holdings.get(raw, {})
+        local = ledger.local.get(raw, {})
+        return {
+            "address": address,
+            "amount": ledger.balance(raw),
+            "min-balance": ledger.min_balance(raw),
+            "round": self.round,
+            "assets": [
+                {"asset-id": asset_id, "amount": amount, "is-frozen": frozen}
+                for asset_id, (amount, frozen) in sorted(assets.items())
+            ],
+            "apps-local-state": [
+                {"id": app_id, "key-value": _state(state)}
+                for app_id, state in sorted(local.items())
+            ],
+        }
+
+    def application(self, app_id):
+        app = self._ledger().apps.get(app_id)
+        if app is None:
+            raise StubError("application does not exist", 404)
+        return {
+            "id": app_id,
+            "params": {
+                "creator": encoding.encode_address(app.creator),
+                "global-state": _state(app.global_state),
+            },
+        }
+
+    def _avm_transaction(self, stxn, txid):
+        """
+        :return: the avm.Transaction of a decoded signed transaction with ID txid.
+        """
+        txn = stxn["txn"]
+        # Encoded transactions omit zero fields, and a zero fee is one to keep.
+        fields = {
+            "Type": txn["type"].encode(),
+            "Fee": 0,
+            "TxID": base64.b32decode(txid + "===="),
+        }
+        for key, name in TXN_FIELDS.items():
+            if key in txn:
+                fields[name] = txn[key]
+        for key, names in SCHEMA_FIELDS.items():
+            schema = txn.get(key, {})
+            fields[names[0]] = schema.get("nui", 0)
+            fields[names[1]] = schema.get("nbs", 0)
+        for key, name in (("apap", "ApprovalProgram"), ("apsu", "ClearStateProgram")):
+            if key in txn:
+                fields[name] = self._source(txn[key])
+        lsig = None
+        args = ()
+        if "lsig" in stxn:
+            lsig = self._source(stxn["lsig"]["l"])
+            args = stxn["lsig"].get("arg", ())
+        return avm.Transaction(lsig=lsig, lsig_args=args, **fields)
+
+    def _source(self, program):
+        if program not in self.programs:
+            raise StubError("program is not registered with the stub")
+        return self.programs[program]
+
+    def _apply(self, signed, txids):
+        """
+        Applies an accepted group to the ledger.
+        """
+        group = [
+            self._avm_transaction(stxn, txid) for stxn, txid in zip(signed, txids)
+        ]
+        result = self.ledger.execute(group)
+        if not result.ok:
+            raise StubError(
+                "TransactionPool.Remember: transaction {}: {}".format(
+                    txids[result.error.txn or 0], result.error
+                )
+            )
+        for txid, txn in zip(txids, result.txns):
+            info = {}
+            if txn.created_app_id:
+                info["application-index"] = txn.created_app_id
+            if txn.logs:
+                info["logs"] = [_b64(log) for log in txn.logs]
+            if info:
+                self.results[txid] = info
+
+    def submit(self, body):
+        """
+        Checks a group of signed transactions and adds it to the pool.
+        :return: the ID of its first transaction.
+        """
+        unpacker = msgpack.Unpacker(raw=False, strict_map_key=False)
+        unpacker.feed(body)
+        try:
+            signed = list(unpacker)
+        except Exception as e:
+            raise StubError("msgpack decode error: {}".format(e))
+        if not signed or len(signed) > MAX_GROUP_SIZE:
+            raise StubError("group of {} transactions".format(len(signed)))
+        raws = [msgpack.packb(stxn["txn"], use_bin_type=True) for stxn in signed]
+        txids = [_txid(raw) for raw in raws]
+        group = signed[0]["txn"].get("grp")
+        if len(signed) > 1:
+            # The group ID is the hash of the IDs the transactions had without it.
+            txlist = [
+                _sha512_256(
+                    b"TX"
+                    + msgpack.packb(
+                        {k: v for k, v in stxn["txn"].items() if k != "grp"},
+                        use_bin_type=True,
+                    )
+                )
+                for stxn in signed
+            ]
+            expected = _sha512_256(
+                b"TG" + msgpack.packb({"txlist": txlist}, use_bin_type=True)
+            )
+            if group != expected:
+                raise StubError("transaction group ID does not match its transactions")
+        fees = 0
+        for stxn, raw, txid in zip(signed, raws, txids):
+            txn = stxn["txn"]
+            if txn.get("grp") != group:
+                raise StubError("{}: transaction is in another group".format(txid))
+            if txid in self.transactions:
+                raise StubError("{}: transaction already in ledger".format(txid))
+            if not txn.get("fv", 0) <= self.round + 1 <= txn.get("lv", 0):
+                raise StubError(
+                    "{}: txn dead: round {} outside of {}--{}".format(
+                        txid, self.round + 1, txn.get("fv", 0), txn.get("lv", 0)
+                    )
+                )
+            if txn.get("gh") != GENESIS_HASH:
+                raise StubError("{}: genesis hash mismatch".format(txid))
+            self._check_signature(stxn, raw, txid)
+            fees += txn.get("fee", 0)
+        if fees < self.min_fee * len(signed):
+            raise StubError(
+                "group fees {} are below {} per transaction".format(fees, self.min_fee)
+            )
+        if self.ledger is not None:
+            self._apply(signed, txids)
+        for txid in txids:
+            self.transactions[txid] = 0
+        self._pending.extend(txids)
+        self.groups += 1
+        return txids[0]
+
+    def _check_signature(self, stxn, raw, txid):
+        txn = stxn["txn"]
+        signer = stxn.get("sgnr", txn["snd"])
+        if "sig" in stxn:
+            try:
+                VerifyKey(signer).verify(b"TX" + raw, stxn["sig"])
+            except BadSignatureError:
+                raise StubError("{}: signature does not verify".format(txid))
+        elif "lsig" in stxn:
+            lsig = stxn["lsig"]
+            program = lsig["l"]
+            size = len(program) + sum(len(arg) for arg in lsig.get("arg", ()))
+            if size > MAX_LOGICSIG_SIZE:
+                raise StubError("{}: logic sig of {} bytes".format(txid, size))
+            if "sig" in lsig or "msig" in lsig:
+                raise StubError("{}: delegated logic sig".format(txid))
+            address = _sha512_256(b"Program" + program)
+            if address != signer:
+                raise StubError(
+                    "{}: logic sig address {} is not the sender".format(
+                        txid, encoding.encode_address(address)
+                    )
+                )
+        elif "msig" not in stxn:
+            raise StubError("{}: transaction is not signed".format(txid))
+
+    async def _serve(self, reader, writer):
+        self.connections += 1
+        handler = asyncio.current_task()
+        self._handlers.add(handler)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                method, target, version = line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                self.requests += 1
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                status, result = await self._handle(method, target.split("?")[0], body)
+                data = json.dumps(result).encode() if result is not None else b""
+                keep_alive = (
+                    version == "HTTP/1.1"
+                    and headers.get("connection", "").lower() != "close"
+                )
+                writer.write(
+                    (
+                        "HTTP/1.1 {} {}\r\nContent-Type: application/json\r\n"
+                        "Content-Length: {}\r\n{}\r\n"
+                    )
+                    .format(
+                        status,
+                        REASONS.get(status, ""),
+                        len(data),
+                        "" if keep_alive else "Connection: close\r\n",
+                    )
+                    .encode("latin-1")
+                    + data
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            self._handlers.discard(handler)
+            writer.close()
+
+    async def _handle(self, method, path, body):
+        """
+        :return: tuple of (status, JSON result).
+        """
+        parts = path.strip("/").split("/")
+        try:
+            if method == "GET" and parts == ["health"]:
+                return 200, None
+            if method == "GET" and parts == ["v2", "status"]:
+                return 200, self.status()
+            if method == "GET" and parts[:3] == ["v2", "status", WAIT_FOR_BLOCK]:
+                return 200, await self.wait_for_block_after(int(parts[3]))
+            if method == "GET" and parts == ["v2", "transactions", "params"]:
+                self.params_requests += 1
+                return 200, self.params()
+            if method == "POST" and parts == ["v2", "transactions"]:
+                return 200, {"txId": self.submit(body)}
+            if method == "GET" and parts[:3] == ["v2", "transactions", "pending"]:
+                return 200, self.pending(parts[3])
+            if method == "GET" and parts[:2] == ["v2", "blocks"]:
+                return 200, self.block(int(parts[2]))
+            if method == "GET" and parts[:2] == ["v2", "accounts"]:
+                return 200, self.account(parts[2])
+            if method == "GET" and parts[:2] == ["v2", "applications"]:
+                return 200, self.application(int(parts[2]))
+            raise StubError("no route for {} {}".format(method, path), 404)
+        except StubError as e:
+            return e.status, {"message": str(e)}
+        except (IndexError, ValueError) as e:
+            return 400, {"message": str(e)}
+
+
+async def serve(host, port, block_time, latency):
+    stub = AlgodStub(block_time, latency)
+    address = await stub.start(host, port)
+    print("algod stub listening on {}".format(address))
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await stub.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a stand-in algod API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--block-time", type=float, default=DEFAULT_BLOCK_TIME)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds added to every response"
+    )
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port, args.block_time, args.latency))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
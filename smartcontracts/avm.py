@@ -0,0 +1,2149 @@
+"""
+In-process TEAL v5 evaluator over an in-memory ledger.
+
+Runs the programs in this directory without a node: the ledger holds balances,
+asset holdings, applications with their global and local state, the latest
+timestamp and round, and executes transaction groups atomically. App calls run
+their approval or clear program, logic signatures run before the group is
+applied, and inner payments and asset transfers are applied like outer ones. A
+failing group leaves the ledger untouched.
+
+    ledger = avm.Ledger(latest_timestamp=1_600_000_000)
+    creator = avm.address("creator")
+    ledger.fund(creator, 10_000_000)
+    result = ledger.execute(
+        [avm.app_create(creator, approval_teal, clear_teal, args=[...])], check=True
+    )
+    app_id = result.txns[0].created_app_id
+
+Programs are parsed with teal.py and turned into a list of prebound handlers once
+per program, so each instruction costs one Python call. Every transaction result
+carries its opcode cost, logs, inner transactions and, with Ledger(trace=True),
+the index of every instruction it executed in program.instructions.
+
+Not modelled: signatures (every transaction is authorized), rekeyed
+authorization, transaction validity windows and leases, and transaction types
+other than pay, axfer and appl.
+"""
+import base64
+import hashlib
+import math
+
+import teal
+
+MAX_UINT64 = 2 ** 64 - 1
+MAX_BYTES = 4096
+MAX_BYTE_MATH = 64
+MAX_GROUP_SIZE = 16
+MAX_INNER_TXNS = 16
+MAX_LOGS = 32
+MAX_LOG_BYTES = 1024
+MAX_KEY_LEN = 64
+MAX_KEY_VALUE_LEN = 128
+MAX_GLOBAL_KEYS = 64
+MAX_LOCAL_KEYS = 16
+
+MIN_TXN_FEE = 1000
+MIN_BALANCE = 100000
+MAX_TXN_LIFE = 1000
+# Minimum balance increments of the v5 protocol.
+ASSET_MIN_BALANCE = 100000
+APP_MIN_BALANCE = 100000
+SCHEMA_MIN_BALANCE = 25000
+UINT_MIN_BALANCE = 3500
+BYTES_MIN_BALANCE = 25000
+
+APPLICATION_MODE = "application"
+SIGNATURE_MODE = "signature"
+
+ZERO_ADDRESS = bytes(32)
+
+TYPE_ENUMS = {b"pay": 1, b"keyreg": 2, b"acfg": 3, b"axfer": 4, b"afrz": 5, b"appl": 6}
+TYPE_NAMES = {value: name for name, value in TYPE_ENUMS.items()}
+
+NO_OP = 0
+OPT_IN = 1
+CLOSE_OUT = 2
+CLEAR_STATE = 3
+UPDATE_APPLICATION = 4
+DELETE_APPLICATION = 5
+
+# Transaction fields holding an address, and the other fields holding bytes.
+ADDRESS_FIELDS = {
+    "Sender", "Receiver", "CloseRemainderTo", "AssetSender", "AssetReceiver",
+    "AssetCloseTo", "RekeyTo", "ConfigAssetManager", "ConfigAssetReserve",
+    "ConfigAssetFreeze", "ConfigAssetClawback", "FreezeAssetAccount",
+}  # fmt: skip
+BYTES_FIELDS = {
+    "Type", "Note", "Lease", "VotePK", "SelectionPK", "TxID", "ApprovalProgram",
+    "ClearStateProgram", "ConfigAssetUnitName", "ConfigAssetName", "ConfigAssetURL",
+    "ConfigAssetMetadataHash",
+}  # fmt: skip
+ARRAY_FIELDS = {"ApplicationArgs", "Accounts", "Assets", "Applications", "Logs"}
+# Fields an inner transaction may set in v5, with whether they hold an address.
+INNER_FIELDS = {
+    "Type": False, "TypeEnum": False, "Sender": True, "Fee": False,
+    "Receiver": True, "Amount": False, "CloseRemainderTo": True, "XferAsset": False,
+    "AssetAmount": False, "AssetSender": True, "AssetReceiver": True,
+    "AssetCloseTo": True,
+}  # fmt: skip
+
+# Opcodes that only exist in one of the two modes.
+APPLICATION_ONLY = {
+    "balance", "min_balance", "app_opted_in", "app_local_get", "app_local_get_ex",
+    "app_global_get", "app_global_get_ex", "app_local_put", "app_global_put",
+    "app_local_del", "app_global_del", "asset_holding_get", "asset_params_get",
+    "app_params_get", "log", "itxn_begin", "itxn_field", "itxn_submit", "itxn",
+    "itxna", "gload", "gloads", "gaid", "gaids",
+}  # fmt: skip
+SIGNATURE_ONLY = {"arg", "arg_0", "arg_1", "arg_2", "arg_3", "args"}
+APPLICATION_GLOBALS = {
+    "LatestTimestamp", "CurrentApplicationID", "CreatorAddress",
+    "CurrentApplicationAddress",
+}  # fmt: skip
+
+
+class AVMError(Exception):
+    """
+    A program failed, or a transaction could not be applied to the ledger.
+    :param line: source line of the failing instruction, when there is one.
+    :param txn: index in the group of the failing transaction.
+    """
+
+    def __init__(self, message, line=None, txn=None):
+        self.message = message
+        self.line = line
+        self.txn = txn
+        super().__init__(message)
+
+    def __str__(self):
+        where = []
+        if self.txn is not None:
+            where.append("txn {}".format(self.txn))
+        if self.line is not None:
+            where.append("line {}".format(self.line))
+        if not where:
+            return self.message
+        return "{}: {}".format(", ".join(where), self.message)
+
+
+class _Return(Exception):
+    def __init__(self, value):
+        self.value = value
+
+
+def _sha512_256(data):
+    return hashlib.new("sha512_256", data).digest()
+
+
+def address(name):
+    """
+    :return: a deterministic 32 byte address for a test account name.
+    """
+    return _sha512_256(b"avm-account:" + name.encode())
+
+
+def application_address(app_id):
+    return _sha512_256(b"appID" + app_id.to_bytes(8, "big"))
+
+
+def encode_address(raw):
+    """
+    :return: the base32 form of a 32 byte address, with its checksum.
+    """
+    checksum = _sha512_256(raw)[-4:]
+    return base64.b32encode(raw + checksum).decode().rstrip("=")
+
+
+def _itob(value):
+    return value.to_bytes(8, "big")
+
+
+def _arg_bytes(value):
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, str):
+        return value.encode()
+    if isinstance(value, int):
+        return _itob(value)
+    raise TypeError("app args must be bytes, str or int, got {!r}".format(value))
+
+
+# Transactions
+
+
+class Transaction:
+    """
+    One transaction, as a dict of TEAL txn field name to value. Addresses are
+    32 byte values; array fields (ApplicationArgs, Accounts, ...) are lists.
+    :param lsig: optional logic signature program (TEAL source or teal.Program)
+        that authorizes the transaction.
+    :param lsig_args: arguments of the logic signature, read with arg/args.
+    """
+
+    def __init__(self, lsig=None, lsig_args=(), **fields):
+        fields.setdefault("Fee", MIN_TXN_FEE)
+        self.fields = fields
+        self.lsig = lsig
+        self.lsig_args = [_arg_bytes(arg) for arg in lsig_args]
+        # Set while the transaction runs in a group.
+        self.group_index = 0
+        self.result = None
+
+    @property
+    def type(self):
+        return self.fields["Type"]
+
+    def get(self, field, default=None):
+        return self.fields.get(field, default)
+
+    def __repr__(self):
+        return "Transaction({})".format(self.fields.get("Type", b"?").decode())
+
+
+def payment(sender, receiver, amount, close_to=None, **fields):
+    fields.update(Type=b"pay", Sender=sender, Receiver=receiver, Amount=amount)
+    if close_to is not None:
+        fields["CloseRemainderTo"] = close_to
+    return Transaction(**fields)
+
+
+def asset_transfer(sender, receiver, asset_id, amount, close_to=None, **fields):
+    fields.update(
+        Type=b"axfer",
+        Sender=sender,
+        AssetReceiver=receiver,
+        XferAsset=asset_id,
+        AssetAmount=amount,
+    )
+    if close_to is not None:
+        fields["AssetCloseTo"] = close_to
+    return Transaction(**fields)
+
+
+def asset_opt_in(sender, asset_id, **fields):
+    return asset_transfer(sender, sender, asset_id, 0, **fields)
+
+
+def app_call(
+    sender,
+    app_id,
+    args=(),
+    on_complete=NO_OP,
+    accounts=(),
+    assets=(),
+    apps=(),
+    **fields
+):
+    fields.update(
+        Type=b"appl",
+        Sender=sender,
+        ApplicationID=app_id,
+        OnCompletion=on_complete,
+        ApplicationArgs=[_arg_bytes(arg) for arg in args],
+        Accounts=list(accounts),
+        Assets=list(assets),
+        Applications=list(apps),
+    )
+    return Transaction(**fields)
+
+
+def app_create(
+    sender,
+    approval,
+    clear,
+    args=(),
+    global_ints=0,
+    global_bytes=0,
+    local_ints=0,
+    local_bytes=0,
+    **fields
+):
+    """
+    :param approval: approval program as TEAL source or teal.Program.
+    :param clear: clear state program as TEAL source or teal.Program.
+    """
+    fields.update(
+        ApprovalProgram=approval,
+        ClearStateProgram=clear,
+        GlobalNumUint=global_ints,
+        GlobalNumByteSlice=global_bytes,
+        LocalNumUint=local_ints,
+        LocalNumByteSlice=local_bytes,
+    )
+    return app_call(sender, 0, args, **fields)
+
+
+# Results
+
+
+class TxnResult:
+    """
+    Outcome of one transaction of a group.
+    :ivar cost: opcodes spent by the app call's program.
+    :ivar lsig_cost: opcodes spent by the logic signature.
+    :ivar trace: instruction indices the app call executed, with Ledger(trace=True).
+    :ivar lsig_trace: the same for the logic signature.
+    :ivar program: teal.Program the app call ran, for mapping the trace to lines.
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.cost = 0
+        self.lsig_cost = 0
+        self.trace = None
+        self.lsig_trace = None
+        self.program = None
+        self.logs = []
+        self.inner = []
+        self.scratch = None
+        self.created_app_id = 0
+        self.created_asset_id = 0
+
+
+class GroupResult:
+    """
+    Outcome of a transaction group. ok is False when the group was rejected, in
+    which case error holds the reason and the ledger is unchanged.
+    """
+
+    def __init__(self, txns):
+        self.txns = txns
+        self.error = None
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    @property
+    def cost(self):
+        return sum(txn.cost for txn in self.txns)
+
+    def __repr__(self):
+        status = "ok" if self.ok else "rejected: {}".format(self.error)
+        return "GroupResult({} txn(s), {})".format(len(self.txns), status)
+
+
+# Ledger objects
+
+
+class Asset:
+    def __init__(
+        self, asset_id, creator, total, decimals=0, default_frozen=False, **params
+    ):
+        self.id = asset_id
+        self.creator = creator
+        self.total = total
+        self.decimals = decimals
+        self.default_frozen = default_frozen
+        self.unit_name = params.get("unit_name", b"")
+        self.name = params.get("name", b"")
+        self.url = params.get("url", b"")
+        self.metadata_hash = params.get("metadata_hash", b"")
+        self.manager = params.get("manager", creator)
+        self.reserve = params.get("reserve", creator)
+        self.freeze = params.get("freeze", ZERO_ADDRESS)
+        self.clawback = params.get("clawback", ZERO_ADDRESS)
+
+    def param(self, field):
+        return {
+            "AssetTotal": self.total,
+            "AssetDecimals": self.decimals,
+            "AssetDefaultFrozen": int(self.default_frozen),
+            "AssetUnitName": self.unit_name,
+            "AssetName": self.name,
+            "AssetURL": self.url,
+            "AssetMetadataHash": self.metadata_hash,
+            "AssetManager": self.manager,
+            "AssetReserve": self.reserve,
+            "AssetFreeze": self.freeze,
+            "AssetClawback": self.clawback,
+            "AssetCreator": self.creator,
+        }[field]
+
+
+class Application:
+    def __init__(self, app_id, creator, approval, clear, schema):
+        self.id = app_id
+        self.creator = creator
+        self.address = application_address(app_id)
+        self.approval = approval
+        self.clear = clear
+        # (global ints, global byte slices, local ints, local byte slices)
+        self.schema = schema
+        self.global_state = {}
+
+    def param(self, field):
+        global_ints, global_bytes, local_ints, local_bytes = self.schema
+        return {
+            "AppApprovalProgram": self.approval.bytecode(),
+            "AppClearStateProgram": self.clear.bytecode(),
+            "AppGlobalNumUint": global_ints,
+            "AppGlobalNumByteSlice": global_bytes,
+            "AppLocalNumUint": local_ints,
+            "AppLocalNumByteSlice": local_bytes,
+            "AppExtraProgramPages": 0,
+            "AppCreator": self.creator,
+            "AppAddress": self.address,
+        }[field]
+
+
+_MISSING = object()
+
+
+class Ledger:
+    """
+    In-memory ledger. State is kept in plain dicts so every change made while a
+    group runs can be journaled and undone when the group fails.
+    :param trace: record the instructions every program executes.
+    :param enforce_min_balance: reject groups that leave a touched account below
+        its minimum balance.
+    """
+
+    def __init__(
+        self, latest_timestamp=0, round=1, trace=False, enforce_min_balance=True
+    ):
+        self.latest_timestamp = latest_timestamp
+        self.round = round
+        self.trace = trace
+        self.enforce_min_balance = enforce_min_balance
+        # address -> microalgos. An account exists while it has an entry.
+        self.balances = {}
+        # address -> {asset id: (amount, frozen)}
+        self.holdings = {}
+        # address -> {app id: dict of local state}
+        self.local = {}
+        self.assets = {}
+        self.apps = {}
+        self._next_id = 1
+        self._journal = None
+        self._touched = None
+
+    # Journaled updates.
+
+    def _set(self, container, key, value):
+        if self._journal is not None:
+            self._journal.append((container, key, container.get(key, _MISSING)))
+        container[key] = value
+
+    def _delete(self, container, key):
+        if key not in container:
+            return
+        if self._journal is not None:
+            self._journal.append((container, key, container[key]))
+        del container[key]
+
+    def _rollback(self, mark=0):
+        journal = self._journal
+        while len(journal) > mark:
+            container, key, old = journal.pop()
+            if old is _MISSING:
+                container.pop(key, None)
+            else:
+                container[key] = old
+
+    def _holding(self, account, asset_id):
+        return self.holdings.get(account, {}).get(asset_id)
+
+    def _set_holding(self, account, asset_id, holding):
+        if account not in self.holdings:
+            self._set(self.holdings, account, {})
+        self._set(self.holdings[account], asset_id, holding)
+
+    def _local_states(self, account):
+        if account not in self.local:
+            self._set(self.local, account, {})
+        return self.local[account]
+
+    def _allocate_id(self):
+        value = self._next_id
+        self._next_id += 1
+        return value
+
+    # Setup helpers, applied outside of any group.
+
+    def fund(self, account, amount):
+        self.balances[account] = self.balances.get(account, 0) + amount
+
+    def create_asset(self, creator, total, decimals=0, default_frozen=False, **params):
+        """
+        Creates an asset held entirely by creator.
+        :return: the asset id.
+        """
+        asset_id = self._allocate_id()
+        self.assets[asset_id] = Asset(
+            asset_id, creator, total, decimals, default_frozen, **params
+        )
+        self.holdings.setdefault(creator, {})[asset_id] = (total, False)
+        return asset_id
+
+    def advance(self, seconds=0, rounds=1):
+        self.latest_timestamp += seconds
+        self.round += rounds
+
+    # Queries.
+
+    def balance(self, account):
+        return self.balances.get(account, 0)
+
+    def asset_balance(self, account, asset_id):
+        """
+        :return: the amount held, or None when account is not opted in.
+        """
+        holding = self._holding(account, asset_id)
+        return None if holding is None else holding[0]
+
+    def global_state(self, app_id):
+        return dict(self.apps[app_id].global_state)
+
+    def local_state(self, account, app_id):
+        """
+        :return: a copy of the local state, or None when account is not opted in.
+        """
+        state = self.local.get(account, {}).get(app_id)
+        return None if state is None else dict(state)
+
+    def _holds(self, account):
+        """
+        :return: whether account holds anything besides algos.
+        """
+        return bool(
+            self.holdings.get(account)
+            or self.local.get(account)
+            or any(app.creator == account for app in self.apps.values())
+        )
+
+    def min_balance(self, account):
+        total = MIN_BALANCE + ASSET_MIN_BALANCE * len(self.holdings.get(account, ()))
+        for app_id in self.local.get(account, ()):
+            if app_id in self.apps:
+                _, _, ints, byteslices = self.apps[app_id].schema
+                total += _schema_min_balance(ints, byteslices)
+        for app in self.apps.values():
+            if app.creator == account:
+                ints, byteslices, _, _ = app.schema
+                total += _schema_min_balance(ints, byteslices)
+        return total
+
+    # Execution.
+
+    def execute(self, group, check=False):
+        """
+        Runs a transaction group atomically.
+        :param group: a Transaction or a list of them.
+        :param check: raise AVMError instead of returning a failed result.
+        :return: GroupResult
+        """
+        if isinstance(group, Transaction):
+            group = [group]
+        group = list(group)
+        results = [TxnResult(i) for i in range(len(group))]
+        outcome = GroupResult(results)
+        self._journal = []
+        self._touched = set()
+        index = None
+        try:
+            if not group or len(group) > MAX_GROUP_SIZE:
+                raise AVMError("group size {} out of range".format(len(group)))
+            fees = sum(txn.get("Fee", 0) for txn in group)
+            if fees < MIN_TXN_FEE * len(group):
+                raise AVMError("group fees {} below the minimum".format(fees))
+            for txn, result in zip(group, results):
+                txn.group_index = result.index
+                txn.result = result
+            # Logic signatures see the group before any of it is applied.
+            for index, txn in enumerate(group):
+                if txn.lsig is not None:
+                    self._run_lsig(group, txn)
+            apps = sum(1 for txn in group if txn.get("Type") == b"appl")
+            budget = [teal.MAX_APP_COST * apps]
+            for index, txn in enumerate(group):
+                self._apply(group, txn, budget)
+            index = None
+            if self.enforce_min_balance:
+                for account in self._touched:
+                    balance = self.balances.get(account)
+                    if balance is None or balance == 0 and not self._holds(account):
+                        continue
+                    if balance < self.min_balance(account):
+                        raise AVMError(
+                            "{} below minimum balance: {} < {}".format(
+                                encode_address(account),
+                                balance,
+                                self.min_balance(account),
+                            )
+                        )
+        except AVMError as error:
+            if error.txn is None:
+                error.txn = index
+            self._rollback()
+            outcome.error = error
+            if check:
+                raise
+        finally:
+            self._journal = None
+            self._touched = None
+        return outcome
+
+    def _run_lsig(self, group, txn):
+        result = txn.result
+        evaluation = _Evaluation(self, group, txn, SIGNATURE_MODE)
+        evaluation.lsig_args = txn.lsig_args
+        program = _compiled(txn.lsig)
+        passed, cost = program.run(
+            evaluation, teal.MAX_LOGICSIG_COST, self._trace_list(result, "lsig_trace")
+        )
+        result.lsig_cost = cost
+        if not passed:
+            raise AVMError("rejected by logic signature")
+
+    def _trace_list(self, result, name):
+        if not self.trace:
+            return None
+        trace = []
+        setattr(result, name, trace)
+        return trace
+
+    def _apply(self, group, txn, budget):
+        sender = txn.get("Sender")
+        self._move_algos(sender, None, txn.get("Fee", 0))
+        kind = txn.get("Type")
+        if kind in (b"pay", b"axfer"):
+            self._transfer(txn)
+        elif kind == b"appl":
+            self._app_call(group, txn, budget)
+        else:
+            raise AVMError("unsupported transaction type {!r}".format(kind))
+
+    # Payments and asset transfers.
+
+    def _move_algos(self, sender, receiver, amount):
+        balance = self.balances.get(sender, 0)
+        if balance < amount:
+            raise AVMError(
+                "overspend by {}: {} < {}".format(
+                    encode_address(sender), balance, amount
+                )
+            )
+        self._set(self.balances, sender, balance - amount)
+        self._touched.add(sender)
+        if receiver is not None and amount:
+            self._set(self.balances, receiver, self.balances.get(receiver, 0) + amount)
+            self._touched.add(receiver)
+
+    def _move_asset(self, sender, receiver, asset_id, amount):
+        # Like the node, moving nothing checks neither side, which lets an account
+        # close out to a receiver of zero.
+        if amount == 0:
+            return
+        for account in (sender, receiver):
+            if self._holding(account, asset_id) is None:
+                raise AVMError(
+                    "{} not opted in to asset {}".format(
+                        encode_address(account), asset_id
+                    )
+                )
+        source = self.holdings[sender][asset_id]
+        target = self.holdings[receiver][asset_id]
+        if source[1] or target[1]:
+            raise AVMError("asset {} frozen".format(asset_id))
+        if source[0] < amount:
+            raise AVMError(
+                "underflow on asset {}: {} < {}".format(asset_id, source[0], amount)
+            )
+        if sender == receiver:
+            return
+        self._set(self.holdings[sender], asset_id, (source[0] - amount, source[1]))
+        self._set(self.holdings[receiver], asset_id, (target[0] + amount, target[1]))
+
+    def _transfer(self, txn):
+        """
+        Applies a pay or axfer transaction, outer or inner.
+        """
+        sender = txn.get("Sender")
+        if txn.get("Type") == b"pay":
+            receiver = txn.get("Receiver", ZERO_ADDRESS)
+            self._move_algos(sender, receiver, txn.get("Amount", 0))
+            close_to = txn.get("CloseRemainderTo", ZERO_ADDRESS)
+            if close_to != ZERO_ADDRESS:
+                if self.holdings.get(sender):
+                    raise AVMError("cannot close an account that holds assets")
+                self._move_algos(sender, close_to, self.balances.get(sender, 0))
+                self._delete(self.balances, sender)
+            return
+
+        asset_id = txn.get("XferAsset", 0)
+        asset = self.assets.get(asset_id)
+        if asset is None:
+            raise AVMError("asset {} does not exist".format(asset_id))
+        receiver = txn.get("AssetReceiver", ZERO_ADDRESS)
+        amount = txn.get("AssetAmount", 0)
+        clawback_from = txn.get("AssetSender", ZERO_ADDRESS)
+        if clawback_from != ZERO_ADDRESS:
+            if sender != asset.clawback:
+                raise AVMError(
+                    "only the clawback address can revoke asset {}".format(asset_id)
+                )
+            self._move_asset(clawback_from, receiver, asset_id, amount)
+            return
+        if (
+            sender == receiver
+            and amount == 0
+            and self._holding(sender, asset_id) is None
+        ):
+            self._set_holding(sender, asset_id, (0, asset.default_frozen))
+            self._touched.add(sender)
+            return
+        self._move_asset(sender, receiver, asset_id, amount)
+        close_to = txn.get("AssetCloseTo", ZERO_ADDRESS)
+        if close_to != ZERO_ADDRESS:
+            if sender == asset.creator:
+                raise AVMError(
+                    "the creator cannot close out of asset {}".format(asset_id)
+                )
+            remaining = self.holdings[sender][asset_id][0]
+            self._move_asset(sender, close_to, asset_id, remaining)
+            self._delete(self.holdings[sender], asset_id)
+
+    # Application calls.
+
+    def _app_call(self, group, txn, budget):
+        result = txn.result
+        sender = txn.get("Sender")
+        app_id = txn.get("ApplicationID", 0)
+        on_complete = txn.get("OnCompletion", NO_OP)
+        if app_id == 0:
+            schema = tuple(
+                txn.get(field, 0)
+                for field in (
+                    "GlobalNumUint",
+                    "GlobalNumByteSlice",
+                    "LocalNumUint",
+                    "LocalNumByteSlice",
+                )
+            )
+            if schema[0] + schema[1] > MAX_GLOBAL_KEYS:
+                raise AVMError("global schema too large")
+            if schema[2] + schema[3] > MAX_LOCAL_KEYS:
+                raise AVMError("local schema too large")
+            app = Application(
+                self._allocate_id(),
+                sender,
+                _compiled(txn.get("ApprovalProgram")),
+                _compiled(txn.get("ClearStateProgram")),
+                schema,
+            )
+            self._set(self.apps, app.id, app)
+            self._touched.add(sender)
+            result.created_app_id = app.id
+        else:
+            app = self.apps.get(app_id)
+            if app is None:
+                raise AVMError("application {} does not exist".format(app_id))
+
+        opted_in = app.id in self.local.get(sender, ())
+        if on_complete == OPT_IN:
+            if opted_in:
+                raise AVMError("already opted in to application {}".format(app.id))
+            self._set(self._local_states(sender), app.id, {})
+            self._touched.add(sender)
+        elif on_complete in (CLOSE_OUT, CLEAR_STATE) and not opted_in:
+            raise AVMError("not opted in to application {}".format(app.id))
+
+        program = app.clear if on_complete == CLEAR_STATE else app.approval
+        evaluation = _Evaluation(self, group, txn, APPLICATION_MODE)
+        evaluation.app = app
+        result.program = program.program
+        trace = self._trace_list(result, "trace")
+        mark = len(self._journal)
+        try:
+            passed, cost = program.run(evaluation, budget[0], trace)
+        except AVMError:
+            if on_complete != CLEAR_STATE:
+                raise
+            # A failing clear state program still clears the local state, but
+            # none of its own changes are kept.
+            self._rollback(mark)
+            passed, cost = False, 0
+        budget[0] -= cost
+        result.cost = cost
+        result.logs = evaluation.logs
+        result.scratch = evaluation.scratch
+
+        if on_complete == CLEAR_STATE:
+            self._delete(self.local[sender], app.id)
+            return
+        if not passed:
+            raise AVMError("rejected by application {}".format(app.id))
+        if on_complete == CLOSE_OUT:
+            self._delete(self.local[sender], app.id)
+        elif on_complete == UPDATE_APPLICATION:
+            app.approval = _compiled(txn.get("ApprovalProgram"))
+            app.clear = _compiled(txn.get("ClearStateProgram"))
+        elif on_complete == DELETE_APPLICATION:
+            self._delete(self.apps, app.id)
+
+
+def _schema_min_balance(ints, byteslices):
+    return (
+        APP_MIN_BALANCE
+        + (SCHEMA_MIN_BALANCE + UINT_MIN_BALANCE) * ints
+        + (SCHEMA_MIN_BALANCE + BYTES_MIN_BALANCE) * byteslices
+    )
+
+
+# Program evaluation
+
+
+class _Evaluation:
+    """
+    Everything a running program can see and change.
+    """
+
+    __slots__ = (
+        "ledger", "group", "txn", "mode", "app", "stack", "scratch", "intc",
+        "bytec", "callstack", "logs", "inner", "inner_fields", "lsig_args",
+    )  # fmt: skip
+
+    def __init__(self, ledger, group, txn, mode):
+        self.ledger = ledger
+        self.group = group
+        self.txn = txn
+        self.mode = mode
+        self.app = None
+        self.stack = []
+        self.scratch = [0] * 256
+        self.intc = []
+        self.bytec = []
+        self.callstack = []
+        self.logs = []
+        self.inner = []
+        self.inner_fields = None
+        self.lsig_args = []
+
+    # Foreign references.
+
+    def account(self, ref):
+        txn = self.txn
+        if ref.__class__ is int:
+            if ref == 0:
+                return txn.get("Sender")
+            accounts = txn.get("Accounts", [])
+            if ref > len(accounts):
+                raise AVMError("invalid account index {}".format(ref))
+            return accounts[ref - 1]
+        if (
+            ref == txn.get("Sender")
+            or ref in txn.get("Accounts", [])
+            or ref == self.app.address
+        ):
+            return ref
+        raise AVMError("unavailable account {}".format(encode_address(ref)))
+
+    def inner_account(self, address):
+        """
+        Checks an address set on an inner transaction is available: the sender,
+        one of Txn.accounts or the application's own address.
+        """
+        txn = self.txn
+        if address in (txn.get("Sender"), self.app.address):
+            return
+        if address not in txn.get("Accounts", []):
+            raise AVMError(
+                "invalid Account reference {}".format(encode_address(address))
+            )
+
+    def asset(self, ref):
+        assets = self.txn.get("Assets", [])
+        if ref < len(assets):
+            return assets[ref]
+        if ref in assets:
+            return ref
+        raise AVMError("unavailable asset {}".format(ref))
+
+    def app_ref(self, ref):
+        apps = self.txn.get("Applications", [])
+        if ref == 0:
+            return self.app.id
+        if ref <= len(apps):
+            return apps[ref - 1]
+        if ref in apps or ref == self.app.id:
+            return ref
+        raise AVMError("unavailable application {}".format(ref))
+
+
+def _txn_field(evaluation, txn, field, index=None):
+    if field in ARRAY_FIELDS:
+        if index is None:
+            raise AVMError("{} needs an index".format(field))
+        if field == "Accounts":
+            values = [txn.get("Sender")] + list(txn.get("Accounts", []))
+        elif field == "Applications":
+            values = [txn.get("ApplicationID", 0)] + list(txn.get("Applications", []))
+        elif field == "Logs":
+            values = txn.result.logs if txn.result is not None else []
+        else:
+            values = txn.get(field, [])
+        if index >= len(values):
+            raise AVMError("{} index {} out of range".format(field, index))
+        return values[index]
+    if index is not None:
+        raise AVMError("{} is not an array field".format(field))
+    if field == "TypeEnum":
+        return TYPE_ENUMS.get(txn.get("Type"), 0)
+    if field in ("NumAppArgs", "NumAccounts", "NumAssets", "NumApplications"):
+        array = {"NumAppArgs": "ApplicationArgs"}.get(field, field[3:])
+        return len(txn.get(array, []))
+    if field == "NumLogs":
+        return len(txn.result.logs) if txn.result is not None else 0
+    if field == "GroupIndex":
+        return txn.group_index
+    if field == "TxID":
+        # A caller that knows the transaction's real ID, as algod_stub does, sets it.
+        if "TxID" in txn.fields:
+            return txn.fields["TxID"]
+        return _sha512_256(b"TX" + repr(sorted(txn.fields.items())).encode())
+    if field == "CreatedApplicationID":
+        return txn.result.created_app_id if txn.result is not None else 0
+    if field == "CreatedAssetID":
+        return txn.result.created_asset_id if txn.result is not None else 0
+    if field in ("ApprovalProgram", "ClearStateProgram"):
+        program = txn.get(field)
+        return b"" if program is None else _compiled(program).bytecode()
+    if field == "FirstValidTime":
+        raise AVMError("FirstValidTime is not available")
+    value = txn.get(field)
+    if value is None:
+        if field in ADDRESS_FIELDS or field in ("Lease", "VotePK", "SelectionPK"):
+            return ZERO_ADDRESS
+        if field in BYTES_FIELDS:
+            return b""
+        return 0
+    if value.__class__ is bool:
+        return int(value)
+    return value
+
+
+def _global_field(evaluation, field):
+    ledger = evaluation.ledger
+    if field in APPLICATION_GLOBALS and evaluation.mode != APPLICATION_MODE:
+        raise AVMError("global {} is only available to applications".format(field))
+    if field == "MinTxnFee":
+        return MIN_TXN_FEE
+    if field == "MinBalance":
+        return MIN_BALANCE
+    if field == "MaxTxnLife":
+        return MAX_TXN_LIFE
+    if field == "ZeroAddress":
+        return ZERO_ADDRESS
+    if field == "GroupSize":
+        return len(evaluation.group)
+    if field == "LogicSigVersion":
+        return teal.MAX_VERSION
+    if field == "Round":
+        return ledger.round
+    if field == "LatestTimestamp":
+        return ledger.latest_timestamp
+    if field == "CurrentApplicationID":
+        return evaluation.app.id
+    if field == "CreatorAddress":
+        return evaluation.app.creator
+    if field == "CurrentApplicationAddress":
+        return evaluation.app.address
+    if field == "GroupID":
+        return bytes(32)
+    raise AVMError("unknown global {}".format(field))
+
+
+# Opcode handlers. Each takes the evaluation and the immediates prepared by
+# _Compiled, and returns the next instruction index for jumps or None.
+
+
+def _type_error(op, expected):
+    return AVMError("{} expects {}".format(op, expected))
+
+
+def _pop_int(stack, op):
+    value = stack.pop()
+    if value.__class__ is not int:
+        raise _type_error(op, "uint64")
+    return value
+
+
+def _pop_bytes(stack, op):
+    value = stack.pop()
+    if value.__class__ is not bytes:
+        raise _type_error(op, "bytes")
+    return value
+
+
+def _push_bytes(stack, value):
+    if len(value) > MAX_BYTES:
+        raise AVMError("byte value longer than {}".format(MAX_BYTES))
+    stack.append(value)
+
+
+def _int_op(name, fn):
+    def handler(evaluation, _):
+        stack = evaluation.stack
+        b = stack.pop()
+        a = stack.pop()
+        if a.__class__ is not int or b.__class__ is not int:
+            raise _type_error(name, "uint64")
+        stack.append(fn(a, b))
+
+    return handler
+
+
+def _checked(name, value):
+    if value > MAX_UINT64:
+        raise AVMError("{} overflowed".format(name))
+    return value
+
+
+def _sub(a, b):
+    if b > a:
+        raise AVMError("- would result negative")
+    return a - b
+
+
+def _div(a, b):
+    if b == 0:
+        raise AVMError("/ by zero")
+    return a // b
+
+
+def _mod(a, b):
+    if b == 0:
+        raise AVMError("% by zero")
+    return a % b
+
+
+def _exp(a, b):
+    if a == 0 and b == 0:
+        raise AVMError("0^0 is undefined")
+    if a > 1 and b >= 64:
+        raise AVMError("exp overflowed")
+    return _checked("exp", a ** b)
+
+
+def _shift(name, fn):
+    def shift(a, b):
+        if b > 63:
+            raise AVMError("{} by more than 63".format(name))
+        return fn(a, b) & MAX_UINT64
+
+    return shift
+
+
+def _equality(negate):
+    def handler(evaluation, _):
+        stack = evaluation.stack
+        b = stack.pop()
+        a = stack.pop()
+        if a.__class__ is not b.__class__:
+            raise AVMError("cannot compare uint64 to bytes")
+        stack.append(int((a == b) != negate))
+
+    return handler
+
+
+def _not(evaluation, _):
+    stack = evaluation.stack
+    stack.append(int(_pop_int(stack, "!") == 0))
+
+
+def _bitwise_not(evaluation, _):
+    stack = evaluation.stack
+    stack.append(_pop_int(stack, "~") ^ MAX_UINT64)
+
+
+def _len(evaluation, _):
+    stack = evaluation.stack
+    stack.append(len(_pop_bytes(stack, "len")))
+
+
+def _itob_op(evaluation, _):
+    stack = evaluation.stack
+    stack.append(_itob(_pop_int(stack, "itob")))
+
+
+def _btoi(evaluation, _):
+    stack = evaluation.stack
+    value = _pop_bytes(stack, "btoi")
+    if len(value) > 8:
+        raise AVMError("btoi of more than 8 bytes")
+    stack.append(int.from_bytes(value, "big"))
+
+
+def _mulw(evaluation, _):
+    stack = evaluation.stack
+    b = _pop_int(stack, "mulw")
+    a = _pop_int(stack, "mulw")
+    product = a * b
+    stack.append(product >> 64)
+    stack.append(product & MAX_UINT64)
+
+
+def _addw(evaluation, _):
+    stack = evaluation.stack
+    b = _pop_int(stack, "addw")
+    a = _pop_int(stack, "addw")
+    total = a + b
+    stack.append(total >> 64)
+    stack.append(total & MAX_UINT64)
+
+
+def _divmodw(evaluation, _):
+    stack = evaluation.stack
+    d = _pop_int(stack, "divmodw")
+    c = _pop_int(stack, "divmodw")
+    b = _pop_int(stack, "divmodw")
+    a = _pop_int(stack, "divmodw")
+    divisor = (c << 64) | d
+    if divisor == 0:
+        raise AVMError("divmodw by zero")
+    quotient, remainder = divmod((a << 64) | b, divisor)
+    stack.extend(
+        [quotient >> 64, quotient & MAX_UINT64, remainder >> 64, remainder & MAX_UINT64]
+    )
+
+
+def _expw(evaluation, _):
+    stack = evaluation.stack
+    b = _pop_int(stack, "expw")
+    a = _pop_int(stack, "expw")
+    if a == 0 and b == 0:
+        raise AVMError("0^0 is undefined")
+    if a > 1 and b >= 128:
+        raise AVMError("expw overflowed")
+    result = a ** b
+    if result >> 128:
+        raise AVMError("expw overflowed")
+    stack.append(result >> 64)
+    stack.append(result & MAX_UINT64)
+
+
+def _sqrt(evaluation, _):
+    stack = evaluation.stack
+    stack.append(math.isqrt(_pop_int(stack, "sqrt")))
+
+
+def _bitlen(evaluation, _):
+    stack = evaluation.stack
+    value = stack.pop()
+    if value.__class__ is bytes:
+        value = int.from_bytes(value, "big")
+    stack.append(value.bit_length())
+
+
+def _hash(name):
+    def handler(evaluation, _):
+        stack = evaluation.stack
+        data = _pop_bytes(stack, name)
+        if name == "keccak256":
+            try:
+                from Crypto.Hash import keccak
+            except ImportError:
+                raise AVMError("keccak256 needs pycryptodome")
+            stack.append(keccak.new(data=data, digest_bits=256).digest())
+        elif name == "sha256":
+            stack.append(hashlib.sha256(data).digest())
+        else:
+            stack.append(_sha512_256(data))
+
+    return handler
+
+
+def _ed25519verify(evaluation, _):
+    stack = evaluation.stack
+    key = _pop_bytes(stack, "ed25519verify")
+    signature = _pop_bytes(stack, "ed25519verify")
+    data = _pop_bytes(stack, "ed25519verify")
+    try:
+        from nacl.exceptions import BadSignatureError
+        from nacl.signing import VerifyKey
+    except ImportError:
+        raise AVMError("ed25519verify needs PyNaCl")
+    if evaluation.mode == APPLICATION_MODE:
+        program = evaluation.app.approval
+    else:
+        program = _compiled(evaluation.txn.lsig)
+    message = b"ProgData" + _sha512_256(b"Program" + program.bytecode()) + data
+    try:
+        VerifyKey(key).verify(message, signature)
+        stack.append(1)
+    except (BadSignatureError, ValueError):
+        stack.append(0)
+
+
+def _unsupported(evaluation, op):
+    raise AVMError("{} is not supported by this evaluator".format(op))
+
+
+# Byte math works on big-endian unsigned integers of up to 64 bytes.
+
+
+def _big(stack, op):
+    value = _pop_bytes(stack, op)
+    if len(value) > MAX_BYTE_MATH:
+        raise AVMError("{} argument longer than {} bytes".format(op, MAX_BYTE_MATH))
+    return int.from_bytes(value, "big")
+
+
+def _to_big_bytes(value):
+    return value.to_bytes((value.bit_length() + 7) // 8, "big")
+
+
+def _byte_math(name, fn):
+    def handler(evaluation, _):
+        stack = evaluation.stack
+        b = _big(stack, name)
+        a = _big(stack, name)
+        result = fn(a, b)
+        stack.append(_to_big_bytes(result) if name[1] not in "<>=!" else int(result))
+
+    return handler
+
+
+def _byte_sub(a, b):
+    if b > a:
+        raise AVMError("b- would result negative")
+    return a - b
+
+
+def _byte_div(a, b):
+    if b == 0:
+        raise AVMError("b/ by zero")
+    return a // b
+
+
+def _byte_mod(a, b):
+    if b == 0:
+        raise AVMError("b% by zero")
+    return a % b
+
+
+def _byte_bitwise(name, fn):
+    def handler(evaluation, _):
+        stack = evaluation.stack
+        b = _pop_bytes(stack, name)
+        a = _pop_bytes(stack, name)
+        width = max(len(a), len(b))
+        a = a.rjust(width, b"\0")
+        b = b.rjust(width, b"\0")
+        stack.append(bytes(fn(x, y) for x, y in zip(a, b)))
+
+    return handler
+
+
+def _byte_invert(evaluation, _):
+    stack = evaluation.stack
+    stack.append(bytes(x ^ 0xFF for x in _pop_bytes(stack, "b~")))
+
+
+def _bzero(evaluation, _):
+    stack = evaluation.stack
+    length = _pop_int(stack, "bzero")
+    if length > MAX_BYTES:
+        raise AVMError("bzero longer than {}".format(MAX_BYTES))
+    stack.append(bytes(length))
+
+
+# Constants and scratch space.
+
+
+def _push(evaluation, value):
+    evaluation.stack.append(value)
+
+
+def _intcblock(evaluation, values):
+    evaluation.intc = values
+
+
+def _bytecblock(evaluation, values):
+    evaluation.bytec = values
+
+
+def _intc(evaluation, index):
+    if index >= len(evaluation.intc):
+        raise AVMError("intc {} beyond the intcblock".format(index))
+    evaluation.stack.append(evaluation.intc[index])
+
+
+def _bytec(evaluation, index):
+    if index >= len(evaluation.bytec):
+        raise AVMError("bytec {} beyond the bytecblock".format(index))
+    evaluation.stack.append(evaluation.bytec[index])
+
+
+def _arg(evaluation, index):
+    if index >= len(evaluation.lsig_args):
+        raise AVMError("arg {} out of range".format(index))
+    evaluation.stack.append(evaluation.lsig_args[index])
+
+
+def _args(evaluation, _):
+    _arg(evaluation, _pop_int(evaluation.stack, "args"))
+
+
+def _load(evaluation, slot):
+    evaluation.stack.append(evaluation.scratch[slot])
+
+
+def _store(evaluation, slot):
+    evaluation.scratch[slot] = evaluation.stack.pop()
+
+
+def _slot(stack, op):
+    slot = _pop_int(stack, op)
+    if slot > 255:
+        raise AVMError("{} slot {} out of range".format(op, slot))
+    return slot
+
+
+def _loads(evaluation, _):
+    stack = evaluation.stack
+    stack.append(evaluation.scratch[_slot(stack, "loads")])
+
+
+def _stores(evaluation, _):
+    stack = evaluation.stack
+    value = stack.pop()
+    evaluation.scratch[_slot(stack, "stores")] = value
+
+
+def _earlier_result(evaluation, group_index, op):
+    if group_index >= evaluation.txn.group_index:
+        raise AVMError("{} can only read earlier transactions".format(op))
+    return evaluation.group[group_index].result
+
+
+def _gload(evaluation, args):
+    group_index, slot = args
+    result = _earlier_result(evaluation, group_index, "gload")
+    if result.scratch is None:
+        raise AVMError("gload of a transaction that is not an app call")
+    evaluation.stack.append(result.scratch[slot])
+
+
+def _gloads(evaluation, slot):
+    group_index = _pop_int(evaluation.stack, "gloads")
+    _gload(evaluation, (group_index, slot))
+
+
+def _gaid(evaluation, group_index):
+    result = _earlier_result(evaluation, group_index, "gaid")
+    created = result.created_app_id or result.created_asset_id
+    if not created:
+        raise AVMError("gaid of a transaction that created nothing")
+    evaluation.stack.append(created)
+
+
+def _gaids(evaluation, _):
+    _gaid(evaluation, _pop_int(evaluation.stack, "gaids"))
+
+
+# Flow control.
+
+
+def _err(evaluation, _):
+    raise AVMError("err opcode executed")
+
+
+def _return(evaluation, _):
+    raise _Return(_pop_int(evaluation.stack, "return"))
+
+
+def _assert(evaluation, _):
+    if not _pop_int(evaluation.stack, "assert"):
+        raise AVMError("assert failed")
+
+
+def _bnz(evaluation, target):
+    if _pop_int(evaluation.stack, "bnz"):
+        return target
+    return None
+
+
+def _bz(evaluation, target):
+    if _pop_int(evaluation.stack, "bz"):
+        return None
+    return target
+
+
+def _b(evaluation, target):
+    return target
+
+
+def _callsub(evaluation, targets):
+    target, following = targets
+    evaluation.callstack.append(following)
+    return target
+
+
+def _retsub(evaluation, _):
+    if not evaluation.callstack:
+        raise AVMError("retsub with an empty call stack")
+    return evaluation.callstack.pop()
+
+
+# Stack manipulation.
+
+
+def _pop(evaluation, _):
+    evaluation.stack.pop()
+
+
+def _dup(evaluation, _):
+    stack = evaluation.stack
+    stack.append(stack[-1])
+
+
+def _dup2(evaluation, _):
+    stack = evaluation.stack
+    if len(stack) < 2:
+        raise IndexError
+    stack.extend(stack[-2:])
+
+
+def _dig(evaluation, depth):
+    stack = evaluation.stack
+    if depth >= len(stack):
+        raise IndexError
+    stack.append(stack[-1 - depth])
+
+
+def _swap(evaluation, _):
+    stack = evaluation.stack
+    stack[-1], stack[-2] = stack[-2], stack[-1]
+
+
+def _select(evaluation, _):
+    stack = evaluation.stack
+    condition = _pop_int(stack, "select")
+    b = stack.pop()
+    a = stack.pop()
+    stack.append(b if condition else a)
+
+
+def _cover(evaluation, depth):
+    stack = evaluation.stack
+    if depth >= len(stack):
+        raise IndexError
+    stack.insert(len(stack) - 1 - depth, stack.pop())
+
+
+def _uncover(evaluation, depth):
+    stack = evaluation.stack
+    if depth >= len(stack):
+        raise IndexError
+    stack.append(stack.pop(len(stack) - 1 - depth))
+
+
+# Byte strings.
+
+
+def _concat(evaluation, _):
+    stack = evaluation.stack
+    b = _pop_bytes(stack, "concat")
+    a = _pop_bytes(stack, "concat")
+    _push_bytes(stack, a + b)
+
+
+def _slice(stack, value, start, end, op):
+    if start > end or end > len(value):
+        raise AVMError("{} range {}:{} out of bounds".format(op, start, end))
+    stack.append(value[start:end])
+
+
+def _substring(evaluation, bounds):
+    stack = evaluation.stack
+    _slice(stack, _pop_bytes(stack, "substring"), bounds[0], bounds[1], "substring")
+
+
+def _substring3(evaluation, _):
+    stack = evaluation.stack
+    end = _pop_int(stack, "substring3")
+    start = _pop_int(stack, "substring3")
+    _slice(stack, _pop_bytes(stack, "substring3"), start, end, "substring3")
+
+
+def _extract(evaluation, bounds):
+    stack = evaluation.stack
+    value = _pop_bytes(stack, "extract")
+    start, length = bounds
+    end = len(value) if length == 0 else start + length
+    _slice(stack, value, start, end, "extract")
+
+
+def _extract3(evaluation, _):
+    stack = evaluation.stack
+    length = _pop_int(stack, "extract3")
+    start = _pop_int(stack, "extract3")
+    _slice(stack, _pop_bytes(stack, "extract3"), start, start + length, "extract3")
+
+
+def _extract_uint(width):
+    name = "extract_uint{}".format(width * 8)
+
+    def handler(evaluation, _):
+        stack = evaluation.stack
+        start = _pop_int(stack, name)
+        value = _pop_bytes(stack, name)
+        if start + width > len(value):
+            raise AVMError("{} out of bounds".format(name))
+        stack.append(int.from_bytes(value[start : start + width], "big"))
+
+    return handler
+
+
+def _getbyte(evaluation, _):
+    stack = evaluation.stack
+    index = _pop_int(stack, "getbyte")
+    value = _pop_bytes(stack, "getbyte")
+    if index >= len(value):
+        raise AVMError("getbyte index {} out of bounds".format(index))
+    stack.append(value[index])
+
+
+def _setbyte(evaluation, _):
+    stack = evaluation.stack
+    byte = _pop_int(stack, "setbyte")
+    index = _pop_int(stack, "setbyte")
+    value = _pop_bytes(stack, "setbyte")
+    if index >= len(value) or byte > 255:
+        raise AVMError("setbyte out of range")
+    stack.append(value[:index] + bytes([byte]) + value[index + 1 :])
+
+
+def _getbit(evaluation, _):
+    stack = evaluation.stack
+    index = _pop_int(stack, "getbit")
+    target = stack.pop()
+    if target.__class__ is int:
+        if index > 63:
+            raise AVMError("getbit index {} out of range".format(index))
+        stack.append((target >> index) & 1)
+        return
+    if index >= len(target) * 8:
+        raise AVMError("getbit index {} out of range".format(index))
+    stack.append((target[index // 8] >> (7 - index % 8)) & 1)
+
+
+def _setbit(evaluation, _):
+    stack = evaluation.stack
+    bit = _pop_int(stack, "setbit")
+    index = _pop_int(stack, "setbit")
+    target = stack.pop()
+    if bit > 1:
+        raise AVMError("setbit value {} is not a bit".format(bit))
+    if target.__class__ is int:
+        if index > 63:
+            raise AVMError("setbit index {} out of range".format(index))
+        stack.append(target | (1 << index) if bit else target & ~(1 << index))
+        return
+    if index >= len(target) * 8:
+        raise AVMError("setbit index {} out of range".format(index))
+    data = bytearray(target)
+    mask = 1 << (7 - index % 8)
+    if bit:
+        data[index // 8] |= mask
+    else:
+        data[index // 8] &= ~mask
+    stack.append(bytes(data))
+
+
+# Transaction and global fields.
+
+
+def _txn(evaluation, field):
+    evaluation.stack.append(_txn_field(evaluation, evaluation.txn, field))
+
+
+def _txna(evaluation, args):
+    field, index = args
+    evaluation.stack.append(_txn_field(evaluation, evaluation.txn, field, index))
+
+
+def _txnas(evaluation, field):
+    stack = evaluation.stack
+    index = _pop_int(stack, "txnas")
+    stack.append(_txn_field(evaluation, evaluation.txn, field, index))
+
+
+def _group_txn(evaluation, group_index):
+    if group_index >= len(evaluation.group):
+        raise AVMError("gtxn {} beyond the group".format(group_index))
+    return evaluation.group[group_index]
+
+
+def _gtxn(evaluation, args):
+    group_index, field = args
+    txn = _group_txn(evaluation, group_index)
+    evaluation.stack.append(_txn_field(evaluation, txn, field))
+
+
+def _gtxna(evaluation, args):
+    group_index, field, index = args
+    txn = _group_txn(evaluation, group_index)
+    evaluation.stack.append(_txn_field(evaluation, txn, field, index))
+
+
+def _gtxns(evaluation, field):
+    stack = evaluation.stack
+    txn = _group_txn(evaluation, _pop_int(stack, "gtxns"))
+    stack.append(_txn_field(evaluation, txn, field))
+
+
+def _gtxnsa(evaluation, args):
+    field, index = args
+    stack = evaluation.stack
+    txn = _group_txn(evaluation, _pop_int(stack, "gtxnsa"))
+    stack.append(_txn_field(evaluation, txn, field, index))
+
+
+def _gtxnas(evaluation, args):
+    group_index, field = args
+    stack = evaluation.stack
+    index = _pop_int(stack, "gtxnas")
+    txn = _group_txn(evaluation, group_index)
+    stack.append(_txn_field(evaluation, txn, field, index))
+
+
+def _gtxnsas(evaluation, field):
+    stack = evaluation.stack
+    index = _pop_int(stack, "gtxnsas")
+    txn = _group_txn(evaluation, _pop_int(stack, "gtxnsas"))
+    stack.append(_txn_field(evaluation, txn, field, index))
+
+
+def _global(evaluation, field):
+    evaluation.stack.append(_global_field(evaluation, field))
+
+
+# Balances, assets and application state.
+
+
+def _balance(evaluation, _):
+    stack = evaluation.stack
+    account = evaluation.account(stack.pop())
+    stack.append(evaluation.ledger.balances.get(account, 0))
+
+
+def _min_balance(evaluation, _):
+    stack = evaluation.stack
+    account = evaluation.account(stack.pop())
+    stack.append(evaluation.ledger.min_balance(account))
+
+
+def _app_opted_in(evaluation, _):
+    stack = evaluation.stack
+    app_id = evaluation.app_ref(_pop_int(stack, "app_opted_in"))
+    account = evaluation.account(stack.pop())
+    stack.append(int(app_id in evaluation.ledger.local.get(account, ())))
+
+
+def _check_key(key, value=b""):
+    if key.__class__ is not bytes:
+        raise _type_error("state access", "a bytes key")
+    if len(key) > MAX_KEY_LEN:
+        raise AVMError("key longer than {} bytes".format(MAX_KEY_LEN))
+    if value.__class__ is bytes and len(key) + len(value) > MAX_KEY_VALUE_LEN:
+        raise AVMError("key and value longer than {} bytes".format(MAX_KEY_VALUE_LEN))
+
+
+def _check_schema(state, ints, byteslices, scope):
+    used_ints = sum(1 for value in state.values() if value.__class__ is int)
+    if used_ints > ints or len(state) - used_ints > byteslices:
+        raise AVMError("{} state exceeds its schema".format(scope))
+
+
+def _app_global_get(evaluation, _):
+    stack = evaluation.stack
+    key = stack.pop()
+    _check_key(key)
+    stack.append(evaluation.app.global_state.get(key, 0))
+
+
+def _app_global_get_ex(evaluation, _):
+    stack = evaluation.stack
+    key = stack.pop()
+    _check_key(key)
+    app_id = evaluation.app_ref(_pop_int(stack, "app_global_get_ex"))
+    app = evaluation.ledger.apps.get(app_id)
+    value = _MISSING if app is None else app.global_state.get(key, _MISSING)
+    stack.extend([0, 0] if value is _MISSING else [value, 1])
+
+
+def _app_global_put(evaluation, _):
+    stack = evaluation.stack
+    value = stack.pop()
+    key = stack.pop()
+    _check_key(key, value)
+    app = evaluation.app
+    state = app.global_state
+    evaluation.ledger._set(state, key, value)
+    _check_schema(state, app.schema[0], app.schema[1], "global")
+
+
+def _app_global_del(evaluation, _):
+    key = evaluation.stack.pop()
+    _check_key(key)
+    evaluation.ledger._delete(evaluation.app.global_state, key)
+
+
+def _local_state(evaluation, account, app_id):
+    state = evaluation.ledger.local.get(account, {}).get(app_id)
+    if state is None:
+        raise AVMError(
+            "{} not opted in to application {}".format(encode_address(account), app_id)
+        )
+    return state
+
+
+def _app_local_get(evaluation, _):
+    stack = evaluation.stack
+    key = stack.pop()
+    _check_key(key)
+    account = evaluation.account(stack.pop())
+    stack.append(_local_state(evaluation, account, evaluation.app.id).get(key, 0))
+
+
+def _app_local_get_ex(evaluation, _):
+    stack = evaluation.stack
+    key = stack.pop()
+    _check_key(key)
+    app_id = evaluation.app_ref(_pop_int(stack, "app_local_get_ex"))
+    account = evaluation.account(stack.pop())
+    state = evaluation.ledger.local.get(account, {}).get(app_id, {})
+    value = state.get(key, _MISSING)
+    stack.extend([0, 0] if value is _MISSING else [value, 1])
+
+
+def _app_local_put(evaluation, _):
+    stack = evaluation.stack
+    value = stack.pop()
+    key = stack.pop()
+    _check_key(key, value)
+    account = evaluation.account(stack.pop())
+    app = evaluation.app
+    state = _local_state(evaluation, account, app.id)
+    evaluation.ledger._set(state, key, value)
+    _check_schema(state, app.schema[2], app.schema[3], "local")
+
+
+def _app_local_del(evaluation, _):
+    stack = evaluation.stack
+    key = stack.pop()
+    _check_key(key)
+    account = evaluation.account(stack.pop())
+    state = _local_state(evaluation, account, evaluation.app.id)
+    evaluation.ledger._delete(state, key)
+
+
+def _asset_holding_get(evaluation, field):
+    stack = evaluation.stack
+    asset_id = evaluation.asset(_pop_int(stack, "asset_holding_get"))
+    account = evaluation.account(stack.pop())
+    holding = evaluation.ledger._holding(account, asset_id)
+    if holding is None:
+        stack.extend([0, 0])
+    elif field == "AssetBalance":
+        stack.extend([holding[0], 1])
+    else:
+        stack.extend([int(holding[1]), 1])
+
+
+def _asset_params_get(evaluation, field):
+    stack = evaluation.stack
+    asset = evaluation.ledger.assets.get(
+        evaluation.asset(_pop_int(stack, "asset_params_get"))
+    )
+    stack.extend([0, 0] if asset is None else [asset.param(field), 1])
+
+
+def _app_params_get(evaluation, field):
+    stack = evaluation.stack
+    app = evaluation.ledger.apps.get(
+        evaluation.app_ref(_pop_int(stack, "app_params_get"))
+    )
+    stack.extend([0, 0] if app is None else [app.param(field), 1])
+
+
+# Logs and inner transactions.
+
+
+def _log(evaluation, _):
+    message = _pop_bytes(evaluation.stack, "log")
+    logs = evaluation.logs
+    if len(logs) >= MAX_LOGS:
+        raise AVMError("more than {} log calls".format(MAX_LOGS))
+    if sum(map(len, logs)) + len(message) > MAX_LOG_BYTES:
+        raise AVMError("logs longer than {} bytes".format(MAX_LOG_BYTES))
+    logs.append(message)
+
+
+def _itxn_begin(evaluation, _):
+    if evaluation.inner_fields is not None:
+        raise AVMError("itxn_begin without itxn_submit")
+    evaluation.inner_fields = {
+        "Sender": evaluation.app.address,
+        "Fee": MIN_TXN_FEE,
+    }
+
+
+def _itxn_field(evaluation, field):
+    fields = evaluation.inner_fields
+    if fields is None:
+        raise AVMError("itxn_field without itxn_begin")
+    value = evaluation.stack.pop()
+    if field not in INNER_FIELDS:
+        raise AVMError("itxn_field {} is not supported".format(field))
+    if INNER_FIELDS[field]:
+        if value.__class__ is not bytes or len(value) != 32:
+            raise AVMError("itxn_field {} expects an address".format(field))
+    elif field == "Type":
+        if value not in (b"pay", b"axfer"):
+            raise AVMError("inner {!r} transactions are not supported".format(value))
+    elif value.__class__ is not int:
+        raise _type_error("itxn_field {}".format(field), "uint64")
+    # As in v5, an inner transaction only reaches the accounts and assets the
+    # outer one made available.
+    if INNER_FIELDS[field] and field != "Sender":
+        evaluation.inner_account(value)
+    elif field == "XferAsset" and value not in evaluation.txn.get("Assets", []):
+        raise AVMError("invalid Asset reference {}".format(value))
+    if field == "TypeEnum":
+        if value not in (1, 4):
+            raise AVMError("inner type {} is not supported".format(value))
+        field, value = "Type", TYPE_NAMES[value]
+    fields[field] = value
+
+
+def _itxn_submit(evaluation, _):
+    fields = evaluation.inner_fields
+    if fields is None:
+        raise AVMError("itxn_submit without itxn_begin")
+    if "Type" not in fields:
+        raise AVMError("inner transaction without a type")
+    if len(evaluation.inner) >= MAX_INNER_TXNS:
+        raise AVMError("more than {} inner transactions".format(MAX_INNER_TXNS))
+    if fields["Sender"] != evaluation.app.address:
+        raise AVMError("inner transactions must be sent by the application")
+    evaluation.inner_fields = None
+    inner = Transaction(**fields)
+    inner.group_index = len(evaluation.inner)
+    ledger = evaluation.ledger
+    ledger._move_algos(inner.get("Sender"), None, inner.get("Fee"))
+    ledger._transfer(inner)
+    evaluation.inner.append(inner)
+    evaluation.txn.result.inner.append(inner)
+
+
+def _last_inner(evaluation):
+    if not evaluation.inner:
+        raise AVMError("no inner transaction submitted")
+    return evaluation.inner[-1]
+
+
+def _itxn(evaluation, field):
+    inner = _last_inner(evaluation)
+    evaluation.stack.append(_txn_field(evaluation, inner, field))
+
+
+def _itxna(evaluation, args):
+    field, index = args
+    inner = _last_inner(evaluation)
+    evaluation.stack.append(_txn_field(evaluation, inner, field, index))
+
+
+_HANDLERS = {
+    "+": _int_op("+", lambda a, b: _checked("+", a + b)),
+    "-": _int_op("-", _sub),
+    "*": _int_op("*", lambda a, b: _checked("*", a * b)),
+    "/": _int_op("/", _div),
+    "%": _int_op("%", _mod),
+    "<": _int_op("<", lambda a, b: int(a < b)),
+    ">": _int_op(">", lambda a, b: int(a > b)),
+    "<=": _int_op("<=", lambda a, b: int(a <= b)),
+    ">=": _int_op(">=", lambda a, b: int(a >= b)),
+    "&&": _int_op("&&", lambda a, b: int(bool(a and b))),
+    "||": _int_op("||", lambda a, b: int(bool(a or b))),
+    "|": _int_op("|", lambda a, b: a | b),
+    "&": _int_op("&", lambda a, b: a & b),
+    "^": _int_op("^", lambda a, b: a ^ b),
+    "shl": _int_op("shl", _shift("shl", lambda a, b: a << b)),
+    "shr": _int_op("shr", _shift("shr", lambda a, b: a >> b)),
+    "exp": _int_op("exp", _exp),
+    "==": _equality(False),
+    "!=": _equality(True),
+    "!": _not,
+    "~": _bitwise_not,
+    "len": _len,
+    "itob": _itob_op,
+    "btoi": _btoi,
+    "mulw": _mulw,
+    "addw": _addw,
+    "divmodw": _divmodw,
+    "expw": _expw,
+    "sqrt": _sqrt,
+    "bitlen": _bitlen,
+    "sha256": _hash("sha256"),
+    "keccak256": _hash("keccak256"),
+    "sha512_256": _hash("sha512_256"),
+    "ed25519verify": _ed25519verify,
+    "b+": _byte_math("b+", lambda a, b: a + b),
+    "b-": _byte_math("b-", _byte_sub),
+    "b*": _byte_math("b*", lambda a, b: a * b),
+    "b/": _byte_math("b/", _byte_div),
+    "b%": _byte_math("b%", _byte_mod),
+    "b<": _byte_math("b<", lambda a, b: a < b),
+    "b>": _byte_math("b>", lambda a, b: a > b),
+    "b<=": _byte_math("b<=", lambda a, b: a <= b),
+    "b>=": _byte_math("b>=", lambda a, b: a >= b),
+    "b==": _byte_math("b==", lambda a, b: a == b),
+    "b!=": _byte_math("b!=", lambda a, b: a != b),
+    "b|": _byte_bitwise("b|", lambda x, y: x | y),
+    "b&": _byte_bitwise("b&", lambda x, y: x & y),
+    "b^": _byte_bitwise("b^", lambda x, y: x ^ y),
+    "b~": _byte_invert,
+    "bzero": _bzero,
+    "intcblock": _intcblock,
+    "bytecblock": _bytecblock,
+    "intc": _intc,
+    "bytec": _bytec,
+    "pushint": _push,
+    "pushbytes": _push,
+    "int": _push,
+    "byte": _push,
+    "addr": _push,
+    "arg": _arg,
+    "args": _args,
+    "load": _load,
+    "store": _store,
+    "loads": _loads,
+    "stores": _stores,
+    "gload": _gload,
+    "gloads": _gloads,
+    "gaid": _gaid,
+    "gaids": _gaids,
+    "err": _err,
+    "return": _return,
+    "assert": _assert,
+    "bnz": _bnz,
+    "bz": _bz,
+    "b": _b,
+    "callsub": _callsub,
+    "retsub": _retsub,
+    "pop": _pop,
+    "dup": _dup,
+    "dup2": _dup2,
+    "dig": _dig,
+    "swap": _swap,
+    "select": _select,
+    "cover": _cover,
+    "uncover": _uncover,
+    "concat": _concat,
+    "substring": _substring,
+    "substring3": _substring3,
+    "extract": _extract,
+    "extract3": _extract3,
+    "extract_uint16": _extract_uint(2),
+    "extract_uint32": _extract_uint(4),
+    "extract_uint64": _extract_uint(8),
+    "getbyte": _getbyte,
+    "setbyte": _setbyte,
+    "getbit": _getbit,
+    "setbit": _setbit,
+    "txn": _txn,
+    "txna": _txna,
+    "txnas": _txnas,
+    "gtxn": _gtxn,
+    "gtxna": _gtxna,
+    "gtxns": _gtxns,
+    "gtxnsa": _gtxnsa,
+    "gtxnas": _gtxnas,
+    "gtxnsas": _gtxnsas,
+    "global": _global,
+    "balance": _balance,
+    "min_balance": _min_balance,
+    "app_opted_in": _app_opted_in,
+    "app_local_get": _app_local_get,
+    "app_local_get_ex": _app_local_get_ex,
+    "app_global_get": _app_global_get,
+    "app_global_get_ex": _app_global_get_ex,
+    "app_local_put": _app_local_put,
+    "app_global_put": _app_global_put,
+    "app_local_del": _app_local_del,
+    "app_global_del": _app_global_del,
+    "asset_holding_get": _asset_holding_get,
+    "asset_params_get": _asset_params_get,
+    "app_params_get": _app_params_get,
+    "log": _log,
+    "itxn_begin": _itxn_begin,
+    "itxn_field": _itxn_field,
+    "itxn_submit": _itxn_submit,
+    "itxn": _itxn,
+    "itxna": _itxna,
+}
+
+
+# Opcodes whose first immediate is a transaction field, optionally followed by an
+# array index.
+_TXN_FIELD_OPS = {
+    "txn", "txna", "txnas", "gtxns", "gtxnsa", "gtxnsas", "itxn", "itxna",
+    "itxn_field",
+}  # fmt: skip
+
+
+def _field_name(kind, token):
+    return teal.FIELD_TABLES[kind][teal.field_index(kind, token)]
+
+
+class _Compiled:
+    """
+    A program prepared for evaluation: one handler and its decoded immediates per
+    instruction, with branch targets resolved to instruction indices.
+    """
+
+    def __init__(self, program):
+        self.program = program
+        self._bytecode = None
+        instructions = program.instructions
+        labels = program.labels()
+        self.lines = [ins.line for ins in instructions]
+        self.costs = [ins.spec.cost for ins in instructions]
+        # The intcblock/bytecblock the assembler adds for pseudo-ops runs first.
+        self.header_cost = teal.implicit_block_cost(instructions)
+        self.handlers = []
+        self.immediates = []
+        self.modes = {}
+        for index, ins in enumerate(instructions):
+            handler, immediate = self._prepare(ins, index, labels)
+            self.handlers.append(handler)
+            self.immediates.append(immediate)
+            if ins.op in APPLICATION_ONLY:
+                self.modes.setdefault(SIGNATURE_MODE, (ins.op, ins.line))
+            elif ins.op in SIGNATURE_ONLY:
+                self.modes.setdefault(APPLICATION_MODE, (ins.op, ins.line))
+
+    def bytecode(self):
+        if self._bytecode is None:
+            self._bytecode = teal.assemble(self.program)
+        return self._bytecode
+
+    @staticmethod
+    def _prepare(ins, index, labels):
+        op, args = ins.op, ins.args
+        if op.startswith(("intc_", "bytec_", "arg_")):
+            base, _, number = op.rpartition("_")
+            return _HANDLERS[base], int(number)
+        handler = _HANDLERS.get(op)
+        if handler is None:
+            return _unsupported, op
+        if op in teal.PSEUDO_OPS or op in ("pushint", "pushbytes"):
+            value = teal.constant_value(ins)
+            if value is None:
+                raise teal.TealError("unbound template variable", ins.line)
+            return handler, value
+        if op == "intcblock":
+            return handler, [teal.parse_int(arg) for arg in args]
+        if op == "bytecblock":
+            return handler, teal.parse_bytes_list(args)
+        if op in ("bnz", "bz", "b"):
+            return handler, labels[args[0]]
+        if op == "callsub":
+            return handler, (labels[args[0]], index + 1)
+        if op == "txn" and len(args) == 2:
+            return _txna, (_field_name("field", args[0]), int(args[1]))
+        if op in _TXN_FIELD_OPS:
+            field = _field_name("field", args[0])
+            return handler, field if len(args) == 1 else (field, int(args[1]))
+        if op == "gtxn" and len(args) == 3:
+            return _gtxna, (int(args[0]), _field_name("field", args[1]), int(args[2]))
+        if op in ("gtxn", "gtxnas"):
+            return handler, (int(args[0]), _field_name("field", args[1]))
+        if op == "gtxna":
+            return handler, (int(args[0]), _field_name("field", args[1]), int(args[2]))
+        if op == "global":
+            return handler, _field_name("gfield", args[0])
+        if op == "asset_holding_get":
+            return handler, _field_name("hfield", args[0])
+        if op == "asset_params_get":
+            return handler, _field_name("pfield", args[0])
+        if op == "app_params_get":
+            return handler, _field_name("afield", args[0])
+        if op in ("substring", "extract", "gload"):
+            return handler, (int(args[0]), int(args[1]))
+        if args:
+            return handler, int(args[0])
+        return handler, None
+
+    def run(self, evaluation, budget, trace=None):
+        """
+        Runs the program until it returns, fails or exceeds budget.
+        :param trace: optional list that receives the index of every instruction run.
+        :return: tuple of (approved, cost).
+        """
+        wrong_mode = self.modes.get(evaluation.mode)
+        if wrong_mode is not None:
+            op, line = wrong_mode
+            raise AVMError(
+                "{} is not allowed in {} mode".format(op, evaluation.mode), line
+            )
+        handlers = self.handlers
+        immediates = self.immediates
+        costs = self.costs
+        end = len(handlers)
+        stack = evaluation.stack
+        pc = 0
+        cost = self.header_cost
+        try:
+            while pc < end:
+                cost += costs[pc]
+                if cost > budget:
+                    raise AVMError("dynamic cost budget exceeded: {}".format(budget))
+                if trace is not None:
+                    trace.append(pc)
+                target = handlers[pc](evaluation, immediates[pc])
+                pc = pc + 1 if target is None else target
+                if len(stack) > 1000:
+                    raise AVMError("stack overflow")
+        except _Return as result:
+            return result.value != 0, cost
+        except IndexError:
+            raise AVMError("stack underflow", self.lines[pc])
+        except AVMError as error:
+            if error.line is None and pc < end:
+                error.line = self.lines[pc]
+            raise
+        if len(stack) != 1:
+            raise AVMError(
+                "stack has {} values at the end of the program".format(len(stack))
+            )
+        value = stack[0]
+        if value.__class__ is not int:
+            raise AVMError("program ended with a bytes value")
+        return value != 0, cost
+
+
+_COMPILED = {}
+
+
+def _compiled(program):
+    """
+    :param program: TEAL source or teal.Program.
+    :return: the cached _Compiled for it.
+    """
+    if program is None:
+        raise AVMError("missing program")
+    key = program if isinstance(program, str) else program.text()
+    compiled = _COMPILED.get(key)
+    if compiled is None:
+        try:
+            parsed = teal.parse(program) if isinstance(program, str) else program
+            compiled = _COMPILED[key] = _Compiled(parsed)
+        except teal.TealError as error:
+            raise AVMError(str(error))
+    return compiled
@@ -0,0 +1,143 @@
+"""
+Opcode-cost and program-size regression benchmark.
+
+Builds every contract, analyzes each route with teal_cost.py and compares the
+results against the stored baseline in cost_baseline.json. Exits with status 1
+when any route's worst-case or typical cost, or any program's size, grows past
+the baseline, when a route's worst case exceeds its opcode budget, one call's
+unless the contract's BUDGET_CALLS pools more for it, or when the analysis cut
+paths off, leaving the worst case a lower bound.
+
+    python3 bench_costs.py             # check against the baseline
+    python3 bench_costs.py --update    # accept the current numbers as the baseline
+
+A route over its budget or with truncated paths is never accepted as a baseline.
+"""
+import argparse
+import json
+import os
+import sys
+
+import build
+import teal_cost
+
+BASELINE_PATH = os.path.join(build.CONTRACT_DIR, "cost_baseline.json")
+
+# Route metrics compared against the baseline.
+ROUTE_METRICS = ["max", "typical"]
+# Program metrics compared against the baseline.
+SIZE_METRICS = ["approval_bytes", "clear_bytes"]
+
+
+def measure(contracts):
+    results = build.build_contracts(contracts)
+    return {
+        contract: teal_cost.analyze_contract(contract, results[contract])
+        for contract in contracts
+    }
+
+
+def check_budgets(current):
+    """
+    :return: list of the routes over their opcode budget or with truncated paths,
+        as messages.
+    """
+    failures = []
+    for contract, report in current.items():
+        for route, cost in report["routes"].items():
+            label = "{} {}".format(contract, route)
+            if cost["max"] is not None and cost["max"] > cost["budget"]:
+                failures.append(
+                    "{}: max {} over its budget of {}".format(
+                        label, cost["max"], cost["budget"]
+                    )
+                )
+            if cost["truncated"]:
+                failures.append(
+                    "{}: {} paths truncated, max is a lower bound".format(
+                        label, cost["truncated"]
+                    )
+                )
+    return failures
+
+
+def compare(baseline, current):
+    """
+    :return: tuple of (regressions, improvements), each a list of messages.
+    """
+    regressions = []
+    improvements = []
+
+    def check(label, old, new):
+        if old is None or new is None or old == new:
+            return
+        message = "{}: {} -> {}".format(label, old, new)
+        (regressions if new > old else improvements).append(message)
+
+    for contract, report in current.items():
+        if contract not in baseline:
+            regressions.append("{}: no baseline".format(contract))
+            continue
+        expected = baseline[contract]
+        for metric in SIZE_METRICS:
+            label = "{} {}".format(contract, metric)
+            check(label, expected.get(metric), report[metric])
+        for route, cost in report["routes"].items():
+            if route not in expected["routes"]:
+                regressions.append("{} {}: no baseline".format(contract, route))
+                continue
+            for metric in ROUTE_METRICS:
+                check(
+                    "{} {} {}".format(contract, route, metric),
+                    expected["routes"][route][metric],
+                    cost[metric],
+                )
+    return regressions, improvements
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check cost and size regressions.")
+    parser.add_argument("contracts", nargs="*", default=build.CONTRACTS)
+    parser.add_argument(
+        "--update", action="store_true", help="write the current numbers as baseline"
+    )
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    args = parser.parse_args(argv)
+
+    current = measure(args.contracts)
+    for contract, report in current.items():
+        print(teal_cost.format_report(contract, report))
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    failures = check_budgets(current)
+    if args.update:
+        if failures:
+            for message in failures:
+                print("FAILED    {}".format(message))
+            print("baseline not written")
+            return 1
+        baseline.update(current)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print("baseline written to {}".format(args.baseline))
+        return 0
+
+    regressions, improvements = compare(baseline, current)
+    for message in improvements:
+        print("improved  {}".format(message))
+    for message in regressions:
+        print("REGRESSED {}".format(message))
+    for message in failures:
+        print("FAILED    {}".format(message))
+    if improvements and not regressions:
+        print("run with --update to lock in the improvements")
+    return 1 if regressions or failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
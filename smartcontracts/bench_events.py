@@ -0,0 +1,327 @@
+"""
+End-to-end check and benchmark of the events the contracts log.
+
+Runs each contract on an avm.Ledger: a donation_votes challenge and a
+periodic_withdrawals schedule as bench_teal_profile.py runs them, and a
+freeze_escrow releasing its tranches weekly. Decodes every log of their calls with
+events.py and checks the events tell what happened: the tallies rebuilt from the
+voted events are the ones the completed event reports, every withdrawal and claim
+adds its amount to the released amount of its schedule, and what the releases sent
+and the deleted event closed out adds up to the deposit. Then times decoding a
+large batch of synthetic logs with decode_many() against decoding them one by one.
+Exits with status 1 when a check fails.
+
+    python3 bench_events.py
+    python3 bench_events.py --voters 500 --logs 5000000
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+
+import avm
+import bench_teal_profile
+import build
+import donation_votes
+import freeze_escrow
+import periodic_withdrawals
+
+START_TIME = bench_teal_profile.START_TIME
+WEEK = 7 * 24 * 3600
+UINT64_MAX = 2 ** 64 - 1
+# Amounts of the freeze_escrow tranches, unlocking a week apart.
+TRANCHES = [100, 2000, 30000, 400000]
+# Sample of logs decoded one by one, the rest of the timing is extrapolated.
+SINGLE_DECODE_SAMPLE = 100000
+
+
+def logs_of(calls):
+    return [log for call in calls for log in call.logs]
+
+
+def run_freeze_escrow(compiled):
+    """
+    :return: tuple of (the avm.TxnResults of the app calls of one escrow, its
+        deposit).
+    """
+    ledger = avm.Ledger(latest_timestamp=START_TIME - 1)
+    calls = []
+
+    def run(group):
+        result = ledger.execute(group, check=True)
+        calls.extend(txn for txn in result.txns if txn.logs is not None)
+        return result
+
+    receiver = avm.address("receiver")
+    ledger.fund(receiver, 10 ** 15)
+    asset = ledger.create_asset(receiver, UINT64_MAX)
+    unlock_time = START_TIME + (len(TRANCHES) + 1) * WEEK
+    packed = b"".join(
+        value.to_bytes(8, "big")
+        for i, amount in enumerate(TRANCHES)
+        for value in (asset, amount, START_TIME + i * WEEK)
+    )
+    result = run(
+        avm.app_create(
+            receiver,
+            compiled["approval"][0],
+            compiled["clear"][0],
+            args=[asset, receiver, unlock_time, packed],
+            assets=[asset],
+            global_ints=freeze_escrow.GLOBAL_SCHEMA[0],
+            global_bytes=freeze_escrow.GLOBAL_SCHEMA[1],
+            local_ints=freeze_escrow.LOCAL_SCHEMA[0],
+            local_bytes=freeze_escrow.LOCAL_SCHEMA[1],
+        )
+    )
+    app_id = result.txns[0].created_app_id
+    app_address = avm.application_address(app_id)
+    deposit = sum(TRANCHES) + 7
+    run(avm.payment(receiver, app_address, 10 ** 6))
+    run(avm.app_call(receiver, app_id, ["setup"], assets=[asset]))
+    run(avm.asset_transfer(receiver, app_address, asset, deposit))
+    # Twice a week, so every other release has nothing left to send.
+    for day in range(0, len(TRANCHES) * 7, 3):
+        ledger.latest_timestamp = START_TIME + day * 24 * 3600 + 1
+        run(
+            [
+                avm.app_call(receiver, app_id, ["release"], assets=[asset]),
+                avm.app_call(receiver, app_id, ["budget"]),
+            ]
+        )
+    ledger.latest_timestamp = unlock_time
+    run(
+        avm.app_call(
+            receiver, app_id, on_complete=avm.DELETE_APPLICATION, assets=[asset]
+        )
+    )
+    return calls, deposit
+
+
+def check_donation_votes(logs, voters):
+    """
+    :return: list of failures.
+    """
+    decoded = donation_votes.Events.decode_many(logs)
+    failures = []
+    opened = decoded["opened"]
+    voted = decoded["voted"]
+    completed = decoded["completed"]
+    options = int(opened["options"][0])
+    # A voted event moves one vote from previous_ballot to ballot, 0 is no vote.
+    tallies = (
+        np.bincount(voted["ballot"], minlength=options + 1)
+        - np.bincount(voted["previous_ballot"], minlength=options + 1)
+    )[1:]
+    # bench_teal_profile closes out every seventh voter.
+    expected = voters - (voters + 6) // 7
+    if tallies.min() < 0 or tallies.sum() != expected:
+        failures.append(
+            "donation_votes: voted events tally {}, {} votes expected".format(
+                tallies.tolist(), expected
+            )
+        )
+    if completed["total_votes"].tolist() != [tallies.sum()]:
+        failures.append(
+            "donation_votes: completed reports {} votes, voted events {}".format(
+                completed["total_votes"].tolist(), tallies.sum()
+            )
+        )
+    if (voted["ballot"] == voted["previous_ballot"]).any():
+        failures.append("donation_votes: a voted event changes nothing")
+    return failures
+
+
+def check_periodic_withdrawals(logs, deposit):
+    """
+    :return: list of failures.
+    """
+    decoded = periodic_withdrawals.Events.decode_many(logs)
+    failures = []
+    withdrew = decoded["withdrew"]
+    claimed = decoded["claimed"]
+    by_beneficiary = claimed["account"] == decoded["registered"]["beneficiary"][0]
+    fields = ["index", "amount", "released_amount"]
+    # The receiver withdraws and claims from the same schedule.
+    for name, sends in [
+        (
+            "receiver",
+            np.concatenate([withdrew[fields], claimed[~by_beneficiary][fields]]),
+        ),
+        ("beneficiary", claimed[by_beneficiary][fields]),
+    ]:
+        sends = np.sort(sends, order="index")
+        if (np.cumsum(sends["amount"]) != sends["released_amount"]).any():
+            failures.append(
+                "periodic_withdrawals: {}'s released amounts are not the sum of "
+                "their withdrawals and claims".format(name)
+            )
+    sent = int(withdrew["amount"].sum() + claimed["amount"].sum())
+    closed = int(decoded["deleted"]["amount"][0])
+    if sent + closed != deposit:
+        failures.append(
+            "periodic_withdrawals: sent {} and closed out {} of a {} deposit".format(
+                sent, closed, deposit
+            )
+        )
+    return failures
+
+
+def check_freeze_escrow(logs, deposit):
+    """
+    :return: list of failures.
+    """
+    decoded = freeze_escrow.Events.decode_many(logs)
+    failures = []
+    released = decoded["released"]
+    counts = released["released_count"].tolist()
+    if released["first"].tolist() != [0] + counts[:-1] or counts[-1:] != [
+        len(TRANCHES)
+    ]:
+        failures.append(
+            "freeze_escrow: released events {} do not release every tranche "
+            "once".format(list(zip(released["first"].tolist(), counts)))
+        )
+    closed = int(decoded["deleted"]["amount"][0])
+    if closed != deposit - sum(TRANCHES):
+        failures.append(
+            "freeze_escrow: closed out {}, {} left after the tranches".format(
+                closed, deposit - sum(TRANCHES)
+            )
+        )
+    return failures
+
+
+def synthetic_logs(count, seed):
+    """
+    :return: tuple of (count logs of donation_votes events in random order, dict of
+        event name to the structured array of its logs).
+    """
+    rng = np.random.default_rng(seed)
+    events = donation_votes.Events.events
+    # Mostly votes, as on a live application.
+    shares = {"opened": 0.001, "voted": 0.99, "completed": 0.001, "deleted": 0.008}
+    rows = {}
+    logs = []
+    for name, share in shares.items():
+        event = events[name]
+        # Random fields, behind the event's tag.
+        data = rng.integers(0, 256, (int(count * share), event.size), np.uint8)
+        data[:, 0] = event.tag
+        event_rows = data.reshape(-1).view(event.dtype)
+        data = data.tobytes()
+        logs += [data[i : i + event.size] for i in range(0, len(data), event.size)]
+        rows[name] = event_rows
+    order = rng.permutation(len(logs))
+    logs = [logs[i] for i in order.tolist()]
+    # Position of each event's logs, in the order they were made.
+    positions = np.empty(len(order), dtype=np.int64)
+    positions[order] = np.arange(len(order))
+    start = 0
+    for name, event_rows in rows.items():
+        rows[name] = event_rows[np.argsort(positions[start : start + len(event_rows)])]
+        start += len(event_rows)
+    return logs, rows
+
+
+def time_decoding(count, seed):
+    """
+    :return: tuple of (report lines, failures).
+    """
+    logs, expected = synthetic_logs(count, seed)
+    schema = donation_votes.Events
+    start = time.perf_counter()
+    decoded = schema.decode_many(logs)
+    bulk = time.perf_counter() - start
+    sample = logs[:SINGLE_DECODE_SAMPLE]
+    start = time.perf_counter()
+    for log in sample:
+        schema.decode(log)
+    single = (time.perf_counter() - start) * len(logs) / len(sample)
+    failures = []
+    for name, rows in expected.items():
+        if not all(
+            np.array_equal(decoded[name][field], rows[field])
+            for field in rows.dtype.names
+        ):
+            failures.append(
+                "decode_many: {} events differ from their logs".format(name)
+            )
+    lines = [
+        "{:>9} logs  decode_many {:6.3f}s {:>12,.0f} logs/s".format(
+            len(logs), bulk, len(logs) / bulk
+        ),
+        "{:>9} logs  decode      {:6.3f}s {:>12,.0f} logs/s  (from {} logs)  "
+        "{:.0f}x slower".format(
+            len(logs), single, len(logs) / single, len(sample), single / bulk
+        ),
+    ]
+    return lines, failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check and time contract events.")
+    parser.add_argument("--voters", type=int, default=200)
+    parser.add_argument("--options", type=int, default=donation_votes.MAX_OPTIONS)
+    parser.add_argument("--periods", type=int, default=20)
+    parser.add_argument("--logs", type=int, default=10 ** 6)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    results = build.build_contracts(
+        ["donation_votes", "periodic_withdrawals", "freeze_escrow"]
+    )
+    calls, deposit = run_freeze_escrow(results["freeze_escrow"])
+    runs = [
+        (
+            "donation_votes",
+            logs_of(
+                bench_teal_profile.run_donation_votes(
+                    results["donation_votes"], args.voters, args.options
+                )
+            ),
+            lambda logs: check_donation_votes(logs, args.voters),
+        ),
+        (
+            "periodic_withdrawals",
+            logs_of(
+                bench_teal_profile.run_periodic_withdrawals(
+                    results["periodic_withdrawals"], args.periods
+                )
+            ),
+            lambda logs: check_periodic_withdrawals(
+                logs, bench_teal_profile.DEPOSIT
+            ),
+        ),
+        (
+            "freeze_escrow",
+            logs_of(calls),
+            lambda logs: check_freeze_escrow(logs, deposit),
+        ),
+    ]
+    failures = []
+    for contract, logs, check in runs:
+        schema = sys.modules[contract].Events
+        counts = {
+            name: len(rows) for name, rows in schema.decode_many(logs).items()
+        }
+        print(
+            "{:<21} {:>5} logs  {}".format(
+                contract,
+                len(logs),
+                "  ".join("{} {}".format(name, n) for name, n in counts.items()),
+            )
+        )
+        failures += check(logs)
+
+    lines, found = time_decoding(args.logs, args.seed)
+    print("\n".join(lines))
+    failures += found
+    for message in failures:
+        print("FAILED  {}".format(message))
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
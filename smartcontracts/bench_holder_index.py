@@ -0,0 +1,388 @@
+"""
+Benchmark of block_stream.py and holder_index.py on synthetic blocks.
+
+Writes a file of msgpack blocks shaped like mainnet's: payments, application calls
+naming the asset among their foreign assets, transfers of other assets, and
+transfers of the indexed asset (opt ins, payments, close outs, clawbacks and inner
+transfers out of an escrow application). The blocks are read once by decoding each
+of them in full and once with block_stream.py, then ingested into a HolderIndex.
+Reports blocks and transactions per second for both reads and the time of
+eligibility queries and snapshots. Exits with status 1 if the two reads disagree,
+or if the index or a snapshot differs from the balances the generator kept.
+
+    python3 bench_holder_index.py
+    python3 bench_holder_index.py --blocks 2000 --txns 2000 --accounts 100000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+import msgpack
+from algosdk import encoding, logic
+
+import block_stream
+import holder_index
+
+ASSET_ID = block_stream.NEKO_ASSET_ID
+OTHER_ASSETS = [31566704, 312769, 226701642]
+TOTAL = 10 ** 15
+ESCROW_APP = 1234
+# Share of each transaction type in a block, the rest being payments. Transfers of
+# the indexed asset take --asset-share, a fifth of them inner transfers.
+SHARES = {"appl": 0.2, "other axfer": 0.15}
+SNAPSHOTS = 5
+
+
+class _Generator:
+    """
+    Builds blocks and keeps the balance of every holder of the asset.
+    """
+
+    def __init__(self, accounts, seed):
+        self.rng = random.Random(seed)
+        self.accounts = [self.rng.randbytes(32) for _ in range(accounts)]
+        self.creator = self.accounts[0]
+        self.clawback = self.accounts[1]
+        self.escrow = encoding.decode_address(
+            logic.get_application_address(ESCROW_APP)
+        )
+        self.balances = {}
+        self.holders = []
+        self.genesis_hash = self.rng.randbytes(32)
+
+    def _sig(self, txn):
+        return {"sig": self.rng.randbytes(64), "txn": txn}
+
+    def _common(self, sender, kind, round_num):
+        return {
+            "fee": 1000,
+            "fv": round_num - 1,
+            "lv": round_num + 999,
+            "snd": sender,
+            "type": kind,
+        }
+
+    def create(self, round_num):
+        txn = self._common(self.creator, "acfg", round_num)
+        txn["apar"] = {
+            "an": "Nekoin",
+            "c": self.clawback,
+            "dc": 6,
+            "t": TOTAL,
+            "un": "NEKO",
+        }
+        self.balances[self.creator] = TOTAL
+        self.holders.append(self.creator)
+        return dict(self._sig(txn), caid=ASSET_ID)
+
+    def _transfer(self, sender, receiver, amount, close_to=None):
+        self.balances[sender] -= amount
+        self.balances[receiver] = self.balances.get(receiver, 0) + amount
+        if close_to is not None:
+            self.balances[close_to] += self.balances.pop(sender)
+            self.holders.remove(sender)
+
+    def _axfer(self, round_num, sender, fields):
+        txn = self._common(sender, "axfer", round_num)
+        txn.update({key: value for key, value in fields.items() if value})
+        txn["xaid"] = ASSET_ID
+        return txn
+
+    def asset_txn(self, round_num):
+        roll = self.rng.random()
+        if roll < 0.3 or len(self.holders) < 3:
+            account = self.rng.choice(self.accounts)
+            if account not in self.balances:
+                self.balances[account] = 0
+                self.holders.append(account)
+            return self._sig(self._axfer(round_num, account, {"arcv": account}))
+        sender, receiver = self.rng.sample(self.holders, 2)
+        amount = self.rng.randint(0, self.balances[sender])
+        if roll < 0.35 and sender not in (self.creator, self.escrow):
+            close_to = receiver
+            self._transfer(sender, receiver, amount, close_to)
+            return self._sig(
+                self._axfer(
+                    round_num,
+                    sender,
+                    {"aamt": amount, "arcv": receiver, "aclose": close_to},
+                )
+            )
+        self._transfer(sender, receiver, amount)
+        if roll < 0.37:
+            fields = {"aamt": amount, "arcv": receiver, "asnd": sender}
+            return self._sig(self._axfer(round_num, self.clawback, fields))
+        fields = {"aamt": amount, "arcv": receiver}
+        return self._sig(self._axfer(round_num, sender, fields))
+
+    def inner_txn(self, round_num):
+        txn = self._common(self.rng.choice(self.accounts), "appl", round_num)
+        txn.update({"apaa": [b"release"], "apas": [ASSET_ID], "apid": ESCROW_APP})
+        inner = []
+        receiver = self.rng.choice(self.holders)
+        amount = min(self.balances.get(self.escrow, 0), self.rng.randint(1, 10 ** 6))
+        if amount and receiver != self.escrow:
+            self._transfer(self.escrow, receiver, amount)
+            inner.append(
+                {
+                    "txn": {
+                        "aamt": amount,
+                        "arcv": receiver,
+                        "fv": round_num - 1,
+                        "lv": round_num + 1,
+                        "snd": self.escrow,
+                        "type": "axfer",
+                        "xaid": ASSET_ID,
+                    }
+                }
+            )
+        stxn = self._sig(txn)
+        if inner:
+            stxn["dt"] = {"itx": inner}
+        return stxn
+
+    def other_txn(self, kind, round_num):
+        sender, receiver = self.rng.sample(self.accounts, 2)
+        if kind == "appl":
+            txn = self._common(sender, "appl", round_num)
+            txn.update(
+                {
+                    "apaa": [
+                        b"vote",
+                        self.rng.randrange(1, 9).to_bytes(8, "big"),
+                        self.rng.randrange(4).to_bytes(8, "big"),
+                    ],
+                    "apas": [ASSET_ID],
+                    "apid": self.rng.randrange(10 ** 8),
+                }
+            )
+        elif kind == "other axfer":
+            txn = self._common(sender, "axfer", round_num)
+            txn.update(
+                {
+                    "aamt": self.rng.randrange(1, 10 ** 9),
+                    "arcv": receiver,
+                    "xaid": self.rng.choice(OTHER_ASSETS),
+                }
+            )
+        else:
+            txn = self._common(sender, "pay", round_num)
+            txn.update({"amt": self.rng.randrange(1, 10 ** 9), "rcv": receiver})
+        return self._sig(txn)
+
+    def block(self, round_num, count, asset_share):
+        txns = []
+        if round_num == 1:
+            txns.append(self.create(round_num))
+            # The escrow's holdings, released by inner transactions.
+            self.balances[self.escrow] = 0
+            self.holders.append(self.escrow)
+            txns.append(
+                self._sig(self._axfer(round_num, self.escrow, {"arcv": self.escrow}))
+            )
+            self._transfer(self.creator, self.escrow, TOTAL // 10)
+            txns.append(
+                self._sig(
+                    self._axfer(
+                        round_num,
+                        self.creator,
+                        {"aamt": TOTAL // 10, "arcv": self.escrow},
+                    )
+                )
+            )
+        shares = dict(
+            SHARES, axfer=asset_share * 0.8, **{"inner axfer": asset_share * 0.2}
+        )
+        kinds = list(shares) + ["pay"]
+        weights = list(shares.values()) + [1 - sum(shares.values())]
+        for kind in self.rng.choices(kinds, weights, k=count - len(txns)):
+            if kind == "axfer":
+                txns.append(self.asset_txn(round_num))
+            elif kind == "inner axfer":
+                txns.append(self.inner_txn(round_num))
+            else:
+                txns.append(self.other_txn(kind, round_num))
+        for stxn in txns:
+            stxn["hgi"] = True
+        block = {
+            "earn": 27521,
+            "fees": self.rng.randbytes(32),
+            "gen": "mainnet-v1.0",
+            "gh": self.genesis_hash,
+            "prev": self.rng.randbytes(32),
+            "proto": "https://github.com/algorandfoundation/specs/tree/abc54f7",
+            "rnd": round_num,
+            "seed": self.rng.randbytes(32),
+            "tc": 10 ** 9 + round_num * count,
+            "ts": 1_600_000_000 + round_num * 4,
+            "txn": self.rng.randbytes(32),
+            "txns": txns,
+        }
+        cert = {
+            "prop": {"dig": self.rng.randbytes(32), "oprop": self.rng.randbytes(32)},
+            "rnd": round_num,
+            "step": 2,
+            "vote": [
+                {"cred": {"pf": self.rng.randbytes(80)}, "sig": self.rng.randbytes(64)}
+                for _ in range(20)
+            ],
+        }
+        return {"block": block, "cert": cert}
+
+
+def full_decode(path, asset_ids):
+    """
+    Reads blocks the plain way, decoding each of them in full.
+    :return: list of (round, transfers) of every block.
+    """
+    result = []
+    with open(path, "rb") as f:
+        for wrapped in msgpack.Unpacker(f, raw=False):
+            block = wrapped["block"]
+            transfers = []
+            for stxn in block.get("txns", ()):
+                block_stream._transfers(stxn, asset_ids, transfers)
+            result.append((block.get("rnd", 0), transfers))
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the holder index.")
+    parser.add_argument("--blocks", type=int, default=300)
+    parser.add_argument("--txns", type=int, default=1000, help="per block")
+    parser.add_argument("--accounts", type=int, default=20000)
+    parser.add_argument(
+        "--asset-share",
+        type=float,
+        default=0.01,
+        help="share of the transactions transferring the indexed asset",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    generator = _Generator(args.accounts, args.seed)
+    rng = random.Random(args.seed)
+    snapshot_rounds = sorted(rng.sample(range(1, args.blocks + 1), SNAPSHOTS))
+    expected_snapshots = {}
+    failures = []
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "blocks.msgpack")
+        start = time.perf_counter()
+        with open(path, "wb") as f:
+            for round_num in range(1, args.blocks + 1):
+                block = generator.block(round_num, args.txns, args.asset_share)
+                f.write(msgpack.packb(block))
+                if round_num in snapshot_rounds:
+                    expected_snapshots[round_num] = dict(generator.balances)
+        size = os.path.getsize(path)
+        txns = args.blocks * args.txns
+        print(
+            "wrote {} blocks of {} transactions, {:.1f} MB in {:.1f}s".format(
+                args.blocks, args.txns, size / 2 ** 20, time.perf_counter() - start
+            )
+        )
+
+        reads = {}
+        for name, read in [
+            ("full decode", lambda: full_decode(path, {ASSET_ID})),
+            (
+                "block_stream",
+                lambda: [
+                    (round_num, transfers)
+                    for round_num, _, transfers in block_stream.blocks(
+                        [path], {ASSET_ID}
+                    )
+                ],
+            ),
+        ]:
+            start = time.perf_counter()
+            reads[name] = read()
+            seconds = time.perf_counter() - start
+            print(
+                "{:<14} {:6.2f}s  {:>8,.0f} blocks/s  {:>10,.0f} txns/s  "
+                "{:>6.0f} MB/s".format(
+                    name,
+                    seconds,
+                    args.blocks / seconds,
+                    txns / seconds,
+                    size / 2 ** 20 / seconds,
+                )
+            )
+        if reads["full decode"] != reads["block_stream"]:
+            failures.append("block_stream read other transfers than a full decode")
+        print(
+            "{} transfers of asset {}".format(
+                sum(len(transfers) for _, transfers in reads["block_stream"]),
+                ASSET_ID,
+            )
+        )
+
+        index = holder_index.HolderIndex(ASSET_ID, checkpoint_rounds=50)
+        start = time.perf_counter()
+        holder_index.ingest([path], {ASSET_ID: index})
+        print(
+            "ingested in {:.2f}s: {} holders, {} opted in".format(
+                time.perf_counter() - start,
+                index.holder_count(),
+                index.opted_in_count(),
+            )
+        )
+
+    def compare(name, holdings, balances):
+        if holdings.holder_count() != sum(1 for b in balances.values() if b):
+            failures.append("{}: holder count {}".format(name, holdings.holder_count()))
+        if holdings.opted_in_count() != len(balances):
+            failures.append(
+                "{}: opted in count {}".format(name, holdings.opted_in_count())
+            )
+        for account in generator.accounts + [generator.escrow]:
+            if holdings.balance(account) != balances.get(account, 0) or (
+                holdings.opted_in(account) != (account in balances)
+            ):
+                failures.append(
+                    "{}: {} holds {}, expected {}".format(
+                        name,
+                        encoding.encode_address(account),
+                        holdings.balance(account),
+                        balances.get(account),
+                    )
+                )
+                break
+
+    compare("index", index, generator.balances)
+    start = time.perf_counter()
+    for account in generator.accounts:
+        index.eligible(account)
+    print(
+        "eligibility query: {:.2f} us".format(
+            (time.perf_counter() - start) / len(generator.accounts) * 1e6
+        )
+    )
+    start = time.perf_counter()
+    locked = index.locked([ESCROW_APP])[ESCROW_APP]
+    print(
+        "application {} locks {} ({:.2f} us)".format(
+            ESCROW_APP, locked, (time.perf_counter() - start) * 1e6
+        )
+    )
+    for round_num, balances in expected_snapshots.items():
+        start = time.perf_counter()
+        snapshot = index.snapshot(round_num)
+        seconds = time.perf_counter() - start
+        print(
+            "snapshot at round {:>5}: {:6.2f} ms, {} holders".format(
+                round_num, seconds * 1e3, snapshot.holder_count()
+            )
+        )
+        compare("snapshot at round {}".format(round_num), snapshot, balances)
+
+    for message in failures[:10]:
+        print("FAILED  {}".format(message))
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+"""
+Benchmark of offline NFT listing instantiation with teal_template.py.
+
+Generates synthetic listings for nft_3way_txn.teal.tmpl, instantiates them in one
+batch and checks a sample against a full teal.assemble() and the LogicSig address
+py-algorand-sdk derives. Exits with status 1 on any mismatch.
+
+    python3 bench_listings.py
+    python3 bench_listings.py --listings 10000 100000 --sample 1000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+from algosdk.future.transaction import LogicSig
+
+import teal
+import teal_template
+
+DEFAULT_LISTINGS = [10 ** 4, 10 ** 5]
+TEMPLATE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "nft_3way_txn.teal.tmpl"
+)
+
+
+def synthetic_listings(count, seed):
+    """
+    :return: list of template values for count listings with random assets, wallets
+        and prices, the royalty and platform wallets shared by the whole drop.
+    """
+    rng = random.Random(seed)
+    charity = rng.randbytes(32)
+    platform = rng.randbytes(32)
+    sellers = [rng.randbytes(32) for _ in range(max(1, count // 10))]
+    listings = []
+    for i in range(count):
+        price = rng.randrange(10 ** 5, 10 ** 10)
+        listings.append(
+            {
+                "TMPL_ASSET_ID": 10 ** 8 + i,
+                "TMPL_SELLER_ADDR": rng.choice(sellers),
+                "TMPL_PAY_RECV2_ADDR": charity,
+                "TMPL_PAY_RECV3_ADDR": platform,
+                "TMPL_PAYMENT_SELLER_AMOUNT": price * 90 // 100,
+                "TMPL_PAYMENT_RECV2_AMOUNT": price * 5 // 100,
+                "TMPL_PAYMENT_RECV3_AMOUNT": price - price * 95 // 100,
+            }
+        )
+    return listings
+
+
+def run(skeleton, count, sample, seed):
+    """
+    :return: tuple of (report lines, mismatches).
+    """
+    listings = synthetic_listings(count, seed)
+    start = time.perf_counter()
+    results = skeleton.instantiate_batch(listings)
+    seconds = time.perf_counter() - start
+    lines = [
+        "{:>9} listings  {:7.3f}s  {:>9,.0f} listings/s  {} layouts".format(
+            count, seconds, count / seconds, len(skeleton._layouts)
+        )
+    ]
+    mismatches = []
+    rng = random.Random(seed)
+    for i in rng.sample(range(count), min(sample, count)):
+        bytecode, address = results[i]
+        if bytecode != teal.assemble(skeleton.program, listings[i]):
+            mismatches.append("listing {}: differs from teal.assemble".format(i))
+        elif address != LogicSig(bytecode).address():
+            mismatches.append("listing {}: address {} differs".format(i, address))
+    lines.append(
+        "          checked {} listings: {}".format(
+            min(sample, count),
+            "{} mismatch(es)".format(len(mismatches)) if mismatches else "agree",
+        )
+    )
+    return lines, mismatches
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark listing instantiation.")
+    parser.add_argument("--listings", type=int, nargs="+", default=DEFAULT_LISTINGS)
+    parser.add_argument("--template", default=TEMPLATE)
+    parser.add_argument(
+        "--sample",
+        type=int,
+        default=300,
+        help="listings checked against a full assembly (0 to skip)",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    skeleton = teal_template.Skeleton.load(args.template)
+    failed = False
+    for count in args.listings:
+        lines, mismatches = run(skeleton, count, args.sample, args.seed)
+        print("\n".join(lines))
+        for message in mismatches:
+            print("MISMATCH  {}".format(message))
+        failed = failed or bool(mismatches)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,141 @@
+"""
+Benchmark of nft_client.py against algod_stub.py.
+
+Starts a stub algod in-process and runs buys of synthetic nft_3way_txn.teal.tmpl
+listings through it: first one at a time over a single connection, as a client
+that submits a trade and waits for its confirmation before the next one does, then
+with run_trades() at each concurrency level. Reports trades per second, the rounds
+they took and how many connections, requests and suggested params fetches they
+needed. Exits with status 1 if any trade fails.
+
+    python3 bench_nft_client.py
+    python3 bench_nft_client.py --trades 5000 --concurrency 64 256 --block-time 1
+"""
+import argparse
+import asyncio
+import functools
+import os
+import random
+import sys
+import time
+
+from algosdk import account, encoding
+
+import algod_client
+import algod_stub
+import nft_client
+import teal_template
+
+TEMPLATE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "nft_3way_txn.teal.tmpl"
+)
+DEFAULT_CONCURRENCY = [32, 256]
+
+
+def synthetic_buys(count, seed):
+    """
+    :return: list of (program, buyer key, asset ID, payouts) of count buys of
+        listings with random sellers and prices.
+    """
+    rng = random.Random(seed)
+    skeleton = teal_template.Skeleton.load(TEMPLATE)
+    charity = encoding.encode_address(rng.randbytes(32))
+    platform = encoding.encode_address(rng.randbytes(32))
+    buyers = [account.generate_account()[0] for _ in range(max(1, count // 10))]
+    buys = []
+    for i in range(count):
+        seller = encoding.encode_address(rng.randbytes(32))
+        price = rng.randrange(10 ** 5, 10 ** 10)
+        amounts = [price * 90 // 100, price * 5 // 100, price - price * 95 // 100]
+        program = skeleton.instantiate(
+            {
+                "TMPL_ASSET_ID": 10 ** 8 + i,
+                "TMPL_SELLER_ADDR": seller,
+                "TMPL_PAY_RECV2_ADDR": charity,
+                "TMPL_PAY_RECV3_ADDR": platform,
+                "TMPL_PAYMENT_SELLER_AMOUNT": amounts[0],
+                "TMPL_PAYMENT_RECV2_AMOUNT": amounts[1],
+                "TMPL_PAYMENT_RECV3_AMOUNT": amounts[2],
+            }
+        )
+        payouts = list(zip([seller, charity, platform], amounts))
+        buys.append((program, rng.choice(buyers), 10 ** 8 + i, payouts))
+    return buys
+
+
+async def run(buys, concurrency, connections, block_time, latency):
+    """
+    :return: tuple of (report line, failures).
+    """
+    stub = algod_stub.AlgodStub(block_time, latency)
+    address = await stub.start()
+    try:
+        async with algod_client.AlgodClient(address, connections=connections) as algod:
+            client = nft_client.SaleClient(algod)
+            trades = (functools.partial(client.buy, *buy) for buy in buys)
+            first_round = stub.round
+            start = time.perf_counter()
+            results = await nft_client.run_trades(trades, concurrency)
+            seconds = time.perf_counter() - start
+            line = (
+                "{:>6} trades  concurrency {:>4}  {:7.2f}s  {:>8,.1f} trades/s  "
+                "{:>3} rounds  {} connections  {} requests  {} params"
+            ).format(
+                len(buys),
+                concurrency,
+                seconds,
+                len(buys) / seconds,
+                stub.round - first_round,
+                stub.connections,
+                algod.requests,
+                stub.params_requests,
+            )
+    finally:
+        await stub.close()
+    failures = [
+        "trade {}: {!r}".format(i, result)
+        for i, result in enumerate(results)
+        if isinstance(result, Exception)
+    ]
+    return line, failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the NFT sale client.")
+    parser.add_argument("--trades", type=int, default=2000)
+    parser.add_argument(
+        "--serial-trades",
+        type=int,
+        default=10,
+        help="trades run one at a time first (0 to skip)",
+    )
+    parser.add_argument(
+        "--concurrency", type=int, nargs="+", default=DEFAULT_CONCURRENCY
+    )
+    parser.add_argument(
+        "--connections", type=int, default=algod_client.DEFAULT_CONNECTIONS
+    )
+    parser.add_argument("--block-time", type=float, default=0.25)
+    parser.add_argument(
+        "--latency", type=float, default=0.002, help="seconds added to every response"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    buys = synthetic_buys(max(args.trades, args.serial_trades), args.seed)
+    runs = [(args.serial_trades, 1, 1)] if args.serial_trades else []
+    runs += [(args.trades, c, args.connections) for c in args.concurrency]
+    failed = False
+    for count, concurrency, connections in runs:
+        line, failures = asyncio.run(
+            run(buys[:count], concurrency, connections, args.block_time, args.latency)
+        )
+        print(line)
+        for message in failures[:10]:
+            print("FAILED  {}".format(message))
+        failed = failed or bool(failures)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
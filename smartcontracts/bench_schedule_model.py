@@ -0,0 +1,230 @@
+"""
+Benchmark of the release schedule model over parameter sweeps.
+
+Sweeps a grid of periodic_withdrawals schedules, every combination of time period,
+withdraw amount, start delay, deposit and lockup length, against years of receiver
+calls for each of STRATEGIES, and a population of random freeze_escrow tranche
+schedules, some out of order, against weekly releases. Reports the time of each
+sweep and what the schedules release, strand and miss, then replays a sample of
+them through the compiled contracts with schedule_model.cross_check_withdrawals()
+and cross_check_tranches(). Exits with status 1 when the model and a contract
+disagree.
+
+    python3 bench_schedule_model.py
+    python3 bench_schedule_model.py --years 5 --escrows 100000 --sample 20
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+
+import freeze_escrow
+import schedule_model
+
+DAY = 24 * 3600
+WEEK = 7 * DAY
+YEAR = 365 * DAY
+START_TIME = 1_600_000_000
+# The grid of periodic_withdrawals parameters.
+TIME_PERIODS = [DAY, WEEK, 2 * WEEK, 30 * DAY]
+WITHDRAW_AMOUNTS = [10 ** 6 * k for k in (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)]
+START_DELAYS = [0, DAY // 2, DAY, 3 * DAY, WEEK, 2 * WEEK, 30 * DAY, 90 * DAY]
+# Deposits in withdraw amounts, some short of a whole one.
+DEPOSITS = [10, 52, 52.5, 100, 365]
+LOCKUPS = [1, 2, 3]
+# Receiver's calls: (name, mean gap between calls, share of claims).
+STRATEGIES = [
+    ("withdraw daily", DAY, 0.0),
+    ("withdraw weekly", WEEK, 0.0),
+    ("claim monthly", 30 * DAY, 1.0),
+    ("mixed", 3 * DAY, 0.3),
+]
+
+
+def withdrawal_grid(years):
+    """
+    :return: dict of the parameter arrays of every schedule of the grid, lockups
+        longer than years left out.
+    """
+    grid = np.array(
+        np.meshgrid(
+            TIME_PERIODS,
+            WITHDRAW_AMOUNTS,
+            START_DELAYS,
+            DEPOSITS,
+            [lockup for lockup in LOCKUPS if lockup <= years],
+            indexing="ij",
+        )
+    ).reshape(5, -1)
+    period, amount, delay, deposit, lockup = grid
+    return {
+        "time_period": period.astype(np.int64),
+        "contract_start_time": (START_TIME + delay).astype(np.int64),
+        "withdraw_amount": amount.astype(np.int64),
+        "deposit": (amount * deposit).astype(np.int64),
+        "delete_time": (START_TIME + lockup * YEAR).astype(np.int64),
+    }
+
+
+def synthetic_escrows(count, seed):
+    """
+    :return: tuple of (tranche amounts, unlock times, tranche counts, deposits,
+        delete times) of count random escrows. Tranches unlock about monthly, one
+        in ten escrows has two swapped, and one in five is funded short.
+    """
+    rng = np.random.default_rng(seed)
+    columns = freeze_escrow.MAX_TRANCHES
+    amount = rng.integers(1, 10 ** 6, (count, columns)) * 10 ** 3
+    gaps = rng.integers(20 * DAY, 40 * DAY, (count, columns))
+    unlock = START_TIME + np.cumsum(gaps, axis=1)
+    swapped = np.flatnonzero(rng.random(count) < 0.1)
+    first = rng.integers(0, columns - 1, len(swapped))
+    unlock[swapped, first], unlock[swapped, first + 1] = (
+        unlock[swapped, first + 1],
+        unlock[swapped, first],
+    )
+    tranche_count = rng.integers(1, columns + 1, count)
+    exists = np.arange(columns) < tranche_count[:, None]
+    owed = np.where(exists, amount, 0).sum(axis=1)
+    short = rng.random(count) < 0.2
+    deposit = np.where(short, owed * rng.uniform(0.5, 1, count), owed).astype(np.int64)
+    last_unlock = np.where(exists, unlock, 0).max(axis=1)
+    delete_time = np.maximum(
+        last_unlock + rng.integers(-60 * DAY, 60 * DAY, count), START_TIME + WEEK
+    )
+    return amount, unlock, tranche_count, deposit, delete_time
+
+
+def run_withdrawals(years, sample, seed):
+    """
+    :return: tuple of (report lines, mismatches).
+    """
+    grid = withdrawal_grid(years)
+    size = len(grid["time_period"])
+    rng = np.random.default_rng(seed)
+    lines = []
+    mismatches = []
+    for name, gap, claim_rate in STRATEGIES:
+        attempts, actions = schedule_model.synthetic_attempts(
+            START_TIME, START_TIME + years * YEAR, gap, claim_rate, seed
+        )
+        start = time.perf_counter()
+        result = schedule_model.simulate_withdrawals(
+            **grid, attempts=attempts, actions=actions
+        )
+        seconds = time.perf_counter() - start
+        deposit = grid["deposit"]
+        lines += [
+            "{:<16} {:>6} schedules x {:>5} calls  model {:6.3f}s  "
+            "{:>11,.0f} schedule-calls/s".format(
+                name, size, len(attempts), seconds, size * len(attempts) / seconds
+            ),
+            "{:<16} released {:5.1%}  stranded at delete {:5.1%} in {} schedules  "
+            "missed periods {} in {} schedules".format(
+                "",
+                result.released.sum() / deposit.sum(),
+                result.held.sum() / deposit.sum(),
+                np.count_nonzero(result.held),
+                result.missed_periods.sum(),
+                np.count_nonzero(result.missed_periods),
+            ),
+        ]
+        if sample:
+            chosen = rng.choice(size, size=min(sample, size), replace=False)
+            start = time.perf_counter()
+            found = schedule_model.cross_check_withdrawals(
+                **{key: values[chosen] for key, values in grid.items()},
+                attempts=attempts,
+                actions=actions
+            )
+            lines.append(
+                "{:<16} contract replay of {} schedules {:.2f}s: {}".format(
+                    "",
+                    len(chosen),
+                    time.perf_counter() - start,
+                    "{} mismatch(es)".format(len(found)) if found else "agrees",
+                )
+            )
+            mismatches += ["{}: {}".format(name, message) for message in found]
+    return lines, mismatches
+
+
+def run_tranches(escrows, sample, seed):
+    """
+    :return: tuple of (report lines, mismatches).
+    """
+    amount, unlock, tranche_count, deposit, delete_time = synthetic_escrows(
+        escrows, seed
+    )
+    attempts = np.arange(START_TIME, delete_time.max(), WEEK)
+    start = time.perf_counter()
+    result = schedule_model.simulate_tranches(
+        amount, unlock, deposit, delete_time, attempts, tranche_count
+    )
+    seconds = time.perf_counter() - start
+    lines = [
+        "{:<16} {:>6} escrows x {:>5} calls  model {:6.3f}s".format(
+            "release weekly", escrows, len(attempts), seconds
+        ),
+        "{:<16} released {:5.1%}  stranded at delete {:5.1%}  short in {} escrows  "
+        "unreleased tranches {} in {} escrows".format(
+            "",
+            result.released.sum() / deposit.sum(),
+            result.held.sum() / deposit.sum(),
+            np.count_nonzero(result.shortfall),
+            result.unreleased.sum(),
+            np.count_nonzero(result.unreleased),
+        ),
+    ]
+    mismatches = []
+    if sample:
+        rng = np.random.default_rng(seed)
+        chosen = rng.choice(escrows, size=min(sample, escrows), replace=False)
+        start = time.perf_counter()
+        mismatches = schedule_model.cross_check_tranches(
+            amount[chosen],
+            unlock[chosen],
+            deposit[chosen],
+            delete_time[chosen],
+            attempts,
+            tranche_count[chosen],
+        )
+        lines.append(
+            "{:<16} contract replay of {} escrows {:.2f}s: {}".format(
+                "",
+                len(chosen),
+                time.perf_counter() - start,
+                "{} mismatch(es)".format(len(mismatches)) if mismatches else "agrees",
+            )
+        )
+    return lines, mismatches
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the schedule model.")
+    parser.add_argument("--years", type=int, default=3)
+    parser.add_argument("--escrows", type=int, default=10000)
+    parser.add_argument(
+        "--sample",
+        type=int,
+        default=8,
+        help="schedules replayed through the contract per sweep (0 to skip)",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    failed = False
+    for lines, mismatches in (
+        run_withdrawals(args.years, args.sample, args.seed),
+        run_tranches(args.escrows, args.sample, args.seed),
+    ):
+        print("\n".join(lines))
+        for message in mismatches:
+            print("MISMATCH  {}".format(message))
+        failed = failed or bool(mismatches)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,299 @@
+"""
+End-to-end check of source_map.py and teal_profile.py on traced avm runs.
+
+Builds the contracts with their source maps, then runs on an avm.Ledger with
+tracing on: a donation_votes challenge (create, setup, open, voters opting in,
+voting, switching votes and closing out, completeVoting) and a periodic_withdrawals
+schedule (create, setup, weekly withdrawals, a beneficiary registering and
+claiming, the receiver claiming, delete). The traces are written like dryrun
+responses, profiled and reported per contract line and subroutine. Exits with
+status 1 if the profiled cost of a contract differs from the cost avm charged, if
+a step other than the constant blocks has no contract line, or if a subroutine
+the runs call is missing from the profile.
+
+    python3 bench_teal_profile.py
+    python3 bench_teal_profile.py --voters 500 --folded-dir profiles
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import avm
+import build
+import donation_votes
+import periodic_withdrawals
+import source_map
+import teal_profile
+
+START_TIME = 1_600_000_000
+END_TIME = START_TIME + 7 * 24 * 3600
+PERIOD = 7 * 24 * 3600
+WITHDRAW_AMOUNT = 1000
+# Amount of the asset deposited in the periodic_withdrawals schedule.
+DEPOSIT = 10 ** 9
+UINT64_MAX = 2 ** 64 - 1
+
+# Subroutines every run calls, by contract.
+EXPECTED_SUBROUTINES = {
+    "donation_votes": [],
+    "periodic_withdrawals": [
+        "timeInCurrentPeriod",
+        "timeSinceLastwithdrawal",
+        "claimAssetsTo",
+    ],
+}
+
+
+class _Run:
+    """
+    Executes groups on a traced ledger, keeping the results of the app calls.
+    """
+
+    def __init__(self, latest_timestamp):
+        self.ledger = avm.Ledger(latest_timestamp=latest_timestamp, trace=True)
+        self.calls = []
+
+    def __call__(self, group):
+        result = self.ledger.execute(group, check=True)
+        self.calls += [txn for txn in result.txns if txn.trace is not None]
+        return result
+
+
+def run_donation_votes(compiled, voters, options):
+    """
+    :return: the avm.TxnResults of the app calls of one challenge.
+    """
+    run = _Run(START_TIME - 1)
+    ledger = run.ledger
+    creator = avm.address("creator")
+    wallets = [avm.address("option {}".format(i)) for i in range(options)]
+    ledger.fund(creator, 10 ** 15)
+    prize = ledger.create_asset(creator, UINT64_MAX)
+    vote_asset = ledger.create_asset(creator, UINT64_MAX)
+    for wallet in wallets:
+        ledger.fund(wallet, 10 ** 6)
+        run(avm.asset_opt_in(wallet, prize))
+    result = run(
+        avm.app_create(
+            creator,
+            compiled["approval"][0],
+            compiled["clear"][0],
+            args=[vote_asset],
+            global_ints=donation_votes.GLOBAL_SCHEMA[0],
+            global_bytes=donation_votes.GLOBAL_SCHEMA[1],
+            local_ints=donation_votes.LOCAL_SCHEMA[0],
+            local_bytes=donation_votes.LOCAL_SCHEMA[1],
+        )
+    )
+    app_id = result.txns[0].created_app_id
+    run(avm.payment(creator, avm.application_address(app_id), 10 ** 6))
+    run(avm.app_call(creator, app_id, ["setup", prize], assets=[prize]))
+    run(avm.asset_transfer(creator, avm.application_address(app_id), prize, 10 ** 9))
+    result = run(
+        avm.app_call(
+            creator,
+            app_id,
+            ["open", START_TIME, END_TIME, prize, 10 ** 9, 0, b"".join(wallets)]
+            + ["option {}".format(i) for i in range(options)],
+        )
+    )
+    challenge_id = donation_votes.Events.opened.decode(result.txns[0].logs[0])[
+        "challenge_id"
+    ]
+
+    ledger.latest_timestamp = START_TIME + 1
+    for i in range(voters):
+        voter = avm.address("voter {}".format(i))
+        ledger.fund(voter, 10 ** 7)
+        run(avm.asset_opt_in(voter, vote_asset))
+        run(avm.asset_transfer(creator, voter, vote_asset, 1))
+        run(avm.app_call(voter, app_id, on_complete=avm.OPT_IN))
+        vote = ["vote", challenge_id, i % options]
+        run(avm.app_call(voter, app_id, vote, assets=[vote_asset]))
+        if i % 3 == 0:
+            vote = ["vote", challenge_id, (i + 1) % options]
+            run(avm.app_call(voter, app_id, vote, assets=[vote_asset]))
+        if i % 7 == 0:
+            run(avm.app_call(voter, app_id, on_complete=avm.CLOSE_OUT))
+
+    ledger.latest_timestamp = END_TIME + 1
+    run(
+        [
+            avm.app_call(
+                creator,
+                app_id,
+                ["completeVoting", challenge_id],
+                assets=[prize],
+                accounts=wallets,
+            )
+        ]
+        + [
+            avm.app_call(creator, app_id, ["budget"])
+            for _ in range(donation_votes.COMPLETE_VOTING_BUDGET_CALLS)
+        ]
+    )
+    return run.calls
+
+
+def run_periodic_withdrawals(compiled, periods):
+    """
+    :return: the avm.TxnResults of the app calls of one withdrawal schedule.
+    """
+    run = _Run(START_TIME - 1)
+    ledger = run.ledger
+    receiver = avm.address("receiver")
+    beneficiary = avm.address("beneficiary")
+    ledger.fund(receiver, 10 ** 15)
+    ledger.fund(beneficiary, 10 ** 7)
+    asset = ledger.create_asset(receiver, UINT64_MAX)
+    unlock_time = START_TIME + (periods + 1) * PERIOD
+    result = run(
+        avm.app_create(
+            receiver,
+            compiled["approval"][0],
+            compiled["clear"][0],
+            args=[asset, receiver, unlock_time, PERIOD, START_TIME, WITHDRAW_AMOUNT],
+            global_ints=periodic_withdrawals.GLOBAL_SCHEMA[0],
+            global_bytes=periodic_withdrawals.GLOBAL_SCHEMA[1],
+            local_ints=periodic_withdrawals.LOCAL_SCHEMA[0],
+            local_bytes=periodic_withdrawals.LOCAL_SCHEMA[1],
+        )
+    )
+    app_id = result.txns[0].created_app_id
+    app_address = avm.application_address(app_id)
+    run(avm.payment(receiver, app_address, 10 ** 6))
+    run(avm.app_call(receiver, app_id, ["setup"], assets=[asset]))
+    run(avm.asset_transfer(receiver, app_address, asset, DEPOSIT))
+
+    run(avm.asset_opt_in(beneficiary, asset))
+    run(avm.app_call(beneficiary, app_id, on_complete=avm.OPT_IN))
+    run(
+        avm.app_call(
+            receiver,
+            app_id,
+            ["register", PERIOD, START_TIME, WITHDRAW_AMOUNT],
+            accounts=[beneficiary],
+            assets=[asset],
+        )
+    )
+    for period in range(periods):
+        ledger.latest_timestamp = START_TIME + period * PERIOD + 1
+        if period % 2:
+            run(avm.app_call(receiver, app_id, ["claim"], assets=[asset]))
+        else:
+            run(avm.app_call(receiver, app_id, ["withdraw"], assets=[asset]))
+        run(avm.app_call(beneficiary, app_id, ["claim"], assets=[asset]))
+
+    # The beneficiary claims the rest of their schedule, so nothing is committed to
+    # them when the application is deleted.
+    ledger.latest_timestamp = unlock_time
+    run(avm.app_call(beneficiary, app_id, ["claim"], assets=[asset]))
+    run(
+        avm.app_call(
+            receiver,
+            app_id,
+            on_complete=avm.DELETE_APPLICATION,
+            assets=[asset],
+        )
+    )
+    return run.calls
+
+
+def profile_calls(contract, calls, out_dir):
+    """
+    Writes the traces of calls like a dryrun response and profiles them against
+    the built program and its source map in out_dir.
+    :return: tuple of (Profile, seconds spent profiling).
+    """
+    name = build.artifact_name(contract, "approval")
+    teal_path = os.path.join(out_dir, name)
+    trace_path = os.path.join(out_dir, contract + ".trace.json")
+    teal_profile.write_trace(trace_path, calls)
+    with open(teal_path) as f:
+        source = f.read()
+    start = time.perf_counter()
+    mapped = source_map.SourceMap.load(
+        os.path.join(out_dir, source_map.map_name(name)), source
+    )
+    profile = teal_profile.Profile(source, mapped, contract)
+    for trace in teal_profile.read_traces(trace_path):
+        profile.add(trace)
+    return profile, time.perf_counter() - start
+
+
+def check(contract, profile, calls):
+    """
+    :return: list of failures.
+    """
+    failures = []
+    charged = sum(call.cost for call in calls)
+    if profile.cost != charged:
+        failures.append(
+            "{}: profiled cost {} avm charged {}".format(
+                contract, profile.cost, charged
+            )
+        )
+    unmapped = profile.lines.get(("", 0, teal_profile.UNMAPPED), 0)
+    # Only the intcblock and bytecblock of every trace lack a contract line.
+    if unmapped > 2 * profile.traces:
+        failures.append(
+            "{}: {} cost without a contract line".format(contract, unmapped)
+        )
+    for subroutine in EXPECTED_SUBROUTINES[contract]:
+        if not profile.subroutines.get(subroutine, [0, 0, 0])[2]:
+            failures.append("{}: no calls of {}".format(contract, subroutine))
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Profile traced contract runs.")
+    parser.add_argument("--voters", type=int, default=200)
+    parser.add_argument("--options", type=int, default=donation_votes.MAX_OPTIONS)
+    parser.add_argument("--periods", type=int, default=20)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--folded-dir", help="write the folded stacks here")
+    args = parser.parse_args(argv)
+
+    contracts = ["donation_votes", "periodic_withdrawals"]
+    failures = []
+    with tempfile.TemporaryDirectory() as out_dir:
+        start = time.perf_counter()
+        results = build.build_contracts(contracts)
+        build.write_artifacts(out_dir, results)
+        build.write_source_maps(out_dir, results)
+        print("built with source maps in {:.2f}s".format(time.perf_counter() - start))
+
+        runs = {
+            "donation_votes": run_donation_votes(
+                results["donation_votes"], args.voters, args.options
+            ),
+            "periodic_withdrawals": run_periodic_withdrawals(
+                results["periodic_withdrawals"], args.periods
+            ),
+        }
+        for contract, calls in runs.items():
+            calls = [call for call in calls if call.program is not None]
+            profile, seconds = profile_calls(contract, calls, out_dir)
+            steps = sum(len(call.trace) for call in calls)
+            print(profile.report(args.top))
+            print(
+                "  profiled {} steps in {:.3f}s: {:,.0f} steps/s".format(
+                    steps, seconds, steps / seconds
+                )
+            )
+            failures += check(contract, profile, calls)
+            if args.folded_dir:
+                os.makedirs(args.folded_dir, exist_ok=True)
+                path = os.path.join(args.folded_dir, contract + ".folded")
+                profile.write_folded(path)
+                print("wrote {}".format(path))
+
+    for message in failures:
+        print("FAILED  {}".format(message))
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
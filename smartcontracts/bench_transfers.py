@@ -0,0 +1,173 @@
+"""
+Compares the strategies of transfers.py: every call site inlined, every call site
+calling a subroutine, and the per call site decision of "auto".
+
+Builds every contract under each strategy, analyzes its routes with teal_cost.py
+and runs the donation_votes challenge and periodic_withdrawals schedule of
+bench_teal_profile.py on avm. Reports the approval program size, its callsubs
+(periodic_withdrawals has subroutines of its own), the worst-case cost of the
+costliest route, the cost avm charged the runs and the weighted total, each opcode
+counting as transfers.BYTES_PER_OPCODE bytes: the run's cost, or the worst-case
+cost of contracts without one.
+
+The contracts send in loops or from few sites, where auto inlines every site. The
+same is measured for a payout program that sends once from each of PAYOUT_ROUTES
+routes, where auto calls a subroutine instead. Exits with status 1 if auto weighs
+more than either forced strategy for a program, or does not call a subroutine in
+the payout program.
+
+    python3 bench_transfers.py
+    python3 bench_transfers.py --voters 500 --periods 50
+"""
+import argparse
+import sys
+
+from pyteal import *
+
+import bench_teal_profile
+import build
+import teal
+import teal_cost
+import transfers
+
+# Routes of the payout program, each sending once.
+PAYOUT_ROUTES = 4
+PAYOUT = "payout program"
+
+# Contracts run on avm, with the runner of their scenario.
+RUNS = {
+    "donation_votes": lambda compiled, args: bench_teal_profile.run_donation_votes(
+        compiled, args.voters, args.options
+    ),
+    "periodic_withdrawals": lambda compiled, args: (
+        bench_teal_profile.run_periodic_withdrawals(compiled, args.periods)
+    ),
+}
+
+
+def payout_program():
+    """
+    :return: approval program paying amount of an asset, or Algos, to an account
+        from each of PAYOUT_ROUTES routes.
+    """
+    sends = transfers.Transfers()
+    return Cond(
+        *[
+            [
+                Txn.application_args[0] == Bytes("pay{}".format(route)),
+                Seq(
+                    sends.send(
+                        Btoi(Txn.application_args[1]),
+                        Txn.accounts[1],
+                        Btoi(Txn.application_args[2]),
+                    ),
+                    Approve(),
+                ),
+            ]
+            for route in range(PAYOUT_ROUTES)
+        ]
+    )
+
+
+def measure_payout():
+    """
+    :return: dict of the numbers measured for the payout program.
+    """
+    source = compileTeal(payout_program(), Mode.Application, version=5)
+    routes = {
+        "pay{}".format(route): {
+            "OnCompletion": "NoOp",
+            "ApplicationArgs": ["pay{}".format(route)],
+        }
+        for route in range(PAYOUT_ROUTES)
+    }
+    costs, size = teal_cost.analyze(source, routes)
+    return {
+        "bytes": size,
+        "callsubs": source.count("callsub "),
+        "max": max(cost.max for cost in costs.values()),
+        "run": None,
+    }
+
+
+def measure(strategy, args):
+    """
+    :return: dict of program name to dict of the measured numbers.
+    """
+    with transfers.forced(strategy):
+        # Uncached and in this process: the strategy is not part of the cache key.
+        results = build.build_contracts(build.CONTRACTS, jobs=1)
+        measured = {PAYOUT: measure_payout()}
+    for contract in build.CONTRACTS:
+        report = teal_cost.analyze_contract(contract, results[contract])
+        approval = results[contract]["approval"][0]
+        numbers = {
+            "bytes": report["approval_bytes"],
+            "callsubs": approval.count("callsub "),
+            "max": max(cost["max"] for cost in report["routes"].values()),
+            "run": None,
+        }
+        if contract in RUNS:
+            calls = RUNS[contract](results[contract], args)
+            numbers["run"] = sum(call.cost for call in calls if call.program)
+        measured[contract] = numbers
+    return measured
+
+
+def weighted(numbers):
+    opcodes = numbers["max"] if numbers["run"] is None else numbers["run"]
+    return numbers["bytes"] + transfers.BYTES_PER_OPCODE * opcodes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare transfer strategies.")
+    parser.add_argument("--voters", type=int, default=200)
+    parser.add_argument(
+        "--options", type=int, default=bench_teal_profile.donation_votes.MAX_OPTIONS
+    )
+    parser.add_argument("--periods", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    measured = {strategy: measure(strategy, args) for strategy in transfers.STRATEGIES}
+    failures = []
+    print(
+        "{:<22} {:<7} {:>7} {:>8} {:>9} {:>9} {:>10}".format(
+            "program", "", "bytes", "callsubs", "max cost", "run cost", "weighted"
+        )
+    )
+    for contract in build.CONTRACTS + [PAYOUT]:
+        for strategy in transfers.STRATEGIES:
+            numbers = measured[strategy][contract]
+            print(
+                "{:<22} {:<7} {:>7} {:>8} {:>9} {:>9} {:>10.0f}".format(
+                    contract,
+                    strategy,
+                    numbers["bytes"],
+                    numbers["callsubs"],
+                    numbers["max"],
+                    "-" if numbers["run"] is None else numbers["run"],
+                    weighted(numbers),
+                )
+            )
+        auto = weighted(measured["auto"][contract])
+        best = min(
+            weighted(measured[strategy][contract])
+            for strategy in transfers.STRATEGIES
+            if strategy != "auto"
+        )
+        if auto > best:
+            failures.append(
+                "{}: auto weighs {:.0f}, a forced strategy {:.0f}".format(
+                    contract, auto, best
+                )
+            )
+    if not measured["auto"][PAYOUT]["callsubs"]:
+        failures.append("{}: auto inlines every site".format(PAYOUT))
+
+    for message in failures:
+        print("FAILED  {}".format(message))
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
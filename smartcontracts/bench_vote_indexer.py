@@ -0,0 +1,357 @@
+"""
+Benchmark of vote_indexer.py on a synthetic feed.
+
+Writes a JSONL file of transaction records: donation_votes applications each running
+their challenges at once, every challenge with a voter population of
+votes_model.synthetic_events(), between payments of other accounts. Only the events
+the contract accepts become records, as only confirmed transactions are recorded.
+Every challenge ends with a completeVoting call.
+
+The file is indexed in one run, then in two runs with a checkpoint in between, then
+again from its start on top of the final checkpoint, which must skip every record.
+Reports records per second against mainnet's throughput and the time of a tally
+query. Exits with status 1 if the runs disagree, or if any tally, payout or final
+vote differs from votes_model.simulate(), the model checked against the contract by
+votes_model.cross_check().
+
+    python3 bench_vote_indexer.py
+    python3 bench_vote_indexer.py --voters 200000 --apps 4 --challenges 3
+"""
+import argparse
+import base64
+import hashlib
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+from algosdk import encoding
+
+import donation_votes
+import vote_indexer
+import votes_model
+
+# Transactions per second Algorand gives as mainnet's capacity.
+MAINNET_TPS = 6000
+TRANSACTIONS_PER_ROUND = 5000
+START_TIME = 1000
+END_TIME = START_TIME + 7 * 24 * 3600
+PRIZE = 10 ** 9
+TALLY_QUERIES = 100000
+
+
+def _address(name):
+    return encoding.encode_address(hashlib.sha256(name.encode()).digest())
+
+
+def _arg(value):
+    if isinstance(value, int):
+        value = value.to_bytes(8, "big")
+    elif isinstance(value, str):
+        value = value.encode()
+    return base64.b64encode(value).decode()
+
+
+class _Feed:
+    """
+    Writes records to a JSONL file, numbering their rounds and offsets.
+    """
+
+    def __init__(self, f, noise):
+        self.f = f
+        self.noise = noise
+        self.count = 0
+        self.calls = 0
+        self.payer = _address("payer")
+
+    def write(self, txn):
+        txn["confirmed-round"], txn["intra-round-offset"] = divmod(
+            self.count, TRANSACTIONS_PER_ROUND
+        )
+        self.f.write(json.dumps(txn))
+        self.f.write("\n")
+        self.count += 1
+
+    def call(self, sender, app_id, args=(), on_completion="noop", **fields):
+        call = {
+            "application-id": app_id,
+            "on-completion": on_completion,
+            "application-args": [_arg(arg) for arg in args],
+        }
+        self.write(
+            dict(
+                {"tx-type": "appl", "sender": sender, "application-transaction": call},
+                **fields
+            )
+        )
+        self.calls += 1
+        for _ in range(self.noise):
+            self.write(
+                {
+                    "tx-type": "pay",
+                    "sender": self.payer,
+                    "payment-transaction": {"amount": 1000, "receiver": self.payer},
+                }
+            )
+
+
+def write_feed(path, voters, apps, challenges, options, noise, seed):
+    """
+    :return: tuple of (records written, application calls, expected, voter
+        addresses). expected maps (app ID, challenge ID) to the
+        votes_model.ChallengeResult of the challenge, whose voter i is address
+        (challenge ID - 1) * voters + i.
+    """
+    rng = random.Random(seed)
+    creator = _address("creator")
+    addresses = [_address("voter {}".format(i)) for i in range(voters * challenges)]
+    expected = {}
+    with open(path, "w") as f:
+        feed = _Feed(f, noise)
+        app_ids = list(range(1, apps + 1))
+        wallets = {
+            app_id: [_address("wallet {} {}".format(app_id, i)) for i in range(options)]
+            for app_id in app_ids
+        }
+        names = ["option {}".format(i) for i in range(options)]
+        for app_id in app_ids:
+            feed.call(creator, 0, [7], **{"created-application-index": app_id})
+        # Every challenge of an application is open at once.
+        calls = []
+        for app_id in app_ids:
+            packed = b"".join(encoding.decode_address(w) for w in wallets[app_id])
+            for challenge_id in range(1, challenges + 1):
+                feed.call(
+                    creator,
+                    app_id,
+                    [b"open", START_TIME, END_TIME, app_id, PRIZE, 0, packed] + names,
+                )
+                voter, timestamp, choice, holds = votes_model.synthetic_events(
+                    voters,
+                    options,
+                    start_time=START_TIME,
+                    end_time=END_TIME,
+                    seed=rng.randrange(2 ** 32),
+                )
+                result = votes_model.simulate(
+                    voter,
+                    timestamp,
+                    choice,
+                    holds,
+                    START_TIME,
+                    END_TIME,
+                    PRIZE,
+                    options,
+                )
+                expected[(app_id, challenge_id)] = result
+                # The events the contract accepts, in time order like on chain.
+                accepted = (choice == votes_model.CLOSE_OUT) | (
+                    (choice < options)
+                    & holds
+                    & (timestamp > START_TIME)
+                    & (timestamp < END_TIME)
+                )
+                # Challenges have voters of their own: closing out removes a
+                # voter's votes from every challenge of the application.
+                offset = (challenge_id - 1) * voters
+                for i in np.flatnonzero(accepted):
+                    calls.append(
+                        (
+                            int(timestamp[i]),
+                            app_id,
+                            challenge_id,
+                            offset + int(voter[i]),
+                            int(choice[i]),
+                        )
+                    )
+        calls.sort(key=lambda call: call[0])
+        opted_in = set()
+        for _, app_id, challenge_id, voter_id, choice in calls:
+            sender = addresses[voter_id]
+            if choice == votes_model.CLOSE_OUT:
+                if (app_id, voter_id) in opted_in:
+                    opted_in.remove((app_id, voter_id))
+                    feed.call(sender, app_id, on_completion="closeout")
+                continue
+            if (app_id, voter_id) not in opted_in:
+                opted_in.add((app_id, voter_id))
+                feed.call(sender, app_id, on_completion="optin")
+            feed.call(sender, app_id, [b"vote", challenge_id, choice])
+        for (app_id, challenge_id), result in expected.items():
+            if result.refund:
+                # Without votes, the creator gets the prize back.
+                receivers = [creator]
+                amounts = [result.refund]
+            else:
+                receivers = wallets[app_id]
+                amounts = result.payouts
+            inner = [
+                {
+                    "tx-type": "axfer",
+                    "asset-transfer-transaction": {
+                        "asset-id": app_id,
+                        "amount": amount,
+                        "receiver": receiver,
+                    },
+                }
+                for amount, receiver in zip(amounts[:-1], receivers)
+            ]
+            # The last challenge to complete closes the application out of the asset.
+            last = {"asset-id": app_id, "amount": amounts[-1]}
+            if challenge_id == challenges:
+                last.update({"amount": 0, "close-amount": amounts[-1]})
+                last["close-to"] = receivers[-1]
+            else:
+                last["receiver"] = receivers[-1]
+            inner.append({"tx-type": "axfer", "asset-transfer-transaction": last})
+            feed.call(
+                creator,
+                app_id,
+                [b"completeVoting", challenge_id],
+                **{"inner-txns": inner}
+            )
+            for _ in range(donation_votes.COMPLETE_VOTING_BUDGET_CALLS):
+                feed.call(creator, app_id, [b"budget"])
+    return feed.count, feed.calls, expected, addresses
+
+
+def check(indexer, expected, addresses, voters):
+    """
+    :return: list of mismatches between the indexer and the model.
+    """
+    mismatches = []
+    for (app_id, challenge_id), result in sorted(expected.items()):
+        tally = indexer.tally(app_id, challenge_id)
+        if tally != result.tallies.tolist():
+            mismatches.append(
+                "app {} challenge {}: tally {} model {}".format(
+                    app_id, challenge_id, tally, result.tallies.tolist()
+                )
+            )
+        paid = indexer.payouts.get((app_id, challenge_id), {}).get(app_id)
+        model = [result.refund] if result.refund else list(result.payouts)
+        if paid != model:
+            mismatches.append(
+                "app {} challenge {}: payouts {} model {}".format(
+                    app_id, challenge_id, paid, model
+                )
+            )
+        offset = (challenge_id - 1) * voters
+        for voter_id, choice in zip(
+            result.voters.tolist(), result.final_choice.tolist()
+        ):
+            actual = indexer.choice(app_id, addresses[offset + voter_id], challenge_id)
+            if actual != (None if choice == votes_model.CLOSE_OUT else choice):
+                mismatches.append(
+                    "app {} challenge {} voter {}: choice {} model {}".format(
+                        app_id, challenge_id, voter_id, actual, choice
+                    )
+                )
+    return mismatches
+
+
+def _state(indexer):
+    return (
+        indexer.tallies,
+        indexer.payouts,
+        indexer.local,
+        indexer.history,
+        indexer.position,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the vote indexer.")
+    parser.add_argument("--voters", type=int, default=50000)
+    parser.add_argument("--apps", type=int, default=2)
+    parser.add_argument("--challenges", type=int, default=2)
+    parser.add_argument("--options", type=int, default=donation_votes.MAX_OPTIONS)
+    parser.add_argument(
+        "--noise", type=int, default=3, help="payments after every application call"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    if not 0 < args.challenges <= donation_votes.MAX_CHALLENGES:
+        parser.error(
+            "an application holds 1 to {} live challenges".format(
+                donation_votes.MAX_CHALLENGES
+            )
+        )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "records.jsonl")
+        checkpoint = os.path.join(tmp, "checkpoint.json")
+        start = time.perf_counter()
+        records, calls, expected, addresses = write_feed(
+            path,
+            args.voters,
+            args.apps,
+            args.challenges,
+            args.options,
+            args.noise,
+            args.seed,
+        )
+        print(
+            "wrote {} records, {} application calls, {:.1f} MB in {:.1f}s".format(
+                records,
+                calls,
+                os.path.getsize(path) / 2 ** 20,
+                time.perf_counter() - start,
+            )
+        )
+
+        indexer = vote_indexer.Indexer(range(1, args.apps + 1))
+        start = time.perf_counter()
+        indexer.index_file(path)
+        seconds = time.perf_counter() - start
+        print(
+            "indexed in {:.2f}s: {:,.0f} records/s, {:.1f}x mainnet's {} "
+            "transactions/s".format(
+                seconds, records / seconds, records / seconds / MAINNET_TPS, MAINNET_TPS
+            )
+        )
+
+        queries = [
+            (app_id, challenge_id)
+            for app_id, challenge_id in expected
+            for _ in range(TALLY_QUERIES // len(expected))
+        ]
+        start = time.perf_counter()
+        for app_id, challenge_id in queries:
+            indexer.tally(app_id, challenge_id)
+        print(
+            "tally query: {:.2f} us".format(
+                (time.perf_counter() - start) / len(queries) * 1e6
+            )
+        )
+
+        failures = check(indexer, expected, addresses, args.voters)
+
+        resumed = vote_indexer.Indexer(range(1, args.apps + 1))
+        start = time.perf_counter()
+        resumed.index_file(path, checkpoint, max_records=records // 2)
+        resumed = vote_indexer.Indexer.load(checkpoint)
+        resumed.index_file(path, checkpoint)
+        print(
+            "indexed in two runs with a checkpoint ({:.1f} MB) in {:.2f}s".format(
+                os.path.getsize(checkpoint) / 2 ** 20, time.perf_counter() - start
+            )
+        )
+        if _state(vote_indexer.Indexer.load(checkpoint)) != _state(indexer):
+            failures.append("resuming from a checkpoint gave another state")
+        replayed = vote_indexer.Indexer.load(checkpoint)
+        replayed.offset = 0
+        replayed.index_file(path)
+        if _state(replayed) != _state(indexer):
+            failures.append("replaying indexed records changed the state")
+
+    for message in failures[:10]:
+        print("FAILED  {}".format(message))
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,233 @@
+"""
+Benchmark of votes_lifecycle.py against algod_stub.py running donation_votes on an
+avm.Ledger.
+
+Every campaign runs a series of challenges, each with its own prize asset, option
+wallets and Algo prize, paid out to donation_votes.MAX_OPTIONS options by default,
+the costliest completeVoting. Campaigns share applications, up to
+donation_votes.MAX_CHALLENGES to each. Voters vote on the ledger directly as soon as
+a challenge opens. The campaigns run one at a time first, each starting when the one
+before it ends, then all at once. Every run reports its time, the rounds it took,
+the requests it sent and the applications it created. Exits with status 1 if a
+campaign fails, or if an option wallet did not get its share of every prize.
+
+    python3 bench_votes_lifecycle.py
+    python3 bench_votes_lifecycle.py --campaigns 50 --challenges 4 --options 2
+"""
+import argparse
+import asyncio
+import random
+import sys
+import time
+
+from algosdk import account, encoding
+
+import algod_client
+import algod_stub
+import avm
+import donation_votes
+import votes_lifecycle
+
+# Chain time: blocks are 60 seconds apart, 20 of them per second of wall time, and
+# every challenge lasts 20 minutes.
+BLOCK_TIME = 0.05
+ROUND_SECONDS = 60
+CHALLENGE_SECONDS = 20 * 60
+START_TIME = 1_600_000_000
+PRIZE = 10 ** 6
+ALGO_PRIZE = 10 ** 6
+VOTERS = 5
+
+
+class _Bench:
+    """
+    A stub algod with a ledger, and the accounts and assets of the campaigns.
+    """
+
+    def __init__(self, campaigns, challenges, options, seed, serial=False):
+        self.rng = random.Random(seed)
+        self.ledger = avm.Ledger()
+        self.stub = algod_stub.AlgodStub(
+            BLOCK_TIME,
+            ledger=self.ledger,
+            timestamp=START_TIME,
+            round_seconds=ROUND_SECONDS,
+        )
+        approval, clear = votes_lifecycle.compile_programs()
+        self.approval = self.stub.register_program(approval)
+        self.clear = self.stub.register_program(clear)
+        key, creator = account.generate_account()
+        self.creator = encoding.decode_address(creator)
+        self.ledger.fund(self.creator, 10 ** 15)
+        self.vote_asset = self.ledger.create_asset(self.creator, 10 ** 9)
+        # Voters opt into every campaign's application.
+        self.voters = [self._account(10 ** 6 * campaigns) for _ in range(VOTERS)]
+        for voter in self.voters:
+            self._run(avm.asset_opt_in(voter, self.vote_asset))
+            self._run(avm.asset_transfer(self.creator, voter, self.vote_asset, 1))
+        self.campaigns = []
+        # Option wallets of every campaign, to check the payouts.
+        self.wallets = []
+        for index in range(campaigns):
+            wallets = [self._account() for _ in range(options)]
+            plans = []
+            start = START_TIME - 1
+            # Campaigns run one at a time start when the one before them ends.
+            if serial:
+                start += index * challenges * CHALLENGE_SECONDS
+            for i in range(challenges):
+                asset_id = self.ledger.create_asset(self.creator, PRIZE)
+                for wallet in wallets:
+                    self._run(avm.asset_opt_in(wallet, asset_id))
+                plans.append(
+                    votes_lifecycle.Challenge(
+                        start,
+                        start + CHALLENGE_SECONDS,
+                        [
+                            ("option {}".format(j), encoding.encode_address(w))
+                            for j, w in enumerate(wallets)
+                        ],
+                        asset_id,
+                        PRIZE,
+                        ALGO_PRIZE,
+                    )
+                )
+                start += CHALLENGE_SECONDS
+            self.campaigns.append(
+                votes_lifecycle.Campaign(key, self.vote_asset, plans)
+            )
+            self.wallets.append(wallets)
+        self.balances = {w: self.ledger.balance(w) for ws in self.wallets for w in ws}
+
+    def _account(self, amount=10 ** 7):
+        address = encoding.decode_address(account.generate_account()[1])
+        self.ledger.fund(address, amount + 10 ** 7)
+        return address
+
+    def _run(self, txn):
+        return self.ledger.execute(txn, check=True)
+
+    def vote(self, campaign, result, step):
+        """
+        Every voter votes for a random option after the steps that open a
+        challenge.
+        """
+        if "open" not in step:
+            return
+        options = len(campaign.challenges[0].wallets)
+        vote = ["vote", result.challenge_ids[-1]]
+        for voter in self.voters:
+            if self.ledger.local_state(voter, result.app_id) is None:
+                self._run(avm.app_call(voter, result.app_id, on_complete=avm.OPT_IN))
+            self._run(
+                avm.app_call(
+                    voter,
+                    result.app_id,
+                    vote + [self.rng.randrange(options)],
+                    assets=[self.vote_asset],
+                )
+            )
+
+    def check(self, index, result):
+        """
+        :return: list of mismatches between the payouts and the prizes.
+        """
+        campaign = self.campaigns[index]
+        wallets = self.wallets[index]
+        mismatches = []
+        for challenge in campaign.challenges:
+            paid = sum(
+                self.ledger.asset_balance(w, challenge.asset_id) for w in wallets
+            )
+            if paid != challenge.prize:
+                mismatches.append(
+                    "campaign {}: {} of asset {} paid out, not {}".format(
+                        index, paid, challenge.asset_id, challenge.prize
+                    )
+                )
+        algos = sum(self.ledger.balance(w) - self.balances[w] for w in wallets)
+        expected = sum(challenge.algo_prize for challenge in campaign.challenges)
+        if algos < expected:
+            mismatches.append(
+                "campaign {}: {} microalgos paid out, less than {}".format(
+                    index, algos, expected
+                )
+            )
+        return mismatches
+
+
+async def run(bench, concurrency):
+    """
+    :return: tuple of (report line, failures).
+    """
+    address = await bench.stub.start()
+    try:
+        async with algod_client.AlgodClient(address) as algod:
+            runner = votes_lifecycle.Runner(
+                algod, bench.approval, bench.clear, on_step=bench.vote
+            )
+            first_round = bench.stub.round
+            start = time.perf_counter()
+            results = await votes_lifecycle.run_campaigns(
+                runner, bench.campaigns, concurrency
+            )
+            seconds = time.perf_counter() - start
+            apps = {
+                result.app_id
+                for result in results
+                if not isinstance(result, Exception)
+            }
+            line = (
+                "{:>4} campaigns of {} challenges  concurrency {:>3}  {:6.2f}s  "
+                "{:>4} rounds  {} requests  {} apps"
+            ).format(
+                len(bench.campaigns),
+                len(bench.campaigns[0].challenges),
+                concurrency,
+                seconds,
+                bench.stub.round - first_round,
+                algod.requests,
+                len(apps),
+            )
+    finally:
+        await bench.stub.close()
+    failures = []
+    for i, result in enumerate(results):
+        if isinstance(result, Exception):
+            failures.append("campaign {}: {!r}".format(i, result))
+        else:
+            failures.extend(bench.check(i, result))
+    return line, failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the votes lifecycle.")
+    parser.add_argument("--campaigns", type=int, default=20)
+    parser.add_argument(
+        "--serial-campaigns",
+        type=int,
+        default=2,
+        help="campaigns run one at a time first (0 to skip)",
+    )
+    parser.add_argument("--challenges", type=int, default=3)
+    parser.add_argument("--options", type=int, default=donation_votes.MAX_OPTIONS)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    runs = [(args.serial_campaigns, 1)] if args.serial_campaigns else []
+    runs.append((args.campaigns, args.campaigns))
+    failed = False
+    for campaigns, concurrency in runs:
+        bench = _Bench(
+            campaigns, args.challenges, args.options, args.seed, concurrency == 1
+        )
+        line, failures = asyncio.run(run(bench, concurrency))
+        print(line)
+        for message in failures[:10]:
+            print("FAILED  {}".format(message))
+        failed = failed or bool(failures)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+"""
+Benchmark of the donation_votes reference model over synthetic voter populations.
+
+For every population size, generates the events, runs votes_model.simulate() and
+replays a sample of the voters through the compiled contract with
+votes_model.cross_check(). Exits with status 1 when the model and the contract
+disagree on any sampled voter, the tallies or the payout.
+
+    python3 bench_votes_model.py
+    python3 bench_votes_model.py --voters 100000 1000000 --sample 500
+    python3 bench_votes_model.py --options 4
+"""
+import argparse
+import sys
+import time
+
+import votes_model
+
+DEFAULT_VOTERS = [10 ** 5, 10 ** 6]
+# Voting window used for every synthetic challenge: one week.
+START_TIME = 1000
+END_TIME = START_TIME + 7 * 24 * 3600
+# Prize held by the application.
+BALANCE = 10 ** 12
+
+
+def run(voters, options, events_per_voter, sample, seed):
+    """
+    :return: tuple of (report lines, mismatches).
+    """
+    events = votes_model.synthetic_events(
+        voters,
+        options=options,
+        events_per_voter=events_per_voter,
+        start_time=START_TIME,
+        end_time=END_TIME,
+        seed=seed,
+    )
+    start = time.perf_counter()
+    result = votes_model.simulate(*events, START_TIME, END_TIME, BALANCE, options)
+    seconds = time.perf_counter() - start
+    count = len(events[0])
+    lines = [
+        "{:>9} voters  {:>9} events  model {:7.3f}s  {:>11,.0f} events/s".format(
+            voters, count, seconds, count / seconds
+        ),
+        "          tallies {}  payouts {}  refund {}".format(
+            result.tallies.tolist(), result.payouts, result.refund
+        ),
+        "          first {}  switches {}  repeats {}  closes {}  rejected {}".format(
+            result.first_votes,
+            result.switches,
+            result.repeats,
+            result.close_outs,
+            result.rejected,
+        ),
+    ]
+    mismatches = []
+    if sample:
+        mask = votes_model.sample_voters(events[0], sample, seed)
+        sampled = [array[mask] for array in events]
+        start = time.perf_counter()
+        mismatches = votes_model.cross_check(
+            *sampled, START_TIME, END_TIME, BALANCE, options
+        )
+        seconds = time.perf_counter() - start
+        lines.append(
+            "          contract replay of {} events ({} voters) {:.2f}s: {}".format(
+                len(sampled[0]),
+                sample,
+                seconds,
+                "{} mismatch(es)".format(len(mismatches)) if mismatches else "agrees",
+            )
+        )
+    return lines, mismatches
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the votes model.")
+    parser.add_argument("--voters", type=int, nargs="+", default=DEFAULT_VOTERS)
+    parser.add_argument("--options", type=int, default=2)
+    parser.add_argument("--events-per-voter", type=float, default=1.3)
+    parser.add_argument(
+        "--sample",
+        type=int,
+        default=300,
+        help="voters replayed through the contract per population (0 to skip)",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    failed = False
+    for voters in args.voters:
+        lines, mismatches = run(
+            voters, args.options, args.events_per_voter, args.sample, args.seed
+        )
+        print("\n".join(lines))
+        for message in mismatches:
+            print("MISMATCH  {}".format(message))
+        failed = failed or bool(mismatches)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,196 @@
+"""
+Streams the asset transfers of chosen assets out of raw msgpack blocks.
+
+Reads files of blocks as algod returns them from /v2/blocks/{round}?format=msgpack,
+one after the other, either wrapped in {"block": ..., "cert": ...} or bare. The
+file is memory mapped and msgpack's Unpacker walks it with skip(), so the fields of
+a block that are not needed are never decoded. Its transactions are searched in
+place for the encoded asset IDs first: a block with none of them is skipped whole,
+otherwise only the transactions holding one are decoded, from memoryview slices of
+the mapped file, with their inner transactions.
+
+blocks() yields (round, timestamp, transfers) for every block, transfers being a
+list of (asset ID, source, receiver, amount, close to) tuples in the order they
+were applied, addresses as 32 raw bytes:
+
+    transfer   source sends amount to receiver; the source is the clawback target
+               (asnd) when there is one, else the sender
+    opt in     source == receiver and amount 0
+    close out  close to receives the rest of the source's balance, after amount,
+               and the source's holding is removed (None otherwise)
+    creation   source is None, the creator receives the asset's total
+
+    for round_num, timestamp, transfers in block_stream.blocks(paths, {asset_id}):
+        ...
+"""
+import mmap
+import os
+
+import msgpack
+
+# Asset names and URLs are msgpack strings, but nothing makes them valid UTF-8.
+UNICODE_ERRORS = "surrogateescape"
+
+# Nekoin, the asset freeze_escrow and periodic_withdrawals lock.
+NEKO_ASSET_ID = 404044168
+
+
+class BlockStreamError(Exception):
+    pass
+
+
+def _patterns(asset_ids):
+    """
+    :return: the byte strings a transaction touching one of asset_ids holds: its
+        ID as the transferred asset, or as the asset a configuration created.
+        msgpack encodes an integer the same way wherever it appears.
+    """
+    patterns = []
+    for asset_id in asset_ids:
+        encoded = msgpack.packb(asset_id)
+        patterns += [b"\xa4xaid" + encoded, b"\xa4caid" + encoded]
+    return patterns
+
+
+def _matches(buffer, patterns, start, end):
+    """
+    :return: sorted offsets of every pattern in buffer[start:end].
+    """
+    offsets = []
+    for pattern in patterns:
+        offset = buffer.find(pattern, start, end)
+        while offset != -1:
+            offsets.append(offset)
+            offset = buffer.find(pattern, offset + 1, end)
+    return sorted(offsets)
+
+
+def _transfers(stxn, asset_ids, out):
+    """
+    Appends the transfers of a decoded transaction with apply data and of its inner
+    transactions to out.
+    """
+    txn = stxn.get("txn", {})
+    kind = txn.get("type")
+    if kind == "axfer" and txn.get("xaid") in asset_ids:
+        sender = txn.get("asnd") or txn["snd"]
+        receiver = txn.get("arcv", bytes(32))
+        out.append(
+            (txn["xaid"], sender, receiver, txn.get("aamt", 0), txn.get("aclose"))
+        )
+    elif kind == "acfg" and not txn.get("caid") and stxn.get("caid") in asset_ids:
+        total = txn.get("apar", {}).get("t", 0)
+        out.append((stxn["caid"], None, txn["snd"], total, None))
+    for inner in stxn.get("dt", {}).get("itx", ()):
+        _transfers(inner, asset_ids, out)
+
+
+def _block_transfers(buffer, view, patterns, asset_ids, start, end):
+    """
+    :return: the transfers of the transactions array at buffer[start:end].
+    """
+    transfers = []
+    matches = _matches(buffer, patterns, start, end)
+    if not matches:
+        return transfers
+    unpacker = msgpack.Unpacker(raw=False, unicode_errors=UNICODE_ERRORS)
+    unpacker.feed(view[start:end])
+    match = 0
+    # Only the transactions up to the last match are walked.
+    for _ in range(unpacker.read_array_header()):
+        txn_start = start + unpacker.tell()
+        unpacker.skip()
+        txn_end = start + unpacker.tell()
+        if matches[match] >= txn_end:
+            continue
+        _transfers(
+            msgpack.unpackb(
+                view[txn_start:txn_end],
+                raw=False,
+                unicode_errors=UNICODE_ERRORS,
+            ),
+            asset_ids,
+            transfers,
+        )
+        while match < len(matches) and matches[match] < txn_end:
+            match += 1
+        if match == len(matches):
+            break
+    return transfers
+
+
+def _read_block(unpacker, buffer, view, patterns, asset_ids):
+    """
+    Reads one block map, wrapped or not, from the unpacker. Zero fields are left
+    out of the encoding, the genesis block's round among them.
+    :return: tuple of (round, timestamp, transfers).
+    """
+    round_num = timestamp = 0
+    transfers = []
+    block = None
+    for _ in range(unpacker.read_map_header()):
+        key = unpacker.unpack()
+        if key == "block":
+            block = _read_block(unpacker, buffer, view, patterns, asset_ids)
+        elif key == "rnd":
+            round_num = unpacker.unpack()
+        elif key == "ts":
+            timestamp = unpacker.unpack()
+        elif key == "txns":
+            start = unpacker.tell()
+            unpacker.skip()
+            transfers = _block_transfers(
+                buffer, view, patterns, asset_ids, start, unpacker.tell()
+            )
+        else:
+            unpacker.skip()
+    return block if block is not None else (round_num, timestamp, transfers)
+
+
+def read_file(path, asset_ids):
+    """
+    Yields (round, timestamp, transfers) of every block of a file, see blocks().
+    """
+    asset_ids = set(asset_ids)
+    patterns = _patterns(asset_ids)
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if not size:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            view = memoryview(buffer)
+            try:
+                unpacker = msgpack.Unpacker(
+                    buffer, raw=False, unicode_errors=UNICODE_ERRORS
+                )
+                while unpacker.tell() < size:
+                    try:
+                        yield _read_block(unpacker, buffer, view, patterns, asset_ids)
+                    except (msgpack.OutOfData, ValueError) as e:
+                        raise BlockStreamError(
+                            "{}: malformed block at byte {}: {!r}".format(
+                                path, unpacker.tell(), e
+                            )
+                        )
+            finally:
+                view.release()
+
+
+def blocks(paths, asset_ids):
+    """
+    Yields (round, timestamp, transfers) of every block of the files, in order.
+    :param asset_ids: IDs of the assets whose transfers are wanted.
+    """
+    for path in paths:
+        yield from read_file(path, asset_ids)
+
+
+def write_blocks(path, blocks, wrap=True):
+    """
+    Writes blocks, dicts as algod encodes them, to a file blocks() reads.
+    :param wrap: whether to wrap every block as {"block": block}, like algod's
+        /v2/blocks does.
+    """
+    with open(path, "wb") as f:
+        for block in blocks:
+            f.write(msgpack.packb({"block": block} if wrap else block))
@@ -0,0 +1,320 @@
+"""
+Build entry point for the smart contracts in this directory.
+
+Compiles the approval and clear programs of every contract in a process pool and
+writes the TEAL artifacts into a single output directory. Compiled programs and
+the hand-written templates in TEMPLATES go through the peephole optimizer in
+teal_opt.py unless --no-optimize is given. Unchanged programs are served from the
+on-disk compile cache (see compile_cache.py). --source-map writes the map of
+every program back to the contract's Python lines next to it (see source_map.py):
+
+    python3 build.py --out-dir build
+    python3 build.py --out-dir build donation_votes freeze_escrow
+    python3 build.py --no-cache --no-optimize
+    python3 build.py --source-map
+"""
+import argparse
+import importlib
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from pyteal import Mode, compileTeal
+
+import source_map
+import teal
+import teal_opt
+from compile_cache import DEFAULT_CACHE_DIR, CompileCache, cache_key, source_digest
+
+# Contract modules built by default. Each one defines approval_program() and
+# clear_program(), memoized with lru_cache so modules that import a contract, like
+# the benches and cost checks, reuse its programs instead of rebuilding the AST.
+CONTRACTS = ["donation_votes", "freeze_escrow", "periodic_withdrawals"]
+# Programs compiled for each contract, in the order they are written.
+PROGRAMS = ["approval", "clear"]
+# Compile options shared by every contract.
+TEAL_VERSION = 5
+TEAL_MODE = Mode.Application
+# Hand-written TEAL templates optimized into the output directory, with the group
+# fields that select each of their routes for the cost report.
+TEMPLATES = {
+    "nft_3way_txn.teal.tmpl": {
+        "withdraw": {"GroupSize": 2},
+        "sell": {"GroupSize": 3},
+        "buy": {"GroupSize": 6},
+    },
+}
+# Directory the contract modules are loaded from.
+CONTRACT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def artifact_name(contract, program):
+    return "{}_{}.teal".format(contract, program)
+
+
+def compile_program(contract, program):
+    """
+    Compiles one program of a contract module into TEAL.
+    :return: the TEAL source.
+    """
+    module = importlib.import_module(contract)
+    ast = getattr(module, "{}_program".format(program))()
+    return compileTeal(ast, TEAL_MODE, version=TEAL_VERSION)
+
+
+def compile_contract(job):
+    """
+    Compiles programs of a contract. Runs inside the worker processes.
+    :param job: tuple of (contract, list of program names, whether to optimize).
+    :return: a dict of program name to (TEAL source, seconds spent compiling).
+    """
+    contract, programs, optimize = job
+    compiled = {}
+    for program in programs:
+        start = time.perf_counter()
+        source = compile_program(contract, program)
+        if optimize:
+            source = teal_opt.optimize(source).text()
+        compiled[program] = (source, time.perf_counter() - start)
+    return compiled
+
+
+def compile_all(contracts, jobs=None, programs=None, optimize=True):
+    """
+    Compiles the given contracts, in parallel when there is more than one.
+    :param programs: optional dict of contract name to the programs to compile.
+        Defaults to every program in PROGRAMS.
+    :return: a dict of contract name to the result of compile_contract.
+    """
+    if not contracts:
+        return {}
+    programs = programs or {}
+    work = [
+        (contract, programs.get(contract, PROGRAMS), optimize) for contract in contracts
+    ]
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    jobs = max(1, min(jobs, len(work)))
+    if jobs == 1:
+        return {job[0]: compile_contract(job) for job in work}
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        return dict(zip(contracts, pool.map(compile_contract, work)))
+
+
+def build_contracts(contracts, cache=None, jobs=None, optimize=True):
+    """
+    Compiles the given contracts, serving unchanged programs from cache and
+    storing freshly compiled ones in it.
+    :param optimize: run the compiled programs through teal_opt.optimize().
+    :return: a dict of contract name to a dict of program name to
+        (TEAL source, seconds spent compiling).
+    """
+    results = {contract: {} for contract in contracts}
+    keys = {}
+    missing = {}
+    for contract in contracts:
+        if cache is None:
+            missing[contract] = PROGRAMS
+            continue
+        # Entries carry bytecode, so the assembler's source is part of the key too.
+        source = source_digest(contract, CONTRACT_DIR)
+        source += source_digest("teal", CONTRACT_DIR)
+        if optimize:
+            source += source_digest("teal_opt", CONTRACT_DIR)
+        for program in PROGRAMS:
+            key = cache_key(source, program, TEAL_MODE, TEAL_VERSION)
+            keys[contract, program] = key
+            entry = cache.get(key)
+            if entry is None:
+                missing.setdefault(contract, []).append(program)
+            else:
+                results[contract][program] = (entry.teal, 0.0)
+
+    compiled = compile_all(list(missing), jobs, missing, optimize)
+    for contract, programs in compiled.items():
+        for program, (source, seconds) in programs.items():
+            results[contract][program] = (source, seconds)
+            if cache is not None:
+                bytecode = teal.assemble(source)
+                cache.put(keys[contract, program], source, seconds, bytecode)
+
+    if cache is not None:
+        cache.evict()
+    return results
+
+
+def write_artifacts(out_dir, results):
+    """
+    Writes compiled programs to out_dir.
+    :return: the list of written paths.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    for contract, compiled in results.items():
+        for program in PROGRAMS:
+            source, _ = compiled[program]
+            path = os.path.join(out_dir, artifact_name(contract, program))
+            with open(path, "w") as f:
+                f.write(source + "\n")
+            paths.append(path)
+    return paths
+
+
+def write_source_maps(out_dir, results, optimize=True):
+    """
+    Writes the source map of every compiled program in results to out_dir. The
+    programs are compiled again, as the map comes out of compiling.
+    :param optimize: whether the programs in results were optimized.
+    :return: the list of written paths.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    for contract, compiled in results.items():
+        for program in PROGRAMS:
+            mapped = source_map.program_map(
+                contract, program, TEAL_MODE, TEAL_VERSION, optimize
+            )
+            name = artifact_name(contract, program)
+            if mapped.teal != compiled[program][0]:
+                raise source_map.SourceMapError(
+                    "{}: the mapped program differs from the built one".format(name)
+                )
+            path = os.path.join(out_dir, source_map.map_name(name))
+            mapped.save(path, name)
+            paths.append(path)
+    return paths
+
+
+def build_templates(out_dir, optimize=True):
+    """
+    Writes the templates in TEMPLATES to out_dir, optimized unless told otherwise.
+    Templates are never written over their own source.
+    :return: a dict of written path to the optimizer report, or None.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    written = {}
+    for name, routes in TEMPLATES.items():
+        origin = os.path.join(CONTRACT_DIR, name)
+        path = os.path.join(out_dir, name)
+        if os.path.abspath(path) == origin:
+            continue
+        with open(origin) as f:
+            source = f.read()
+        summary = None
+        if optimize:
+            before = teal.parse(source)
+            after = teal_opt.optimize(before)
+            source = after.text() + "\n"
+            summary = teal_opt.report(
+                name, before, after, routes, budget=teal.MAX_LOGICSIG_COST
+            )
+        with open(path, "w") as f:
+            f.write(source)
+        written[path] = summary
+    return written
+
+
+def optimizer_report(results):
+    """
+    Compares the optimized programs in results against freshly compiled ones.
+    """
+    reports = []
+    for contract, compiled in results.items():
+        routes = getattr(importlib.import_module(contract), "ROUTES", None)
+        for program in PROGRAMS:
+            before = teal.parse(compile_program(contract, program))
+            after = teal.parse(compiled[program][0])
+            name = artifact_name(contract, program)
+            program_routes = routes if program == "approval" else None
+            reports.append(teal_opt.report(name, before, after, program_routes))
+    return "\n".join(reports)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Compile the smart contracts to TEAL.")
+    parser.add_argument(
+        "contracts",
+        nargs="*",
+        default=CONTRACTS,
+        help="contract modules to build (default: all)",
+    )
+    parser.add_argument(
+        "--out-dir", default="build", help="directory the TEAL files are written to"
+    )
+    parser.add_argument(
+        "--jobs", type=int, default=None, help="worker processes (default: CPU count)"
+    )
+    parser.add_argument(
+        "--cache-dir", default=DEFAULT_CACHE_DIR, help="compile cache directory"
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="compile everything, bypassing the cache",
+    )
+    parser.add_argument(
+        "--no-optimize",
+        action="store_true",
+        help="write the programs exactly as compileTeal produced them",
+    )
+    parser.add_argument(
+        "--report",
+        action="store_true",
+        help="print the optimizer's size and cost changes for every program",
+    )
+    parser.add_argument(
+        "--source-map",
+        action="store_true",
+        help="write a map of every program's lines to the contract's Python lines",
+    )
+    parser.add_argument(
+        "--cache-max-mb",
+        type=float,
+        default=64,
+        help="evict least recently used entries above this size (default: 64)",
+    )
+    parser.add_argument(
+        "--cache-max-age-days",
+        type=float,
+        default=30,
+        help="evict entries unused for this many days (default: 30)",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    start = time.perf_counter()
+    cache = None
+    if not args.no_cache:
+        cache = CompileCache(
+            args.cache_dir,
+            max_bytes=int(args.cache_max_mb * 1024 * 1024),
+            max_age=args.cache_max_age_days * 24 * 60 * 60,
+        )
+    optimize = not args.no_optimize
+    results = build_contracts(args.contracts, cache, args.jobs, optimize)
+    for path in write_artifacts(args.out_dir, results):
+        print("wrote {}".format(path))
+    if args.source_map:
+        for path in write_source_maps(args.out_dir, results, optimize):
+            print("wrote {}".format(path))
+    for path, summary in build_templates(args.out_dir, optimize).items():
+        print("wrote {}".format(path))
+        if summary and args.report:
+            print(summary)
+    if optimize and args.report:
+        print(optimizer_report(results))
+    if cache is not None:
+        print(cache.report())
+    print(
+        "built {} contract(s) in {:.2f}s".format(
+            len(results), time.perf_counter() - start
+        )
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,219 @@
+"""
+Content-addressed on-disk cache for compiled TEAL programs.
+
+Entries are keyed on a hash of the contract source (including the sibling modules
+it imports), the PyTeal version and the compile options, so an entry can only be
+served when compiling again would produce the same output.
+"""
+import ast
+import hashlib
+import json
+import os
+import time
+from importlib import metadata
+
+# Bump to invalidate every existing entry when the entry layout changes.
+CACHE_FORMAT = "1"
+
+# Cache directory used when none is given.
+DEFAULT_CACHE_DIR = ".teal_cache"
+
+
+def pyteal_version():
+    try:
+        return metadata.version("pyteal")
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+
+def _local_imports(path, search_dir):
+    """
+    Finds the modules imported by the file at path that live in search_dir.
+    """
+    with open(path, "rb") as f:
+        tree = ast.parse(f.read(), filename=path)
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names.add(node.module)
+    paths = []
+    for name in sorted(names):
+        candidate = os.path.join(search_dir, name.split(".")[0] + ".py")
+        if os.path.isfile(candidate):
+            paths.append(candidate)
+    return paths
+
+
+def source_digest(module_name, search_dir):
+    """
+    Hashes the source of a contract module and every sibling module it imports,
+    transitively.
+    :return: hex digest of the combined sources.
+    """
+    digest = hashlib.sha256()
+    pending = [os.path.join(search_dir, module_name + ".py")]
+    seen = set()
+    while pending:
+        path = pending.pop()
+        if path in seen:
+            continue
+        seen.add(path)
+        pending.extend(_local_imports(path, search_dir))
+    for path in sorted(seen):
+        with open(path, "rb") as f:
+            digest.update(os.path.basename(path).encode())
+            digest.update(b"\0")
+            digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
+
+
+def cache_key(source, program, mode, version):
+    """
+    Builds the cache key of one compiled program.
+    :param source: the source_digest of the contract module.
+    :param program: program name, e.g. "approval".
+    :param mode: pyteal Mode the program is compiled in.
+    :param version: TEAL version the program is compiled for.
+    """
+    parts = [
+        CACHE_FORMAT,
+        pyteal_version(),
+        getattr(mode, "name", str(mode)),
+        str(version),
+        program,
+        source,
+    ]
+    return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+
+class CacheEntry:
+    def __init__(self, teal, compile_seconds, bytecode=None):
+        self.teal = teal
+        # Time the original compile took, reported as saved on every hit.
+        self.compile_seconds = compile_seconds
+        self.bytecode = bytecode
+
+
+class CompileCache:
+    """
+    Stores one file triple per entry: <key>.teal, <key>.json (metadata) and
+    optionally <key>.bin with the assembled bytecode.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=None, max_age=None):
+        self.directory = directory
+        # Total size the cache is trimmed to on evict(), in bytes.
+        self.max_bytes = max_bytes
+        # Entries not used for longer than this many seconds are evicted.
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+    def _path(self, key, ext):
+        return os.path.join(self.directory, key + ext)
+
+    def get(self, key):
+        start = time.perf_counter()
+        try:
+            with open(self._path(key, ".json")) as f:
+                meta = json.load(f)
+            with open(self._path(key, ".teal")) as f:
+                teal = f.read()
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        bytecode = None
+        if meta.get("bytecode"):
+            try:
+                with open(self._path(key, ".bin"), "rb") as f:
+                    bytecode = f.read()
+            except OSError:
+                bytecode = None
+        # Refresh the access time used by age and size eviction.
+        os.utime(self._path(key, ".json"))
+        entry = CacheEntry(teal, meta["compile_seconds"], bytecode)
+        self.hits += 1
+        self.saved_seconds += max(
+            0.0, entry.compile_seconds - (time.perf_counter() - start)
+        )
+        return entry
+
+    def put(self, key, teal, compile_seconds, bytecode=None):
+        os.makedirs(self.directory, exist_ok=True)
+        if bytecode is not None:
+            self._write(self._path(key, ".bin"), bytecode, "wb")
+        self._write(self._path(key, ".teal"), teal, "w")
+        meta = {
+            "compile_seconds": compile_seconds,
+            "created": time.time(),
+            "bytecode": bytecode is not None,
+        }
+        # Metadata goes last so a partially written entry is never served.
+        self._write(self._path(key, ".json"), json.dumps(meta), "w")
+
+    @staticmethod
+    def _write(path, data, mode):
+        tmp = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp, mode) as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def _entries(self):
+        """
+        :return: list of (last used timestamp, total size, key), oldest first.
+        """
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return []
+        entries = []
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+            key = name[: -len(".json")]
+            size = 0
+            for ext in (".json", ".teal", ".bin"):
+                try:
+                    size += os.path.getsize(self._path(key, ext))
+                except OSError:
+                    pass
+            entries.append((os.path.getmtime(self._path(key, ".json")), size, key))
+        entries.sort()
+        return entries
+
+    def remove(self, key):
+        for ext in (".json", ".teal", ".bin"):
+            try:
+                os.remove(self._path(key, ext))
+            except OSError:
+                pass
+
+    def evict(self):
+        """
+        Removes entries older than max_age, then the least recently used entries
+        until the cache fits in max_bytes.
+        :return: number of removed entries.
+        """
+        entries = self._entries()
+        removed = 0
+        if self.max_age is not None:
+            cutoff = time.time() - self.max_age
+            while entries and entries[0][0] < cutoff:
+                self.remove(entries.pop(0)[2])
+                removed += 1
+        if self.max_bytes is not None:
+            total = sum(size for _, size, _ in entries)
+            while entries and total > self.max_bytes:
+                _, size, key = entries.pop(0)
+                self.remove(key)
+                total -= size
+                removed += 1
+        return removed
+
+    def report(self):
+        return "cache: {} hit(s), {} miss(es), saved {:.2f}s".format(
+            self.hits, self.misses, self.saved_seconds
+        )
@@ -1,80 +1,254 @@
-import sys
-from pyteal import *
+from functools import lru_cache
 
+from pyteal import *
 
-class AppVariables:
+from events import ADDRESS, UINT8, UINT64, Event, EventSchema
+from state import GlobalState, LocalState
+from state_schema import Field, GlobalSchema, LocalSchema
+from transfers import Transfers
+
+
+# Most options a challenge can have. completeVoting pays every option's wallet, so
+# all of them must fit in the transaction's accounts array, which holds 4.
+MAX_OPTIONS = 4
+# Most challenges live at once. Each takes a global key and one per option it may
+# have, and closing out removes a vote from each of them within the opcode budget.
+MAX_CHALLENGES = 8
+# Size in bytes of a voter's ballots: a local value and its one byte key take at
+# most 128 bytes.
+BALLOTS_SIZE = 127
+# Challenges are numbered from 1 and IDs are never reused, as ballots keep a nibble
+# per challenge ID for good. An application opens at most this many challenges.
+MAX_CHALLENGE_ID = 2 * BALLOTS_SIZE - 1
+# Size in bytes of each vote counter in a challenge.
+COUNTER_SIZE = 8
+# Size in bytes of each wallet address in the packed wallets argument.
+ADDRESS_SIZE = 32
+# Most assets the transaction's assets array holds.
+MAX_ASSETS = 8
+# Budget calls completeVoting is grouped with, right after it. Paying out a prize
+# asset and an Algo prize to MAX_OPTIONS wallets takes more than one call's opcode
+# budget, and each budget call adds its own.
+COMPLETE_VOTING_BUDGET_CALLS = 1
+MAX_UINT64 = 2**64 - 1
+
+# Offsets in a challenge of its 8 byte big-endian fields, which the vote counters
+# follow.
+START_TIME = 0
+END_TIME = 8
+ASSET_ID = 16
+PRIZE = 24
+ALGO_PRIZE = 32
+HEADER_SIZE = 40
+
+
+class AppVariables(GlobalSchema):
     """
     All the possible global variables in the application.
     """
 
-    # Count of votes for option one org.
-    optionOneVotes = "optionOneVotes"
-    # Count of votes for option two org.
-    optionTwoVotes = "optionTwoVotes"
     # Creator of the smart contract wallet address.
-    creatorAddress = "creatorAddress"
-    # Start time for the current challenge in unix timestamp.
-    startTime = "startTime"
-    # End time for the current challenge in unix timestamp.
-    endTime = "endTime"
-    # Asset ID which is needed in a user's wallet to allow them to vote.
-    assetID = "assetID"
-    # Current challenge ID.
-    challengeID = "challengeID"
-    # Option one org name.
-    optionOneName = "optionOneName"
-    # Option two org name.
-    optionTwoName = "optionTwoName"
-    # Option one org's wallet address.
-    optionOneWallet = "optionOneWallet"
-    # Option two org's wallet address.
-    optionTwoWallet = "optionTwoWallet"
-    # Asset required to vote.
-    voteAsset = "voteAsset"
-
-
-class LocalVariables:
+    creatorAddress = Field(TealType.bytes)
+    # Asset required to vote, in every challenge.
+    voteAsset = Field(TealType.uint64)
+    # ID of the last challenge opened.
+    lastChallengeID = Field(TealType.uint64)
+    # IDs of the live challenges, one byte each, in the order they were opened.
+    liveChallenges = Field(TealType.bytes)
+    # Every live challenge by ID: start and end time in unix timestamp, prize asset,
+    # amount of the prize asset and of Algos to pay out, then the count of votes for
+    # every option, packed as 8 byte big-endian integers.
+    challenge = Field(
+        TealType.bytes, count=MAX_CHALLENGES, indexes=MAX_CHALLENGE_ID + 1
+    )
+    # Every option of the live challenges, by challenge ID * MAX_OPTIONS + option
+    # index: the org wallet address followed by the org name.
+    option = Field(
+        TealType.bytes,
+        count=MAX_CHALLENGES * MAX_OPTIONS,
+        indexes=(MAX_CHALLENGE_ID + 1) * MAX_OPTIONS,
+    )
+
+
+class LocalVariables(LocalSchema):
     """
     All the possible local variables in the application.
     """
 
-    # Last challenge the user voted on.
-    lastVotedID = "lastVotedID"
-    # Last org the user voted on.
-    lastVotedOptionName = "lastVotedOption"
+    # The user's vote in every challenge, a nibble per challenge ID, the high one
+    # first: 0 until they vote, then the index of the option they voted for plus 1.
+    ballots = Field(TealType.bytes)
+
+
+class Events(EventSchema):
+    """
+    The events the application logs.
+    """
+
+    # A challenge opened, with the number of its options.
+    opened = Event(
+        challenge_id=UINT8,
+        start_time=UINT64,
+        end_time=UINT64,
+        asset_id=UINT64,
+        prize=UINT64,
+        algo_prize=UINT64,
+        options=UINT8,
+    )
+    # A voter's ballot in a challenge changed from previous_ballot, by a vote or by
+    # closing out. Ballots are as in LocalVariables: the option plus 1, 0 for none.
+    voted = Event(
+        challenge_id=UINT8, voter=ADDRESS, ballot=UINT8, previous_ballot=UINT8
+    )
+    # A challenge paid out and removed. Without votes, the creator got its prizes.
+    completed = Event(challenge_id=UINT8, total_votes=UINT64)
+    # The application deleted.
+    deleted = Event()
+
+
+# Global and local schema (uints, byte slices) the application must be created with.
+GLOBAL_SCHEMA = AppVariables.state_schema()
+LOCAL_SCHEMA = LocalVariables.state_schema()
+# Longest option name: a global value and its key take at most 128 bytes.
+MAX_NAME_SIZE = 128 - len(AppVariables.option.entry_key(0)) - ADDRESS_SIZE
+
+
+def decode_challenge(value):
+    """
+    :param value: a challenge's value, as AppVariables.decode() returns it.
+    :return: dict of its fields by name, "votes" holding the list of the votes for
+        every option.
+    """
+    fields = {
+        name: int.from_bytes(value[offset : offset + 8], "big")
+        for name, offset in [
+            ("startTime", START_TIME),
+            ("endTime", END_TIME),
+            ("assetID", ASSET_ID),
+            ("prize", PRIZE),
+            ("algoPrize", ALGO_PRIZE),
+        ]
+    }
+    fields["votes"] = [
+        int.from_bytes(value[i : i + COUNTER_SIZE], "big")
+        for i in range(HEADER_SIZE, len(value), COUNTER_SIZE)
+    ]
+    return fields
+
+
+def decode_ballots(ballots):
+    """
+    :return: dict of challenge ID to the index of the option the user voted for,
+        for every challenge they voted in.
+    """
+    choices = {}
+    for index, ballot_byte in enumerate(ballots):
+        for challenge_id, ballot in [
+            (2 * index, ballot_byte >> 4),
+            (2 * index + 1, ballot_byte & 15),
+        ]:
+            if ballot:
+                choices[challenge_id] = ballot - 1
+    return choices
+
 
+def option_key(challenge_id, option):
+    return AppVariables.option[challenge_id * Int(MAX_OPTIONS) + option]
 
-class DefaultValues:
-    defaultVotes = 0
+
+def option_wallet(challenge_id, option):
+    return Extract(
+        App.globalGet(option_key(challenge_id, option)), Int(0), Int(ADDRESS_SIZE)
+    )
 
 
-def remove_existing_vote():
-    # Total votes for org one.
-    option_one_votes = App.globalGet(Bytes(AppVariables.optionOneVotes))
-    # Total votes for org two.
-    option_two_votes = App.globalGet(Bytes(AppVariables.optionTwoVotes))
-    # Org one name.
-    option_one_name = App.globalGet(Bytes(AppVariables.optionOneName))
-    # Org two name.
-    option_two_name = App.globalGet(Bytes(AppVariables.optionTwoName))
-    # Org user last voted for.
-    user_current_voted_option = App.localGet(
-        Txn.sender(), Bytes(LocalVariables.lastVotedOptionName)
+def challenge_options(challenge):
+    """
+    :return: the number of options of a challenge, from the size of its value.
+    """
+    return (Len(challenge) - Int(HEADER_SIZE)) / Int(COUNTER_SIZE)
+
+
+def change_votes(challenge, option, delta):
+    """
+    Adds delta (1 or -1) to the counter of option in a challenge's value. challenge
+    is read several times, so pass a scratch load.
+    :return:
+    """
+    offset = ScratchVar(TealType.uint64)
+    count = ExtractUint64(challenge, offset.load())
+    return Seq(
+        offset.store(option * Int(COUNTER_SIZE) + Int(HEADER_SIZE)),
+        Concat(
+            Substring(challenge, Int(0), offset.load()),
+            Itob(count + Int(1) if delta > 0 else count - Int(1)),
+            Substring(challenge, offset.load() + Int(COUNTER_SIZE), Len(challenge)),
+        ),
     )
 
+
+def get_ballot(ballots, challenge_id):
+    """
+    challenge_id is read several times, so pass a scratch load.
+    :return: the user's vote in a challenge from their ballots: the index of the
+        option plus 1, or 0.
+    """
+    ballot_byte = GetByte(ballots, challenge_id / Int(2))
+    return If(challenge_id % Int(2), ballot_byte % Int(16), ballot_byte / Int(16))
+
+
+def set_ballot(ballots, challenge_id, ballot):
+    """
+    ballots and challenge_id are read several times, so pass scratch loads.
+    :return: ballots with the user's vote in a challenge replaced by ballot.
+    """
+    ballot_byte = GetByte(ballots, challenge_id / Int(2))
+    return SetByte(
+        ballots,
+        challenge_id / Int(2),
+        If(
+            challenge_id % Int(2),
+            ballot_byte / Int(16) * Int(16) + ballot,
+            ballot_byte % Int(16) + ballot * Int(16),
+        ),
+    )
+
+
+def store_options(challenge_id, options, wallets_arg, first_name_arg):
+    """
+    Stores the options of a new challenge from the application args: the wallets
+    packed in one argument, 32 bytes each, then one argument per name.
+    :param options: ScratchVar set to the number of options.
+    :return:
+    """
+    wallets = Txn.application_args[wallets_arg]
+    i = ScratchVar(TealType.uint64)
+
     return Seq(
         [
-            If(user_current_voted_option == option_one_name)
-            .Then(
-                App.globalPut(
-                    Bytes(AppVariables.optionOneVotes), option_one_votes - Int(1)
+            options.store(Txn.application_args.length() - Int(first_name_arg)),
+            Assert(
+                And(
+                    options.load() >= Int(2),
+                    options.load() <= Int(MAX_OPTIONS),
+                    Len(wallets) == options.load() * Int(ADDRESS_SIZE),
                 )
-            )
-            .Else(
+            ),
+            For(
+                i.store(Int(0)),
+                i.load() < options.load(),
+                i.store(i.load() + Int(1)),
+            ).Do(
                 App.globalPut(
-                    Bytes(AppVariables.optionTwoVotes), option_two_votes - Int(1)
+                    option_key(challenge_id, i.load()),
+                    Concat(
+                        Extract(
+                            wallets, i.load() * Int(ADDRESS_SIZE), Int(ADDRESS_SIZE)
+                        ),
+                        Txn.application_args[i.load() + Int(first_name_arg)],
+                    ),
                 )
-            )
+            ),
         ]
     )
 
@@ -82,121 +256,162 @@ def remove_existing_vote():
 def on_create():
     """
     Initialization of the global variables in the application with the previously defined default values and application args.
+    Challenges are opened once the application exists.
     :return:
     """
-    start_time = Btoi(Txn.application_args[2])
-    end_time = Btoi(Txn.application_args[3])
-    challenge_id = Btoi(Txn.application_args[4])
-    option_one_name = Txn.application_args[5]
-    option_two_name = Txn.application_args[6]
-    asset_id = Btoi(Txn.application_args[7])
-    option_one_wallet = Txn.application_args[8]
-    option_two_wallet = Txn.application_args[9]
-    vote_asset = Btoi(Txn.application_args[10])
+    vote_asset = Btoi(Txn.application_args[0])
 
     return Seq(
         [
-            Assert(And(Global.latest_timestamp() < end_time, challenge_id != Int(0))),
-            App.globalPut(Bytes(AppVariables.creatorAddress), Txn.sender()),
+            App.globalPut(AppVariables.creatorAddress, Txn.sender()),
+            App.globalPut(AppVariables.voteAsset, vote_asset),
+            App.globalPut(AppVariables.liveChallenges, Bytes("")),
+            Approve(),
+        ]
+    )
+
+
+# OnOpen handles opening a new challenge, live alongside the others until it is
+# completed. It takes the ID after the last challenge's, logged in its opened event.
+# The creator deposits the prizes: the application must hold them when the challenge
+# completes.
+def on_open():
+    start_time = Btoi(Txn.application_args[1])
+    end_time = Btoi(Txn.application_args[2])
+    asset_id = Btoi(Txn.application_args[3])
+    prize = Btoi(Txn.application_args[4])
+    algo_prize = Btoi(Txn.application_args[5])
+    challenge_id = ScratchVar(TealType.uint64)
+    options = ScratchVar(TealType.uint64)
+    live_challenges = ScratchVar(TealType.bytes)
+
+    return Seq(
+        [
+            live_challenges.store(App.globalGet(AppVariables.liveChallenges)),
+            challenge_id.store(App.globalGet(AppVariables.lastChallengeID) + Int(1)),
+            Assert(
+                And(
+                    # The wallet opening a challenge must be the original creator.
+                    Txn.sender() == App.globalGet(AppVariables.creatorAddress),
+                    Global.latest_timestamp() < end_time,
+                    Len(live_challenges.load()) < Int(MAX_CHALLENGES),
+                    challenge_id.load() <= Int(MAX_CHALLENGE_ID),
+                )
+            ),
+            # Option wallets packed in argument 6, option names from argument 7 on.
+            store_options(challenge_id.load(), options, 6, 7),
+            # Every counter starts at zero.
             App.globalPut(
-                Bytes(AppVariables.optionOneVotes), Int(DefaultValues.defaultVotes)
+                AppVariables.challenge[challenge_id.load()],
+                Concat(
+                    Itob(start_time),
+                    Itob(end_time),
+                    Itob(asset_id),
+                    Itob(prize),
+                    Itob(algo_prize),
+                    BytesZero(options.load() * Int(COUNTER_SIZE)),
+                ),
             ),
             App.globalPut(
-                Bytes(AppVariables.optionTwoVotes), Int(DefaultValues.defaultVotes)
+                AppVariables.liveChallenges,
+                Concat(
+                    live_challenges.load(),
+                    Extract(Itob(challenge_id.load()), Int(7), Int(1)),
+                ),
+            ),
+            App.globalPut(AppVariables.lastChallengeID, challenge_id.load()),
+            Events.opened.log(
+                challenge_id=challenge_id.load(),
+                start_time=start_time,
+                end_time=end_time,
+                asset_id=asset_id,
+                prize=prize,
+                algo_prize=algo_prize,
+                options=options.load(),
             ),
-            App.globalPut(Bytes(AppVariables.startTime), start_time),
-            App.globalPut(Bytes(AppVariables.endTime), end_time),
-            App.globalPut(Bytes(AppVariables.challengeID), challenge_id),
-            App.globalPut(Bytes(AppVariables.optionOneName), option_one_name),
-            App.globalPut(Bytes(AppVariables.optionTwoName), option_two_name),
-            App.globalPut(Bytes(AppVariables.assetID), asset_id),
-            App.globalPut(Bytes(AppVariables.optionOneWallet), option_one_wallet),
-            App.globalPut(Bytes(AppVariables.optionTwoWallet), option_two_wallet),
-            App.globalPut(Bytes(AppVariables.voteAsset), vote_asset),
             Approve(),
         ]
     )
 
 
-# OnVote handles a user casting a vote.
+# OnVote handles a user casting a vote in a live challenge.
 def on_vote():
-    # Checks what challenge the user last voted on.
-    user_last_voted_challenge_id = App.localGet(
-        Txn.sender(), Bytes(LocalVariables.lastVotedID)
-    )
+    state = GlobalState()
+    voter = LocalState()
+    challenge_id = ScratchVar(TealType.uint64)
+    challenge_key = ScratchVar(TealType.bytes)
+    challenge = ScratchVar(TealType.bytes)
     # Checks if the user is holding a specified asset.
     user_holds_vote_asset = AssetHolding.balance(
-        Txn.sender(), App.globalGet(Bytes(AppVariables.voteAsset))
-    )
-    # The organization that the user is voting for.
-    user_choice = Txn.application_args[1]
-    # Total votes for org one.
-    option_one_votes = App.globalGet(Bytes(AppVariables.optionOneVotes))
-    # Total votes for org two.
-    option_two_votes = App.globalGet(Bytes(AppVariables.optionTwoVotes))
-    # Org one name.
-    option_one_name = App.globalGet(Bytes(AppVariables.optionOneName))
-    # Org two name.
-    option_two_name = App.globalGet(Bytes(AppVariables.optionTwoName))
-
-    # Checks that the organization the user voted for is in the current challenge.
-    user_vote_valid = Or(
-        user_choice == App.globalGet(Bytes(AppVariables.optionOneName)),
-        user_choice == App.globalGet(Bytes(AppVariables.optionTwoName)),
+        Int(0), state.get(AppVariables.voteAsset)
     )
+    # Index of the option the user is voting for.
+    user_choice = ScratchVar(TealType.uint64)
+    ballots = ScratchVar(TealType.bytes)
+    # The user's vote in this challenge before this one, 0 if none.
+    user_previous_ballot = ScratchVar(TealType.uint64)
+
+    # Checks that the option the user voted for is in the challenge.
+    user_vote_valid = user_choice.load() < challenge_options(challenge.load())
 
     # Checks that the user holds the asset that allows for voting and that the current time is within the allowed voting time range.
     can_user_vote = And(
         user_holds_vote_asset.value() > Int(0),
-        Global.latest_timestamp() > App.globalGet(Bytes(AppVariables.startTime)),
-        Global.latest_timestamp() < App.globalGet(Bytes(AppVariables.endTime)),
-    )
-
-    # Checks if user has voted in the current challenge.
-    has_user_voted = user_last_voted_challenge_id == App.globalGet(
-        Bytes(AppVariables.challengeID)
-    )
-
-    # Updates vote count with users choice.
-    add_new_vote = (
-        If(user_choice == option_one_name)
-        .Then(
-            App.globalPut(Bytes(AppVariables.optionOneVotes), option_one_votes + Int(1))
-        )
-        .Else(
-            App.globalPut(Bytes(AppVariables.optionTwoVotes), option_two_votes + Int(1))
-        )
-    )
-
-    # Update local variables on user's wallet.
-    update_user_local_variables = Seq(
-        [
-            App.localPut(
-                Txn.sender(),
-                Bytes(LocalVariables.lastVotedID),
-                App.globalGet(Bytes(AppVariables.challengeID)),
-            ),
-            App.localPut(
-                Txn.sender(), Bytes(LocalVariables.lastVotedOptionName), user_choice
-            ),
-        ]
+        Global.latest_timestamp()
+        > ExtractUint64(challenge.load(), Int(START_TIME)),
+        Global.latest_timestamp() < ExtractUint64(challenge.load(), Int(END_TIME)),
     )
 
     return Seq(
         [
+            challenge_id.store(Btoi(Txn.application_args[1])),
+            challenge_key.store(AppVariables.challenge[challenge_id.load()]),
+            # A challenge that is not live reads as 0, which user_vote_valid's Len()
+            # rejects.
+            challenge.store(App.globalGet(challenge_key.load())),
             user_holds_vote_asset,
-            Assert(user_vote_valid),
-            Assert(can_user_vote),
-            If(has_user_voted).Then(remove_existing_vote()),
-            add_new_vote,
-            update_user_local_variables,
+            user_choice.store(Btoi(Txn.application_args[2])),
+            Assert(And(user_vote_valid, can_user_vote)),
+            ballots.store(voter.get(LocalVariables.ballots)),
+            user_previous_ballot.store(
+                get_ballot(ballots.load(), challenge_id.load())
+            ),
+            # Voting for the same option again changes nothing.
+            If(user_previous_ballot.load() == user_choice.load() + Int(1)).Then(
+                Approve()
+            ),
+            If(user_previous_ballot.load()).Then(
+                challenge.store(
+                    change_votes(
+                        challenge.load(), user_previous_ballot.load() - Int(1), -1
+                    )
+                )
+            ),
+            # Updates vote count with users choice.
+            App.globalPut(
+                challenge_key.load(),
+                change_votes(challenge.load(), user_choice.load(), 1),
+            ),
+            # Update local variables on user's wallet.
+            voter.put(
+                LocalVariables.ballots,
+                set_ballot(
+                    ballots.load(), challenge_id.load(), user_choice.load() + Int(1)
+                ),
+            ),
+            Events.voted.log(
+                challenge_id=challenge_id.load(),
+                voter=Txn.sender(),
+                ballot=user_choice.load() + Int(1),
+                previous_ballot=user_previous_ballot.load(),
+            ),
             Approve(),
         ]
     )
 
 
 # OnSetup handles opting in the smart contract into a specified asset.
-def on_setup():
+def on_setup(transfers):
     # Asset to be opted in.
     opt_in_asset = Btoi(Txn.application_args[1])
 
@@ -206,220 +421,262 @@ def on_setup():
                 And(
                     # The wallet triggering the setup must be the original creator and receiver.
                     Txn.sender()
-                    == App.globalGet(Bytes(AppVariables.creatorAddress))
+                    == App.globalGet(AppVariables.creatorAddress)
                 )
             ),
-            InnerTxnBuilder.Begin(),
-            InnerTxnBuilder.SetFields(
-                {
-                    # Send 0 units of the asset to itself to opt-in.
-                    TxnField.type_enum: TxnType.AssetTransfer,
-                    TxnField.xfer_asset: opt_in_asset,
-                    TxnField.asset_receiver: Global.current_application_address(),
-                }
-            ),
-            InnerTxnBuilder.Submit(),
+            transfers.opt_in(opt_in_asset),
             Approve(),
         ]
     )
 
 
-# OnWithdraw handles sending assets to the winning organization's wallet.
-def on_complete_voting():
-    # Asset to be withdrawn.
-    withdraw_asset_id = Btoi(Txn.application_args[1])
-    total_votes = App.globalGet(Bytes(AppVariables.optionOneVotes)) + App.globalGet(
-        Bytes(AppVariables.optionTwoVotes)
-    )
-    asset_holding = AssetHolding.balance(
-        Global.current_application_address(), withdraw_asset_id
-    )
-
-    # Send wallet specified amount of asset.
-    @Subroutine(TealType.none)
-    def sendAssetsTo(wallet: Expr, amount: Expr) -> Expr:
-        return Seq(
-            InnerTxnBuilder.Begin(),
-            InnerTxnBuilder.SetFields(
-                {
-                    TxnField.type_enum: TxnType.AssetTransfer,
-                    TxnField.xfer_asset: withdraw_asset_id,
-                    TxnField.asset_amount: amount,
-                    TxnField.asset_receiver: wallet,
-                    TxnField.sender: Global.current_application_address(),
-                }
-            ),
-            InnerTxnBuilder.Submit(),
+# OnCompleteVoting handles sending a challenge's prize and Algo prize to every
+# organization's wallet, in proportion to the votes it received, then removes the
+# challenge. Without votes, both go back to the creator.
+def on_complete_voting(transfers):
+    app_address = Global.current_application_address()
+    challenge_id = ScratchVar(TealType.uint64)
+    challenge_key = ScratchVar(TealType.bytes)
+    challenge = ScratchVar(TealType.bytes)
+    live_challenge = App.globalGetEx(Int(0), challenge_key.load())
+    votes = ScratchVar(TealType.bytes)
+    option_count = ScratchVar(TealType.uint64)
+    total_votes = ScratchVar(TealType.uint64)
+    # Wallets paid a share of each prize, and the wallet sent the rest.
+    shares = ScratchVar(TealType.uint64)
+    last_wallet = ScratchVar(TealType.bytes)
+    # Offset in the challenge of the amount being paid out, PRIZE then ALGO_PRIZE.
+    prize_offset = ScratchVar(TealType.uint64)
+    withdraw_asset_id = ScratchVar(TealType.uint64)
+    # Amount split between the wallets, and how much of it was sent.
+    prize = ScratchVar(TealType.uint64)
+    paid = ScratchVar(TealType.uint64)
+    amount = ScratchVar(TealType.uint64)
+    live_challenges = ScratchVar(TealType.bytes)
+    i = ScratchVar(TealType.uint64)
+    asset_holding = AssetHolding.balance(app_address, withdraw_asset_id.load())
+    is_algos = withdraw_asset_id.load() == Int(0)
+    option_votes = ExtractUint64(votes.load(), i.load() * Int(COUNTER_SIZE))
+
+    # Sends every option but the last its share of the prize.
+    def pay_shares(share):
+        return For(
+            i.store(Int(0)),
+            i.load() < shares.load(),
+            i.store(i.load() + Int(1)),
+        ).Do(
+            Seq(
+                amount.store(share),
+                transfers.send(
+                    withdraw_asset_id.load(),
+                    option_wallet(challenge_id.load(), i.load()),
+                    amount.load(),
+                    runs=2 * (MAX_OPTIONS - 1),
+                ),
+                paid.store(paid.load() + amount.load()),
+            )
         )
 
-    # Send rest of asset to specified wallet.
-    @Subroutine(TealType.none)
-    def closeAssetsTo(wallet: Expr) -> Expr:
-        return Seq(
-            InnerTxnBuilder.Begin(),
-            InnerTxnBuilder.SetFields(
-                {
-                    TxnField.type_enum: TxnType.AssetTransfer,
-                    TxnField.xfer_asset: withdraw_asset_id,
-                    TxnField.asset_close_to: wallet,
-                }
-            ),
-            InnerTxnBuilder.Submit(),
+    pay_out_prize = Seq(
+        withdraw_asset_id.store(
+            If(
+                prize_offset.load() == Int(PRIZE),
+                ExtractUint64(challenge.load(), Int(ASSET_ID)),
+                Int(0),
+            )
+        ),
+        prize.store(ExtractUint64(challenge.load(), prize_offset.load())),
+        paid.store(Int(0)),
+        # Send every wallet but the last a number of assets proportional to the
+        # number of votes its option recieved. When prize * votes could overflow,
+        # the product is taken 128 bits wide, at the price of a divmodw per wallet.
+        If(shares.load())
+        .Then(
+            If(prize.load() <= Int(MAX_UINT64) / total_votes.load())
+            .Then(pay_shares(prize.load() * option_votes / total_votes.load()))
+            .Else(
+                pay_shares(
+                    WideRatio([prize.load(), option_votes], [total_votes.load()])
+                )
+            )
+        ),
+        # Send the rest to the last wallet, closing out of the asset unless another
+        # challenge's prize is held in it too.
+        If(is_algos)
+        .Then(
+            transfers.send(
+                withdraw_asset_id.load(),
+                last_wallet.load(),
+                prize.load() - paid.load(),
+                runs=2,
+            )
         )
+        .Else(
+            Seq(
+                asset_holding,
+                If(asset_holding.value() == prize.load() - paid.load())
+                .Then(
+                    transfers.close_asset(withdraw_asset_id.load(), last_wallet.load())
+                )
+                .Else(
+                    transfers.send(
+                        withdraw_asset_id.load(),
+                        last_wallet.load(),
+                        prize.load() - paid.load(),
+                    )
+                ),
+            )
+        ),
+    )
 
     return Seq(
         [
-            asset_holding,
+            Assert(
+                Global.group_size()
+                > Txn.group_index() + Int(COMPLETE_VOTING_BUDGET_CALLS)
+            ),
+            *[
+                Assert(
+                    And(
+                        budget_call.type_enum() == TxnType.ApplicationCall,
+                        budget_call.application_id()
+                        == Global.current_application_id(),
+                        budget_call.on_completion() == OnComplete.NoOp,
+                        budget_call.application_args[0] == Bytes("budget"),
+                    )
+                )
+                for budget_call in [
+                    Gtxn[Txn.group_index() + Int(k)]
+                    for k in range(1, COMPLETE_VOTING_BUDGET_CALLS + 1)
+                ]
+            ],
+            challenge_id.store(Btoi(Txn.application_args[1])),
+            challenge_key.store(AppVariables.challenge[challenge_id.load()]),
+            live_challenge,
+            Assert(live_challenge.hasValue()),
+            challenge.store(live_challenge.value()),
             Assert(
                 And(
                     # The wallet triggering the withdraw must be the original creator.
-                    Txn.sender() == App.globalGet(Bytes(AppVariables.creatorAddress)),
+                    Txn.sender() == App.globalGet(AppVariables.creatorAddress),
                     # The current time must be after the end time.
                     Global.latest_timestamp()
-                    > App.globalGet(Bytes(AppVariables.endTime)),
-                    # Smart contract must hold specified asset
-                    asset_holding.hasValue(),
+                    > ExtractUint64(challenge.load(), Int(END_TIME)),
                 )
             ),
-            # Send wallet one number of assets proportional to number of votes option one recieved.
-            sendAssetsTo(
-                App.globalGet(Bytes(AppVariables.optionOneWallet)),
-                asset_holding.value()
-                * App.globalGet(Bytes(AppVariables.optionOneVotes))
-                / total_votes,
+            votes.store(
+                Substring(challenge.load(), Int(HEADER_SIZE), Len(challenge.load()))
             ),
-            # # Send rest of assets to wallet two.
-            closeAssetsTo(App.globalGet(Bytes(AppVariables.optionTwoWallet))),
-            Approve(),
-        ]
-    )
-
-
-# Handle updating the smart contract to start a new challenge.
-def on_update():
-    withdraw_asset_id = App.globalGet(Bytes(AppVariables.assetID))
-    start_time = Btoi(Txn.application_args[1])
-    end_time = Btoi(Txn.application_args[2])
-    option_one_name = Txn.application_args[3]
-    option_two_name = Txn.application_args[4]
-    option_one_wallet = Txn.application_args[5]
-    option_two_wallet = Txn.application_args[6]
-    new_asset_id = Btoi(Txn.application_args[7])
-    current_challenge_id = App.globalGet(Bytes(AppVariables.challengeID))
-
-    asset_holding = AssetHolding.balance(
-        Global.current_application_address(), withdraw_asset_id
-    )
-
-    return Seq(
-        [
-            asset_holding,
-            Assert(
-                And(
-                    # The wallet triggering the close must be the original creator and receiver.
-                    Txn.sender() == App.globalGet(Bytes(AppVariables.creatorAddress)),
-                    # Can only update after current challenge is over.
-                    Global.latest_timestamp()
-                    > App.globalGet(Bytes(AppVariables.endTime)),
-                    # Make sure previous vote rewards have been sent before updating.
-                    asset_holding.value() == Int(0),
+            option_count.store(challenge_options(challenge.load())),
+            total_votes.store(Int(0)),
+            For(
+                i.store(Int(0)),
+                i.load() < option_count.load(),
+                i.store(i.load() + Int(1)),
+            ).Do(total_votes.store(total_votes.load() + option_votes)),
+            If(total_votes.load())
+            .Then(
+                Seq(
+                    shares.store(option_count.load() - Int(1)),
+                    last_wallet.store(
+                        option_wallet(challenge_id.load(), shares.load())
+                    ),
+                )
+            )
+            .Else(
+                Seq(
+                    shares.store(Int(0)),
+                    last_wallet.store(App.globalGet(AppVariables.creatorAddress)),
                 )
             ),
-            App.globalPut(Bytes(AppVariables.optionOneName), option_one_name),
-            App.globalPut(Bytes(AppVariables.optionTwoName), option_two_name),
-            App.globalPut(Bytes(AppVariables.startTime), start_time),
-            App.globalPut(Bytes(AppVariables.endTime), end_time),
-            App.globalPut(Bytes(AppVariables.optionOneWallet), option_one_wallet),
-            App.globalPut(Bytes(AppVariables.optionTwoWallet), option_two_wallet),
-            App.globalPut(Bytes(AppVariables.assetID), new_asset_id),
-            App.globalPut(
-                Bytes(AppVariables.challengeID), current_challenge_id + Int(1)
+            For(
+                prize_offset.store(Int(PRIZE)),
+                prize_offset.load() <= Int(ALGO_PRIZE),
+                prize_offset.store(prize_offset.load() + Int(8)),
+            ).Do(
+                If(ExtractUint64(challenge.load(), prize_offset.load())).Then(
+                    pay_out_prize
+                )
             ),
+            # Remove the challenge.
+            For(
+                i.store(Int(0)),
+                i.load() < option_count.load(),
+                i.store(i.load() + Int(1)),
+            ).Do(App.globalDel(option_key(challenge_id.load(), i.load()))),
+            App.globalDel(challenge_key.load()),
+            live_challenges.store(App.globalGet(AppVariables.liveChallenges)),
+            For(
+                i.store(Int(0)),
+                GetByte(live_challenges.load(), i.load()) != challenge_id.load(),
+                i.store(i.load() + Int(1)),
+            ).Do(Seq()),
             App.globalPut(
-                Bytes(AppVariables.optionOneVotes), Int(DefaultValues.defaultVotes)
+                AppVariables.liveChallenges,
+                Concat(
+                    Substring(live_challenges.load(), Int(0), i.load()),
+                    Substring(
+                        live_challenges.load(),
+                        i.load() + Int(1),
+                        Len(live_challenges.load()),
+                    ),
+                ),
             ),
-            App.globalPut(
-                Bytes(AppVariables.optionTwoVotes), Int(DefaultValues.defaultVotes)
+            Events.completed.log(
+                challenge_id=challenge_id.load(), total_votes=total_votes.load()
             ),
             Approve(),
         ]
     )
 
 
-def handle_no_op():
-    return Cond(
-        [Txn.application_args[0] == Bytes("completeVoting"), on_complete_voting()],
-        [Txn.application_args[0] == Bytes("vote"), on_vote()],
-        [Txn.application_args[0] == Bytes("setup"), on_setup()],
-        [Txn.application_args[0] == Bytes("update"), on_update()],
-    )
-
-
-def closeAssetsTo(account: Expr) -> Expr:
-    asset_id = App.globalGet(Bytes(AppVariables.assetID))
-    asset_holding = AssetHolding.balance(Global.current_application_address(), asset_id)
-    return Seq(
-        asset_holding,
-        If(asset_holding.value() == Int(0))
-        .Then(
-            Seq(
-                InnerTxnBuilder.Begin(),
-                InnerTxnBuilder.SetFields(
-                    {
-                        TxnField.type_enum: TxnType.AssetTransfer,
-                        TxnField.xfer_asset: asset_id,
-                        TxnField.asset_close_to: account,
-                    }
-                ),
-                InnerTxnBuilder.Submit(),
-            )
-        )
-        .Else(Seq([Reject()])),
-    )
+# OnBudget approves without doing anything. Grouped with a completeVoting, it adds
+# its opcode budget to the payout's.
+def on_budget():
+    return Approve()
 
 
-def close_account_to(account: Expr) -> Expr:
-    asset_balance = AssetHolding.balance(
-        Global.current_application_address(), App.globalGet(Bytes(AppVariables.assetID))
-    )
-    return Seq(
+def handle_no_op(transfers):
+    # Votes are by far the most frequent call, so they are routed first.
+    return Cond(
+        [Txn.application_args[0] == Bytes("vote"), on_vote()],
         [
-            asset_balance,
-            If(asset_balance.value() == Int(0))
-            .Then(
-                Seq(
-                    InnerTxnBuilder.Begin(),
-                    InnerTxnBuilder.SetFields(
-                        {
-                            TxnField.type_enum: TxnType.Payment,
-                            TxnField.close_remainder_to: account,
-                        }
-                    ),
-                    InnerTxnBuilder.Submit(),
-                )
-            )
-            .Else(Seq([Reject()])),
-        ]
+            Txn.application_args[0] == Bytes("completeVoting"),
+            on_complete_voting(transfers),
+        ],
+        [Txn.application_args[0] == Bytes("setup"), on_setup(transfers)],
+        [Txn.application_args[0] == Bytes("open"), on_open()],
+        [Txn.application_args[0] == Bytes("budget"), on_budget()],
     )
 
 
-def handle_delete():
-    creator_account = App.globalGet(Bytes(AppVariables.creatorAddress))
+def handle_delete(transfers):
+    creator_account = App.globalGet(AppVariables.creatorAddress)
+    i = ScratchVar(TealType.uint64)
     return Seq(
         [
             Assert(
                 And(
                     # The wallet triggering the close must be the original creator and receiver.
-                    Txn.sender() == App.globalGet(Bytes(AppVariables.creatorAddress)),
-                    # Can only delete after current challenge is over.
-                    Global.latest_timestamp()
-                    > App.globalGet(Bytes(AppVariables.endTime)),
+                    Txn.sender() == App.globalGet(AppVariables.creatorAddress),
+                    # Can only delete once every challenge is completed.
+                    Len(App.globalGet(AppVariables.liveChallenges)) == Int(0),
+                )
+            ),
+            # Close out of the assets passed in before deleting, every prize has
+            # been paid out so what is left of them goes back to the creator.
+            For(
+                i.store(Int(0)),
+                i.load() < Txn.assets.length(),
+                i.store(i.load() + Int(1)),
+            ).Do(
+                transfers.close_asset(
+                    Txn.assets[i.load()], creator_account, runs=MAX_ASSETS
                 )
             ),
-            # Remove assets before deleting
-            closeAssetsTo(creator_account),
             # Remove algos before deleting
-            close_account_to(creator_account),
+            transfers.close_account(creator_account),
+            Events.deleted.log(),
             Approve(),
         ]
     )
@@ -427,48 +684,80 @@ def handle_delete():
 
 # Handle wallet opting into the smart contract.
 def handle_opt_in():
+    voter = LocalState()
     return Seq(
         [
-            App.localPut(Txn.sender(), Bytes(LocalVariables.lastVotedID), Int(0)),
-            App.localPut(
-                Txn.sender(), Bytes(LocalVariables.lastVotedOptionName), Bytes("NA")
-            ),
+            voter.put(LocalVariables.ballots, BytesZero(Int(BALLOTS_SIZE))),
             Approve(),
         ]
     )
 
 
-# Handle updating the smart contract to start a new challenge.
+# Handle wallet closing out of the smart contract, removing its votes from the live
+# challenges.
 def handle_close_out():
-    # Org user last voted for.
-    user_current_voted_option = App.localGet(
-        Txn.sender(), Bytes(LocalVariables.lastVotedOptionName)
-    )
+    voter = LocalState()
+    live_challenges = ScratchVar(TealType.bytes)
+    ballots = ScratchVar(TealType.bytes)
+    challenge_id = ScratchVar(TealType.uint64)
+    challenge_key = ScratchVar(TealType.bytes)
+    challenge = ScratchVar(TealType.bytes)
+    # The user's vote in the challenge, 0 if none.
+    ballot = ScratchVar(TealType.uint64)
+    i = ScratchVar(TealType.uint64)
 
-    # Checks what challenge the user last voted on.
-    user_last_voted_challenge_id = App.localGet(
-        Txn.sender(), Bytes(LocalVariables.lastVotedID)
-    )
-
-    # Checks if user has voted in the current challenge.
-    has_user_voted = user_last_voted_challenge_id == App.globalGet(
-        Bytes(AppVariables.challengeID)
+    return Seq(
+        [
+            live_challenges.store(App.globalGet(AppVariables.liveChallenges)),
+            ballots.store(voter.get(LocalVariables.ballots)),
+            For(
+                i.store(Int(0)),
+                i.load() < Len(live_challenges.load()),
+                i.store(i.load() + Int(1)),
+            ).Do(
+                Seq(
+                    challenge_id.store(GetByte(live_challenges.load(), i.load())),
+                    ballot.store(get_ballot(ballots.load(), challenge_id.load())),
+                    If(ballot.load()).Then(
+                        Seq(
+                            challenge_key.store(
+                                AppVariables.challenge[challenge_id.load()]
+                            ),
+                            challenge.store(App.globalGet(challenge_key.load())),
+                            App.globalPut(
+                                challenge_key.load(),
+                                change_votes(
+                                    challenge.load(), ballot.load() - Int(1), -1
+                                ),
+                            ),
+                            Events.voted.log(
+                                challenge_id=challenge_id.load(),
+                                voter=Txn.sender(),
+                                ballot=Int(0),
+                                previous_ballot=ballot.load(),
+                            ),
+                        )
+                    ),
+                )
+            ),
+            Approve(),
+        ]
     )
 
-    return Seq([If(has_user_voted).Then(remove_existing_vote()), Approve()])
-
 
+@lru_cache(maxsize=None)
 def approval_program():
     """
     Approval program of the application. Combines all the logic of the application that was implemented previously.
     :return:
     """
 
+    transfers = Transfers()
     program = Cond(
         [Txn.application_id() == Int(0), on_create()],
-        [Txn.on_completion() == OnComplete.NoOp, handle_no_op()],
+        [Txn.on_completion() == OnComplete.NoOp, handle_no_op(transfers)],
         [Txn.on_completion() == OnComplete.OptIn, handle_opt_in()],
-        [Txn.on_completion() == OnComplete.DeleteApplication, handle_delete()],
+        [Txn.on_completion() == OnComplete.DeleteApplication, handle_delete(transfers)],
         [Txn.on_completion() == OnComplete.CloseOut, handle_close_out()],
         [
             Or(
@@ -483,18 +772,68 @@ def approval_program():
     return program
 
 
+@lru_cache(maxsize=None)
 def clear_program():
     return Approve()
 
 
-original_stdout = sys.stdout
-
-with open("donation_votes_approval.teal", "w") as f:
-    sys.stdout = f
-    print(compileTeal(approval_program(), Mode.Application, version=5))
-    sys.stdout = original_stdout
-
-with open("donation_votes_clear.teal", "w") as f:
-    sys.stdout = f
-    print(compileTeal(clear_program(), Mode.Application, version=5))
-    sys.stdout = original_stdout
+# Transaction fields that select each route of approval_program(), used by teal_cost.py.
+# Routes on a challenge find it live with the most options a challenge can have,
+# behind MAX_CHALLENGES - 1 others.
+_ROUTE_CHALLENGES = bytes(range(2, MAX_CHALLENGES + 1)) + bytes([1])
+ROUTES = {
+    "create": {"ApplicationID": 0, "ApplicationArgs": [1]},
+    "open": {
+        "OnCompletion": "NoOp",
+        "ApplicationArgs": ["open", 1, 2, 1, 1, 1, bytes(ADDRESS_SIZE * MAX_OPTIONS)]
+        + [""] * MAX_OPTIONS,
+        "GlobalState": {AppVariables.liveChallenges.key: _ROUTE_CHALLENGES[1:]},
+    },
+    # Prizes too large to multiply by the votes narrowly take the costlier payout,
+    # to four wallets in the prize asset and in Algos.
+    "completeVoting": {
+        "OnCompletion": "NoOp",
+        "ApplicationArgs": ["completeVoting", 1],
+        "GlobalState": {
+            AppVariables.challenge.entry_key(1): b"".join(
+                value.to_bytes(8, "big")
+                for value in [0, 0, 1, MAX_UINT64, MAX_UINT64] + [1] * MAX_OPTIONS
+            ),
+            AppVariables.liveChallenges.key: _ROUTE_CHALLENGES,
+        },
+    },
+    "vote": {
+        "OnCompletion": "NoOp",
+        "ApplicationArgs": ["vote", 1, 0],
+        "GlobalState": {
+            AppVariables.challenge.entry_key(1): bytes(
+                HEADER_SIZE + COUNTER_SIZE * MAX_OPTIONS
+            ),
+        },
+    },
+    "setup": {"OnCompletion": "NoOp", "ApplicationArgs": ["setup"]},
+    "budget": {"OnCompletion": "NoOp", "ApplicationArgs": ["budget"]},
+    "opt_in": {"OnCompletion": "OptIn"},
+    "delete": {
+        "OnCompletion": "DeleteApplication",
+        "NumAssets": MAX_ASSETS,
+        "GlobalState": {AppVariables.liveChallenges.key: b""},
+    },
+    # Costliest for a user with a vote in every live challenge.
+    "close_out": {
+        "OnCompletion": "CloseOut",
+        "GlobalState": {AppVariables.liveChallenges.key: _ROUTE_CHALLENGES},
+    },
+}
+
+# Budget calls grouped with each route, for teal_cost.py.
+BUDGET_CALLS = {"completeVoting": COMPLETE_VOTING_BUDGET_CALLS}
+
+# Loops run at most once per live challenge, teal_cost.py cuts paths off past that.
+LOOP_BOUND = MAX_CHALLENGES
+
+
+if __name__ == "__main__":
+    import build
+
+    build.main(["--out-dir", ".", "donation_votes"])
@@ -0,0 +1,372 @@
+"""
+Fixed-layout binary events the contracts log, and their bulk decoder.
+
+A contract declares the events its routes log as an EventSchema, whose attributes
+are Events with their typed fields in log order:
+
+    class Events(EventSchema):
+        # A voter's ballot in a challenge changed.
+        voted = Event(challenge_id=UINT8, voter=ADDRESS, ballot=UINT8)
+
+Every event is given a one byte tag in the order it is declared, and its log is the
+tag followed by its fields, big-endian and unpadded: UINT8 takes one byte, UINT64
+eight and ADDRESS 32. Programs log an event by giving every field a value:
+
+    Events.voted.log(challenge_id=challenge_id.load(), voter=Txn.sender(), ...)
+
+As every event of a kind has the same size, decode_many() turns a list of logs
+into one NumPy structured array per event, in a few vectorized operations however
+many logs there are, and decode() turns a single log into a dict of its fields:
+
+    Events.decode_many(logs)["voted"]["ballot"]
+    Events.decode(log)
+
+Decode the events logged by an application's calls, from indexer transaction
+records, or block records holding them, one JSON record per line:
+
+    python3 events.py donation_votes records.jsonl
+    python3 events.py periodic_withdrawals records.jsonl --app 1234 --counts
+"""
+import argparse
+import base64
+import importlib
+import json
+import sys
+
+import numpy as np
+from algosdk import encoding
+from pyteal import *
+from pyteal.types import require_type
+
+# The most bytes a transaction may log in all.
+MAX_LOG_BYTES = 1024
+# Size in bytes of an event's tag.
+TAG_SIZE = 1
+
+
+class EventError(Exception):
+    pass
+
+
+class FieldType:
+    """
+    Type of an event field.
+    :ivar size: bytes it takes in a log.
+    :ivar dtype: its NumPy dtype.
+    """
+
+    def __init__(self, name, size, dtype, teal_type):
+        self.name = name
+        self.size = size
+        self.dtype = np.dtype(dtype)
+        self.teal_type = teal_type
+
+    def constant(self, value):
+        """
+        :return: value's bytes in a log if value is an Int, else None.
+        """
+        require_type(value.type_of(), self.teal_type)
+        if isinstance(value, Int):
+            return value.value.to_bytes(self.size, "big")
+        return None
+
+    def encode(self, value):
+        """
+        :return: the expression of value's bytes in a log.
+        """
+        require_type(value.type_of(), self.teal_type)
+        if self.teal_type == TealType.bytes:
+            return value
+        if self.size == 8:
+            return Itob(value)
+        return Extract(Itob(value), Int(8 - self.size), Int(self.size))
+
+    def python_value(self, value):
+        # NumPy strips the trailing zero bytes of "S" values.
+        if self.teal_type == TealType.bytes:
+            return bytes(value).ljust(self.size, b"\0")
+        return int(value)
+
+    def __repr__(self):
+        return self.name
+
+
+UINT8 = FieldType("UINT8", 1, "u1", TealType.uint64)
+UINT64 = FieldType("UINT64", 8, ">u8", TealType.uint64)
+ADDRESS = FieldType("ADDRESS", 32, "S32", TealType.bytes)
+
+
+class Event:
+    """
+    A kind of event: its tag and fields.
+    :ivar name: attribute name in its schema.
+    :ivar tag: the byte its logs start with.
+    :ivar fields: dict of field name to FieldType, in log order.
+    :ivar size: bytes of its logs.
+    :ivar dtype: NumPy structured dtype of its logs, the tag first.
+    """
+
+    def __init__(self, **fields):
+        for name, field_type in fields.items():
+            if not isinstance(field_type, FieldType):
+                raise EventError("field {} is not a FieldType".format(name))
+        self.name = None
+        self.tag = None
+        self.fields = fields
+        self.size = TAG_SIZE + sum(field_type.size for field_type in fields.values())
+        if self.size > MAX_LOG_BYTES:
+            raise EventError(
+                "an event takes {} bytes, a transaction logs at most {}".format(
+                    self.size, MAX_LOG_BYTES
+                )
+            )
+        self.dtype = np.dtype(
+            [("tag", "u1")]
+            + [(name, field_type.dtype) for name, field_type in fields.items()]
+        )
+
+    def log(self, **values):
+        """
+        Runs of the tag, UINT8 fields and Int values are set in a constant with
+        setbyte, cheaper than converting each and concatenating them. UINT8 values
+        over 255 fail the program.
+        :param values: expression of every field's value, by field name.
+        :return: the expression logging the event.
+        """
+        if values.keys() != self.fields.keys():
+            raise TealInputError(
+                "{} logs {}, not {}".format(
+                    self.name, ", ".join(self.fields), ", ".join(values)
+                )
+            )
+        parts = []
+        template = bytearray([self.tag])
+        # (offset in template, value) of the UINT8 fields set in it.
+        set_bytes = []
+
+        def end_template():
+            if template:
+                part = Bytes(bytes(template))
+                for offset, value in set_bytes:
+                    part = SetByte(part, Int(offset), value)
+                parts.append(part)
+            template.clear()
+            set_bytes.clear()
+
+        for name, field_type in self.fields.items():
+            value = values[name]
+            constant = field_type.constant(value)
+            if constant is not None:
+                template.extend(constant)
+            elif field_type is UINT8:
+                set_bytes.append((len(template), value))
+                template.append(0)
+            else:
+                end_template()
+                parts.append(field_type.encode(value))
+        end_template()
+        return Log(Concat(*parts) if len(parts) > 1 else parts[0])
+
+    def decode(self, log):
+        """
+        :return: dict of field name to value, int or bytes.
+        """
+        if len(log) != self.size or log[0] != self.tag:
+            raise EventError(
+                "not an event {}: {} bytes of tag {}".format(
+                    self.name, len(log), log[0] if log else None
+                )
+            )
+        row = np.frombuffer(log, dtype=self.dtype)[0]
+        return {
+            name: field_type.python_value(row[name])
+            for name, field_type in self.fields.items()
+        }
+
+
+class EventSchema:
+    """
+    The events of a contract.
+    :cvar events: dict of name to Event.
+    """
+
+    events = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        events = {
+            name: value for name, value in vars(cls).items() if isinstance(value, Event)
+        }
+        if len(events) > 255:
+            raise EventError("{}: out of tags".format(cls.__name__))
+        for tag, (name, event) in enumerate(events.items(), 1):
+            if event.name is not None:
+                raise EventError(
+                    "{}.{} is already {} of another schema".format(
+                        cls.__name__, name, event.name
+                    )
+                )
+            event.name = name
+            event.tag = tag
+        cls.events = events
+        cls._by_tag = {event.tag: event for event in events.values()}
+
+    @classmethod
+    def decode(cls, log):
+        """
+        :return: tuple of (event name, dict of its fields).
+        """
+        event = cls._by_tag.get(log[0]) if log else None
+        if event is None:
+            raise EventError("{}: no event logs {!r}".format(cls.__name__, log[:1]))
+        return event.name, event.decode(log)
+
+    @classmethod
+    def decode_many(cls, logs):
+        """
+        :param logs: list of logs, as bytes.
+        :return: dict of event name to a NumPy structured array of its logs, in the
+            order of logs, their position in logs as field "index". Events not
+            logged are left out.
+        """
+        if not logs:
+            return {}
+        lengths = np.fromiter(map(len, logs), dtype=np.int64, count=len(logs))
+        if not lengths.all():
+            raise EventError("empty log at {}".format(np.argmin(lengths)))
+        data = np.frombuffer(b"".join(logs), dtype=np.uint8)
+        starts = np.cumsum(lengths) - lengths
+        tags = data[starts]
+        found = np.isin(tags, list(cls._by_tag))
+        if not found.all():
+            first = np.argmin(found)
+            raise EventError(
+                "{}: no event has tag {} (log {})".format(
+                    cls.__name__, tags[first], first
+                )
+            )
+        decoded = {}
+        for tag in np.unique(tags).tolist():
+            event = cls._by_tag[tag]
+            index = np.flatnonzero(tags == tag)
+            wrong = lengths[index] != event.size
+            if wrong.any():
+                raise EventError(
+                    "{} logs {} bytes, log {} has {}".format(
+                        event.name,
+                        event.size,
+                        index[wrong][0],
+                        lengths[index[wrong][0]],
+                    )
+                )
+            rows = data[starts[index, None] + np.arange(event.size)]
+            decoded[event.name] = _with_index(
+                rows.reshape(-1).view(event.dtype), index
+            )
+        return decoded
+
+
+def _with_index(rows, index):
+    """
+    :return: a copy of the structured array rows with an "index" field.
+    """
+    result = np.empty(len(rows), dtype=rows.dtype.descr + [("index", np.int64)])
+    for name in rows.dtype.names:
+        result[name] = rows[name]
+    result["index"] = index
+    return result
+
+
+def record_logs(records, app_id=None):
+    """
+    :param records: indexer transaction records, or block records holding them in
+        "transactions".
+    :param app_id: only keep the logs of calls to this application.
+    :return: tuple of (logs, list of the (round, intra-round offset) of each).
+    """
+    logs = []
+    positions = []
+    for record in records:
+        if "transactions" in record:
+            txns = [
+                (txn, record["round"], txn.get("intra-round-offset", intra))
+                for intra, txn in enumerate(record["transactions"])
+            ]
+        else:
+            txns = [
+                (
+                    record,
+                    record.get("confirmed-round"),
+                    record.get("intra-round-offset", 0),
+                )
+            ]
+        for txn, round_num, intra in txns:
+            if txn.get("tx-type") != "appl" or not txn.get("logs"):
+                continue
+            call = txn["application-transaction"]
+            called = call.get("application-id") or txn.get(
+                "created-application-index"
+            )
+            if app_id is not None and called != app_id:
+                continue
+            for log in txn["logs"]:
+                logs.append(base64.b64decode(log))
+                positions.append((round_num, intra))
+    return logs, positions
+
+
+def _printable(value):
+    if isinstance(value, bytes):
+        if len(value) == ADDRESS.size:
+            return encoding.encode_address(value)
+        return value.hex()
+    return value
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Decode the events logged by a contract's calls."
+    )
+    parser.add_argument("contract", help="contract module, e.g. donation_votes")
+    parser.add_argument("records", help="JSONL file of transaction or block records")
+    parser.add_argument("--app", type=int, help="only decode this application's logs")
+    parser.add_argument(
+        "--counts", action="store_true", help="only count the events of each kind"
+    )
+    args = parser.parse_args(argv)
+
+    schema = importlib.import_module(args.contract).Events
+    with open(args.records) as f:
+        logs, positions = record_logs(
+            (json.loads(line) for line in f if line.strip()), args.app
+        )
+    try:
+        if args.counts:
+            decoded = schema.decode_many(logs)
+            for name in schema.events:
+                print("{}: {}".format(name, len(decoded.get(name, ()))))
+            return 0
+        for (round_num, intra), log in zip(positions, logs):
+            name, fields = schema.decode(log)
+            print(
+                "round {} offset {} {}: {}".format(
+                    round_num,
+                    intra,
+                    name,
+                    "  ".join(
+                        "{} {}".format(field, _printable(value))
+                        for field, value in fields.items()
+                    ),
+                )
+            )
+    except EventError as e:
+        print("{}: {}".format(args.records, e), file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    # Run as the events module the contracts import, so their EventErrors are caught.
+    import events
+
+    sys.exit(events.main())
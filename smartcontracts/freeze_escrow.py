@@ -1,64 +1,92 @@
+from functools import lru_cache
+
 from pyteal import *
-import sys
 
-def approval_program():
-    # Keys for the global data stored by this smart contract.
+from events import UINT8, UINT64, Event, EventSchema
+from state_schema import Field, GlobalSchema, LocalSchema
+from transfers import Transfers
+
+# Most tranches an escrow can hold. Each is one global key, and releasing them all
+# takes one inner transaction each, of the 16 a call may submit. Releasing more than
+# 12 at once needs the budget of a budget call in the same group.
+MAX_TRANCHES = 16
+# Size in bytes of a tranche: its asset ID, amount and unlock timestamp.
+TRANCHE_SIZE = 24
+# Most assets a transaction's assets array holds. A release sends every tranche's
+# asset, which must be in its assets array, so the tranches hold at most this many
+# different assets.
+MAX_FOREIGN_ASSETS = 8
+
+
+class AppVariables(GlobalSchema):
+    """
+    The global data stored by this smart contract.
+    """
 
     # AssetID that this smart contract will freeze.
     # For Nekoin, this is 404044168.
-    asset_id_key = Bytes("asset_id")
+    asset_id = Field(TealType.uint64)
     # Address of the wallet that will receive the funds in this smart contract when it is closed.
     # For Nekoin, this is T4DCI74KWWQA437VGK7VO5VAQ2XQE5LUMC2SKY4IQ7P4PRDRXU4KYHDJH4.
     # We will freeze the creator wallet's 500 million Nekos.
-    receiver_address_key = Bytes("receiver_address_key")
+    receiver_address = Field(TealType.bytes)
     # Timestamp after which this smart contract can be closed.
     # For Nekoin, this is 1669881600 which is December 1, 2022 00:00:00 PST
-    unlock_time_key = Bytes("unlock_time")
-
-    # Sends all of the asset specified by assetID to the specified account.
-    @Subroutine(TealType.none)
-    def closeAssetsTo(assetID: Expr, account: Expr) -> Expr:
-        asset_holding = AssetHolding.balance(Global.current_application_address(), assetID)
-        return Seq(
-            asset_holding,
-            If(asset_holding.hasValue()).Then(
-                Seq(
-                    InnerTxnBuilder.Begin(),
-                    InnerTxnBuilder.SetFields(
-                        {
-                            TxnField.type_enum: TxnType.AssetTransfer,
-                            TxnField.xfer_asset: assetID,
-                            TxnField.asset_close_to: account,
-                        }
-                    ),
-                    InnerTxnBuilder.Submit(),
-                )
-            ),
-        )
-    
-    # Sends all of the Algo's to the specified account.
-    @Subroutine(TealType.none)
-    def closeAccountTo(account: Expr) -> Expr:
-        return If(Balance(Global.current_application_address()) != Int(0)).Then(
-            Seq(
-                InnerTxnBuilder.Begin(),
-                InnerTxnBuilder.SetFields(
-                    {
-                        TxnField.type_enum: TxnType.Payment,
-                        TxnField.close_remainder_to: account,
-                    }
-                ),
-                InnerTxnBuilder.Submit(),
-            )
-        )
+    unlock_time = Field(TealType.uint64)
+    # Number of tranches given at creation, see tranche.
+    tranche_count = Field(TealType.uint64)
+    # Number of tranches already sent to the receiver. Tranches are ordered by unlock
+    # timestamp, so these are always the first ones.
+    released_count = Field(TealType.uint64)
+    # Each tranche, by index: its assetID, amount and unlock timestamp, packed as 8
+    # bytes each.
+    tranche = Field(TealType.bytes, count=MAX_TRANCHES)
+
+
+class LocalVariables(LocalSchema):
+    """
+    This smart contract keeps no local data.
+    """
+
+
+class Events(EventSchema):
+    """
+    The events the application logs.
+    """
+
+    # A release sent the tranches from index first up to released_count.
+    released = Event(first=UINT8, released_count=UINT8)
+    # The application deleted, closing amount of the asset to the receiver. Other
+    # assets closed are left out.
+    deleted = Event(amount=UINT64)
+
+
+@lru_cache(maxsize=None)
+def approval_program():
+    i = ScratchVar(TealType.uint64)
+
+    # Inner transactions sending and closing out of assets and Algos.
+    transfers = Transfers()
 
     # OnCreate handles creating this freeze smart contract.
     # arg[0]: the assetID of the asset we want to freeze. For Nekoin it is 404044168
     # arg[1]: the recipient of the assets held in this smart contract. Must be the creator.
     # arg[2]: the Unix timestamp of when this smart contract can be closed. When the 
     #         contract is closed, everything is sent to the receiver.
+    # arg[3]: optional, the tranches ordered by unlock timestamp. For each, the assetID,
+    #         the amount and the Unix timestamp from which release sends that amount
+    #         to the receiver, packed as 8 bytes each. Release stops at the first
+    #         tranche still locked, so one out of order only holds back the next ones.
+    #         Every tranche's asset must be in the assets array, which caps them at
+    #         MAX_FOREIGN_ASSETS different assets, as many as a release can send.
     on_create_unlock_time = Btoi(Txn.application_args[2])
     on_create_receiver = Txn.application_args[1]
+    on_create_tranches = Txn.application_args[3]
+    on_create_tranche_count = Len(on_create_tranches) / Int(TRANCHE_SIZE)
+    # Only available when the asset is in the assets array.
+    on_create_tranche_asset = AssetParam.total(
+        ExtractUint64(on_create_tranches, i.load() * Int(TRANCHE_SIZE))
+    )
     on_create = Seq(
         Assert(
             And(
@@ -68,43 +96,133 @@ def approval_program():
                 Txn.sender() == on_create_receiver,
             ),
         ),
-        App.globalPut(asset_id_key, Btoi(Txn.application_args[0])),
-        App.globalPut(receiver_address_key, on_create_receiver),
-        App.globalPut(unlock_time_key, on_create_unlock_time),
+        App.globalPut(AppVariables.asset_id, Btoi(Txn.application_args[0])),
+        App.globalPut(AppVariables.receiver_address, on_create_receiver),
+        App.globalPut(AppVariables.unlock_time, on_create_unlock_time),
+        If(Txn.application_args.length() > Int(3)).Then(
+            Seq(
+                Assert(
+                    And(
+                        Len(on_create_tranches) % Int(TRANCHE_SIZE) == Int(0),
+                        on_create_tranche_count <= Int(MAX_TRANCHES),
+                    )
+                ),
+                App.globalPut(AppVariables.tranche_count, on_create_tranche_count),
+                For(
+                    i.store(Int(0)),
+                    i.load() < on_create_tranche_count,
+                    i.store(i.load() + Int(1)),
+                ).Do(
+                    Seq(
+                        on_create_tranche_asset,
+                        Assert(on_create_tranche_asset.hasValue()),
+                        App.globalPut(
+                            AppVariables.tranche[i.load()],
+                            Extract(
+                                on_create_tranches,
+                                i.load() * Int(TRANCHE_SIZE),
+                                Int(TRANCHE_SIZE),
+                            ),
+                        ),
+                    )
+                ),
+            )
+        ),
         Approve(),
     )
 
     # OnSetup handles setting up this freeze smart contract. Namely, it tells this smart
-    # contract to opt into the asset it was created to hold. This smart contract must
-    # hold enough Algo's to make this transaction.
+    # contract to opt into the asset it was created to hold and every asset in the
+    # transaction's assets array, in one call. This smart contract must hold enough
+    # Algo's to make these transactions.
     on_setup = Seq(
         Assert(
             And (
                 # The wallet triggering the setup must be the original creator and receiver.
-                Txn.sender() == App.globalGet(receiver_address_key),
+                Txn.sender() == App.globalGet(AppVariables.receiver_address),
                 # This smart contract must be set up before the unlock timestamp.
-                Global.latest_timestamp() < App.globalGet(unlock_time_key),
+                Global.latest_timestamp() < App.globalGet(AppVariables.unlock_time),
             )
         ),
-        InnerTxnBuilder.Begin(),
-        InnerTxnBuilder.SetFields(
-            {
-                # Send 0 units of the asset to itself to opt-in.
-                TxnField.type_enum: TxnType.AssetTransfer,
-                TxnField.xfer_asset: App.globalGet(asset_id_key),
-                TxnField.asset_receiver: Global.current_application_address(),
-            }
+        transfers.opt_in(App.globalGet(AppVariables.asset_id)),
+        For(
+            i.store(Int(0)),
+            i.load() < Txn.assets.length(),
+            i.store(i.load() + Int(1)),
+        ).Do(
+            # Opting into the asset again is a transfer of 0 units to itself.
+            If(Txn.assets[i.load()] != App.globalGet(AppVariables.asset_id)).Then(
+                transfers.opt_in(Txn.assets[i.load()], runs=MAX_FOREIGN_ASSETS)
+            )
         ),
-        InnerTxnBuilder.Submit(),
         Approve(),
     )
 
+    # OnRelease handles sending the receiver every tranche whose unlock timestamp has
+    # passed, in one call. Each tranche is sent once, in full: release stops at the
+    # first tranche whose amount is not held, and sends it once it is deposited.
+    # Logs a released event when any was.
+    tranche = ScratchVar(TealType.bytes)
+    first = ScratchVar(TealType.uint64)
+    tranche_holding = AssetHolding.balance(
+        Global.current_application_address(), ExtractUint64(tranche.load(), Int(0))
+    )
+    on_release = Seq(
+        Assert(
+            # The wallet triggering the release must be the receiver.
+            Txn.sender() == App.globalGet(AppVariables.receiver_address),
+        ),
+        first.store(App.globalGet(AppVariables.released_count)),
+        For(
+            i.store(first.load()),
+            i.load() < App.globalGet(AppVariables.tranche_count),
+            i.store(i.load() + Int(1)),
+        ).Do(
+            Seq(
+                tranche.store(App.globalGet(AppVariables.tranche[i.load()])),
+                # Every tranche after this one unlocks later.
+                If(
+                    ExtractUint64(tranche.load(), Int(16)) > Global.latest_timestamp()
+                ).Then(Break()),
+                # Not held, or not opted into: wait for the deposit.
+                tranche_holding,
+                If(
+                    tranche_holding.value() < ExtractUint64(tranche.load(), Int(8))
+                ).Then(Break()),
+                transfers.send_asset(
+                    ExtractUint64(tranche.load(), Int(0)),
+                    App.globalGet(AppVariables.receiver_address),
+                    ExtractUint64(tranche.load(), Int(8)),
+                    runs=MAX_TRANCHES,
+                ),
+            )
+        ),
+        If(i.load() > first.load()).Then(
+            Seq(
+                App.globalPut(AppVariables.released_count, i.load()),
+                Events.released.log(first=first.load(), released_count=i.load()),
+            )
+        ),
+        Approve(),
+    )
+
+    # OnBudget approves without doing anything. Grouped with a release, it adds its
+    # opcode budget to the release's.
+    on_budget = Approve()
+
+    # Handle NoOp call: setup, release or budget. Any other call is rejected.
+    on_no_op = Cond(
+        [Txn.application_args[0] == Bytes("setup"), on_setup],
+        [Txn.application_args[0] == Bytes("release"), on_release],
+        [Txn.application_args[0] == Bytes("budget"), on_budget],
+    )
+
     # OnOptIn handles when a wallet request to opt into this smart contract. Only the
     # wallet receiving (and sending) the funds can opt into this smart contract.
     on_opt_in = Seq(
         Assert(
             # Only the original creator and receiver can opt into this smart contract.
-            Txn.sender() == App.globalGet(receiver_address_key),
+            Txn.sender() == App.globalGet(AppVariables.receiver_address),
         ),
         Approve(),
     )
@@ -112,27 +230,47 @@ def approval_program():
     # OnDelete handles deleting the smart contract, which will trigger sending all the funds
     # held in this wallet to the receiver. This transaction will only be approved if the
     # latest_timestamp is after the unlock timestamp (the lock up has expired).
+    on_delete_holding = AssetHolding.balance(
+        Global.current_application_address(), App.globalGet(AppVariables.asset_id)
+    )
     on_delete = Seq(
         Assert(
             And(
                 # The wallet triggering the close must be the original creator and receiver.
-                Txn.sender() == App.globalGet(receiver_address_key),
+                Txn.sender() == App.globalGet(AppVariables.receiver_address),
                 # The current timestamp must be greater than the unlock timestamp. Otherwise
                 # this transaction will be rejected.
-                App.globalGet(unlock_time_key) <= Global.latest_timestamp(),
+                App.globalGet(AppVariables.unlock_time) <= Global.latest_timestamp(),
             ),
         ),
         # These operations are only run if unlock timestamp has passed.
-        # Close all the assets and Algo's held by this account to the receiver.
-        closeAssetsTo(App.globalGet(asset_id_key), App.globalGet(receiver_address_key)),
-        closeAccountTo(App.globalGet(receiver_address_key)),
+        # Close all the assets and Algo's held by this account to the receiver. Every
+        # asset opted into at setup must be in the transaction's assets array.
+        on_delete_holding,
+        Events.deleted.log(amount=on_delete_holding.value()),
+        transfers.close_held_asset(
+            App.globalGet(AppVariables.asset_id),
+            App.globalGet(AppVariables.receiver_address),
+        ),
+        For(
+            i.store(Int(0)),
+            i.load() < Txn.assets.length(),
+            i.store(i.load() + Int(1)),
+        ).Do(
+            transfers.close_held_asset(
+                Txn.assets[i.load()],
+                App.globalGet(AppVariables.receiver_address),
+                runs=MAX_FOREIGN_ASSETS,
+            )
+        ),
+        transfers.close_funded_account(App.globalGet(AppVariables.receiver_address)),
         Approve(),
     )
 
     # Application router for this smart contract.
     program = Cond(
         [Txn.application_id() == Int(0), on_create],
-        [Txn.on_completion() == OnComplete.NoOp, on_setup],
+        [Txn.on_completion() == OnComplete.NoOp, on_no_op],
         [Txn.on_completion() == OnComplete.OptIn, on_opt_in],
         [Txn.on_completion() == OnComplete.DeleteApplication, on_delete],
         [
@@ -148,17 +286,56 @@ def approval_program():
 
     return program
 
+@lru_cache(maxsize=None)
 def clear_program():
     return Approve()
 
-original_stdout = sys.stdout
 
-with open("freeze_escrow_approval.teal", "w") as f:
-    sys.stdout = f
-    print(compileTeal(approval_program(), Mode.Application, version=5))
-    sys.stdout = original_stdout
+# Global and local schema (uints, byte slices) the application must be created with.
+GLOBAL_SCHEMA = AppVariables.state_schema()
+LOCAL_SCHEMA = LocalVariables.state_schema()
+
+
+# Transaction fields that select each route of approval_program(), used by teal_cost.py.
+# Loops run over a full assets array, every asset but the escrow's own, and all
+# MAX_TRANCHES tranches, none released yet.
+_ROUTE_ASSETS = list(range(2, MAX_FOREIGN_ASSETS + 2))
+ROUTES = {
+    "create": {
+        "ApplicationID": 0,
+        "ApplicationArgs": [1, bytes(32), 2, bytes(TRANCHE_SIZE * MAX_TRANCHES)],
+        "Assets": _ROUTE_ASSETS,
+        "NumAssets": len(_ROUTE_ASSETS),
+    },
+    "setup": {
+        "OnCompletion": "NoOp",
+        "ApplicationArgs": ["setup"],
+        "Assets": _ROUTE_ASSETS,
+        "NumAssets": len(_ROUTE_ASSETS),
+        "GlobalState": {AppVariables.asset_id.key: 1},
+    },
+    "release": {
+        "OnCompletion": "NoOp",
+        "ApplicationArgs": ["release"],
+        "GlobalState": {
+            AppVariables.tranche_count.key: MAX_TRANCHES,
+            AppVariables.released_count.key: 0,
+        },
+    },
+    "budget": {"OnCompletion": "NoOp", "ApplicationArgs": ["budget"]},
+    "opt_in": {"OnCompletion": "OptIn"},
+    "delete": {
+        "OnCompletion": "DeleteApplication",
+        "Assets": _ROUTE_ASSETS,
+        "NumAssets": len(_ROUTE_ASSETS),
+    },
+}
+# Budget calls grouped with each route, for teal_cost.py: a release of all
+# MAX_TRANCHES tranches needs one.
+BUDGET_CALLS = {"release": 1}
+
+
+if __name__ == "__main__":
+    import build
 
-with open("freeze_escrow_clear.teal", "w") as f:
-    sys.stdout = f
-    print(compileTeal(clear_program(), Mode.Application, version=5))
-    sys.stdout = original_stdout
+    build.main(["--out-dir", ".", "freeze_escrow"])
@@ -0,0 +1,399 @@
+"""
+Holder balance index of an asset, built from the blocks block_stream.py reads.
+
+Every account that ever held or opted into the asset gets a slot, and the balances
+and opt ins of the slots are kept in flat arrays, 9 bytes per account. The number
+of holders is kept up to date as blocks are applied, and a balance is a dictionary
+lookup and an array read. Vote eligibility in donation_votes (on_vote requires a
+positive balance of the vote asset), holder counts and how much of the asset the
+freeze_escrow and periodic_withdrawals applications lock are answered from the
+index instead of account lookups against algod.
+
+Past rounds stay queryable: every change is logged with its round, and the whole
+arrays are copied every `checkpoint_rounds` rounds. snapshot() returns the state at
+any round since the index started, from the checkpoint before it and the changes
+logged after that checkpoint.
+
+An index either follows the asset from the block creating it, or starts from the
+balances of every holder at a round, e.g. from indexer's
+/v2/assets/{asset-id}/balances, with from_balances().
+
+    python3 holder_index.py blocks/*.msgpack --balances balances.json \\
+        --round 20000000 --eligible ADDRESS --locked-app 1234 --top 10
+"""
+import argparse
+import array
+import bisect
+import json
+import sys
+
+import numpy as np
+from algosdk import encoding, logic
+
+import block_stream
+
+# Rounds between two copies of the whole arrays. More rounds use less memory and
+# make snapshots replay more of the log.
+DEFAULT_CHECKPOINT_ROUNDS = 10000
+
+
+class HolderIndexError(Exception):
+    pass
+
+
+def _raw(address):
+    return encoding.decode_address(address) if isinstance(address, str) else address
+
+
+class _Holdings:
+    """
+    Queries on slots, balances and opted arrays, shared by the index and its
+    snapshots. Slots past the end of the arrays belong to accounts that appeared
+    later and hold nothing.
+    """
+
+    def _slot(self, address):
+        slot = self.slots.get(_raw(address))
+        return None if slot is None or slot >= len(self.balances) else slot
+
+    def balance(self, address):
+        slot = self._slot(address)
+        return 0 if slot is None else int(self.balances[slot])
+
+    def opted_in(self, address):
+        slot = self._slot(address)
+        return slot is not None and bool(self.opted[slot])
+
+    def eligible(self, address):
+        """
+        :return: whether address may vote with the asset as donation_votes' vote
+            asset: on_vote requires a positive balance.
+        """
+        return self.balance(address) > 0
+
+    def locked(self, app_ids):
+        """
+        :return: dict of application ID to the balance of its account, e.g. what a
+            freeze_escrow or periodic_withdrawals application holds.
+        """
+        return {
+            app_id: self.balance(logic.get_application_address(app_id))
+            for app_id in app_ids
+        }
+
+    def _top(self, balances, count):
+        order = np.argsort(balances, kind="stable")[::-1][:count]
+        return [
+            (encoding.encode_address(self.addresses[slot]), int(balances[slot]))
+            for slot in order.tolist()
+            if balances[slot]
+        ]
+
+
+class Snapshot(_Holdings):
+    """
+    The holdings of an asset at a past round.
+    """
+
+    def __init__(self, asset_id, round_num, slots, addresses, balances, opted):
+        self.asset_id = asset_id
+        self.round = round_num
+        self.slots = slots
+        self.addresses = addresses
+        self.balances = balances
+        self.opted = opted
+
+    def holder_count(self):
+        return int(np.count_nonzero(self.balances))
+
+    def opted_in_count(self):
+        return int(np.count_nonzero(self.opted))
+
+    def circulating(self):
+        return int(self.balances.sum(dtype=np.uint64))
+
+    def top(self, count):
+        """
+        :return: list of (address, balance) of the count largest holders.
+        """
+        return self._top(self.balances, count)
+
+
+class HolderIndex(_Holdings):
+    """
+    Balances of every holder of an asset, up to the last round applied.
+    """
+
+    def __init__(self, asset_id, checkpoint_rounds=DEFAULT_CHECKPOINT_ROUNDS):
+        self.asset_id = asset_id
+        self.checkpoint_rounds = checkpoint_rounds
+        # Last round applied, None before the first.
+        self.round = None
+        self.slots = {}
+        self.addresses = []
+        self.balances = array.array("Q")
+        self.opted = array.array("B")
+        self.holders = 0
+        self.opted_in_accounts = 0
+        # Round, slot, balance and opt in after every change, in order.
+        self._log_rounds = array.array("Q")
+        self._log_slots = array.array("Q")
+        self._log_balances = array.array("Q")
+        self._log_opted = array.array("B")
+        # Round of every checkpoint, and its (log length, balances, opted).
+        self._checkpoint_rounds = []
+        self._checkpoints = []
+
+    @classmethod
+    def from_balances(
+        cls, asset_id, round_num, balances, checkpoint_rounds=DEFAULT_CHECKPOINT_ROUNDS
+    ):
+        """
+        :param balances: iterable of (address, amount) of every account opted into
+            the asset at round_num.
+        """
+        index = cls(asset_id, checkpoint_rounds)
+        index.round = round_num
+        for address, amount in balances:
+            index._set(index._slot_for(_raw(address)), amount, 1)
+        # No snapshot goes back past this checkpoint, its changes need no log.
+        for log in (index._log_rounds, index._log_slots, index._log_balances):
+            del log[:]
+        del index._log_opted[:]
+        index._checkpoint(round_num)
+        return index
+
+    def holder_count(self):
+        return self.holders
+
+    def opted_in_count(self):
+        return self.opted_in_accounts
+
+    def circulating(self):
+        balances = np.frombuffer(self.balances, dtype=np.uint64)
+        total = int(balances.sum(dtype=np.uint64))
+        # The array cannot grow while numpy holds its buffer.
+        del balances
+        return total
+
+    def top(self, count):
+        balances = np.frombuffer(self.balances, dtype=np.uint64)
+        top = self._top(balances, count)
+        del balances
+        return top
+
+    def _slot_for(self, address):
+        slot = self.slots.get(address)
+        if slot is None:
+            slot = self.slots[address] = len(self.addresses)
+            self.addresses.append(address)
+            self.balances.append(0)
+            self.opted.append(0)
+        return slot
+
+    def _set(self, slot, balance, opted):
+        if (self.balances[slot] > 0) != (balance > 0):
+            self.holders += 1 if balance > 0 else -1
+        if self.opted[slot] != opted:
+            self.opted_in_accounts += 1 if opted else -1
+        self.balances[slot] = balance
+        self.opted[slot] = opted
+        self._log_rounds.append(self.round)
+        self._log_slots.append(slot)
+        self._log_balances.append(balance)
+        self._log_opted.append(opted)
+
+    def _debit(self, slot, amount):
+        balance = self.balances[slot]
+        if balance < amount:
+            raise HolderIndexError(
+                "round {}: {} sends {} of asset {} but holds {}; start the index at "
+                "the asset's creation or from_balances()".format(
+                    self.round,
+                    encoding.encode_address(self.addresses[slot]),
+                    amount,
+                    self.asset_id,
+                    balance,
+                )
+            )
+        self._set(slot, balance - amount, 1)
+
+    def _transfer(self, source, receiver, amount, close_to):
+        if source is None:
+            self._set(self._slot_for(receiver), amount, 1)
+            return
+        slot = self._slot_for(source)
+        if source == receiver and not amount and close_to is None:
+            if not self.opted[slot]:
+                self._set(slot, 0, 1)
+            return
+        if amount:
+            self._debit(slot, amount)
+            target = self._slot_for(receiver)
+            self._set(target, self.balances[target] + amount, 1)
+        if close_to is not None:
+            rest = self.balances[slot]
+            self._set(slot, 0, 0)
+            target = self._slot_for(close_to)
+            self._set(target, self.balances[target] + rest, 1)
+
+    def _checkpoint(self, round_num):
+        self._checkpoint_rounds.append(round_num)
+        self._checkpoints.append(
+            (len(self._log_rounds), self.balances[:], self.opted[:])
+        )
+
+    def apply_block(self, round_num, transfers):
+        """
+        Applies the transfers of a block, as block_stream.blocks() yields them.
+        Transfers of other assets are ignored.
+        """
+        if self.round is not None and round_num <= self.round:
+            raise HolderIndexError(
+                "round {} is not after round {}".format(round_num, self.round)
+            )
+        # The arrays hold the state at the round before this block.
+        if (
+            not self._checkpoint_rounds
+            or round_num - 1 - self._checkpoint_rounds[-1] >= self.checkpoint_rounds
+        ):
+            self._checkpoint(round_num - 1)
+        self.round = round_num
+        for transfer in transfers:
+            if transfer[0] == self.asset_id:
+                self._transfer(*transfer[1:])
+
+    def snapshot(self, round_num):
+        """
+        :return: Snapshot of the holdings at the end of round_num.
+        """
+        first = self._checkpoint_rounds[0] if self._checkpoint_rounds else None
+        if first is None or not first <= round_num <= self.round:
+            raise HolderIndexError(
+                "round {} is not between rounds {} and {}".format(
+                    round_num, first, self.round
+                )
+            )
+        i = bisect.bisect_right(self._checkpoint_rounds, round_num) - 1
+        log_start, checkpoint_balances, checkpoint_opted = self._checkpoints[i]
+        balances = np.zeros(len(self.balances), dtype=np.uint64)
+        opted = np.zeros(len(self.opted), dtype=np.uint8)
+        # Checkpoints never grow, numpy may keep their buffers.
+        balances[: len(checkpoint_balances)] = np.frombuffer(
+            checkpoint_balances, dtype=np.uint64
+        )
+        opted[: len(checkpoint_opted)] = np.frombuffer(checkpoint_opted, dtype=np.uint8)
+
+        rounds = np.frombuffer(self._log_rounds, dtype=np.uint64)[log_start:]
+        log_end = log_start + int(
+            np.searchsorted(rounds, np.uint64(round_num), side="right")
+        )
+        del rounds
+        if log_end > log_start:
+            slots = np.frombuffer(self._log_slots, dtype=np.uint64)[log_start:log_end]
+            # The last change of every slot is its state at round_num.
+            changed, last = np.unique(slots[::-1], return_index=True)
+            last = log_end - 1 - last
+            del slots
+            log_balances = np.frombuffer(self._log_balances, dtype=np.uint64)
+            log_opted = np.frombuffer(self._log_opted, dtype=np.uint8)
+            balances[changed] = log_balances[last]
+            opted[changed] = log_opted[last]
+            del log_balances, log_opted
+        return Snapshot(
+            self.asset_id, round_num, self.slots, self.addresses, balances, opted
+        )
+
+
+def ingest(paths, indexes):
+    """
+    Applies the blocks of msgpack block files to indexes, skipping the rounds an
+    index already applied.
+    :param indexes: dict of asset ID to HolderIndex.
+    :return: the number of blocks read.
+    """
+    count = 0
+    for round_num, _, transfers in block_stream.blocks(paths, indexes):
+        count += 1
+        for index in indexes.values():
+            if index.round is None or round_num > index.round:
+                index.apply_block(round_num, transfers)
+    return count
+
+
+def load_balances(path):
+    """
+    Reads an indexer /v2/assets/{asset-id}/balances response.
+    :return: tuple of (round, list of (address, amount)).
+    """
+    with open(path) as f:
+        response = json.load(f)
+    return (
+        response["current-round"],
+        [
+            (holding["address"], holding["amount"])
+            for holding in response["balances"]
+            if not holding.get("deleted")
+        ],
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Index the holders of an asset.")
+    parser.add_argument("blocks", nargs="+", help="msgpack block files, in order")
+    parser.add_argument("--asset", type=int, default=block_stream.NEKO_ASSET_ID)
+    parser.add_argument(
+        "--balances",
+        help="indexer balances of every holder to start from, instead of the "
+        "asset's creation",
+    )
+    parser.add_argument(
+        "--round", type=int, help="round to report, by default the last one"
+    )
+    parser.add_argument("--eligible", nargs="*", default=[], metavar="ADDRESS")
+    parser.add_argument("--locked-app", type=int, nargs="*", default=[])
+    parser.add_argument("--top", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    if args.balances:
+        round_num, balances = load_balances(args.balances)
+        index = HolderIndex.from_balances(args.asset, round_num, balances)
+    else:
+        index = HolderIndex(args.asset)
+    blocks = ingest(args.blocks, {args.asset: index})
+    if index.round is None:
+        print("no blocks")
+        return 1
+    holdings = (
+        index
+        if args.round is None or args.round == index.round
+        else index.snapshot(args.round)
+    )
+    print(
+        "asset {} at round {} ({} blocks read): {} holders, {} opted in, "
+        "{} circulating".format(
+            args.asset,
+            holdings.round,
+            blocks,
+            holdings.holder_count(),
+            holdings.opted_in_count(),
+            holdings.circulating(),
+        )
+    )
+    for address in args.eligible:
+        print(
+            "{} holds {}: {}".format(
+                address,
+                holdings.balance(address),
+                "eligible" if holdings.eligible(address) else "not eligible",
+            )
+        )
+    for app_id, amount in holdings.locked(args.locked_app).items():
+        print("application {} locks {}".format(app_id, amount))
+    for address, amount in holdings.top(args.top):
+        print("{} {}".format(address, amount))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
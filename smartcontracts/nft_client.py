@@ -0,0 +1,97 @@
+"""
+Asynchronous client for the NFT sale escrows of nft_3way_txn.teal.tmpl and
+nft_split_sale.py: builds their sell, buy and withdraw groups with nft_groups.py,
+signs them, submits them to algod and waits for their confirmation, for many trades
+at once.
+
+Requests go through algod_client.AlgodClient: a pool of keep-alive connections,
+suggested params fetched once per round and shared by every trade built in that
+round, and one watcher of new blocks shared by every trade waiting for its
+confirmation.
+
+    async with algod_client.AlgodClient(address, token) as algod:
+        client = nft_client.SaleClient(algod)
+        results = await nft_client.run_trades(
+            [functools.partial(client.buy, program, key, asset_id, payouts) ...],
+            concurrency=64,
+        )
+
+run_trades() runs at most `concurrency` trades at a time and pulls the next trade
+from its iterable only when one finishes, so a generator of trades is never read
+ahead of the trades in flight. algod_stub.py serves the algod endpoints locally for
+tests and benchmarks.
+"""
+from algosdk import account
+
+import algod_client
+import nft_groups
+
+# Trades run_trades() runs at the same time.
+DEFAULT_CONCURRENCY = algod_client.DEFAULT_CONCURRENCY
+# Rounds a trade waits for its confirmation before giving up.
+DEFAULT_WAIT_ROUNDS = algod_client.DEFAULT_WAIT_ROUNDS
+
+
+class SaleClient:
+    """
+    Trades against the NFT sale escrows. Accounts are given by their private key,
+    base64 as algosdk keeps it, and programs are the instantiated logic sig
+    bytecode, see teal_template.py. Every trade returns the pending transaction info
+    of its confirmed group.
+    """
+
+    def __init__(self, algod, fee=None, wait_rounds=DEFAULT_WAIT_ROUNDS):
+        self.algod = algod
+        self.fee = fee
+        self.wait_rounds = wait_rounds
+
+    async def submit(self, txns):
+        txid = await self.algod.send_transactions(txns)
+        return await self.algod.wait_for_confirmation(txid, self.wait_rounds)
+
+    @staticmethod
+    def _sign(txns, private_key):
+        return [
+            txn.sign(private_key) if hasattr(txn, "sign") else txn for txn in txns
+        ]
+
+    async def sell(self, program, seller_key, asset_id, fee_pooled=False):
+        params = await self.algod.suggested_params()
+        seller = account.address_from_private_key(seller_key)
+        txns = nft_groups.sell_group(
+            params, program, seller, asset_id, fee_pooled, self.fee
+        )
+        return await self.submit(self._sign(txns, seller_key))
+
+    async def buy(self, program, buyer_key, asset_id, payouts, fee_pooled=False):
+        """
+        :param payouts: list of (address, amount) of every receiver, the seller
+            first.
+        """
+        params = await self.algod.suggested_params()
+        buyer = account.address_from_private_key(buyer_key)
+        txns = nft_groups.buy_group(
+            params, program, buyer, asset_id, payouts, fee_pooled, self.fee
+        )
+        return await self.submit(self._sign(txns, buyer_key))
+
+    async def withdraw(self, program, seller_key, asset_id, fee_pooled=False):
+        params = await self.algod.suggested_params()
+        seller = account.address_from_private_key(seller_key)
+        txns = nft_groups.withdraw_group(
+            params, program, seller, asset_id, fee_pooled, self.fee
+        )
+        if fee_pooled:
+            txns = [nft_groups.sign_withdraw(txns[0], program, seller_key)]
+        return await self.submit(self._sign(txns, seller_key))
+
+
+async def run_trades(trades, concurrency=DEFAULT_CONCURRENCY):
+    """
+    Runs trades with at most `concurrency` of them in flight, see
+    algod_client.run_concurrently().
+    :param trades: iterable of functions without arguments returning the coroutine
+        of a trade, e.g. functools.partial(client.buy, ...).
+    :return: list of the result of every trade in order, or the exception it raised.
+    """
+    return await algod_client.run_concurrently(trades, concurrency)
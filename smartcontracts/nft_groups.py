@@ -0,0 +1,142 @@
+"""
+Transaction group builders for the NFT sale logic sigs of nft_split_sale.py, and
+of nft_3way_txn.teal.tmpl, which has the same routes with 3 receivers.
+
+Every builder takes the instantiated logic sig bytecode (see teal_template.py) and
+returns the group in order, with its group ID assigned: the escrow's transaction
+as a LogicSigTransaction ready to send, the others unsigned for their sender's
+wallet to sign. Fees are flat, `fee` per transaction (the minimum by default).
+
+With fee_pooled=True the groups match fee_pooled_program(): the escrow pays no fee
+and the seller or buyer pays it instead, so sell takes 2 transactions, buy
+receivers + 2 and withdraw 1. A fee pooled withdraw is authorized by the seller's
+signature of its transaction ID, see sign_withdraw(). That signature is checked
+against the seller's address, so it needs the account's own key, not a rekeyed one.
+
+    program = skeleton.instantiate(values)
+    group = nft_groups.buy_group(params, program, buyer, asset_id, payouts, True)
+"""
+import base64
+import copy
+
+from algosdk import constants, logic
+from algosdk.future.transaction import (
+    AssetTransferTxn,
+    LogicSig,
+    LogicSigTransaction,
+    PaymentTxn,
+    assign_group_id,
+)
+
+
+def escrow_address(program):
+    return LogicSig(program).address()
+
+
+def _params(params, fee):
+    """
+    :return: a copy of the suggested params with a flat fee.
+    """
+    params = copy.copy(params)
+    params.flat_fee = True
+    params.fee = fee
+    return params
+
+
+def _min_fee(params, fee):
+    if fee is not None:
+        return fee
+    return params.min_fee or constants.min_txn_fee
+
+
+def _group(program, txns, escrow_index):
+    """
+    Assigns the group ID and wraps the escrow's transaction in the logic sig.
+    """
+    assign_group_id(txns)
+    txns[escrow_index] = LogicSigTransaction(txns[escrow_index], LogicSig(program))
+    return txns
+
+
+def sell_group(params, program, seller, asset_id, fee_pooled=False, fee=None):
+    """
+    :return: the escrow's opt-in to the NFT, the seller's transfer of the NFT to the
+        escrow and, unless fee_pooled, the seller's payment of the escrow's fee.
+    """
+    fee = _min_fee(params, fee)
+    escrow = escrow_address(program)
+    escrow_fee = 0 if fee_pooled else fee
+    seller_fee = 2 * fee if fee_pooled else fee
+    txns = [
+        AssetTransferTxn(escrow, _params(params, escrow_fee), escrow, 0, asset_id),
+        AssetTransferTxn(seller, _params(params, seller_fee), escrow, 1, asset_id),
+    ]
+    if not fee_pooled:
+        txns.append(PaymentTxn(seller, _params(params, fee), escrow, escrow_fee))
+    return _group(program, txns, 0)
+
+
+def buy_group(params, program, buyer, asset_id, payouts, fee_pooled=False, fee=None):
+    """
+    :param payouts: list of (address, amount) of every receiver, in receiver order,
+        the seller first.
+    :return: the buyer's opt-in to the NFT, the escrow's transfer of the NFT to the
+        buyer, the buyer's payment of every receiver and, unless fee_pooled, the
+        buyer's payment of the escrow's fee.
+    """
+    fee = _min_fee(params, fee)
+    escrow = escrow_address(program)
+    escrow_fee = 0 if fee_pooled else fee
+    opt_in_fee = 2 * fee if fee_pooled else fee
+    txns = [
+        AssetTransferTxn(buyer, _params(params, opt_in_fee), buyer, 0, asset_id),
+        AssetTransferTxn(escrow, _params(params, escrow_fee), buyer, 1, asset_id),
+    ]
+    for receiver, amount in payouts:
+        txns.append(PaymentTxn(buyer, _params(params, fee), receiver, amount))
+    if not fee_pooled:
+        txns.append(PaymentTxn(buyer, _params(params, fee), escrow, escrow_fee))
+    return _group(program, txns, 1)
+
+
+def withdraw_group(params, program, seller, asset_id, fee_pooled=False, fee=None):
+    """
+    :return: the escrow's transfer of the NFT back to the seller and the seller's
+        payment of its fee. With fee_pooled, only the escrow's transfer, which also
+        closes it out of the NFT and pays its own fee. It is returned unsigned:
+        authorize it with sign_withdraw().
+    """
+    fee = _min_fee(params, fee)
+    escrow = escrow_address(program)
+    if fee_pooled:
+        params = _params(params, fee)
+        return [
+            AssetTransferTxn(
+                escrow, params, seller, 1, asset_id, close_assets_to=seller
+            )
+        ]
+    txns = [
+        AssetTransferTxn(escrow, _params(params, fee), seller, 1, asset_id),
+        PaymentTxn(seller, _params(params, fee), escrow, fee),
+    ]
+    return _group(program, txns, 0)
+
+
+def transaction_id(txn):
+    """
+    :return: the raw 32 byte ID of a transaction, as TEAL's txn TxID loads it.
+    """
+    txid = txn.get_txid()
+    return base64.b32decode(txid + "=" * (-len(txid) % 8))
+
+
+def sign_withdraw(txn, program, private_key):
+    """
+    Authorizes a fee pooled withdraw with the seller's signature of its
+    transaction ID, passed to the logic sig as arg 0.
+    :param private_key: the seller's private key, base64 as algosdk keeps it.
+    :return: the LogicSigTransaction ready to send.
+    """
+    escrow = escrow_address(program)
+    signature = logic.teal_sign(private_key, transaction_id(txn), escrow)
+    return LogicSigTransaction(txn, LogicSig(program, [signature]))
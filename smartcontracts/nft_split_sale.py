@@ -0,0 +1,383 @@
+import argparse
+import os
+import sys
+from functools import lru_cache
+
+from pyteal import *
+
+# Nekoin NFT Transaction K-way Payment LogicSig
+
+# Generates the logic sig of nft_3way_txn.teal.tmpl for any number of payout
+# receivers. The escrow holds an NFT placed by its seller, and anyone can claim it by
+# paying every receiver their amount. Receiver 1 is the seller, TMPL_SELLER_ADDR paid
+# TMPL_PAYMENT_SELLER_AMOUNT, and receiver k > 1 is TMPL_PAY_RECV<k>_ADDR paid
+# TMPL_PAYMENT_RECV<k>_AMOUNT, e.g. a charity and the marketplace platform fee. With 3
+# receivers, the template variables are the same as nft_3way_txn.teal.tmpl's.
+
+# The logic sig has the same functionalities as the template:
+#   1. sell (group of 3): opt's the escrow account into holding the NFT and transfers
+#      the NFT from the seller to the escrow. Can only be executed by the seller.
+#   2. withdraw (group of 2): transfers the NFT from the escrow account back to the
+#      seller. Can only be executed by the seller.
+#   3. buy (group of receivers + 3): opt's the buyer into holding the NFT, transfers the
+#      NFT from the escrow to the buyer, and pays ALGO from the buyer to every receiver
+#      and to the escrow to cover its fee. Can be executed by anyone.
+
+# fee_pooled_program() is a variant without the transactions that pay the escrow back
+# for its fee: the seller or buyer overpays their own fee to cover the escrow's, which
+# pays none. Sell takes 2 transactions, buy receivers + 2, and withdraw 1, the seller
+# authorizing it with a signature of its transaction ID. nft_groups.py builds the
+# groups of both variants.
+
+# Most receivers a buy can pay. A logic sig and its args are limited to 1000 bytes,
+# and each receiver adds its 32 byte address and its amount: with 10, the logic sig
+# takes about 965 bytes, or 908 bytes plus the 64 byte withdraw signature when fee
+# pooled.
+MAX_RECEIVERS = 10
+# Highest fee the escrow account pays for its transaction. The buyer or seller pays it
+# back in the same group.
+MAX_FEE = 2000
+# The hand-written template this logic sig generalizes, and its number of receivers.
+TEMPLATE = "nft_3way_txn.teal.tmpl"
+DEFAULT_RECEIVERS = 3
+
+
+def receiver_templates(receivers):
+    """
+    :return: tuple of the list of receiver address template variables and the list
+        of their payment amount template variables, in payment order.
+    """
+    wallets = [Tmpl.Addr("TMPL_SELLER_ADDR")]
+    amounts = [Tmpl.Int("TMPL_PAYMENT_SELLER_AMOUNT")]
+    for k in range(2, receivers + 1):
+        wallets.append(Tmpl.Addr("TMPL_PAY_RECV{}_ADDR".format(k)))
+        amounts.append(Tmpl.Int("TMPL_PAYMENT_RECV{}_AMOUNT".format(k)))
+    return wallets, amounts
+
+
+def template_checks(asset_id, wallets):
+    """
+    :return: the checks that the template variables are set correctly: AssetID and
+        all the receiver addresses must be non-zero.
+    """
+    return [asset_id > Int(0)] + [wallet != Global.zero_address() for wallet in wallets]
+
+
+def payment_checks(first, buyer, wallets, amounts):
+    """
+    :return: the checks that Gtxn[first] onwards pay every receiver the expected
+        amount of ALGO from the buyer.
+    """
+    checks = []
+    for i, (wallet, amount) in enumerate(zip(wallets, amounts)):
+        checks += [
+            Gtxn[first + i].type_enum() == TxnType.Payment,
+            Gtxn[first + i].sender() == buyer,
+            Gtxn[first + i].receiver() == wallet,
+            Gtxn[first + i].amount() == amount,
+        ]
+    return checks
+
+
+def _check_receivers(receivers):
+    if not 1 <= receivers <= MAX_RECEIVERS:
+        raise ValueError("receivers must be between 1 and {}".format(MAX_RECEIVERS))
+
+
+@lru_cache(maxsize=None)
+def logicsig_program(receivers=DEFAULT_RECEIVERS):
+    _check_receivers(receivers)
+    asset_id = Tmpl.Int("TMPL_ASSET_ID")
+    wallets, amounts = receiver_templates(receivers)
+    seller = wallets[0]
+
+    # Validate that the template variables are set correctly, and the transaction this
+    # logic sig approves. The escrow account only ever sends its own transaction, the
+    # others are signed by their senders, so these checks are done once, on Txn:
+    # assetCloseTo, closeRemainderTo, and rekeyTo must not be set and the fee must be
+    # reasonable.
+    shared_checks = Assert(
+        And(
+            *template_checks(asset_id, wallets),
+            Txn.asset_close_to() == Global.zero_address(),
+            Txn.close_remainder_to() == Global.zero_address(),
+            Txn.rekey_to() == Global.zero_address(),
+            Txn.fee() <= Int(MAX_FEE),
+        )
+    )
+
+    # Withdraw transfers the NFT held by the escrow account back to the seller. The
+    # seller must cover the gas fees for the contract account.
+    withdraw = And(
+        # Gtxn[0]: asset transfer of the NFT from the escrow account to the seller.
+        Txn.group_index() == Int(0),
+        Txn.type_enum() == TxnType.AssetTransfer,
+        Txn.xfer_asset() == asset_id,
+        Txn.asset_receiver() == seller,
+        # Gtxn[1]: ALGO payment from the seller to the escrow account, with amount
+        # matching the fee required for gtxn 0.
+        Gtxn[1].type_enum() == TxnType.Payment,
+        Gtxn[1].receiver() == Txn.sender(),
+        Gtxn[1].amount() == Txn.fee(),
+        Gtxn[1].sender() == seller,
+    )
+
+    # Sell opt's the escrow account into holding the NFT and send the NFT from seller
+    # to escrow account.
+    sell = And(
+        # Gtxn[0]: asset transfer of zero from and to the escrow address to opt-in to
+        # the ASA.
+        Txn.group_index() == Int(0),
+        Txn.type_enum() == TxnType.AssetTransfer,
+        Txn.xfer_asset() == asset_id,
+        Txn.asset_amount() == Int(0),
+        Txn.sender() == Txn.asset_receiver(),
+        # Gtxn[1]: asset transfer of the ASA from the seller to the contract address.
+        Gtxn[1].type_enum() == TxnType.AssetTransfer,
+        Gtxn[1].xfer_asset() == asset_id,
+        Gtxn[1].sender() == seller,
+        Gtxn[1].asset_receiver() == Txn.sender(),
+        # Gtxn[2]: payment transfer from the seller to the contract address to cover
+        # the fees of gtxn 0.
+        Gtxn[2].type_enum() == TxnType.Payment,
+        Gtxn[2].amount() == Txn.fee(),
+        Gtxn[2].sender() == seller,
+        Gtxn[2].receiver() == Txn.sender(),
+    )
+
+    # Buy opt's the buyer into holding the NFT, transfers the NFT from the escrow
+    # account to the buyer, pays ALGO from the buyer to every receiver, and pays ALGO
+    # from the buyer to the escrow account to cover the fee of the NFT transfer.
+    buyer = Txn.asset_receiver()
+    fee_payment = Gtxn[receivers + 2]
+    buy = And(
+        # Gtxn[0]: Buyer opting into NFT. Asset transfer transaction from buyer to self
+        # with 0 amount.
+        Gtxn[0].type_enum() == TxnType.AssetTransfer,
+        Gtxn[0].xfer_asset() == asset_id,
+        Gtxn[0].asset_amount() == Int(0),
+        Gtxn[0].sender() == buyer,
+        Gtxn[0].asset_receiver() == buyer,
+        # Gtxn[1]: asset transfer of NFT from contract account to buyer.
+        Txn.group_index() == Int(1),
+        Txn.type_enum() == TxnType.AssetTransfer,
+        Txn.xfer_asset() == asset_id,
+        Txn.asset_amount() == Int(1),
+        # Gtxn[2] to Gtxn[receivers + 1]: payment from buyer to each receiver with the
+        # expected amount of ALGO.
+        *payment_checks(2, buyer, wallets, amounts),
+        # Last transaction: payment transfer from the buyer to the contract address to
+        # cover the fees of gtxn 1.
+        fee_payment.type_enum() == TxnType.Payment,
+        fee_payment.sender() == buyer,
+        fee_payment.receiver() == Txn.sender(),
+        fee_payment.amount() == Txn.fee(),
+    )
+
+    # This logic sig expects a group transaction of either 2 (withdraw), 3 (sell), or
+    # receivers + 3 (buy) transactions. Any other size is rejected.
+    return Seq(
+        shared_checks,
+        Cond(
+            [Global.group_size() == Int(2), withdraw],
+            [Global.group_size() == Int(3), sell],
+            [Global.group_size() == Int(receivers + 3), buy],
+        ),
+    )
+
+
+@lru_cache(maxsize=None)
+def fee_pooled_program(receivers=DEFAULT_RECEIVERS):
+    _check_receivers(receivers)
+    asset_id = Tmpl.Int("TMPL_ASSET_ID")
+    wallets, amounts = receiver_templates(receivers)
+    seller = wallets[0]
+
+    # Validate that the template variables are set correctly, and that the
+    # transaction this logic sig approves does not close the escrow account or rekey
+    # it.
+    shared_checks = Assert(
+        And(
+            *template_checks(asset_id, wallets),
+            Txn.close_remainder_to() == Global.zero_address(),
+            Txn.rekey_to() == Global.zero_address(),
+        )
+    )
+
+    # Withdraw closes the escrow account out of the NFT back to the seller, in a
+    # transaction of its own. The seller authorizes it by signing its transaction ID,
+    # passed as arg 0. The escrow pays the fee from the minimum balance the close out
+    # frees.
+    withdraw = And(
+        Txn.type_enum() == TxnType.AssetTransfer,
+        Txn.xfer_asset() == asset_id,
+        Txn.asset_receiver() == seller,
+        Txn.asset_close_to() == seller,
+        Txn.fee() <= Int(MAX_FEE),
+        Ed25519Verify(Txn.tx_id(), Arg(0), seller),
+    )
+
+    # Sell opt's the escrow account into holding the NFT and send the NFT from seller
+    # to escrow account. The seller's transfer pays the fees of both.
+    sell = And(
+        # Gtxn[0]: asset transfer of zero from and to the escrow address to opt-in to
+        # the ASA, with no fee.
+        Txn.group_index() == Int(0),
+        Txn.type_enum() == TxnType.AssetTransfer,
+        Txn.xfer_asset() == asset_id,
+        Txn.asset_amount() == Int(0),
+        Txn.asset_close_to() == Global.zero_address(),
+        Txn.fee() == Int(0),
+        Txn.sender() == Txn.asset_receiver(),
+        # Gtxn[1]: asset transfer of the ASA from the seller to the contract address.
+        Gtxn[1].type_enum() == TxnType.AssetTransfer,
+        Gtxn[1].xfer_asset() == asset_id,
+        Gtxn[1].sender() == seller,
+        Gtxn[1].asset_receiver() == Txn.sender(),
+    )
+
+    # Buy opt's the buyer into holding the NFT, transfers the NFT from the escrow
+    # account to the buyer and pays ALGO from the buyer to every receiver. The buyer's
+    # transactions pay the fee of the NFT transfer.
+    buyer = Txn.asset_receiver()
+    buy = And(
+        # Gtxn[0]: Buyer opting into NFT. Asset transfer transaction from buyer to self
+        # with 0 amount.
+        Gtxn[0].type_enum() == TxnType.AssetTransfer,
+        Gtxn[0].xfer_asset() == asset_id,
+        Gtxn[0].asset_amount() == Int(0),
+        Gtxn[0].sender() == buyer,
+        Gtxn[0].asset_receiver() == buyer,
+        # Gtxn[1]: asset transfer of NFT from contract account to buyer, with no fee.
+        Txn.group_index() == Int(1),
+        Txn.type_enum() == TxnType.AssetTransfer,
+        Txn.xfer_asset() == asset_id,
+        Txn.asset_amount() == Int(1),
+        Txn.asset_close_to() == Global.zero_address(),
+        Txn.fee() == Int(0),
+        # Gtxn[2] onwards: payment from buyer to each receiver with the expected
+        # amount of ALGO.
+        *payment_checks(2, buyer, wallets, amounts),
+    )
+
+    # This logic sig expects a group transaction of either 1 (withdraw), 2 (sell), or
+    # receivers + 2 (buy) transactions. Any other size is rejected.
+    return Seq(
+        shared_checks,
+        Cond(
+            [Global.group_size() == Int(1), withdraw],
+            [Global.group_size() == Int(2), sell],
+            [Global.group_size() == Int(receivers + 2), buy],
+        ),
+    )
+
+
+def compile_logicsig(receivers=DEFAULT_RECEIVERS, fee_pooled=False):
+    """
+    :return: the TEAL template of the logic sig for the given number of receivers.
+    """
+    program = fee_pooled_program if fee_pooled else logicsig_program
+    return compileTeal(program(receivers), Mode.Signature, version=5)
+
+
+def template_name(receivers, fee_pooled=False):
+    return "nft_split_sale_{}{}.teal.tmpl".format(
+        receivers, "_pooled" if fee_pooled else ""
+    )
+
+
+def routes(receivers=DEFAULT_RECEIVERS, fee_pooled=False):
+    """
+    :return: the group fields that select each route of the logic sig, for
+        teal_cost.py.
+    """
+    if fee_pooled:
+        return {
+            "withdraw": {"GroupSize": 1},
+            "sell": {"GroupSize": 2},
+            "buy": {"GroupSize": receivers + 2},
+        }
+    return {
+        "withdraw": {"GroupSize": 2},
+        "sell": {"GroupSize": 3},
+        "buy": {"GroupSize": receivers + 3},
+    }
+
+
+def compare(receivers=DEFAULT_RECEIVERS, fee_pooled=False):
+    """
+    Compares the size and worst-case cost of every route of the generated logic sig
+    with the hand-written 3-way template, both optimized by teal_opt.py as the build
+    does.
+    """
+    import teal_cost
+    import teal_opt
+
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), TEMPLATE)
+    with open(path) as f:
+        before = teal_opt.optimize(f.read())
+    after = teal_opt.optimize(compile_logicsig(receivers, fee_pooled))
+    size_before = teal_opt.program_size(before)
+    size_after = teal_opt.program_size(after)
+    lines = [
+        "{} -> {}".format(TEMPLATE, template_name(receivers, fee_pooled)),
+        "  size: {} B -> {} B ({:+d} B)".format(
+            size_before, size_after, size_after - size_before
+        ),
+    ]
+    old = teal_cost.Analyzer(before)
+    new = teal_cost.Analyzer(after)
+    for route, fields in routes(receivers, fee_pooled).items():
+        cost_before = old.route(route, routes(DEFAULT_RECEIVERS)[route]).max
+        cost_after = new.route(route, fields).max
+        lines.append(
+            "  {:<16} max cost {} -> {} ({:+d})".format(
+                route, cost_before, cost_after, cost_after - cost_before
+            )
+        )
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate the K-way sale logic sig.")
+    parser.add_argument(
+        "--receivers", type=int, nargs="+", default=[DEFAULT_RECEIVERS]
+    )
+    parser.add_argument(
+        "--out-dir", default=".", help="directory the TEAL templates are written to"
+    )
+    parser.add_argument(
+        "--no-optimize",
+        action="store_true",
+        help="write the programs exactly as compileTeal produced them",
+    )
+    parser.add_argument(
+        "--fee-pooled",
+        action="store_true",
+        help="generate the variant without the fee reimbursement transactions",
+    )
+    parser.add_argument(
+        "--compare",
+        action="store_true",
+        help="print the size and cost against nft_3way_txn.teal.tmpl",
+    )
+    args = parser.parse_args(argv)
+
+    import teal_opt
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    for receivers in args.receivers:
+        source = compile_logicsig(receivers, args.fee_pooled)
+        if not args.no_optimize:
+            source = teal_opt.optimize(source).text()
+        path = os.path.join(args.out_dir, template_name(receivers, args.fee_pooled))
+        with open(path, "w") as f:
+            f.write(source + "\n")
+        print("wrote {}".format(path))
+        if args.compare:
+            print(compare(receivers, args.fee_pooled))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
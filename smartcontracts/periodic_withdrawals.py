@@ -1,107 +1,154 @@
+from functools import lru_cache
+
 from pyteal import *
-import sys
 
+from events import ADDRESS, UINT64, Event, EventSchema
+from state import GlobalState, LocalState
+from state_schema import Field, GlobalSchema, LocalSchema, Schema
+from transfers import Transfers
 
-def approval_program():
-    # Keys for the global data stored by this smart contract.
+
+class Schedule(Schema):
+    """
+    A withdrawal schedule, kept in global state for the receiver and in the local
+    state of each beneficiary.
+    """
+
+    # Period of time represented in seconds when at most one transfer is allowed.
+    # For Nekoin, this is 604800 which is one week
+    time_period = Field(TealType.uint64)
+    # Unix timestamp for when the smart contract begins.
+    contract_start_time = Field(TealType.uint64)
+    # Amount of asset to be withdrawn per withdrawal.
+    withdraw_amount = Field(TealType.uint64)
+    # Total amount sent to the receiver so far by withdrawals and claims.
+    released_amount = Field(TealType.uint64)
+    # Unix timestamp when last withdrawal occured.
+    latest_withdrawal_time = Field(TealType.uint64)
+
+
+class AppVariables(GlobalSchema, Schedule):
+    """
+    The global data stored by this smart contract: the receiver's schedule and the
+    following.
+    """
 
     # AssetID that this smart contract will freeze.
     # For Nekoin, this is 404044168.
-    asset_id_key = Bytes("asset_id")
+    asset_id = Field(TealType.uint64)
     # Address of the wallet that will receive the funds in this smart contract when it is closed.
     # For Nekoin, this is O6UUGUA4LCJSMYUP2ZYHRETX5I2XJSXELGJCRDCBDNQ7KSSCBJRSPZRZCI.
     # We will freeze the donation wallet's 2 billion Nekos.
-    receiver_address_key = Bytes("receiver_address_key")
+    receiver_address = Field(TealType.bytes)
     # Unix timestamp after which this smart contract can be closed.
     # For Nekoin, this is 1669881600 which is December 1, 2022 00:00:00 PST
-    unlock_time_key = Bytes("unlock_time")
-    # Unix timestamp when last withdrawal occured.
-    last_withdrawal_time_key = Bytes("latest_withdrawal_time")
-    # Period of time represented in seconds when at most one transfer is allowed.
-    # For Nekoin, this is 604800 which is one week
-    time_period_key = Bytes("time_period")
-    # Unix timestamp for when the smart contract begins.
-    contract_start_time_key = Bytes("contract_start_time")
-    # Amount of asset to be withdrawn per withdrawal.
-    withdraw_amount_key = Bytes("withdraw_amount")
+    unlock_time = Field(TealType.uint64)
+    # Total of the assets held for beneficiaries: everything their schedules release
+    # by the unlock time, less what they have claimed.
+    committed_amount = Field(TealType.uint64)
 
-    # Sends all of the asset specified by assetID to the specified account.
-    @Subroutine(TealType.none)
-    def closeAssetsTo(assetID: Expr, account: Expr) -> Expr:
-        asset_holding = AssetHolding.balance(
-            Global.current_application_address(), assetID
-        )
-        return Seq(
-            asset_holding,
-            If(asset_holding.hasValue()).Then(
-                Seq(
-                    InnerTxnBuilder.Begin(),
-                    InnerTxnBuilder.SetFields(
-                        {
-                            TxnField.type_enum: TxnType.AssetTransfer,
-                            TxnField.xfer_asset: assetID,
-                            TxnField.asset_close_to: account,
-                        }
-                    ),
-                    InnerTxnBuilder.Submit(),
-                )
-            ),
-        )
 
-    # Sends all of the Algo's to the specified account.
-    @Subroutine(TealType.none)
-    def closeAccountTo(account: Expr) -> Expr:
-        return If(Balance(Global.current_application_address()) != Int(0)).Then(
-            Seq(
-                InnerTxnBuilder.Begin(),
-                InnerTxnBuilder.SetFields(
-                    {
-                        TxnField.type_enum: TxnType.Payment,
-                        TxnField.close_remainder_to: account,
-                    }
-                ),
-                InnerTxnBuilder.Submit(),
-            )
-        )
+class LocalVariables(LocalSchema, Schedule):
+    """
+    The local data of a beneficiary: their schedule.
+    """
+
+
+class Events(EventSchema):
+    """
+    The events the application logs.
+    """
+
+    # A withdrawal sent the receiver amount, bringing their released amount to
+    # released_amount.
+    withdrew = Event(amount=UINT64, released_amount=UINT64)
+    # A claim sent account amount, bringing the released amount of their schedule to
+    # released_amount.
+    claimed = Event(account=ADDRESS, amount=UINT64, released_amount=UINT64)
+    # The receiver registered beneficiary on a withdrawal schedule.
+    registered = Event(
+        beneficiary=ADDRESS,
+        time_period=UINT64,
+        contract_start_time=UINT64,
+        withdraw_amount=UINT64,
+    )
+    # The application deleted, closing amount of the asset to the receiver.
+    deleted = Event(amount=UINT64)
+
+
+# Amount a withdrawal schedule has released by time now: the withdraw amount for every
+# period that has begun since the contract start time.
+def released_by(now, contract_start_time, time_period, withdraw_amount):
+    return If(
+        now < contract_start_time,
+        Int(0),
+        ((now - contract_start_time) / time_period + Int(1)) * withdraw_amount,
+    )
+
+
+# Amount a beneficiary's schedule releases in all, the amount registering them
+# commits: their schedule stops releasing at the unlock time.
+def beneficiary_total(schedule):
+    return released_by(
+        App.globalGet(AppVariables.unlock_time),
+        schedule.get(Schedule.contract_start_time),
+        schedule.get(Schedule.time_period),
+        schedule.get(Schedule.withdraw_amount),
+    )
+
+
+@lru_cache(maxsize=None)
+def approval_program():
+    # Inner transactions sending and closing out of assets and Algos.
+    transfers = Transfers()
 
-    # Sends specified withdrawal amount of an asset specified by assetID to the specified account.
-    @Subroutine(TealType.none)
-    def sendAssetsTo(assetID: Expr, account: Expr) -> Expr:
+    # Sends up to amount of an asset specified by assetID to the specified account,
+    # clamped to the balance held by this smart contract less reserved.
+    # Returns the amount sent.
+    @Subroutine(TealType.uint64)
+    def claimAssetsTo(
+        assetID: Expr, account: Expr, amount: Expr, reserved: Expr
+    ) -> Expr:
         asset_holding = AssetHolding.balance(
             Global.current_application_address(), assetID
         )
+        available = ScratchVar(TealType.uint64)
+        claimed = ScratchVar(TealType.uint64)
         return Seq(
             asset_holding,
-            If(asset_holding.value() > App.globalGet(withdraw_amount_key)).Then(
-                Seq(
-                    InnerTxnBuilder.Begin(),
-                    InnerTxnBuilder.SetFields(
-                        {
-                            TxnField.type_enum: TxnType.AssetTransfer,
-                            TxnField.xfer_asset: assetID,
-                            TxnField.asset_amount: App.globalGet(withdraw_amount_key),
-                            TxnField.asset_receiver: account,
-                            TxnField.sender: Global.current_application_address(),
-                        }
-                    ),
-                    InnerTxnBuilder.Submit(),
-                    App.globalPut(last_withdrawal_time_key, Global.latest_timestamp()),
-                )
-            ),
+            available.store(asset_holding.value() - reserved),
+            claimed.store(If(amount < available.load(), amount, available.load())),
+            # Reject claims that would send nothing.
+            Assert(claimed.load() > Int(0)),
+            transfers.send_asset(assetID, account, claimed.load()),
+            claimed.load(),
+        )
+
+    # Amount released by a withdrawal schedule so far. The schedule is read from
+    # schedule, the global state for the receiver's schedule and a beneficiary's local
+    # state for theirs. A beneficiary's schedule releases nothing after the unlock time.
+    def vested_amount(schedule, now):
+        return released_by(
+            now,
+            schedule.get(Schedule.contract_start_time),
+            schedule.get(Schedule.time_period),
+            schedule.get(Schedule.withdraw_amount),
         )
 
     # Check how long it has been since the current period has started.
     @Subroutine(TealType.uint64)
     def timeInCurrentPeriod():
         current_time_from_start_of_contract = Global.latest_timestamp() - App.globalGet(
-            contract_start_time_key
+            Schedule.contract_start_time
         )
-        return current_time_from_start_of_contract % App.globalGet(time_period_key)
+        return current_time_from_start_of_contract % App.globalGet(Schedule.time_period)
 
     # Check how long it has been since the last withdrawal.
     @Subroutine(TealType.uint64)
     def timeSinceLastwithdrawal():
-        return Global.latest_timestamp() - App.globalGet(last_withdrawal_time_key)
+        return Global.latest_timestamp() - App.globalGet(
+            Schedule.latest_withdrawal_time
+        )
 
     # OnCreate handles creating this periodic withdrawal smart contract.
     # arg[0]: the assetID of the asset we want to freeze. For Nekoin it is 404044168
@@ -129,13 +176,15 @@ def approval_program():
                 Txn.sender() == on_create_receiver,
             )
         ),
-        App.globalPut(asset_id_key, Btoi(Txn.application_args[0])),
-        App.globalPut(receiver_address_key, on_create_receiver),
-        App.globalPut(unlock_time_key, on_create_unlock_time),
-        App.globalPut(time_period_key, on_create_time_period),
-        App.globalPut(contract_start_time_key, on_create_contract_start_time),
-        App.globalPut(withdraw_amount_key, on_create_withdraw_amount),
-        App.globalPut(last_withdrawal_time_key, Int(0)),
+        App.globalPut(AppVariables.asset_id, Btoi(Txn.application_args[0])),
+        App.globalPut(AppVariables.receiver_address, on_create_receiver),
+        App.globalPut(AppVariables.unlock_time, on_create_unlock_time),
+        App.globalPut(Schedule.time_period, on_create_time_period),
+        App.globalPut(Schedule.contract_start_time, on_create_contract_start_time),
+        App.globalPut(Schedule.withdraw_amount, on_create_withdraw_amount),
+        App.globalPut(Schedule.latest_withdrawal_time, Int(0)),
+        App.globalPut(Schedule.released_amount, Int(0)),
+        App.globalPut(AppVariables.committed_amount, Int(0)),
         Approve(),
     )
 
@@ -146,76 +195,233 @@ def approval_program():
         Assert(
             And(
                 # The wallet triggering the setup must be the original creator and receiver.
-                Txn.sender() == App.globalGet(receiver_address_key),
+                Txn.sender() == App.globalGet(AppVariables.receiver_address),
                 # This smart contract must be set up before the unlock timestamp.
-                Global.latest_timestamp() < App.globalGet(unlock_time_key),
+                Global.latest_timestamp() < App.globalGet(AppVariables.unlock_time),
             )
         ),
-        InnerTxnBuilder.Begin(),
-        InnerTxnBuilder.SetFields(
-            {
-                # Send 0 units of the asset to itself to opt-in.
-                TxnField.type_enum: TxnType.AssetTransfer,
-                TxnField.xfer_asset: App.globalGet(asset_id_key),
-                TxnField.asset_receiver: Global.current_application_address(),
-            }
-        ),
-        InnerTxnBuilder.Submit(),
+        transfers.opt_in(App.globalGet(AppVariables.asset_id)),
         Approve(),
     )
 
     # OnWithdraw handles withdrawing the money, which will trigger sending a specified amount of the funds to a user if a withdrawal has not been made in the same period of time.
+    on_withdraw_holding = AssetHolding.balance(
+        Global.current_application_address(), App.globalGet(AppVariables.asset_id)
+    )
     on_withdraw = Seq(
         Assert(
             And(
                 # The wallet triggering the withdrawal must be the original creator and receiver.
-                Txn.sender() == App.globalGet(receiver_address_key),
+                Txn.sender() == App.globalGet(AppVariables.receiver_address),
                 # Check current time is after contract start time.
-                Global.latest_timestamp() >= App.globalGet(contract_start_time_key),
+                Global.latest_timestamp()
+                >= App.globalGet(Schedule.contract_start_time),
                 # Check if last withdrawal happened before the current period begins.
                 timeSinceLastwithdrawal() > timeInCurrentPeriod(),
             )
         ),
         # Only run if the last withdrawal did not happen in the same time period.
-        # Send specified amount of assets to reciever.
-        sendAssetsTo(App.globalGet(asset_id_key), App.globalGet(receiver_address_key)),
+        # Send specified amount of assets to reciever, if more than that is held on
+        # top of what is committed to beneficiaries.
+        on_withdraw_holding,
+        If(
+            on_withdraw_holding.value()
+            > App.globalGet(AppVariables.committed_amount)
+            + App.globalGet(Schedule.withdraw_amount)
+        ).Then(
+            Seq(
+                transfers.send_asset(
+                    App.globalGet(AppVariables.asset_id),
+                    App.globalGet(AppVariables.receiver_address),
+                    App.globalGet(Schedule.withdraw_amount),
+                ),
+                App.globalPut(
+                    Schedule.latest_withdrawal_time, Global.latest_timestamp()
+                ),
+                App.globalPut(
+                    Schedule.released_amount,
+                    App.globalGet(Schedule.released_amount)
+                    + App.globalGet(Schedule.withdraw_amount),
+                ),
+                Events.withdrew.log(
+                    amount=App.globalGet(Schedule.withdraw_amount),
+                    released_amount=App.globalGet(Schedule.released_amount),
+                ),
+            )
+        ),
         Approve(),
     )
 
-    # Handle NoOp call.
-    on_no_op = Cond(
-        [Txn.application_args[0] == Bytes("setup"), on_setup],
-        [Txn.application_args[0] == Bytes("withdraw"), on_withdraw],
+    # OnClaim handles claiming, in one call, everything a withdrawal schedule has
+    # released and not yet sent: the withdraw amount for every period since the
+    # contract start time, including periods without a withdrawal. The receiver claims
+    # from the schedule in global state and a registered beneficiary from their own.
+    # The receiver can only claim what is held on top of the committed amount, and a
+    # beneficiary's claim takes theirs out of it.
+    # arg[1]: optional, the most to claim. Without it everything claimable is sent.
+    on_claim_requested_amount = Btoi(Txn.application_args[1])
+
+    # checks run before anything is claimed, and may read the schedule.
+    def claim(schedule, is_beneficiary, *checks):
+        claimable = ScratchVar(TealType.uint64)
+        claimed = ScratchVar(TealType.uint64)
+        released = ScratchVar(TealType.uint64)
+        committed = App.globalGet(AppVariables.committed_amount)
+        if is_beneficiary:
+            now = If(
+                Global.latest_timestamp() < App.globalGet(AppVariables.unlock_time),
+                Global.latest_timestamp(),
+                App.globalGet(AppVariables.unlock_time),
+            )
+        else:
+            now = Global.latest_timestamp()
+        return Seq(
+            *checks,
+            claimable.store(
+                vested_amount(schedule, now) - schedule.get(Schedule.released_amount)
+            ),
+            If(Txn.application_args.length() > Int(1)).Then(
+                If(on_claim_requested_amount < claimable.load()).Then(
+                    claimable.store(on_claim_requested_amount)
+                )
+            ),
+            claimed.store(
+                claimAssetsTo(
+                    App.globalGet(AppVariables.asset_id),
+                    Txn.sender(),
+                    claimable.load(),
+                    Int(0) if is_beneficiary else committed,
+                )
+            ),
+            *(
+                [
+                    App.globalPut(
+                        AppVariables.committed_amount, committed - claimed.load()
+                    )
+                ]
+                if is_beneficiary
+                else []
+            ),
+            schedule.put(Schedule.latest_withdrawal_time, Global.latest_timestamp()),
+            released.store(schedule.get(Schedule.released_amount) + claimed.load()),
+            schedule.put(Schedule.released_amount, released.load()),
+            Events.claimed.log(
+                account=Txn.sender(),
+                amount=claimed.load(),
+                released_amount=released.load(),
+            ),
+        )
+
+    beneficiary = LocalState()
+    on_claim = Seq(
+        If(Txn.sender() == App.globalGet(AppVariables.receiver_address))
+        .Then(claim(GlobalState(), False))
+        .Else(
+            claim(
+                beneficiary,
+                True,
+                # Only registered beneficiaries have a schedule.
+                Assert(beneficiary.get(Schedule.time_period) > Int(0)),
+            )
+        ),
+        Approve(),
     )
 
-    # OnOptIn handles when a wallet requests to opt into this smart contract. Only the
-    # wallet receiving (and sending) the funds can opt into this smart contract.
-    on_opt_in = Seq(
+    # OnRegister handles the receiver adding a beneficiary, paid from the assets held by
+    # this smart contract on their own withdrawal schedule kept in their local state.
+    # The beneficiary is accounts[1]. They must have opted in, cannot be the receiver
+    # and can only be registered once. Everything their schedule releases by the unlock
+    # time is committed to them, and must be held on top of the committed amount.
+    # arg[1]: period of time represented in seconds when one withdrawal is released.
+    # arg[2]: the Unix timestamp of when the first period begins.
+    # arg[3]: the amount of the assetID released per period.
+    new_beneficiary = LocalState(Int(1))
+    on_register_time_period = Btoi(Txn.application_args[1])
+    on_register_contract_start_time = Btoi(Txn.application_args[2])
+    on_register_withdraw_amount = Btoi(Txn.application_args[3])
+    on_register_holding = AssetHolding.balance(
+        Global.current_application_address(), App.globalGet(AppVariables.asset_id)
+    )
+    on_register_committed = ScratchVar(TealType.uint64)
+    on_register = Seq(
         Assert(
-            # Only the original creator and receiver can opt into this smart contract.
-            Txn.sender()
-            == App.globalGet(receiver_address_key)
+            And(
+                # Only the original creator and receiver can register beneficiaries.
+                Txn.sender() == App.globalGet(AppVariables.receiver_address),
+                Txn.accounts[1] != App.globalGet(AppVariables.receiver_address),
+                on_register_time_period > Int(0),
+                on_register_withdraw_amount > Int(0),
+                new_beneficiary.get(Schedule.time_period) == Int(0),
+            )
+        ),
+        new_beneficiary.put(Schedule.time_period, on_register_time_period),
+        new_beneficiary.put(
+            Schedule.contract_start_time, on_register_contract_start_time
+        ),
+        new_beneficiary.put(Schedule.withdraw_amount, on_register_withdraw_amount),
+        new_beneficiary.put(Schedule.released_amount, Int(0)),
+        new_beneficiary.put(Schedule.latest_withdrawal_time, Int(0)),
+        on_register_holding,
+        on_register_committed.store(
+            App.globalGet(AppVariables.committed_amount)
+            + released_by(
+                App.globalGet(AppVariables.unlock_time),
+                on_register_contract_start_time,
+                on_register_time_period,
+                on_register_withdraw_amount,
+            )
+        ),
+        Assert(on_register_holding.value() >= on_register_committed.load()),
+        App.globalPut(AppVariables.committed_amount, on_register_committed.load()),
+        Events.registered.log(
+            beneficiary=Txn.accounts[1],
+            time_period=on_register_time_period,
+            contract_start_time=on_register_contract_start_time,
+            withdraw_amount=on_register_withdraw_amount,
         ),
         Approve(),
     )
 
+    # Handle NoOp call.
+    on_no_op = Cond(
+        [Txn.application_args[0] == Bytes("setup"), on_setup],
+        [Txn.application_args[0] == Bytes("withdraw"), on_withdraw],
+        [Txn.application_args[0] == Bytes("claim"), on_claim],
+        [Txn.application_args[0] == Bytes("register"), on_register],
+    )
+
+    # OnOptIn handles when a wallet requests to opt into this smart contract. Any wallet
+    # can opt in, its local state holds a withdrawal schedule once the receiver
+    # registers it as a beneficiary.
+    on_opt_in = Approve()
+
     # OnDelete handles deleting the smart contract, which will trigger sending all the funds
     # held in this wallet to the receiver. This transaction will only be approved if the
-    # latest_timestamp is after the unlock timestamp (the lock up has expired).
+    # latest_timestamp is after the unlock timestamp (the lock up has expired) and every
+    # beneficiary has claimed what was committed to them.
+    on_delete_holding = AssetHolding.balance(
+        Global.current_application_address(), App.globalGet(AppVariables.asset_id)
+    )
     on_delete = Seq(
         Assert(
             And(
                 # The wallet triggering the close must be the original creator and receiver.
-                Txn.sender() == App.globalGet(receiver_address_key),
+                Txn.sender() == App.globalGet(AppVariables.receiver_address),
                 # The current timestamp must be greater than the unlock timestamp. Otherwise
                 # this transaction will be rejected.
-                App.globalGet(unlock_time_key) <= Global.latest_timestamp(),
+                App.globalGet(AppVariables.unlock_time) <= Global.latest_timestamp(),
+                App.globalGet(AppVariables.committed_amount) == Int(0),
             )
         ),
         # These operations are only run if unlock timestamp has passed.
         # Close all the assets and Algo's held by this account to the receiver.
-        closeAssetsTo(App.globalGet(asset_id_key), App.globalGet(receiver_address_key)),
-        closeAccountTo(App.globalGet(receiver_address_key)),
+        on_delete_holding,
+        Events.deleted.log(amount=on_delete_holding.value()),
+        transfers.close_held_asset(
+            App.globalGet(AppVariables.asset_id),
+            App.globalGet(AppVariables.receiver_address),
+        ),
+        transfers.close_funded_account(App.globalGet(AppVariables.receiver_address)),
         Approve(),
     )
 
@@ -239,18 +445,42 @@ def approval_program():
     return program
 
 
+# A beneficiary clearing their local state gives up what is committed to them and not
+# yet claimed, so it no longer holds up the receiver's withdrawals or the deletion.
+@lru_cache(maxsize=None)
 def clear_program():
-    return Approve()
+    schedule = LocalState()
+    return Seq(
+        If(schedule.get(Schedule.time_period) > Int(0)).Then(
+            App.globalPut(
+                AppVariables.committed_amount,
+                App.globalGet(AppVariables.committed_amount)
+                + schedule.get(Schedule.released_amount)
+                - beneficiary_total(schedule),
+            )
+        ),
+        Approve(),
+    )
+
+
+# Global and local schema (uints, byte slices) the application must be created with.
+GLOBAL_SCHEMA = AppVariables.state_schema()
+LOCAL_SCHEMA = LocalVariables.state_schema()
+
 
+# Transaction fields that select each route of approval_program(), used by teal_cost.py.
+ROUTES = {
+    "create": {"ApplicationID": 0},
+    "setup": {"OnCompletion": "NoOp", "ApplicationArgs": ["setup"]},
+    "withdraw": {"OnCompletion": "NoOp", "ApplicationArgs": ["withdraw"]},
+    "claim": {"OnCompletion": "NoOp", "ApplicationArgs": ["claim"]},
+    "register": {"OnCompletion": "NoOp", "ApplicationArgs": ["register"]},
+    "opt_in": {"OnCompletion": "OptIn"},
+    "delete": {"OnCompletion": "DeleteApplication"},
+}
 
-original_stdout = sys.stdout
 
-with open("periodic_withdrawals_approval.teal", "w") as f:
-    sys.stdout = f
-    print(compileTeal(approval_program(), Mode.Application, version=5))
-    sys.stdout = original_stdout
+if __name__ == "__main__":
+    import build
 
-with open("periodic_withdrawals_clear.teal", "w") as f:
-    sys.stdout = f
-    print(compileTeal(clear_program(), Mode.Application, version=5))
-    sys.stdout = original_stdout
+    build.main(["--out-dir", ".", "periodic_withdrawals"])
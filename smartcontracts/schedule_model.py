@@ -0,0 +1,507 @@
+"""
+Vectorized reference model of the release schedules of periodic_withdrawals and
+freeze_escrow.
+
+Evaluates thousands of candidate schedules against the same receiver calls in one
+batch, every schedule a row of parameter arrays:
+
+    periodic_withdrawals  time_period, contract_start_time, withdraw_amount,
+                          the deposit held once set up, and the delete time
+    freeze_escrow         the amount and unlock timestamp of every tranche, one
+                          column each, the deposit and the delete time
+
+and the calls, a sorted array of their timestamps and, for periodic_withdrawals,
+the action of each, WITHDRAW or CLAIM. The rules are the contract's, to the
+integer:
+
+    withdraw  accepted from contract_start_time on, when the last withdrawal or
+              claim happened before the current period began, that is when
+              now - latest_withdrawal_time > (now - contract_start_time) %
+              time_period. Sends withdraw_amount only while more than that is
+              held, and otherwise approves without sending or recording anything.
+    claim     sends withdraw_amount for every period begun since
+              contract_start_time, less what was already sent, clamped to the
+              balance held, and is rejected when that is nothing.
+    release   sends every tranche unlocked since the last release, in full,
+              stopping at the first one still locked or whose amount is not held.
+              Calls are assumed grouped with a budget call for the opcode budget.
+    delete    at the delete time, unlock_time or later, closes the rest out to the
+              receiver. Calls at or after the delete time never run.
+
+Only the receiver's own schedule is modelled, not beneficiaries', and only
+freeze_escrow tranches of the escrow's asset.
+
+cross_check_withdrawals() and cross_check_tranches() replay a sample of schedules
+through the compiled contracts with avm.py and compare the final state, to catch
+drift between this model and the contracts.
+"""
+import numpy as np
+
+import avm
+import build
+import freeze_escrow
+import periodic_withdrawals
+
+WITHDRAW = 0
+CLAIM = 1
+
+UINT64_MAX = 2 ** 64 - 1
+INT64_MAX = 2 ** 63 - 1
+
+
+class WithdrawalResult:
+    """
+    Outcome of periodic_withdrawals schedules, one entry per schedule.
+    :ivar released: released_amount at delete, sent by withdrawals and claims.
+    :ivar held: the balance the delete closes out to the receiver.
+    :ivar latest_withdrawal_time: latest_withdrawal_time at delete.
+    :ivar vested_unsent: what the schedule has released at the delete time and was
+        never sent, clamped to the deposit.
+    :ivar missed_periods: periods begun by the delete time, of those the deposit
+        covers at withdraw_amount each, in which nothing was sent.
+    """
+
+    def __init__(self, **fields):
+        self.released = fields["released"]
+        self.held = fields["held"]
+        self.latest_withdrawal_time = fields["latest_withdrawal_time"]
+        self.vested_unsent = fields["vested_unsent"]
+        self.missed_periods = fields["missed_periods"]
+        # Calls that sent something, approved without sending, and rejected.
+        self.withdrawals = fields["withdrawals"]
+        self.claims = fields["claims"]
+        self.idle = fields["idle"]
+        self.rejected = fields["rejected"]
+
+    def row(self, i):
+        """
+        :return: dict of the outcome of schedule i.
+        """
+        return {name: int(values[i]) for name, values in vars(self).items()}
+
+
+class TrancheResult:
+    """
+    Outcome of freeze_escrow schedules, one entry per schedule.
+    :ivar released_count: released_count at delete.
+    :ivar released: the amount release sent.
+    :ivar held: the balance the delete closes out to the receiver.
+    :ivar shortfall: what the balance lacked to send the unlocked tranche release
+        stopped at, 0 when it stopped at a locked one or sent them all.
+    :ivar unreleased: tranches unlocked before the delete time and never released,
+        for lack of a release since, or held back by an earlier tranche still
+        locked or not held in full.
+    """
+
+    def __init__(self, **fields):
+        self.released_count = fields["released_count"]
+        self.released = fields["released"]
+        self.held = fields["held"]
+        self.shortfall = fields["shortfall"]
+        self.unreleased = fields["unreleased"]
+
+    def row(self, i):
+        return {name: int(values[i]) for name, values in vars(self).items()}
+
+
+def _rows(*values):
+    """
+    :return: the number of schedules of parameters with one entry per schedule, or
+        a value they share.
+    """
+    return np.broadcast(*[np.atleast_1d(value) for value in values]).shape[0]
+
+
+def _int_arrays(rows, *values):
+    arrays = [np.broadcast_to(np.asarray(v, dtype=np.int64), rows) for v in values]
+    return [array.copy() for array in arrays]
+
+
+def vested_amount(time_period, contract_start_time, withdraw_amount, now):
+    """
+    :return: what a schedule has released by now, like the contract's
+        vested_amount(), not clamped to any balance.
+    """
+    begun = now >= contract_start_time
+    periods = (now - contract_start_time) // time_period + 1
+    return np.where(begun, periods * withdraw_amount, 0)
+
+
+def simulate_withdrawals(
+    time_period,
+    contract_start_time,
+    withdraw_amount,
+    deposit,
+    delete_time,
+    attempts,
+    actions=WITHDRAW,
+):
+    """
+    Runs periodic_withdrawals schedules against the receiver's calls. Every
+    schedule parameter is an array with one entry per schedule, or a value they
+    share.
+    :param deposit: the asset balance held once the application is set up.
+    :param delete_time: when the application is deleted, unlock_time or later.
+        Calls from then on do not run.
+    :param attempts: sorted timestamps of the receiver's calls, shared by every
+        schedule.
+    :param actions: WITHDRAW or CLAIM for every call, or one for all of them.
+    :return: WithdrawalResult
+    """
+    attempts = np.asarray(attempts, dtype=np.int64)
+    actions = np.broadcast_to(np.asarray(actions, dtype=np.int64), attempts.shape)
+    parameters = [time_period, contract_start_time, withdraw_amount, deposit]
+    size = _rows(*parameters, delete_time)
+    period, start, amount, held, delete = _int_arrays(size, *parameters, delete_time)
+    if np.any(period <= 0) or np.any(amount <= 0):
+        raise ValueError("on_create rejects a time period or withdraw amount of 0")
+    if np.any(np.diff(attempts) < 0):
+        raise ValueError("attempts must be sorted")
+    # vested_amount() must fit the contract's uint64, and this model's int64.
+    periods = np.maximum(delete - start, 0) // period + 1
+    if np.any(periods > INT64_MAX // amount):
+        raise ValueError("the vested amount outgrows 64 bits by the delete time")
+
+    released = np.zeros(size, dtype=np.int64)
+    latest = np.zeros(size, dtype=np.int64)
+    # Periods the deposit covers at withdraw_amount each, the last period something
+    # was sent in, and how many of the covered periods something was sent in.
+    funded_periods = -(-held // amount)
+    last_paid = np.full(size, -1, dtype=np.int64)
+    paid_periods = np.zeros(size, dtype=np.int64)
+    counts = {
+        name: np.zeros(size, dtype=np.int64)
+        for name in ("withdrawals", "claims", "idle", "rejected")
+    }
+    for now, action in zip(attempts.tolist(), actions.tolist()):
+        live = now < delete
+        since_start = now - start
+        begun = live & (since_start >= 0)
+        if action == WITHDRAW:
+            accepted = begun & (now - latest > since_start % period)
+            sent = np.where(accepted & (held > amount), amount, 0)
+            counts["withdrawals"] += sent > 0
+            counts["idle"] += accepted & (sent == 0)
+            counts["rejected"] += live & ~accepted
+        elif action == CLAIM:
+            claimable = vested_amount(period, start, amount, now) - released
+            sent = np.where(live, np.minimum(claimable, held), 0)
+            counts["claims"] += sent > 0
+            counts["rejected"] += live & (sent == 0)
+        else:
+            raise ValueError("unknown action {}".format(action))
+        paying = sent > 0
+        released += sent
+        held -= sent
+        latest = np.where(paying, now, latest)
+        index = since_start // period
+        paid_periods += paying & (index != last_paid) & (index < funded_periods)
+        last_paid = np.where(paying, index, last_paid)
+
+    vested = vested_amount(period, start, amount, delete)
+    vested_unsent = np.minimum(vested, released + held) - released
+    begun_periods = np.where(delete >= start, (delete - start) // period + 1, 0)
+    missed = np.minimum(begun_periods, funded_periods) - paid_periods
+    return WithdrawalResult(
+        released=released,
+        held=held,
+        latest_withdrawal_time=latest,
+        vested_unsent=vested_unsent,
+        missed_periods=missed,
+        **counts
+    )
+
+
+def simulate_tranches(
+    tranche_amount, tranche_unlock, deposit, delete_time, attempts, tranche_count=None
+):
+    """
+    Runs freeze_escrow schedules against the receiver's release calls. A release
+    sends the tranches unlocked since the last one, and nothing is deposited after
+    setup, so only the last release before the delete time matters.
+    :param tranche_amount: array of the amount of every tranche, a row per
+        schedule.
+    :param tranche_unlock: array of the unlock timestamp of every tranche, in the
+        order given at creation.
+    :param deposit: the asset balance held once the escrow is set up.
+    :param delete_time: when the escrow is deleted, unlock_time or later.
+    :param attempts: sorted timestamps of the release calls, shared by every
+        schedule.
+    :param tranche_count: tranches in each schedule, the rest of its row unused.
+        Every column by default.
+    :return: TrancheResult
+    """
+    amount = np.atleast_2d(np.asarray(tranche_amount, dtype=np.int64))
+    unlock = np.atleast_2d(np.asarray(tranche_unlock, dtype=np.int64))
+    rows, columns = amount.shape
+    held, delete = _int_arrays(rows, deposit, delete_time)
+    attempts = np.asarray(attempts, dtype=np.int64)
+    if np.any(np.diff(attempts) < 0):
+        raise ValueError("attempts must be sorted")
+    count = _int_arrays(rows, columns if tranche_count is None else tranche_count)[0]
+    if np.any(count > freeze_escrow.MAX_TRANCHES):
+        raise ValueError(
+            "an escrow holds at most {} tranches".format(freeze_escrow.MAX_TRANCHES)
+        )
+    exists = np.arange(columns) < count[:, None]
+
+    # The last release before the delete time, or none.
+    last = np.searchsorted(attempts, delete, side="left") - 1
+    released_by = np.where(last >= 0, attempts[np.maximum(last, 0)], -1)
+    unlocked = (unlock <= released_by[:, None]) & exists
+    # What sending every tranche up to each one takes from the deposit.
+    needed = np.cumsum(np.where(exists, amount, 0), axis=1)
+    sendable = unlocked & (needed <= held[:, None])
+    # Release stops at the first tranche still locked or not held in full.
+    released_count = np.where(
+        sendable.all(axis=1), columns, np.argmin(sendable, axis=1)
+    )
+    is_released = np.arange(columns) < released_count[:, None]
+    released = np.where(is_released, amount, 0).sum(axis=1)
+    stop = np.minimum(released_count, columns - 1)[:, None]
+    stopped_short = (released_count < count) & np.take_along_axis(
+        unlocked, stop, axis=1
+    )[:, 0]
+    shortfall = np.take_along_axis(needed, stop, axis=1)[:, 0] - held
+    unlocked_by_delete = (unlock < delete[:, None]) & exists & ~is_released
+    return TrancheResult(
+        released_count=released_count,
+        released=released,
+        held=held - released,
+        shortfall=np.where(stopped_short, shortfall, 0),
+        unreleased=unlocked_by_delete.sum(axis=1),
+    )
+
+
+def synthetic_attempts(start_time, end_time, mean_gap, claim_rate=0.0, seed=0):
+    """
+    Generates the receiver's calls, at exponentially distributed gaps from
+    start_time to end_time, each a claim with probability claim_rate.
+    :return: tuple of (attempts, actions) arrays.
+    """
+    rng = np.random.default_rng(seed)
+    count = int((end_time - start_time) / mean_gap * 1.5) + 1
+    gaps = rng.exponential(mean_gap, count).astype(np.int64)
+    attempts = start_time + np.cumsum(gaps)
+    attempts = attempts[attempts < end_time]
+    actions = np.where(rng.random(len(attempts)) < claim_rate, CLAIM, WITHDRAW)
+    return attempts, actions.astype(np.int64)
+
+
+class _Ledger:
+    """
+    An avm.Ledger with a receiver holding an asset, to deploy a contract on.
+    """
+
+    def __init__(self, latest_timestamp):
+        self.ledger = avm.Ledger(latest_timestamp=latest_timestamp)
+        self.receiver = avm.address("receiver")
+        self.ledger.fund(self.receiver, 10 ** 15)
+        self.asset = self.ledger.create_asset(self.receiver, UINT64_MAX)
+
+    def run(self, group):
+        return self.ledger.execute(group, check=True)
+
+    def deploy(self, contract, args, deposit):
+        """
+        Creates, funds and sets up the contract, then deposits its asset.
+        :return: the application ID.
+        """
+        module = {
+            "periodic_withdrawals": periodic_withdrawals,
+            "freeze_escrow": freeze_escrow,
+        }[contract]
+        compiled = build.build_contracts([contract])[contract]
+        result = self.run(
+            avm.app_create(
+                self.receiver,
+                compiled["approval"][0],
+                compiled["clear"][0],
+                args=args,
+                assets=[self.asset],
+                global_ints=module.GLOBAL_SCHEMA[0],
+                global_bytes=module.GLOBAL_SCHEMA[1],
+                local_ints=module.LOCAL_SCHEMA[0],
+                local_bytes=module.LOCAL_SCHEMA[1],
+            )
+        )
+        app_id = result.txns[0].created_app_id
+        self.app_address = avm.application_address(app_id)
+        self.run(avm.payment(self.receiver, self.app_address, 10 ** 6))
+        self.run(avm.app_call(self.receiver, app_id, ["setup"], assets=[self.asset]))
+        if deposit:
+            self.run(
+                avm.asset_transfer(self.receiver, self.app_address, self.asset, deposit)
+            )
+        return app_id
+
+    def delete(self, app_id, delete_time):
+        """
+        :return: the amount the delete closed out to the receiver.
+        """
+        self.ledger.latest_timestamp = delete_time
+        before = self.ledger.asset_balance(self.receiver, self.asset)
+        self.run(
+            avm.app_call(
+                self.receiver,
+                app_id,
+                on_complete=avm.DELETE_APPLICATION,
+                assets=[self.asset],
+            )
+        )
+        return self.ledger.asset_balance(self.receiver, self.asset) - before
+
+
+def _compare(mismatches, name, model, contract):
+    for field, value in contract.items():
+        if model[field] != value:
+            mismatches.append(
+                "{} {}: model {} contract {}".format(name, field, model[field], value)
+            )
+
+
+def cross_check_withdrawals(
+    time_period,
+    contract_start_time,
+    withdraw_amount,
+    deposit,
+    delete_time,
+    attempts,
+    actions=WITHDRAW,
+    unlock_time=None,
+):
+    """
+    Replays every schedule through the compiled periodic_withdrawals in avm.py, with
+    every call before its delete time, and compares the outcome with
+    simulate_withdrawals(). Pass a sample, replaying costs tens of microseconds per
+    call.
+    :param unlock_time: the unlock_time of each schedule, its delete time by
+        default.
+    :return: list of mismatch messages, empty when the model and contract agree.
+    """
+    attempts = np.asarray(attempts, dtype=np.int64)
+    actions = np.broadcast_to(np.asarray(actions, dtype=np.int64), attempts.shape)
+    model = simulate_withdrawals(
+        time_period,
+        contract_start_time,
+        withdraw_amount,
+        deposit,
+        delete_time,
+        attempts,
+        actions,
+    )
+    size = len(model.released)
+    period, start, amount, held, delete = _int_arrays(
+        size, time_period, contract_start_time, withdraw_amount, deposit, delete_time
+    )
+    unlock = _int_arrays(size, delete if unlock_time is None else unlock_time)[0]
+    mismatches = []
+    for i in range(size):
+        created = int(min(attempts[0], start[i]) - 1) if len(attempts) else 0
+        ledger = _Ledger(created)
+        receiver = ledger.receiver
+        app_id = ledger.deploy(
+            "periodic_withdrawals",
+            [
+                ledger.asset,
+                receiver,
+                int(unlock[i]),
+                int(period[i]),
+                int(start[i]),
+                int(amount[i]),
+            ],
+            int(held[i]),
+        )
+        counts = {"withdrawals": 0, "claims": 0, "idle": 0, "rejected": 0}
+        for now, action in zip(attempts.tolist(), actions.tolist()):
+            if now >= delete[i]:
+                break
+            ledger.ledger.latest_timestamp = now
+            method = "withdraw" if action == WITHDRAW else "claim"
+            result = ledger.ledger.execute(
+                avm.app_call(receiver, app_id, [method], assets=[ledger.asset])
+            )
+            if not result.ok:
+                counts["rejected"] += 1
+            elif result.txns[0].inner:
+                counts["withdrawals" if action == WITHDRAW else "claims"] += 1
+            else:
+                counts["idle"] += 1
+        state = periodic_withdrawals.AppVariables.decode(
+            ledger.ledger.global_state(app_id)
+        )
+        contract = dict(
+            counts,
+            released=state["released_amount"],
+            latest_withdrawal_time=state["latest_withdrawal_time"],
+            held=ledger.ledger.asset_balance(ledger.app_address, ledger.asset),
+        )
+        closed = ledger.delete(app_id, int(delete[i]))
+        if closed != contract["held"]:
+            mismatches.append(
+                "schedule {}: delete closed out {} of {} held".format(
+                    i, closed, contract["held"]
+                )
+            )
+        _compare(mismatches, "schedule {}".format(i), model.row(i), contract)
+    return mismatches
+
+
+def cross_check_tranches(
+    tranche_amount, tranche_unlock, deposit, delete_time, attempts, tranche_count=None
+):
+    """
+    Replays every schedule through the compiled freeze_escrow in avm.py, each
+    release grouped with a budget call for its opcode budget, and compares the
+    outcome with simulate_tranches(). The escrow's unlock_time is its delete time.
+    :return: list of mismatch messages, empty when the model and contract agree.
+    """
+    amount = np.atleast_2d(np.asarray(tranche_amount, dtype=np.int64))
+    unlock = np.atleast_2d(np.asarray(tranche_unlock, dtype=np.int64))
+    attempts = np.asarray(attempts, dtype=np.int64)
+    model = simulate_tranches(
+        amount, unlock, deposit, delete_time, attempts, tranche_count
+    )
+    rows, columns = amount.shape
+    held, delete = _int_arrays(rows, deposit, delete_time)
+    count = _int_arrays(rows, columns if tranche_count is None else tranche_count)[0]
+    mismatches = []
+    for i in range(rows):
+        created = int(attempts[0] - 1) if len(attempts) else 0
+        ledger = _Ledger(created)
+        receiver = ledger.receiver
+        packed = b"".join(
+            value.to_bytes(8, "big")
+            for j in range(count[i])
+            for value in (ledger.asset, int(amount[i, j]), int(unlock[i, j]))
+        )
+        app_id = ledger.deploy(
+            "freeze_escrow",
+            [ledger.asset, receiver, int(delete[i]), packed],
+            int(held[i]),
+        )
+        for now in attempts.tolist():
+            if now >= delete[i]:
+                break
+            ledger.ledger.latest_timestamp = now
+            release = [
+                avm.app_call(receiver, app_id, ["release"], assets=[ledger.asset]),
+                avm.app_call(receiver, app_id, ["budget"]),
+            ]
+            ledger.run(release)
+        state = freeze_escrow.AppVariables.decode(ledger.ledger.global_state(app_id))
+        held_now = ledger.ledger.asset_balance(ledger.app_address, ledger.asset)
+        contract = {
+            "released_count": state.get("released_count", 0),
+            "released": int(held[i]) - held_now,
+            "held": held_now,
+        }
+        closed = ledger.delete(app_id, int(delete[i]))
+        if closed != held_now:
+            mismatches.append(
+                "escrow {}: delete closed out {} of {} held".format(
+                    i, closed, held_now
+                )
+            )
+        _compare(mismatches, "escrow {}".format(i), model.row(i), contract)
+    return mismatches
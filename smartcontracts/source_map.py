@@ -0,0 +1,240 @@
+"""
+Source maps from compiled TEAL back to the Python lines of the contracts.
+
+PyTeal keeps the stack every expression was built at. compile_map() runs the passes
+of compileTeal() itself, so it still knows the expression behind each TEAL line,
+and maps the line to the frames of that stack from the outermost one in the
+contract module inwards, leaving out PyTeal's own: a line built by a helper such
+as state.py shows up under the contract line that called it. Subroutine bodies
+are built when they are compiled, so their stacks start at the subroutine. Lines
+the compiler adds on its own (branches, labels, the stores of subroutine
+arguments) take the frames of the line before them in their routine, or the
+definition of the routine when they come first.
+
+teal_opt.optimize() keeps the line every instruction was parsed from, so
+optimize() follows the instructions of the optimized program back to the
+compiled lines. The constant blocks it adds have no line.
+
+Maps are written next to the TEAL artifacts by build.py --source-map, as JSON:
+
+    {
+      "format": 1,
+      "program": "periodic_withdrawals_approval.teal",
+      "lines": {
+        "12": {
+          "subroutine": "claimAssetsTo",
+          "stack": [["periodic_withdrawals.py", 42, "claimAssetsTo"]]
+        },
+        ...
+      }
+    }
+
+keyed by TEAL line, with stacks outermost first, paths relative to this directory,
+and a null subroutine for lines of the main program.
+"""
+import importlib
+import json
+import os
+import re
+from collections import namedtuple
+
+from pyteal import TealLabel
+from pyteal.compiler.compiler import (
+    CompileOptions,
+    assignScratchSlotsToSubroutines,
+    compileSubroutine,
+    flattenSubroutines,
+    resolveSubroutines,
+    spillLocalSlotsDuringRecursion,
+)
+
+import teal_opt
+
+# Bump when the layout of written maps changes.
+MAP_FORMAT = 1
+
+# Directory the contract modules are loaded from; frames of other files are left out.
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_FRAME = re.compile(r'\s*File "(.+)", line (\d+), in (.+)')
+
+# A Python frame: path relative to SOURCE_DIR, line number and function name.
+Frame = namedtuple("Frame", ["path", "line", "function"])
+# Where a TEAL line comes from: the subroutine it belongs to, or None in the main
+# program, and the tuple of Frames that built it, outermost first.
+Origin = namedtuple("Origin", ["subroutine", "stack"])
+
+
+class SourceMapError(Exception):
+    pass
+
+
+class SourceMap:
+    """
+    Map of the lines of one TEAL program to their Origin.
+    :ivar teal: the TEAL source the map is for.
+    :ivar lines: dict of 1-based TEAL line number to Origin.
+    """
+
+    def __init__(self, teal, lines):
+        self.teal = teal
+        self.lines = lines
+
+    def origin(self, line):
+        return self.lines.get(line)
+
+    def as_dict(self, program):
+        return {
+            "format": MAP_FORMAT,
+            "program": program,
+            "lines": {
+                str(line): {
+                    "subroutine": origin.subroutine,
+                    "stack": [list(frame) for frame in origin.stack],
+                }
+                for line, origin in sorted(self.lines.items())
+            },
+        }
+
+    def save(self, path, program):
+        with open(path, "w") as f:
+            json.dump(self.as_dict(program), f, separators=(",", ":"))
+
+    @classmethod
+    def load(cls, path, teal=None):
+        """
+        Reads a map written by save().
+        :param teal: the TEAL source the map is for, if at hand.
+        """
+        with open(path) as f:
+            document = json.load(f)
+        if document.get("format") != MAP_FORMAT:
+            raise SourceMapError(
+                "{}: unsupported source map format {!r}".format(
+                    path, document.get("format")
+                )
+            )
+        lines = {
+            int(line): Origin(
+                entry["subroutine"], tuple(Frame(*frame) for frame in entry["stack"])
+            )
+            for line, entry in document["lines"].items()
+        }
+        return cls(teal, lines)
+
+
+def _stack(expr, module_path):
+    """
+    :return: tuple of the Frames that built expr, from the outermost one in the
+        file at module_path, or an empty tuple when it was built elsewhere.
+    """
+    trace = getattr(expr, "trace", None) or ()
+    stack = []
+    for entry in trace:
+        match = _FRAME.match(entry)
+        if match is None:
+            continue
+        path = os.path.abspath(match.group(1))
+        if not stack and path != module_path:
+            continue
+        if os.path.dirname(path) != SOURCE_DIR:
+            continue
+        stack.append(
+            Frame(os.path.basename(path), int(match.group(2)), match.group(3))
+        )
+    return tuple(stack)
+
+
+def _definition(function):
+    """
+    :return: the Frame of the line defining function (its first decorator).
+    """
+    function = getattr(function, "__wrapped__", function)
+    code = function.__code__
+    return Frame(os.path.basename(code.co_filename), code.co_firstlineno, code.co_name)
+
+
+def compile_map(ast, mode, version, module_path, program_function=None):
+    """
+    Compiles a PyTeal expression like compileTeal(), mapping every line.
+    :param module_path: file of the contract module; stacks start in it.
+    :param program_function: function that built ast, for lines of the main
+        program the compiler adds before any of its own.
+    :return: SourceMap
+    """
+    module_path = os.path.abspath(module_path)
+    options = CompileOptions(mode=mode, version=version)
+    mapping = {}
+    graph = {}
+    blocks = {}
+    compileSubroutine(ast, options, mapping, graph, blocks)
+    slots = assignScratchSlotsToSubroutines(mapping, blocks)
+    spillLocalSlotsDuringRecursion(version, mapping, graph, slots)
+
+    # The components of every routine, before flattening adds the labels of the
+    # subroutines, with the origin of each.
+    origins = {}
+    for subroutine, components in mapping.items():
+        if subroutine is None:
+            name = None
+            previous = (_definition(program_function),) if program_function else ()
+        else:
+            name = subroutine.name()
+            previous = (_definition(subroutine.implementation),)
+        for component in components:
+            stack = _stack(getattr(component, "expr", None), module_path)
+            if stack:
+                previous = stack
+            origins[id(component)] = Origin(name, previous)
+
+    labels = resolveSubroutines(mapping)
+    definitions = {label: subroutine for subroutine, label in labels.items()}
+    components = flattenSubroutines(mapping, labels)
+
+    lines = ["#pragma version {}".format(version)]
+    origin_of_line = {}
+    for number, component in enumerate(components, start=2):
+        lines.append(component.assemble())
+        origin = origins.get(id(component))
+        if origin is None and isinstance(component, TealLabel):
+            subroutine = definitions.get(component.getLabelRef().getLabel())
+            if subroutine is not None:
+                origin = Origin(
+                    subroutine.name(), (_definition(subroutine.implementation),)
+                )
+        if origin is not None:
+            origin_of_line[number] = origin
+    return SourceMap("\n".join(lines), origin_of_line)
+
+
+def optimize(source_map):
+    """
+    Runs the program of a map through teal_opt.optimize().
+    :return: SourceMap of the optimized program.
+    """
+    program = teal_opt.optimize(source_map.teal)
+    lines = {}
+    for number, item in enumerate(program.body, start=2):
+        origin = source_map.origin(item.line) if item.line is not None else None
+        if origin is not None:
+            lines[number] = origin
+    return SourceMap(program.text(), lines)
+
+
+def program_map(contract, program, mode, version, optimized=True):
+    """
+    Compiles one program of a contract module with its map.
+    :param optimized: map the program teal_opt.optimize() makes of it.
+    :return: SourceMap
+    """
+    module = importlib.import_module(contract)
+    function = getattr(module, "{}_program".format(program))
+    source_map = compile_map(function(), mode, version, module.__file__, function)
+    return optimize(source_map) if optimized else source_map
+
+
+def map_name(artifact):
+    """
+    :return: the file name of the map of a TEAL artifact.
+    """
+    return artifact + ".map.json"
@@ -0,0 +1,117 @@
+"""
+Typed access to application global and local state.
+
+GlobalState and LocalState read and write one kind of state with the same get()
+and put(), so a handler can work on a schema shared by global and local state, like
+periodic_withdrawals' withdrawal schedules. Keys are strings, Bytes or the Fields of
+a state_schema.py schema. The gets of a Field are typed and its puts check the type
+of the value.
+
+    def claim(schedule):
+        return schedule.put(
+            Schedule.released_amount, schedule.get(Schedule.released_amount) + amount
+        )
+
+    claim(GlobalState())
+    claim(LocalState())
+
+Every get() and put() reads or writes state directly. Handlers read or write any
+key at most twice, where a scratch slot would cost more opcodes than it saves.
+"""
+import abc
+
+from pyteal import *
+
+from state_schema import Field
+
+
+class _Typed(Expr):
+    """
+    Expression of another whose value has a known type.
+    """
+
+    def __init__(self, expr, type_):
+        super().__init__()
+        self._expr = expr
+        self._type = type_
+
+    def __teal__(self, options):
+        return self._expr.__teal__(options)
+
+    def __str__(self):
+        return "(state {})".format(self._expr)
+
+    def type_of(self):
+        return self._type
+
+    def has_return(self):
+        return False
+
+
+def _key_bytes(key):
+    if isinstance(key, str):
+        return Bytes(key)
+    if isinstance(key, Field):
+        if key.count is not None:
+            raise TealInputError("access the entries of {} by their key".format(key))
+        return key
+    if isinstance(key, Bytes):
+        return key
+    raise TealInputError("state keys must be str, Bytes or Field, got {}".format(key))
+
+
+class _State(abc.ABC):
+    @abc.abstractmethod
+    def _load(self, key):
+        """
+        :return: the expression reading key.
+        """
+
+    @abc.abstractmethod
+    def _store(self, key, value):
+        """
+        :return: the expression writing value to key.
+        """
+
+    def get(self, key, type_=None):
+        """
+        :param type_: type of the value, by default the field's for a Field key and
+            anytype otherwise.
+        """
+        if type_ is None:
+            type_ = key.value_type if isinstance(key, Field) else TealType.anytype
+        return _Typed(self._load(_key_bytes(key)), type_)
+
+    def put(self, key, value):
+        if isinstance(key, Field):
+            key.check(value)
+        return self._store(_key_bytes(key), value)
+
+
+class GlobalState(_State):
+    """
+    Access to the application's global state.
+    """
+
+    def _load(self, key):
+        return App.globalGet(key)
+
+    def _store(self, key, value):
+        return App.globalPut(key, value)
+
+
+class LocalState(_State):
+    """
+    Access to the local state of one account. Defaults to the sender, referenced by
+    its index in the accounts array: `int 0` assembles to one byte where
+    `txn Sender` takes two.
+    """
+
+    def __init__(self, account=None):
+        self.account = account if account is not None else Int(0)
+
+    def _load(self, key):
+        return App.localGet(self.account, key)
+
+    def _store(self, key, value):
+        return App.localPut(self.account, key, value)
@@ -0,0 +1,375 @@
+"""
+Declarative schemas of application global and local state.
+
+A schema is a class whose attributes are the typed Fields of the state:
+
+    class AppVariables(GlobalSchema):
+        # End time for the current challenge in unix timestamp.
+        endTime = Field(TealType.uint64)
+        # Each option's org name, by option index.
+        optionName = Field(TealType.bytes, count=MAX_OPTIONS)
+
+Every field is given a one byte key in the order it is declared, a letter or digit
+unless it asks for key=, and a field with count= holds that many entries, keyed by
+its key followed by the entry's index as one byte. With indexes= as well, the
+entries held at once are drawn from a wider range of indexes, two bytes wide past
+256. Fields are expressions of their key, so programs use them wherever a key goes,
+and index the entries:
+
+    App.globalPut(AppVariables.endTime, end_time)
+    App.globalGet(AppVariables.optionName[i.load()])
+
+An index computed at run time fails the program when the key cannot hold it, past
+255 for a one byte index and past indexes= for a two byte one, rather than keying
+another entry.
+state.GlobalState and LocalState take fields as keys too. A schema extending
+another keeps its fields and their keys, which lets global and local state share a
+layout. state_schema() counts the uints and byte slices an application must be
+created with, and decode() turns a state read from algod or avm back into the
+values of the fields, by name:
+
+    GLOBAL_SCHEMA = AppVariables.state_schema()
+    AppVariables.decode(ledger.global_state(app_id))["endTime"]
+
+Decode the state of an application or an account from algod's JSON:
+
+    python3 state_schema.py donation_votes app_info.json
+    python3 state_schema.py donation_votes account_info.json --app 1234
+"""
+import argparse
+import base64
+import importlib
+import json
+import string
+import sys
+
+from pyteal import *
+from pyteal.ir import Op, TealOp, TealSimpleBlock
+from pyteal.types import require_type
+
+# Keys given to the fields in declaration order.
+KEY_ALPHABET = (string.ascii_letters + string.digits).encode()
+# Indexes one byte of an entry's key tells apart, and the most two bytes do.
+BYTE_INDEXES = 256
+MAX_INDEXES = 2 ** 16
+# Python types of the values of each field type.
+_VALUE_TYPES = {TealType.uint64: int, TealType.bytes: bytes}
+
+
+class StateSchemaError(Exception):
+    pass
+
+
+def _key_expr(key):
+    """
+    :return: the Bytes of key, as a string when it is one.
+    """
+    try:
+        text = key.decode("ascii")
+    except UnicodeDecodeError:
+        return Bytes(key)
+    return Bytes(text) if text.isprintable() else Bytes(key)
+
+
+class Field(Expr):
+    """
+    A typed value of a schema, or count values with count=. As an expression, the
+    key of the value.
+    :ivar name: attribute name in its schema.
+    :ivar key: bytes of the key, or of the prefix of the entries' keys.
+    :ivar value_type: TealType.uint64 or TealType.bytes.
+    :ivar count: most entries held at once, or None for a single value.
+    :ivar indexes: number of entry indexes, count unless given.
+    :ivar index_size: bytes of the index in an entry's key.
+    """
+
+    def __init__(self, value_type, count=None, key=None, indexes=None):
+        super().__init__()
+        if value_type not in _VALUE_TYPES:
+            raise StateSchemaError(
+                "fields hold uint64 or bytes values, not {}".format(value_type)
+            )
+        if indexes is None:
+            indexes = count
+        elif count is None:
+            raise StateSchemaError("indexes= goes with count=")
+        if count is not None and not 0 < count <= indexes <= MAX_INDEXES:
+            raise StateSchemaError(
+                "a field holds 1 to indexes entries, of at most {} indexes, not {} "
+                "of {}".format(MAX_INDEXES, count, indexes)
+            )
+        self.name = None
+        self.key = key.encode() if isinstance(key, str) else key
+        self.value_type = value_type
+        self.count = count
+        self.indexes = indexes
+        self.index_size = 1 if indexes is None or indexes <= BYTE_INDEXES else 2
+
+    def entry_key(self, index):
+        """
+        :return: the key bytes of the entry at index.
+        """
+        return self.key + index.to_bytes(self.index_size, "big")
+
+    def __getitem__(self, index):
+        """
+        :param index: int or expression of the entry's index.
+        :return: the key of the entry.
+        """
+        if self.count is None:
+            raise TealInputError("{} holds a single value".format(self.name))
+        if isinstance(index, Int):
+            index = index.value
+        if isinstance(index, int):
+            if not 0 <= index < self.indexes:
+                raise TealInputError(
+                    "{} has no entry {}, its indexes run to {}".format(
+                        self.name, index, self.indexes - 1
+                    )
+                )
+            return _key_expr(self.entry_key(index))
+        # The key keeps the low bytes of the index, fail instead of keying another
+        # entry with a larger one: setbyte fails past 255.
+        if self.index_size == 1:
+            return SetByte(_key_expr(self.entry_key(0)), Int(len(self.key)), index)
+        return Concat(
+            _key_expr(self.key), Extract(Itob(_EntryIndex(self, index)), Int(6), Int(2))
+        )
+
+    def check(self, value):
+        """
+        Raises TealTypeError if the expression value cannot be stored in the field.
+        :return: value
+        """
+        require_type(value.type_of(), self.value_type)
+        return value
+
+    def __teal__(self, options):
+        if self.count is not None:
+            raise TealInputError(
+                "{} holds {} entries, index it".format(self.name, self.count)
+            )
+        return _key_expr(self.key).__teal__(options)
+
+    def __str__(self):
+        return "(field {})".format(self.name)
+
+    def type_of(self):
+        return TealType.bytes
+
+    def has_return(self):
+        return False
+
+
+class _EntryIndex(Expr):
+    """
+    The index of an entry of field, failing the program when the field has no entry
+    at it.
+    """
+
+    def __init__(self, field, index):
+        super().__init__()
+        require_type(index.type_of(), TealType.uint64)
+        self.field = field
+        self.index = index
+
+    def __teal__(self, options):
+        start, end = self.index.__teal__(options)
+        check = TealSimpleBlock(
+            [
+                TealOp(self, Op.dup),
+                TealOp(self, Op.int, self.field.indexes),
+                TealOp(self, Op.lt),
+                TealOp(self, Op.assert_),
+            ]
+        )
+        end.setNextBlock(check)
+        return start, check
+
+    def __str__(self):
+        return "(entry {} {})".format(self.field.name, self.index)
+
+    def type_of(self):
+        return TealType.uint64
+
+    def has_return(self):
+        return False
+
+
+class Schema:
+    """
+    Fields of a state. Subclass GlobalSchema or LocalSchema, or Schema itself for a
+    layout shared by both.
+    :cvar fields: dict of name to Field, inherited ones first.
+    :cvar MAX_KEYS: most keys the state can hold, or None.
+    """
+
+    fields = {}
+    MAX_KEYS = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        fields = {}
+        for base in reversed(cls.__mro__[1:]):
+            fields.update(getattr(base, "fields", {}))
+        declared = {
+            name: value for name, value in vars(cls).items() if isinstance(value, Field)
+        }
+        used = {field.key for field in fields.values()}
+        for name, field in declared.items():
+            if field.name is not None:
+                raise StateSchemaError(
+                    "{}.{} is already {} of another schema".format(
+                        cls.__name__, name, field.name
+                    )
+                )
+            field.name = name
+            if field.key is not None:
+                if field.key in used:
+                    raise StateSchemaError(
+                        "{}.{}: key {!r} is taken".format(cls.__name__, name, field.key)
+                    )
+                used.add(field.key)
+        free = (bytes([byte]) for byte in KEY_ALPHABET if bytes([byte]) not in used)
+        for field in declared.values():
+            if field.key is None:
+                field.key = next(free, None)
+                if field.key is None:
+                    raise StateSchemaError(
+                        "{}: out of keys at {}".format(cls.__name__, field.name)
+                    )
+        fields.update(declared)
+        cls.fields = fields
+
+        keys = sum(field.count or 1 for field in fields.values())
+        if cls.MAX_KEYS is not None and keys > cls.MAX_KEYS:
+            raise StateSchemaError(
+                "{} takes {} keys, the state holds {}".format(
+                    cls.__name__, keys, cls.MAX_KEYS
+                )
+            )
+        # Key of every value to (field name, entry index or None, Python type).
+        decoding = {}
+        for field in fields.values():
+            value_type = _VALUE_TYPES[field.value_type]
+            indexes = [None] if field.count is None else range(field.indexes)
+            for index in indexes:
+                key = field.key if index is None else field.entry_key(index)
+                if key in decoding:
+                    raise StateSchemaError(
+                        "{}: {} and {} share key {!r}".format(
+                            cls.__name__, decoding[key][0], field.name, key
+                        )
+                    )
+                decoding[key] = (field.name, index, value_type)
+        cls._decoding = decoding
+
+    @classmethod
+    def state_schema(cls):
+        """
+        :return: tuple of the (uints, byte slices) the state must be created with.
+        """
+        counts = {TealType.uint64: 0, TealType.bytes: 0}
+        for field in cls.fields.values():
+            counts[field.value_type] += field.count or 1
+        return counts[TealType.uint64], counts[TealType.bytes]
+
+    @classmethod
+    def decode(cls, state):
+        """
+        :param state: dict of key bytes to int or bytes value, as avm.Ledger and
+            raw_state() return them.
+        :return: dict of field name to its value, or to a dict of entry index to
+            value for fields with count=. Keys of no field are kept as they are.
+        """
+        decoding = cls._decoding
+        fields = {}
+        for key, value in state.items():
+            entry = decoding.get(key)
+            if entry is None:
+                fields[key] = value
+                continue
+            name, index, value_type = entry
+            if type(value) is not value_type:
+                raise StateSchemaError(
+                    "{}.{} holds {}, not {}".format(
+                        cls.__name__, name, value_type.__name__, type(value).__name__
+                    )
+                )
+            if index is None:
+                fields[name] = value
+            else:
+                fields.setdefault(name, {})[index] = value
+        return fields
+
+
+class GlobalSchema(Schema):
+    MAX_KEYS = 64
+
+
+class LocalSchema(Schema):
+    MAX_KEYS = 16
+
+
+def raw_state(entries):
+    """
+    :param entries: a state in algod's key-value JSON, the "global-state" of an
+        application or the "key-value" of an account's local state.
+    :return: dict of key bytes to int or bytes value.
+    """
+    state = {}
+    for entry in entries or ():
+        value = entry["value"]
+        state[base64.b64decode(entry["key"])] = (
+            value["uint"] if value["type"] == 2 else base64.b64decode(value["bytes"])
+        )
+    return state
+
+
+def _printable(value):
+    if isinstance(value, dict):
+        return {index: _printable(entry) for index, entry in value.items()}
+    if isinstance(value, bytes):
+        if value.isascii() and value.decode().isprintable():
+            return value.decode()
+        return value.hex()
+    return value
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Decode an application's state from algod's JSON."
+    )
+    parser.add_argument("contract", help="contract module, e.g. donation_votes")
+    parser.add_argument(
+        "dump", help="algod application info, or account info with --app"
+    )
+    parser.add_argument("--app", type=int, help="decode this application's local state")
+    args = parser.parse_args(argv)
+
+    module = importlib.import_module(args.contract)
+    with open(args.dump) as f:
+        document = json.load(f)
+    if args.app is None:
+        schema = module.AppVariables
+        entries = document.get("params", {}).get("global-state")
+    else:
+        schema = module.LocalVariables
+        local_states = document.get("apps-local-state") or ()
+        found = [state for state in local_states if state["id"] == args.app]
+        if not found:
+            print("{}: not opted into {}".format(args.dump, args.app), file=sys.stderr)
+            return 1
+        entries = found[0].get("key-value")
+    try:
+        fields = schema.decode(raw_state(entries))
+    except StateSchemaError as e:
+        print("{}: {}".format(args.dump, e), file=sys.stderr)
+        return 1
+    for name, value in fields.items():
+        print("{}: {}".format(name, _printable(value)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
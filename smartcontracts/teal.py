@@ -0,0 +1,764 @@
+"""
+TEAL v5 toolkit: opcode table, parser and offline assembler.
+
+The rest of the tooling in this directory (cost analysis, optimization, local
+evaluation) works on the Program objects produced here, so TEAL text only has to
+be understood in one place.
+"""
+import base64
+import re
+
+# Highest TEAL version the toolkit understands.
+MAX_VERSION = 5
+
+# Protocol limits for application programs.
+MAX_APP_PROGRAM_LEN = 2048
+MAX_APP_COST = 700
+MAX_LOGICSIG_COST = 20000
+
+
+class OpSpec:
+    """
+    :param code: opcode byte.
+    :param cost: opcode cost in the v5 cost model.
+    :param pops: number of stack values consumed, None for stack manipulation ops
+        whose effect depends on an immediate.
+    :param pushes: number of stack values produced.
+    :param immediates: immediate argument kinds: "u8", "field", "gfield", "hfield",
+        "pfield", "afield", "label", "varuint", "bytes", "ints" or "byteslist".
+    """
+
+    __slots__ = ("name", "code", "cost", "pops", "pushes", "immediates")
+
+    def __init__(self, name, code, cost, pops, pushes, immediates=()):
+        self.name = name
+        self.code = code
+        self.cost = cost
+        self.pops = pops
+        self.pushes = pushes
+        self.immediates = immediates
+
+
+# name, code, cost, pops, pushes, immediates
+_OPCODES = [
+    ("err", 0x00, 1, 0, 0, ()),
+    ("sha256", 0x01, 35, 1, 1, ()),
+    ("keccak256", 0x02, 130, 1, 1, ()),
+    ("sha512_256", 0x03, 45, 1, 1, ()),
+    ("ed25519verify", 0x04, 1900, 3, 1, ()),
+    ("ecdsa_verify", 0x05, 1700, 5, 1, ("u8",)),
+    ("ecdsa_pk_decompress", 0x06, 650, 1, 2, ("u8",)),
+    ("ecdsa_pk_recover", 0x07, 2000, 4, 2, ("u8",)),
+    ("+", 0x08, 1, 2, 1, ()),
+    ("-", 0x09, 1, 2, 1, ()),
+    ("/", 0x0A, 1, 2, 1, ()),
+    ("*", 0x0B, 1, 2, 1, ()),
+    ("<", 0x0C, 1, 2, 1, ()),
+    (">", 0x0D, 1, 2, 1, ()),
+    ("<=", 0x0E, 1, 2, 1, ()),
+    (">=", 0x0F, 1, 2, 1, ()),
+    ("&&", 0x10, 1, 2, 1, ()),
+    ("||", 0x11, 1, 2, 1, ()),
+    ("==", 0x12, 1, 2, 1, ()),
+    ("!=", 0x13, 1, 2, 1, ()),
+    ("!", 0x14, 1, 1, 1, ()),
+    ("len", 0x15, 1, 1, 1, ()),
+    ("itob", 0x16, 1, 1, 1, ()),
+    ("btoi", 0x17, 1, 1, 1, ()),
+    ("%", 0x18, 1, 2, 1, ()),
+    ("|", 0x19, 1, 2, 1, ()),
+    ("&", 0x1A, 1, 2, 1, ()),
+    ("^", 0x1B, 1, 2, 1, ()),
+    ("~", 0x1C, 1, 1, 1, ()),
+    ("mulw", 0x1D, 1, 2, 2, ()),
+    ("addw", 0x1E, 1, 2, 2, ()),
+    ("divmodw", 0x1F, 20, 4, 4, ()),
+    ("intcblock", 0x20, 1, 0, 0, ("ints",)),
+    ("intc", 0x21, 1, 0, 1, ("u8",)),
+    ("intc_0", 0x22, 1, 0, 1, ()),
+    ("intc_1", 0x23, 1, 0, 1, ()),
+    ("intc_2", 0x24, 1, 0, 1, ()),
+    ("intc_3", 0x25, 1, 0, 1, ()),
+    ("bytecblock", 0x26, 1, 0, 0, ("byteslist",)),
+    ("bytec", 0x27, 1, 0, 1, ("u8",)),
+    ("bytec_0", 0x28, 1, 0, 1, ()),
+    ("bytec_1", 0x29, 1, 0, 1, ()),
+    ("bytec_2", 0x2A, 1, 0, 1, ()),
+    ("bytec_3", 0x2B, 1, 0, 1, ()),
+    ("arg", 0x2C, 1, 0, 1, ("u8",)),
+    ("arg_0", 0x2D, 1, 0, 1, ()),
+    ("arg_1", 0x2E, 1, 0, 1, ()),
+    ("arg_2", 0x2F, 1, 0, 1, ()),
+    ("arg_3", 0x30, 1, 0, 1, ()),
+    ("txn", 0x31, 1, 0, 1, ("field",)),
+    ("global", 0x32, 1, 0, 1, ("gfield",)),
+    ("gtxn", 0x33, 1, 0, 1, ("u8", "field")),
+    ("load", 0x34, 1, 0, 1, ("u8",)),
+    ("store", 0x35, 1, 1, 0, ("u8",)),
+    ("txna", 0x36, 1, 0, 1, ("field", "u8")),
+    ("gtxna", 0x37, 1, 0, 1, ("u8", "field", "u8")),
+    ("gtxns", 0x38, 1, 1, 1, ("field",)),
+    ("gtxnsa", 0x39, 1, 1, 1, ("field", "u8")),
+    ("gload", 0x3A, 1, 0, 1, ("u8", "u8")),
+    ("gloads", 0x3B, 1, 1, 1, ("u8",)),
+    ("gaid", 0x3C, 1, 0, 1, ("u8",)),
+    ("gaids", 0x3D, 1, 1, 1, ()),
+    ("loads", 0x3E, 1, 1, 1, ()),
+    ("stores", 0x3F, 1, 2, 0, ()),
+    ("bnz", 0x40, 1, 1, 0, ("label",)),
+    ("bz", 0x41, 1, 1, 0, ("label",)),
+    ("b", 0x42, 1, 0, 0, ("label",)),
+    ("return", 0x43, 1, 1, 0, ()),
+    ("assert", 0x44, 1, 1, 0, ()),
+    ("pop", 0x48, 1, 1, 0, ()),
+    ("dup", 0x49, 1, 1, 2, ()),
+    ("dup2", 0x4A, 1, 2, 4, ()),
+    ("dig", 0x4B, 1, None, 1, ("u8",)),
+    ("swap", 0x4C, 1, 2, 2, ()),
+    ("select", 0x4D, 1, 3, 1, ()),
+    ("cover", 0x4E, 1, None, 0, ("u8",)),
+    ("uncover", 0x4F, 1, None, 0, ("u8",)),
+    ("concat", 0x50, 1, 2, 1, ()),
+    ("substring", 0x51, 1, 1, 1, ("u8", "u8")),
+    ("substring3", 0x52, 1, 3, 1, ()),
+    ("getbit", 0x53, 1, 2, 1, ()),
+    ("setbit", 0x54, 1, 3, 1, ()),
+    ("getbyte", 0x55, 1, 2, 1, ()),
+    ("setbyte", 0x56, 1, 3, 1, ()),
+    ("extract", 0x57, 1, 1, 1, ("u8", "u8")),
+    ("extract3", 0x58, 1, 3, 1, ()),
+    ("extract_uint16", 0x59, 1, 2, 1, ()),
+    ("extract_uint32", 0x5A, 1, 2, 1, ()),
+    ("extract_uint64", 0x5B, 1, 2, 1, ()),
+    ("balance", 0x60, 1, 1, 1, ()),
+    ("app_opted_in", 0x61, 1, 2, 1, ()),
+    ("app_local_get", 0x62, 1, 2, 1, ()),
+    ("app_local_get_ex", 0x63, 1, 3, 2, ()),
+    ("app_global_get", 0x64, 1, 1, 1, ()),
+    ("app_global_get_ex", 0x65, 1, 2, 2, ()),
+    ("app_local_put", 0x66, 1, 3, 0, ()),
+    ("app_global_put", 0x67, 1, 2, 0, ()),
+    ("app_local_del", 0x68, 1, 2, 0, ()),
+    ("app_global_del", 0x69, 1, 1, 0, ()),
+    ("asset_holding_get", 0x70, 1, 2, 2, ("hfield",)),
+    ("asset_params_get", 0x71, 1, 1, 2, ("pfield",)),
+    ("app_params_get", 0x72, 1, 1, 2, ("afield",)),
+    ("min_balance", 0x78, 1, 1, 1, ()),
+    ("pushbytes", 0x80, 1, 0, 1, ("bytes",)),
+    ("pushint", 0x81, 1, 0, 1, ("varuint",)),
+    ("callsub", 0x88, 1, 0, 0, ("label",)),
+    ("retsub", 0x89, 1, 0, 0, ()),
+    ("shl", 0x90, 1, 2, 1, ()),
+    ("shr", 0x91, 1, 2, 1, ()),
+    ("sqrt", 0x92, 4, 1, 1, ()),
+    ("bitlen", 0x93, 1, 1, 1, ()),
+    ("exp", 0x94, 1, 2, 1, ()),
+    ("expw", 0x95, 10, 2, 2, ()),
+    ("b+", 0xA0, 10, 2, 1, ()),
+    ("b-", 0xA1, 10, 2, 1, ()),
+    ("b/", 0xA2, 20, 2, 1, ()),
+    ("b*", 0xA3, 20, 2, 1, ()),
+    ("b<", 0xA4, 1, 2, 1, ()),
+    ("b>", 0xA5, 1, 2, 1, ()),
+    ("b<=", 0xA6, 1, 2, 1, ()),
+    ("b>=", 0xA7, 1, 2, 1, ()),
+    ("b==", 0xA8, 1, 2, 1, ()),
+    ("b!=", 0xA9, 1, 2, 1, ()),
+    ("b%", 0xAA, 20, 2, 1, ()),
+    ("b|", 0xAB, 6, 2, 1, ()),
+    ("b&", 0xAC, 6, 2, 1, ()),
+    ("b^", 0xAD, 6, 2, 1, ()),
+    ("b~", 0xAE, 4, 1, 1, ()),
+    ("bzero", 0xAF, 1, 1, 1, ()),
+    ("log", 0xB0, 1, 1, 0, ()),
+    ("itxn_begin", 0xB1, 1, 0, 0, ()),
+    ("itxn_field", 0xB2, 1, 1, 0, ("field",)),
+    ("itxn_submit", 0xB3, 1, 0, 0, ()),
+    ("itxn", 0xB4, 1, 0, 1, ("field",)),
+    ("itxna", 0xB5, 1, 0, 1, ("field", "u8")),
+    ("txnas", 0xB8, 1, 1, 1, ("field",)),
+    ("gtxnas", 0xB9, 1, 1, 1, ("u8", "field")),
+    ("gtxnsas", 0xBA, 1, 2, 1, ("field",)),
+    ("args", 0xBB, 1, 1, 1, ()),
+]
+
+OPCODES = {row[0]: OpSpec(*row) for row in _OPCODES}
+
+# Pseudo-ops resolved by the assembler into constant loads.
+PSEUDO_OPS = {
+    "int": OpSpec("int", None, 1, 0, 1, ("int",)),
+    "byte": OpSpec("byte", None, 1, 0, 1, ("byte",)),
+    "addr": OpSpec("addr", None, 1, 0, 1, ("addr",)),
+}
+
+TXN_FIELDS = [
+    "Sender", "Fee", "FirstValid", "FirstValidTime", "LastValid", "Note", "Lease",
+    "Receiver", "Amount", "CloseRemainderTo", "VotePK", "SelectionPK", "VoteFirst",
+    "VoteLast", "VoteKeyDilution", "Type", "TypeEnum", "XferAsset", "AssetAmount",
+    "AssetSender", "AssetReceiver", "AssetCloseTo", "GroupIndex", "TxID",
+    "ApplicationID", "OnCompletion", "ApplicationArgs", "NumAppArgs", "Accounts",
+    "NumAccounts", "ApprovalProgram", "ClearStateProgram", "RekeyTo", "ConfigAsset",
+    "ConfigAssetTotal", "ConfigAssetDecimals", "ConfigAssetDefaultFrozen",
+    "ConfigAssetUnitName", "ConfigAssetName", "ConfigAssetURL",
+    "ConfigAssetMetadataHash", "ConfigAssetManager", "ConfigAssetReserve",
+    "ConfigAssetFreeze", "ConfigAssetClawback", "FreezeAsset", "FreezeAssetAccount",
+    "FreezeAssetFrozen", "Assets", "NumAssets", "Applications", "NumApplications",
+    "GlobalNumUint", "GlobalNumByteSlice", "LocalNumUint", "LocalNumByteSlice",
+    "ExtraProgramPages", "Nonparticipation", "Logs", "NumLogs", "CreatedAssetID",
+    "CreatedApplicationID",
+]  # fmt: skip
+GLOBAL_FIELDS = [
+    "MinTxnFee", "MinBalance", "MaxTxnLife", "ZeroAddress", "GroupSize",
+    "LogicSigVersion", "Round", "LatestTimestamp", "CurrentApplicationID",
+    "CreatorAddress", "CurrentApplicationAddress", "GroupID",
+]  # fmt: skip
+ASSET_HOLDING_FIELDS = ["AssetBalance", "AssetFrozen"]
+ASSET_PARAMS_FIELDS = [
+    "AssetTotal", "AssetDecimals", "AssetDefaultFrozen", "AssetUnitName",
+    "AssetName", "AssetURL", "AssetMetadataHash", "AssetManager", "AssetReserve",
+    "AssetFreeze", "AssetClawback", "AssetCreator",
+]  # fmt: skip
+APP_PARAMS_FIELDS = [
+    "AppApprovalProgram", "AppClearStateProgram", "AppGlobalNumUint",
+    "AppGlobalNumByteSlice", "AppLocalNumUint", "AppLocalNumByteSlice",
+    "AppExtraProgramPages", "AppCreator", "AppAddress",
+]  # fmt: skip
+ECDSA_CURVES = ["Secp256k1"]
+
+FIELD_TABLES = {
+    "field": TXN_FIELDS,
+    "gfield": GLOBAL_FIELDS,
+    "hfield": ASSET_HOLDING_FIELDS,
+    "pfield": ASSET_PARAMS_FIELDS,
+    "afield": APP_PARAMS_FIELDS,
+}
+
+# Named integer constants accepted by the int pseudo-op.
+NAMED_INTS = {
+    "unknown": 0, "pay": 1, "keyreg": 2, "acfg": 3, "axfer": 4, "afrz": 5, "appl": 6,
+    "NoOp": 0, "OptIn": 1, "CloseOut": 2, "ClearState": 3, "UpdateApplication": 4,
+    "DeleteApplication": 5,
+}  # fmt: skip
+
+# Prefix of template variables, e.g. TMPL_ASSET_ID.
+TEMPLATE_PREFIX = "TMPL_"
+
+
+class TealError(Exception):
+    def __init__(self, message, line=None):
+        if line is not None:
+            message = "line {}: {}".format(line, message)
+        super().__init__(message)
+        self.line = line
+
+
+class Label:
+    __slots__ = ("name", "line")
+
+    def __init__(self, name, line=None):
+        self.name = name
+        self.line = line
+
+    def __repr__(self):
+        return "Label({!r})".format(self.name)
+
+
+class Instruction:
+    """
+    One TEAL instruction.
+    :param op: opcode or pseudo-op name.
+    :param args: immediate arguments exactly as written in the source.
+    :param line: 1-based line number in the source it was parsed from. Kept through
+        rewrites so tooling can map instructions back to the original program.
+    """
+
+    __slots__ = ("op", "args", "line")
+
+    def __init__(self, op, args=(), line=None):
+        self.op = op
+        self.args = tuple(args)
+        self.line = line
+
+    @property
+    def spec(self):
+        return OPCODES.get(self.op) or PSEUDO_OPS[self.op]
+
+    def text(self):
+        return " ".join((self.op,) + self.args)
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, Instruction)
+            and self.op == other.op
+            and self.args == other.args
+        )
+
+    def __hash__(self):
+        return hash((self.op, self.args))
+
+    def __repr__(self):
+        return "Instruction({!r})".format(self.text())
+
+
+class Program:
+    """
+    A parsed TEAL program: a version and a body of Label and Instruction items.
+    """
+
+    def __init__(self, version, body):
+        self.version = version
+        self.body = body
+
+    @property
+    def instructions(self):
+        return [item for item in self.body if isinstance(item, Instruction)]
+
+    def labels(self):
+        """
+        :return: dict of label name to the index in body of the next instruction.
+        """
+        result = {}
+        index = 0
+        for item in self.body:
+            if isinstance(item, Label):
+                result[item.name] = index
+            else:
+                index += 1
+        return result
+
+    def text(self):
+        lines = ["#pragma version {}".format(self.version)]
+        for item in self.body:
+            lines.append(item.name + ":" if isinstance(item, Label) else item.text())
+        return "\n".join(lines)
+
+    def copy(self):
+        return Program(self.version, list(self.body))
+
+
+_TOKEN = re.compile(r'"(?:[^"\\]|\\.)*"|//.*|\S+')
+
+
+def _tokenize(line):
+    tokens = []
+    for match in _TOKEN.finditer(line):
+        token = match.group(0)
+        if token.startswith("//"):
+            break
+        tokens.append(token)
+    return tokens
+
+
+def parse(source):
+    """
+    Parses TEAL assembly.
+    :return: Program
+    """
+    version = 1
+    body = []
+    for number, raw in enumerate(source.splitlines(), start=1):
+        tokens = _tokenize(raw)
+        if not tokens:
+            continue
+        if tokens[0] == "#pragma":
+            if len(tokens) != 3 or tokens[1] != "version":
+                raise TealError("unsupported pragma", number)
+            version = int(tokens[2])
+            if version > MAX_VERSION:
+                raise TealError("unsupported version {}".format(version), number)
+            continue
+        if len(tokens) == 1 and tokens[0].endswith(":"):
+            body.append(Label(tokens[0][:-1], number))
+            continue
+        op = tokens[0]
+        if op not in OPCODES and op not in PSEUDO_OPS:
+            raise TealError("unknown opcode {}".format(op), number)
+        body.append(Instruction(op, tokens[1:], number))
+    return Program(version, body)
+
+
+def is_template(token):
+    return token.startswith(TEMPLATE_PREFIX)
+
+
+def parse_int(token):
+    if token in NAMED_INTS:
+        return NAMED_INTS[token]
+    if token.startswith(("0x", "0X")):
+        return int(token, 16)
+    if len(token) > 1 and token.startswith("0"):
+        return int(token, 8)
+    return int(token)
+
+
+_ESCAPES = {"n": b"\n", "r": b"\r", "t": b"\t", '"': b'"', "\\": b"\\"}
+
+
+def _parse_string(token):
+    body = token[1:-1]
+    out = bytearray()
+    i = 0
+    while i < len(body):
+        char = body[i]
+        if char != "\\":
+            out += char.encode()
+            i += 1
+            continue
+        escape = body[i + 1]
+        if escape == "x":
+            out.append(int(body[i + 2 : i + 4], 16))
+            i += 4
+        else:
+            out += _ESCAPES[escape]
+            i += 2
+    return bytes(out)
+
+
+def _b32decode(text):
+    return base64.b32decode(text + "=" * (-len(text) % 8))
+
+
+def parse_bytes(args):
+    """
+    Parses the arguments of a byte pseudo-op or bytecblock entry.
+    :return: tuple of (bytes, number of tokens consumed).
+    """
+    token = args[0]
+    if token.startswith('"'):
+        return _parse_string(token), 1
+    if token.startswith(("0x", "0X")):
+        return bytes.fromhex(token[2:]), 1
+    for name, decode in (
+        ("base64", base64.b64decode),
+        ("b64", base64.b64decode),
+        ("base32", _b32decode),
+        ("b32", _b32decode),
+    ):
+        if token == name:
+            return decode(args[1]), 2
+        if token.startswith(name + "(") and token.endswith(")"):
+            return decode(token[len(name) + 1 : -1]), 1
+    raise TealError("cannot parse byte constant {}".format(token))
+
+
+def parse_addr(token):
+    raw = _b32decode(token)
+    if len(raw) != 36:
+        raise TealError("invalid address {}".format(token))
+    return raw[:32]
+
+
+def constant_value(instruction):
+    """
+    :return: the value loaded by an int, byte, addr, pushint or pushbytes
+        instruction, or None for template placeholders.
+    """
+    op, args = instruction.op, instruction.args
+    if args and is_template(args[0]):
+        return None
+    if op in ("int", "pushint"):
+        return parse_int(args[0])
+    if op in ("byte", "pushbytes"):
+        return parse_bytes(args)[0]
+    if op == "addr":
+        return parse_addr(args[0])
+    raise TealError("{} is not a constant load".format(op), instruction.line)
+
+
+def field_index(kind, token):
+    """
+    Resolves a named (or numeric) field immediate.
+    """
+    if kind == "u8" or token.isdigit():
+        return int(token)
+    try:
+        return FIELD_TABLES[kind].index(token)
+    except ValueError:
+        raise TealError("unknown field {}".format(token))
+
+
+def encode_varuint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _encode_bytes(value):
+    return encode_varuint(len(value)) + value
+
+
+def _resolve_template(token, template, line):
+    if template is None or token not in template:
+        raise TealError("unbound template variable {}".format(token), line)
+    return template[token]
+
+
+def _constant(instruction, template):
+    value = constant_value(instruction)
+    if value is None:
+        value = _resolve_template(instruction.args[0], template, instruction.line)
+        if instruction.op == "addr" and isinstance(value, str):
+            value = parse_addr(value)
+    return value
+
+
+class _ConstantPlan:
+    """
+    Decides how every int/byte/addr pseudo-op is loaded: values used more than
+    once go into intcblock/bytecblock ordered by use count, the rest are pushed
+    inline with pushint/pushbytes.
+    """
+
+    def __init__(self, instructions, template):
+        self.ints = []
+        self.bytes = []
+        self.explicit = False
+        counts = {}
+        order = []
+        for ins in instructions:
+            if ins.op in ("intcblock", "bytecblock"):
+                self.explicit = True
+            if ins.op in PSEUDO_OPS:
+                kind = "int" if ins.op == "int" else "byte"
+                key = (kind, _constant(ins, template))
+                if key not in counts:
+                    order.append(key)
+                    counts[key] = 0
+                counts[key] += 1
+        if self.explicit:
+            for ins in instructions:
+                if ins.op == "intcblock":
+                    self.ints = [parse_int(a) for a in ins.args]
+                elif ins.op == "bytecblock":
+                    self.bytes = parse_bytes_list(ins.args)
+            return
+        shared = [key for key in order if counts[key] > 1]
+        shared.sort(key=lambda key: -counts[key])
+        self.ints = [value for kind, value in shared if kind == "int"]
+        self.bytes = [value for kind, value in shared if kind == "byte"]
+
+    def header(self, record=None, starts=None):
+        """
+        :param record: optional function called with the (kind, value) key, offset
+            and size of every constant written, offsets relative to the header.
+        :param starts: optional list that receives the offset of every block.
+        """
+        if self.explicit:
+            return b""
+        out = bytearray()
+        if self.ints:
+            if starts is not None:
+                starts.append(len(out))
+            out += bytes([OPCODES["intcblock"].code]) + encode_varuint(len(self.ints))
+            for value in self.ints:
+                encoded = encode_varuint(value)
+                if record is not None:
+                    record(("int", value), len(out), len(encoded))
+                out += encoded
+        if self.bytes:
+            if starts is not None:
+                starts.append(len(out))
+            out += bytes([OPCODES["bytecblock"].code]) + encode_varuint(len(self.bytes))
+            for value in self.bytes:
+                encoded = _encode_bytes(value)
+                if record is not None:
+                    offset = len(out) + len(encoded) - len(value)
+                    record(("byte", value), offset, len(value))
+                out += encoded
+        return bytes(out)
+
+    def load(self, ins, template, record=None):
+        value = _constant(ins, template)
+        if ins.op == "int":
+            table, prefix, push = self.ints, "intc", "pushint"
+        else:
+            table, prefix, push = self.bytes, "bytec", "pushbytes"
+        if value in table:
+            index = table.index(value)
+            if index < 4:
+                return bytes([OPCODES["{}_{}".format(prefix, index)].code])
+            return bytes([OPCODES[prefix].code, index])
+        if push == "pushint":
+            key, encoded = ("int", value), encode_varuint(value)
+            size = len(encoded)
+        else:
+            key, encoded = ("byte", value), _encode_bytes(value)
+            size = len(value)
+        if record is not None:
+            # The value follows the opcode and, for bytes, their length.
+            record(key, 1 + len(encoded) - size, size)
+        return bytes([OPCODES[push].code]) + encoded
+
+
+def parse_bytes_list(args):
+    values = []
+    i = 0
+    while i < len(args):
+        value, used = parse_bytes(args[i:])
+        values.append(value)
+        i += used
+    return values
+
+
+def _encode(ins, template, plan, record=None):
+    """
+    Encodes one instruction, with a zero placeholder for branch offsets.
+    :param record: optional function called with the (kind, value) key, offset and
+        size of every constant written, offsets relative to the instruction.
+    """
+    if ins.op in PSEUDO_OPS:
+        return plan.load(ins, template, record)
+    spec = OPCODES[ins.op]
+    out = bytearray([spec.code])
+    kinds = spec.immediates
+    if kinds == ("ints",):
+        values = [
+            _resolve_template(a, template, ins.line) if is_template(a) else parse_int(a)
+            for a in ins.args
+        ]
+        out += encode_varuint(len(values))
+        for value in values:
+            encoded = encode_varuint(value)
+            if record is not None:
+                record(("int", value), len(out), len(encoded))
+            out += encoded
+        return bytes(out)
+    if kinds == ("byteslist",):
+        values = parse_bytes_list(ins.args)
+        out += encode_varuint(len(values)) + b"".join(_encode_bytes(v) for v in values)
+        return bytes(out)
+    if kinds == ("varuint",):
+        value = _constant(ins, template)
+        encoded = encode_varuint(value)
+        if record is not None:
+            record(("int", value), len(out), len(encoded))
+        return bytes(out) + encoded
+    if kinds == ("bytes",):
+        value = _constant(ins, template)
+        encoded = _encode_bytes(value)
+        if record is not None:
+            record(("byte", value), len(out) + len(encoded) - len(value), len(value))
+        return bytes(out) + encoded
+    if kinds == ("label",):
+        return bytes(out) + b"\0\0"
+    if len(ins.args) != len(kinds):
+        raise TealError(
+            "{} expects {} immediate(s)".format(ins.op, len(kinds)), ins.line
+        )
+    for kind, token in zip(kinds, ins.args):
+        if kind == "u8" and ins.op.startswith("ecdsa"):
+            index = ECDSA_CURVES.index(token) if token in ECDSA_CURVES else int(token)
+        else:
+            index = field_index(kind, token)
+        out.append(index)
+    return bytes(out)
+
+
+def implicit_block_cost(instructions):
+    """
+    :return: the cost of the intcblock/bytecblock the assembler puts in front of a
+        program that loads its constants with pseudo-ops, which runs on every path.
+    """
+    if any(ins.op in ("intcblock", "bytecblock") for ins in instructions):
+        return 0
+    counts = {}
+    for ins in instructions:
+        if ins.op in PSEUDO_OPS:
+            kind = "int" if ins.op == "int" else "byte"
+            key = (kind, ins.args)
+            counts[key] = counts.get(key, 0) + 1
+    kinds = {kind for (kind, _), count in counts.items() if count > 1}
+    return sum(OPCODES[kind + "cblock"].cost for kind in kinds)
+
+
+def _template_keys(instructions, template):
+    """
+    :return: dict of the (kind, value) key of every template value to its variable.
+        Variables of equal values share one key, and values equal to a constant of
+        the program are left out, as they load the same constant.
+    """
+    keys = {}
+    constants = set()
+    for ins in instructions:
+        kind = "int" if ins.op in ("int", "pushint", "intcblock") else "byte"
+        if ins.op in PSEUDO_OPS or ins.op in ("pushint", "pushbytes"):
+            tokens = ins.args[:1]
+        elif ins.op == "intcblock":
+            tokens = ins.args
+        else:
+            continue
+        for token in tokens:
+            if not is_template(token):
+                if ins.op == "intcblock":
+                    constants.add((kind, parse_int(token)))
+                else:
+                    constants.add((kind, constant_value(ins)))
+                continue
+            value = _resolve_template(token, template, ins.line)
+            if ins.op == "addr" and isinstance(value, str):
+                value = parse_addr(value)
+            keys.setdefault((kind, value), token)
+    for key in constants:
+        keys.pop(key, None)
+    return keys
+
+
+def assemble(program, template=None, slots=None, offsets=None):
+    """
+    Assembles a Program (or TEAL source) into bytecode.
+    :param template: optional dict of TMPL_ variable name to value (int, bytes, or
+        address string for addr).
+    :param slots: optional list that receives a (variable, offset, size) tuple for
+        every template value written, in bytecode order, so the bytecode can be
+        patched with other values of the same sizes. A value shared by several
+        variables is recorded under one of them, and one equal to a constant of the
+        program is not recorded.
+    :return: bytes
+    """
+    if isinstance(program, str):
+        program = parse(program)
+    instructions = program.instructions
+    plan = _ConstantPlan(instructions, template)
+    code = bytearray(encode_varuint(program.version))
+    record = None
+    if slots is not None:
+        keys = _template_keys(instructions, template)
+
+        def record(key, offset, size):
+            if key in keys:
+                slots.append((keys[key], base + offset, size))
+
+    base = len(code)
+    starts = []
+    code += plan.header(record, starts)
+    if offsets is not None:
+        offsets.update((base + start, None) for start in starts)
+    labels = {}
+    fixups = []
+    index = 0
+    for item in program.body:
+        if isinstance(item, Label):
+            labels[item.name] = len(code)
+            continue
+        if offsets is not None:
+            offsets[len(code)] = index
+        index += 1
+        base = len(code)
+        encoded = _encode(item, template, plan, record)
+        if item.op in ("bnz", "bz", "b", "callsub"):
+            fixups.append((len(code), item))
+        code += encoded
+    for position, ins in fixups:
+        if ins.args[0] not in labels:
+            raise TealError("unknown label {}".format(ins.args[0]), ins.line)
+        delta = labels[ins.args[0]] - (position + 3)
+        if not -0x8000 <= delta <= 0x7FFF:
+            raise TealError("branch too far", ins.line)
+        code[position + 1 : position + 3] = (delta & 0xFFFF).to_bytes(2, "big")
+    return bytes(code)
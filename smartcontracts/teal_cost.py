@@ -0,0 +1,538 @@
+"""
+Static opcode-cost and program-size analyzer for compiled TEAL.
+
+Every route of a contract is described by the transaction fields that select it
+(see ROUTES in the contract modules). The analyzer walks the compiled program
+with those fields bound, resolving the router's branches and exploring both
+sides of every branch that depends on runtime state. A route may also pin
+global state values under "GlobalState", e.g. the number of items a loop runs
+over. The cost of each approving path is summed with the v5 cost model, and
+every route reports its cheapest, typical (mean) and worst-case path. A route
+grouped with calls to the contract's "budget" route, listed in its BUDGET_CALLS,
+is measured against the opcode budget they pool with it.
+
+    python3 teal_cost.py                      # every contract in build.CONTRACTS
+    python3 teal_cost.py donation_votes
+    python3 teal_cost.py --teal some_program.teal
+"""
+import argparse
+import importlib
+import sys
+
+import teal
+
+# Times a path may take the same backward branch, per iteration of the loops
+# around it, before it is cut off.
+DEFAULT_LOOP_BOUND = 16
+# Paths explored per route before the analysis gives up on the rest.
+DEFAULT_MAX_PATHS = 20000
+
+_UINT64 = 2**64
+
+# Placeholder for values not known statically.
+UNKNOWN = None
+
+
+class RouteCost:
+    """
+    Cost summary of one route.
+    :param paths: number of approving paths found.
+    :param rejected: number of paths that end in err, a failed assert or return 0.
+    :param truncated: number of paths cut off by the loop bound or path limit. A
+        non-zero value means the worst case is a lower bound.
+    """
+
+    def __init__(self, name, costs, rejected, truncated):
+        self.name = name
+        self.paths = len(costs)
+        self.rejected = rejected
+        self.truncated = truncated
+        self.min = min(costs) if costs else None
+        self.max = max(costs) if costs else None
+        self.typical = round(sum(costs) / len(costs), 1) if costs else None
+
+    def as_dict(self):
+        return {
+            "min": self.min,
+            "typical": self.typical,
+            "max": self.max,
+            "paths": self.paths,
+            "truncated": self.truncated,
+        }
+
+
+class _Path:
+    __slots__ = ("pc", "stack", "scratch", "calls", "loops", "cost")
+
+    def __init__(self, pc, stack, scratch, calls, loops, cost):
+        self.pc = pc
+        self.stack = stack
+        self.scratch = scratch
+        self.calls = calls
+        self.loops = loops
+        self.cost = cost
+
+    def fork(self, pc):
+        return _Path(
+            pc,
+            list(self.stack),
+            dict(self.scratch),
+            list(self.calls),
+            dict(self.loops),
+            self.cost,
+        )
+
+
+class _Reject(Exception):
+    pass
+
+
+def _as_bytes(value):
+    if isinstance(value, str):
+        return value.encode()
+    if isinstance(value, int):
+        return value.to_bytes(8, "big")
+    return value
+
+
+def _route_env(route):
+    """
+    Normalizes a route spec into known txn/global field values.
+    """
+    env = dict(route)
+    if "ApplicationID" not in env:
+        # Any existing application, for routes other than creation.
+        env["ApplicationID"] = 1
+    if isinstance(env.get("OnCompletion"), str):
+        env["OnCompletion"] = teal.NAMED_INTS[env["OnCompletion"]]
+    if "ApplicationArgs" in env:
+        env["ApplicationArgs"] = [_as_bytes(arg) for arg in env["ApplicationArgs"]]
+    env["GlobalState"] = {
+        _as_bytes(key): value for key, value in env.get("GlobalState", {}).items()
+    }
+    return env
+
+
+def _binary(op, a, b):
+    if op == "+":
+        result = a + b
+    elif op == "-":
+        result = a - b
+    elif op == "*":
+        result = a * b
+    elif op == "/":
+        if b == 0:
+            raise _Reject()
+        result = a // b
+    elif op == "%":
+        if b == 0:
+            raise _Reject()
+        result = a % b
+    elif op == "<":
+        result = int(a < b)
+    elif op == ">":
+        result = int(a > b)
+    elif op == "<=":
+        result = int(a <= b)
+    elif op == ">=":
+        result = int(a >= b)
+    elif op == "&&":
+        result = int(bool(a) and bool(b))
+    elif op == "||":
+        result = int(bool(a) or bool(b))
+    elif op == "==":
+        return int(a == b)
+    elif op == "!=":
+        return int(a != b)
+    elif op == "|":
+        result = a | b
+    elif op == "&":
+        result = a & b
+    elif op == "^":
+        result = a ^ b
+    elif op == "concat":
+        return a + b
+    else:
+        return UNKNOWN
+    if not 0 <= result < _UINT64:
+        raise _Reject()
+    return result
+
+
+def _extract_int(op, a, b):
+    """
+    :return: the uint64 at offset b of a for extract_uint64, the byte at index b
+        for getbyte.
+    """
+    size = 8 if op == "extract_uint64" else 1
+    if b + size > len(a):
+        raise _Reject()
+    return int.from_bytes(a[b : b + size], "big")
+
+
+_BINARY_OPS = {
+    "+", "-", "*", "/", "%", "<", ">", "<=", ">=", "&&", "||", "==", "!=", "|",
+    "&", "^", "concat",
+}  # fmt: skip
+
+
+class Analyzer:
+    """
+    Explores the paths of one program. Create once per program and call route()
+    for every route.
+    """
+
+    def __init__(
+        self, program, loop_bound=DEFAULT_LOOP_BOUND, max_paths=DEFAULT_MAX_PATHS
+    ):
+        if isinstance(program, str):
+            program = teal.parse(program)
+        self.program = program
+        self.code = program.instructions
+        self.labels = program.labels()
+        self.loop_bound = loop_bound
+        self.max_paths = max_paths
+        self.intc = []
+        self.bytec = []
+        for ins in self.code:
+            if ins.op == "intcblock":
+                self.intc = [teal.parse_int(arg) for arg in ins.args]
+            elif ins.op == "bytecblock":
+                self.bytec = teal.parse_bytes_list(ins.args)
+        self.header_cost = teal.implicit_block_cost(self.code)
+
+    def size(self):
+        return len(teal.assemble(self.program))
+
+    def route(self, name, route):
+        env = _route_env(route)
+        costs = []
+        rejected = 0
+        pending = [_Path(0, [], {}, [], {}, self.header_cost)]
+        self._truncated = 0
+        while pending:
+            if len(costs) + rejected + self._truncated >= self.max_paths:
+                self._truncated += len(pending)
+                break
+            path = pending.pop()
+            try:
+                outcome = self._run(path, env, pending)
+            except _Reject:
+                rejected += 1
+                continue
+            if outcome is None:
+                self._truncated += 1
+            elif outcome:
+                costs.append(path.cost)
+            else:
+                rejected += 1
+        return RouteCost(name, costs, rejected, self._truncated)
+
+    def _jump(self, path, label):
+        target = self.labels[label]
+        if target <= path.pc:
+            count = path.loops.get(target, 0) + 1
+            if count > self.loop_bound:
+                return False
+            # Loops nested in this one start counting again on its next iteration.
+            for inner in [t for t in path.loops if target < t < path.pc]:
+                del path.loops[inner]
+            path.loops[target] = count
+        path.pc = target
+        return True
+
+    def _run(self, path, env, pending):
+        """
+        Runs a path until it ends, pushing the other side of every unresolved branch
+        onto pending.
+        :return: True when the path approves, False when it rejects and None when it
+            is truncated.
+        """
+        code = self.code
+        stack = path.stack
+        while True:
+            if path.pc >= len(code):
+                return bool(stack) and stack[-1] != 0
+            ins = code[path.pc]
+            op = ins.op
+            spec = ins.spec
+            path.cost += spec.cost
+            path.pc += 1
+
+            if op in ("int", "byte", "addr", "pushint", "pushbytes"):
+                stack.append(teal.constant_value(ins))
+            elif op.startswith("intc") and op != "intcblock":
+                index = int(ins.args[0]) if op == "intc" else int(op[-1])
+                stack.append(self.intc[index] if index < len(self.intc) else UNKNOWN)
+            elif op.startswith("bytec") and op != "bytecblock":
+                index = int(ins.args[0]) if op == "bytec" else int(op[-1])
+                stack.append(self.bytec[index] if index < len(self.bytec) else UNKNOWN)
+            elif op == "txn":
+                stack.append(self._txn(env, ins.args[0]))
+            elif op == "txna":
+                args = env.get(ins.args[0])
+                index = int(ins.args[1])
+                known = args is not None and index < len(args)
+                stack.append(args[index] if known else UNKNOWN)
+            elif op == "txnas":
+                args = env.get(ins.args[0])
+                index = stack.pop()
+                known = args is not None and index is not UNKNOWN
+                stack.append(args[index] if known and index < len(args) else UNKNOWN)
+            elif op == "app_global_get":
+                key = stack.pop()
+                stack.append(env["GlobalState"].get(key, UNKNOWN))
+            elif op == "app_global_get_ex":
+                key = stack.pop()
+                app = stack.pop()
+                known = app == 0 and key in env["GlobalState"]
+                stack.append(env["GlobalState"][key] if known else UNKNOWN)
+                stack.append(1 if known else UNKNOWN)
+            elif op == "global":
+                stack.append(self._global(env, ins.args[0]))
+            elif op in _BINARY_OPS:
+                b = stack.pop()
+                a = stack.pop()
+                known = a is not UNKNOWN and b is not UNKNOWN
+                stack.append(_binary(op, a, b) if known else UNKNOWN)
+            elif op == "!":
+                a = stack.pop()
+                stack.append(UNKNOWN if a is UNKNOWN else int(a == 0))
+            elif op == "len":
+                a = stack.pop()
+                stack.append(UNKNOWN if a is UNKNOWN else len(a))
+            elif op == "itob":
+                a = stack.pop()
+                stack.append(UNKNOWN if a is UNKNOWN else a.to_bytes(8, "big"))
+            elif op == "extract":
+                a = stack.pop()
+                start, length = int(ins.args[0]), int(ins.args[1])
+                end = start + length if length else None
+                if a is not UNKNOWN and (end or start) > len(a):
+                    raise _Reject()
+                stack.append(UNKNOWN if a is UNKNOWN else a[start:end])
+            elif op in ("substring3", "extract3"):
+                c = stack.pop()
+                b = stack.pop()
+                a = stack.pop()
+                known = UNKNOWN not in (a, b, c)
+                end = c if op == "substring3" else b + c
+                if known and not b <= end <= len(a):
+                    raise _Reject()
+                stack.append(a[b:end] if known else UNKNOWN)
+            elif op in ("extract_uint64", "getbyte"):
+                b = stack.pop()
+                a = stack.pop()
+                known = a is not UNKNOWN and b is not UNKNOWN
+                stack.append(_extract_int(op, a, b) if known else UNKNOWN)
+            elif op == "setbyte":
+                c = stack.pop()
+                b = stack.pop()
+                a = stack.pop()
+                known = UNKNOWN not in (a, b, c)
+                if known and (b >= len(a) or c > 255):
+                    raise _Reject()
+                stack.append(a[:b] + bytes([c]) + a[b + 1 :] if known else UNKNOWN)
+            elif op == "btoi":
+                a = stack.pop()
+                known = a is not UNKNOWN and len(a) <= 8
+                stack.append(int.from_bytes(a, "big") if known else UNKNOWN)
+            elif op == "load":
+                stack.append(path.scratch.get(int(ins.args[0]), 0))
+            elif op == "store":
+                path.scratch[int(ins.args[0])] = stack.pop()
+            elif op == "pop":
+                stack.pop()
+            elif op == "dup":
+                stack.append(stack[-1])
+            elif op == "dup2":
+                stack.extend(stack[-2:])
+            elif op == "swap":
+                stack[-1], stack[-2] = stack[-2], stack[-1]
+            elif op == "dig":
+                stack.append(stack[-1 - int(ins.args[0])])
+            elif op == "cover":
+                depth = int(ins.args[0])
+                stack.insert(len(stack) - 1 - depth, stack.pop())
+            elif op == "uncover":
+                depth = int(ins.args[0])
+                stack.append(stack.pop(len(stack) - 1 - depth))
+            elif op == "select":
+                c = stack.pop()
+                b = stack.pop()
+                a = stack.pop()
+                if c is UNKNOWN:
+                    stack.append(UNKNOWN if a != b else a)
+                else:
+                    stack.append(b if c else a)
+            elif op == "b":
+                if not self._jump(path, ins.args[0]):
+                    return None
+            elif op in ("bnz", "bz"):
+                condition = stack.pop()
+                if condition is UNKNOWN:
+                    other = path.fork(path.pc)
+                    if self._jump(other, ins.args[0]):
+                        pending.append(other)
+                    else:
+                        self._truncated += 1
+                    continue
+                if bool(condition) == (op == "bnz"):
+                    if not self._jump(path, ins.args[0]):
+                        return None
+            elif op == "callsub":
+                path.calls.append(path.pc)
+                if not self._jump(path, ins.args[0]):
+                    return None
+            elif op == "retsub":
+                path.pc = path.calls.pop()
+            elif op == "assert":
+                if stack.pop() == 0:
+                    return False
+            elif op == "return":
+                return stack.pop() != 0
+            elif op == "err":
+                return False
+            else:
+                pops = spec.pops
+                if pops:
+                    del stack[len(stack) - pops :]
+                stack.extend([UNKNOWN] * spec.pushes)
+
+    @staticmethod
+    def _txn(env, field):
+        if field == "NumAppArgs" and "ApplicationArgs" in env:
+            return len(env["ApplicationArgs"])
+        return env.get(field, UNKNOWN)
+
+    @staticmethod
+    def _global(env, field):
+        if field == "ZeroAddress":
+            return bytes(32)
+        return env.get(field, UNKNOWN)
+
+
+def analyze(source, routes=None, **kwargs):
+    """
+    Analyzes every route of a compiled program.
+    :param source: TEAL source or parsed teal.Program.
+    :param routes: dict of route name to the transaction fields selecting it. When
+        omitted the whole program is analyzed as a single "program" route.
+    :return: tuple of (dict of route name to RouteCost, program size in bytes).
+    """
+    analyzer = Analyzer(source, **kwargs)
+    routes = routes if routes is not None else {"program": {}}
+    costs = {name: analyzer.route(name, route) for name, route in routes.items()}
+    return costs, analyzer.size()
+
+
+def pooled_budget(budget_calls, budget_route_cost):
+    """
+    :return: the opcode budget of a call grouped with budget_calls calls to the
+        budget route, less what those cost themselves.
+    """
+    return teal.MAX_APP_COST * (budget_calls + 1) - budget_calls * budget_route_cost
+
+
+def analyze_contract(contract, results=None):
+    """
+    Analyzes a contract module built by build.py. The module may set LOOP_BOUND,
+    the most iterations any of its loops can run, in place of DEFAULT_LOOP_BOUND,
+    and BUDGET_CALLS, the number of "budget" route calls by route that are grouped
+    with it.
+    :param results: optional build result of the contract, as returned by
+        build.build_contracts. Built (through the compile cache) when omitted.
+    :return: dict with the route costs, each with the opcode budget it has, and
+        program sizes.
+    """
+    import build
+
+    if results is None:
+        results = build.build_contracts([contract])[contract]
+    module = importlib.import_module(contract)
+    routes = getattr(module, "ROUTES", None)
+    loop_bound = getattr(module, "LOOP_BOUND", DEFAULT_LOOP_BOUND)
+    budget_calls = getattr(module, "BUDGET_CALLS", {})
+    approval, approval_size = analyze(
+        results["approval"][0], routes, loop_bound=loop_bound
+    )
+    _, clear_size = analyze(results["clear"][0])
+    costs = {name: cost.as_dict() for name, cost in approval.items()}
+    for name, cost in costs.items():
+        cost["budget"] = teal.MAX_APP_COST
+        if name in budget_calls:
+            cost["budget"] = pooled_budget(
+                budget_calls[name], approval["budget"].max
+            )
+    return {
+        "routes": costs,
+        "approval_bytes": approval_size,
+        "clear_bytes": clear_size,
+    }
+
+
+def format_report(name, report, budget=teal.MAX_APP_COST):
+    """
+    :param budget: opcode budget of the routes that do not give their own.
+    """
+    lines = ["{}".format(name)]
+    lines.append(
+        "  {:<16} {:>6} {:>8} {:>6} {:>7} {:>6}".format(
+            "route", "min", "typical", "max", "budget", "paths"
+        )
+    )
+    for route, cost in report["routes"].items():
+        if cost["max"] is None:
+            lines.append("  {:<16} {:>6}".format(route, "reject"))
+            continue
+        route_budget = cost.get("budget", budget)
+        lines.append(
+            "  {:<16} {:>6} {:>8} {:>6} {:>6.1f}% {:>6}{}{}".format(
+                route,
+                cost["min"],
+                cost["typical"],
+                cost["max"],
+                100.0 * cost["max"] / route_budget,
+                cost["paths"],
+                " (pooled {})".format(route_budget) if route_budget != budget else "",
+                " (truncated)" if cost["truncated"] else "",
+            )
+        )
+    if "approval_bytes" in report:
+        total = report["approval_bytes"] + report["clear_bytes"]
+        lines.append(
+            "  size: approval {} B, clear {} B, total {} / {} B ({:.1f}%)".format(
+                report["approval_bytes"],
+                report["clear_bytes"],
+                total,
+                teal.MAX_APP_PROGRAM_LEN,
+                100.0 * total / teal.MAX_APP_PROGRAM_LEN,
+            )
+        )
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    import build
+
+    parser = argparse.ArgumentParser(description="Report opcode cost per route.")
+    parser.add_argument("contracts", nargs="*", default=build.CONTRACTS)
+    parser.add_argument("--teal", help="analyze a TEAL file instead of contracts")
+    args = parser.parse_args(argv)
+
+    if args.teal:
+        with open(args.teal) as f:
+            costs, size = analyze(f.read())
+        report = {"routes": {n: c.as_dict() for n, c in costs.items()}}
+        print(format_report(args.teal, report))
+        print("  size: {} B".format(size))
+        return 0
+
+    results = build.build_contracts(args.contracts)
+    for contract in args.contracts:
+        print(format_report(contract, analyze_contract(contract, results[contract])))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,380 @@
+"""
+Peephole optimizer for compiled TEAL.
+
+Rewrites programs with semantics-preserving rules, repeated until nothing changes:
+
+- dead code: instructions no path can reach, e.g. after Approve()/Reject(), and
+  labels no branch refers to, are removed.
+- jumps: branches to the next instruction are dropped, jumps to a jump are
+  threaded, and jumps to an `int N; return` block are replaced by a copy of it.
+- assert/return: `assert; int 1; return` becomes `return`, which approves and
+  rejects in exactly the same cases.
+- redundant loads: a value loaded twice in a row is duplicated instead
+  (`byte k; byte k` -> `byte k; dup`), and `store n; load n` becomes
+  `dup; store n`.
+- constants: int/byte constants used more than once are gathered into explicit
+  intcblock/bytecblock instructions ordered by use count, so the most used ones
+  get the one byte intc_N/bytec_N forms. Programs with template variables
+  (TMPL_*) keep their pseudo-ops: goal cannot substitute an address inside a
+  bytecblock, and the assembler lays their constants out the same way once the
+  values are known.
+
+Instructions keep the source line they were parsed from, so the optimized
+program still maps back to the original one.
+
+    python3 teal_opt.py nft_3way_txn.teal.tmpl -o build/nft_3way_txn.teal.tmpl
+"""
+import argparse
+import sys
+
+import teal
+from teal import Instruction, Label
+
+# Opcodes after which execution never falls through to the next instruction.
+TERMINATORS = {"b", "return", "err", "retsub"}
+BRANCHES = {"b", "bz", "bnz", "callsub"}
+
+
+def _referenced_labels(body):
+    return {
+        item.args[0]
+        for item in body
+        if isinstance(item, Instruction) and item.op in BRANCHES
+    }
+
+
+def remove_dead_code(program):
+    """
+    Removes instructions unreachable from the entry point and unreferenced labels.
+    """
+    body = program.body
+    positions = {item.name: i for i, item in enumerate(body) if isinstance(item, Label)}
+    reachable = set()
+    pending = [0]
+    while pending:
+        i = pending.pop()
+        while i < len(body) and i not in reachable:
+            reachable.add(i)
+            item = body[i]
+            if isinstance(item, Instruction):
+                if item.op in BRANCHES:
+                    pending.append(positions[item.args[0]])
+                if item.op in TERMINATORS:
+                    break
+            i += 1
+    kept = [item for i, item in enumerate(body) if i in reachable]
+    referenced = _referenced_labels(kept)
+    kept = [
+        item for item in kept if not isinstance(item, Label) or item.name in referenced
+    ]
+    changed = len(kept) != len(body)
+    program.body = kept
+    return changed
+
+
+def _label_targets(body):
+    """
+    :return: dict of label name to the first instruction after it, or None.
+    """
+    targets = {}
+    for i, item in enumerate(body):
+        if isinstance(item, Label):
+            following = body[i + 1 :]
+            targets[item.name] = next(
+                (x for x in following if isinstance(x, Instruction)), None
+            )
+    return targets
+
+
+def _block_at(body, name):
+    """
+    :return: the instructions from label name up to the next label or terminator.
+    """
+    start = next(
+        i
+        for i, item in enumerate(body)
+        if isinstance(item, Label) and item.name == name
+    )
+    block = []
+    for item in body[start + 1 :]:
+        if isinstance(item, Label):
+            # Skip over labels that directly follow, they mark the same position.
+            if block:
+                return block
+            continue
+        block.append(item)
+        if item.op in TERMINATORS:
+            return block
+    return block
+
+
+def simplify_jumps(program):
+    body = program.body
+    changed = False
+    targets = _label_targets(body)
+    out = []
+    for i, item in enumerate(body):
+        if isinstance(item, Instruction) and item.op in ("b", "bz", "bnz"):
+            name = item.args[0]
+            # Thread jumps to an unconditional jump.
+            seen = {name}
+            target = targets.get(name)
+            while (
+                target is not None and target.op == "b" and target.args[0] not in seen
+            ):
+                name = target.args[0]
+                seen.add(name)
+                target = targets.get(name)
+            if name != item.args[0]:
+                item = Instruction(item.op, (name,), item.line)
+                changed = True
+            # Drop branches to the position right after them.
+            following = body[i + 1 :]
+            labels_next = []
+            for x in following:
+                if not isinstance(x, Label):
+                    break
+                labels_next.append(x.name)
+            if name in labels_next:
+                if item.op != "b":
+                    out.append(Instruction("pop", (), item.line))
+                changed = True
+                continue
+            # Replace jumps to `int N; return` with a copy of it.
+            if item.op == "b":
+                block = _block_at(body, name)
+                if len(block) == 2 and block[0].op == "int" and block[1].op == "return":
+                    out.extend(Instruction(x.op, x.args, item.line) for x in block)
+                    changed = True
+                    continue
+        out.append(item)
+    program.body = out
+    return changed
+
+
+def _window_rewrite(program, size, rewrite):
+    """
+    Applies rewrite to every window of size consecutive instructions that no label
+    interrupts. rewrite returns the replacement list or None to keep the window.
+    """
+    body = program.body
+    out = []
+    changed = False
+    i = 0
+    while i < len(body):
+        window = body[i : i + size]
+        if len(window) == size and all(isinstance(x, Instruction) for x in window):
+            replacement = rewrite(window)
+            if replacement is not None:
+                out.extend(replacement)
+                i += size
+                changed = True
+                continue
+        out.append(body[i])
+        i += 1
+    program.body = out
+    return changed
+
+
+def fold_assert_return(program):
+    def rewrite(window):
+        assert_, one, return_ = window
+        if (
+            assert_.op == "assert"
+            and one.op == "int"
+            and one.args == ("1",)
+            and return_.op == "return"
+        ):
+            return [Instruction("return", (), assert_.line)]
+        return None
+
+    return _window_rewrite(program, 3, rewrite)
+
+
+# Instructions that push a value without side effects, so a second identical
+# instruction right after can be replaced by dup.
+_PURE_LOADS = {
+    "int",
+    "byte",
+    "addr",
+    "pushint",
+    "pushbytes",
+    "load",
+    "txn",
+    "txna",
+    "global",
+}
+
+
+def eliminate_redundant_loads(program):
+    def rewrite(window):
+        first, second = window
+        if first.op in _PURE_LOADS and first == second:
+            return [first, Instruction("dup", (), second.line)]
+        if first.op == "store" and second.op == "load" and first.args == second.args:
+            return [Instruction("dup", (), first.line), first]
+        return None
+
+    return _window_rewrite(program, 2, rewrite)
+
+
+def _constant_key(ins):
+    if ins.op not in teal.PSEUDO_OPS:
+        return None
+    kind = "int" if ins.op == "int" else "byte"
+    return kind, teal.constant_value(ins)
+
+
+def _format_bytes(value):
+    return "0x" + value.hex()
+
+
+def build_constant_blocks(program):
+    """
+    Moves constants used more than once into frequency-ordered intcblock and
+    bytecblock instructions and rewrites every constant load to use them.
+    """
+    body = program.body
+    for ins in program.instructions:
+        if ins.op in ("intcblock", "bytecblock"):
+            return False
+        if any(teal.is_template(arg) for arg in ins.args):
+            return False
+    counts = {}
+    order = []
+    # Byte constants keep the literal they were first written as.
+    literals = {}
+    for item in body:
+        if isinstance(item, Instruction):
+            key = _constant_key(item)
+            if key is not None:
+                if key not in counts:
+                    counts[key] = 0
+                    order.append(key)
+                    if item.op == "byte":
+                        literals[key] = item.args
+                counts[key] += 1
+    if not counts:
+        return False
+    shared = [key for key in order if counts[key] > 1]
+    shared.sort(key=lambda key: -counts[key])
+    ints = [value for kind, value in shared if kind == "int"]
+    byteslist = [value for kind, value in shared if kind == "byte"]
+
+    out = []
+    if ints:
+        out.append(Instruction("intcblock", [str(v) for v in ints]))
+    if byteslist:
+        args = []
+        for value in byteslist:
+            args.extend(literals.get(("byte", value), (_format_bytes(value),)))
+        out.append(Instruction("bytecblock", args))
+    for item in body:
+        key = _constant_key(item) if isinstance(item, Instruction) else None
+        if key is None:
+            out.append(item)
+            continue
+        kind, value = key
+        table, prefix = (ints, "intc") if kind == "int" else (byteslist, "bytec")
+        if value in table:
+            index = table.index(value)
+            if index < 4:
+                out.append(Instruction("{}_{}".format(prefix, index), (), item.line))
+            else:
+                out.append(Instruction(prefix, (str(index),), item.line))
+        elif kind == "int":
+            out.append(Instruction("pushint", (str(value),), item.line))
+        else:
+            out.append(Instruction("pushbytes", (_format_bytes(value),), item.line))
+    program.body = out
+    return True
+
+
+# Rules run until none of them changes the program.
+PASSES = [
+    remove_dead_code,
+    simplify_jumps,
+    fold_assert_return,
+    eliminate_redundant_loads,
+]
+
+
+def optimize(source):
+    """
+    Optimizes TEAL source or a parsed teal.Program.
+    :return: the optimized teal.Program.
+    """
+    program = teal.parse(source) if isinstance(source, str) else source.copy()
+    changed = True
+    while changed:
+        changed = False
+        for rule in PASSES:
+            changed = rule(program) or changed
+    build_constant_blocks(program)
+    return program
+
+
+def placeholder_values(program):
+    """
+    :return: stand-in values for every template variable of a program, for sizing.
+    """
+    values = {}
+    for ins in program.instructions:
+        for arg in ins.args:
+            if teal.is_template(arg):
+                values[arg] = bytes(32) if ins.op == "addr" else 1
+    return values
+
+
+def program_size(program):
+    return len(teal.assemble(program, placeholder_values(program)))
+
+
+def report(name, before, after, routes=None, budget=teal.MAX_APP_COST):
+    """
+    Formats a before/after comparison of size and estimated worst-case cost.
+    """
+    import teal_cost
+
+    lines = [name]
+    size_before = program_size(before)
+    size_after = program_size(after)
+    lines.append(
+        "  size: {} B -> {} B ({:+d} B)".format(
+            size_before, size_after, size_after - size_before
+        )
+    )
+    routes = routes or {"program": {}}
+    old = teal_cost.Analyzer(before)
+    new = teal_cost.Analyzer(after)
+    for route, fields in routes.items():
+        cost_before = old.route(route, fields).max
+        cost_after = new.route(route, fields).max
+        if cost_before is None or cost_after is None:
+            continue
+        lines.append(
+            "  {:<16} max cost {} -> {} ({:+d}) of {}".format(
+                route, cost_before, cost_after, cost_after - cost_before, budget
+            )
+        )
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Optimize a TEAL program.")
+    parser.add_argument("source", help="TEAL file (templates are accepted)")
+    parser.add_argument("-o", "--output", help="write the optimized program here")
+    args = parser.parse_args(argv)
+
+    with open(args.source) as f:
+        before = teal.parse(f.read())
+    after = optimize(before)
+    print(report(args.source, before, after))
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(after.text() + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
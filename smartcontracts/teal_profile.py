@@ -0,0 +1,252 @@
+"""
+Opcode-cost profiler for execution traces of compiled contracts.
+
+Reads the app call traces of JSON files in the shape of algod's dryrun response
+(POST /v2/teal/dryrun), whose "txns" each hold an "app-call-trace" of steps with
+the "pc" they ran at. write_trace() writes the traces avm.Ledger(trace=True)
+records in the same shape. Every step costs its opcode's v5 cost, looked up at
+its pc in the bytecode teal.assemble() makes of the program, and is followed back
+through the program's source map (build.py --source-map, see source_map.py) to
+the Python lines that built it.
+
+callsub and retsub are followed, so a step inside a subroutine is charged under
+the frames of the line that called it. The report gives the cost of every contract
+line, the lines of helpers like state.py charged to the contract line calling
+them, and of every subroutine, on its own lines and including the subroutines it
+calls. --folded writes folded stacks, one "frame;frame;... cost" line per stack,
+which flamegraph.pl and speedscope read.
+
+    python3 build.py --source-map
+    python3 teal_profile.py build/donation_votes_approval.teal dryrun.json
+    python3 teal_profile.py build/donation_votes_approval.teal traces/*.json \\
+        --folded donation_votes.folded
+    flamegraph.pl donation_votes.folded > donation_votes.svg
+"""
+import argparse
+import json
+import os
+import sys
+
+import source_map
+import teal
+
+# Frame of the steps no line of the source map covers, like the constant blocks.
+UNMAPPED = "(constant blocks)"
+# Name of the main program in the subroutine report.
+MAIN = "(main)"
+
+_OPCODES_BY_CODE = {spec.code: spec for spec in teal.OPCODES.values()}
+
+
+class ProfileError(Exception):
+    pass
+
+
+def _contract_frame(stack):
+    """
+    :return: the innermost frame of stack in the file of its outermost one, the
+        contract line a helper module's lines are charged to.
+    """
+    for frame in reversed(stack):
+        if frame.path == stack[0].path:
+            return tuple(frame)
+    return ("", 0, UNMAPPED)
+
+
+class Profile:
+    """
+    Costs of the steps of one program's traces.
+    :ivar lines: dict of contract (path, line, function) to the cost of the steps
+        built there, or by helpers it called.
+    :ivar subroutines: dict of subroutine name, or MAIN, to [own cost, cost with the
+        subroutines it calls, calls].
+    :ivar stacks: dict of folded stack to cost.
+    :ivar traces: number of traces added.
+    :ivar cost: total cost.
+    """
+
+    def __init__(self, program, source_map, name="program"):
+        """
+        :param program: teal.Program the traces ran, or its TEAL source.
+        :param source_map: source_map.SourceMap of the program.
+        :param name: root frame of the folded stacks.
+        """
+        if isinstance(program, str):
+            program = teal.parse(program)
+        self.name = name
+        self.instructions = program.instructions
+        self.offsets = {}
+        self.bytecode = teal.assemble(program, offsets=self.offsets)
+        self.source_map = source_map
+        self.lines = {}
+        self.subroutines = {}
+        self.stacks = {}
+        self.traces = 0
+        self.cost = 0
+
+    def _step(self, pc):
+        """
+        :return: tuple of (opcode spec, instruction or None) run at pc.
+        """
+        if pc not in self.offsets:
+            raise ProfileError("no instruction starts at pc {}".format(pc))
+        spec = _OPCODES_BY_CODE[self.bytecode[pc]]
+        index = self.offsets[pc]
+        return spec, None if index is None else self.instructions[index]
+
+    def _totals(self, subroutine):
+        return self.subroutines.setdefault(subroutine, [0, 0, 0])
+
+    def add(self, pcs):
+        """
+        Adds the trace of one app call, the pc of every step it ran.
+        """
+        self._totals(MAIN)[2] += 1
+        # [frames of the call site, subroutine] of every call running, the
+        # subroutine known once its first step runs.
+        calls = []
+        for pc in pcs:
+            spec, ins = self._step(pc)
+            origin = None
+            if ins is not None and ins.line is not None:
+                origin = self.source_map.origin(ins.line)
+            if origin is None:
+                key = ("", 0, UNMAPPED)
+                frames = (UNMAPPED,)
+                subroutine = calls[-1][1] if calls else MAIN
+            else:
+                key = _contract_frame(origin.stack)
+                frames = tuple(
+                    "{} ({}:{})".format(frame.function, frame.path, frame.line)
+                    for frame in origin.stack
+                )
+                subroutine = origin.subroutine or MAIN
+            if calls and calls[-1][1] is None:
+                calls[-1][1] = subroutine
+                self._totals(subroutine)[2] += 1
+            cost = spec.cost
+            self.cost += cost
+            self.lines[key] = self.lines.get(key, 0) + cost
+            callers = calls[-1][0] if calls else ()
+            folded = ";".join((self.name,) + callers + frames)
+            self.stacks[folded] = self.stacks.get(folded, 0) + cost
+            self._totals(subroutine)[0] += cost
+            # Recursive calls count once towards their subroutine.
+            for name in {MAIN, subroutine}.union(call[1] for call in calls):
+                if name is not None:
+                    self._totals(name)[1] += cost
+            if ins is not None and ins.op == "callsub":
+                calls.append([callers + frames, None])
+            elif ins is not None and ins.op == "retsub" and calls:
+                calls.pop()
+        self.traces += 1
+
+    def report(self, top=20):
+        lines = [
+            "{}: {} trace(s), cost {}".format(self.name, self.traces, self.cost),
+            "  by line:",
+        ]
+        ranked = sorted(self.lines.items(), key=lambda item: -item[1])
+        for (path, line, function), cost in ranked[:top]:
+            where = "{}:{} {}".format(path, line, function) if path else function
+            lines.append(
+                "    {:>8} {:>5.1f}%  {}".format(
+                    cost, 100 * cost / (self.cost or 1), where
+                )
+            )
+        lines.append("  by subroutine (own, with callees, calls):")
+        ranked = sorted(self.subroutines.items(), key=lambda item: -item[1][1])
+        for name, (own, total, calls) in ranked:
+            lines.append("    {:>8} {:>8} {:>6}  {}".format(own, total, calls, name))
+        return "\n".join(lines)
+
+    def write_folded(self, path):
+        with open(path, "w") as f:
+            for stack, cost in sorted(self.stacks.items()):
+                f.write("{} {}\n".format(stack, cost))
+
+
+def read_traces(path):
+    """
+    :return: the list of app call traces of a dryrun response, each a list of pcs.
+    """
+    with open(path) as f:
+        document = json.load(f)
+    traces = []
+    for txn in document.get("txns") or ():
+        steps = txn.get("app-call-trace")
+        if steps:
+            traces.append([step["pc"] for step in steps])
+    return traces
+
+
+def avm_trace(result):
+    """
+    :return: the pcs of the steps of an avm.TxnResult's trace, the constant blocks
+        the assembler puts in front of the program first.
+    """
+    offsets = {}
+    teal.assemble(result.program, offsets=offsets)
+    pcs = {index: pc for pc, index in offsets.items() if index is not None}
+    header = sorted(pc for pc, index in offsets.items() if index is None)
+    return header + [pcs[index] for index in result.trace]
+
+
+def write_trace(path, results):
+    """
+    Writes the traces of avm.TxnResults of app calls run with Ledger(trace=True),
+    in the shape of a dryrun response.
+    """
+    txns = [
+        {"app-call-trace": [{"pc": pc} for pc in avm_trace(result)]}
+        for result in results
+        if result.trace is not None
+    ]
+    with open(path, "w") as f:
+        json.dump({"txns": txns}, f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Profile the opcode cost of traces by contract line."
+    )
+    parser.add_argument("teal", help="TEAL program the traces ran")
+    parser.add_argument("traces", nargs="+", help="dryrun response JSON files")
+    parser.add_argument(
+        "--map", help="source map of the program (default: the TEAL path + .map.json)"
+    )
+    parser.add_argument("--folded", help="write folded stacks to this file")
+    parser.add_argument(
+        "--top", type=int, default=20, help="lines shown in the report (default: 20)"
+    )
+    args = parser.parse_args(argv)
+
+    map_path = args.map or source_map.map_name(args.teal)
+    if not os.path.exists(map_path):
+        print(
+            "{}: no source map, build with build.py --source-map".format(map_path),
+            file=sys.stderr,
+        )
+        return 1
+    with open(args.teal) as f:
+        source = f.read()
+    name = os.path.basename(args.teal)
+    if name.endswith(".teal"):
+        name = name[: -len(".teal")]
+    profile = Profile(source, source_map.SourceMap.load(map_path, source), name)
+    try:
+        for path in args.traces:
+            for trace in read_traces(path):
+                profile.add(trace)
+    except ProfileError as e:
+        print("{}: {}".format(path, e), file=sys.stderr)
+        return 1
+    print(profile.report(args.top))
+    if args.folded:
+        profile.write_folded(args.folded)
+        print("wrote {}".format(args.folded))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
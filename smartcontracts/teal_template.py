@@ -0,0 +1,221 @@
+"""
+Offline instantiation of TEAL templates such as nft_3way_txn.teal.tmpl.
+
+Every NFT listing is the LogicSig template with its TMPL_ variables filled in, and
+its escrow is the address of the resulting bytecode. Instead of assembling the
+template once per listing, a Skeleton assembles it once per layout and records
+where each variable's value lands in the bytecode, so a listing is a few byte
+splices and a hash:
+
+    skeleton = teal_template.Skeleton.load("nft_3way_txn.teal.tmpl")
+    program = skeleton.instantiate({"TMPL_ASSET_ID": 1234, ...})
+    escrow = teal_template.program_address(program)
+
+Integers are varuints, and equal values share one constant, so the layout depends
+on how many bytes each value takes and on which values are equal to each other or
+to a constant of the template. A skeleton keeps one layout per such shape it has
+seen, and the bytecode is exactly what teal.assemble() produces for the values.
+
+Instantiate a CSV of listings, one column per template variable, into a CSV with
+the escrow address and base64 bytecode of each:
+
+    python3 teal_template.py nft_3way_txn.teal.tmpl listings.csv -o escrows.csv
+"""
+import argparse
+import base64
+import csv
+import hashlib
+import sys
+
+import teal
+
+# Largest value of a TEAL uint64.
+MAX_UINT64 = 2 ** 64 - 1
+
+
+def program_address(program):
+    """
+    :return: the address of the contract account of a LogicSig's bytecode.
+    """
+    digest = hashlib.new("sha512_256", b"Program" + program).digest()
+    checksum = hashlib.new("sha512_256", digest).digest()[-4:]
+    return base64.b32encode(digest + checksum).decode().rstrip("=")
+
+
+class Skeleton:
+    """
+    A template program assembled once per layout and patched per instantiation.
+    """
+
+    def __init__(self, program):
+        if isinstance(program, str):
+            program = teal.parse(program)
+        self.program = program
+        # Template variables in order of first use, and the op that loads each.
+        self.variables = []
+        self.ops = {}
+        # (kind, value) keys of the constants the template loads.
+        self._constants = set()
+        for ins in program.instructions:
+            templates = [arg for arg in ins.args if teal.is_template(arg)]
+            if ins.op not in teal.PSEUDO_OPS:
+                if templates:
+                    raise teal.TealError(
+                        "{} is only supported in int, byte and addr".format(
+                            templates[0]
+                        ),
+                        ins.line,
+                    )
+                continue
+            kind = "int" if ins.op == "int" else "byte"
+            token = ins.args[0]
+            if not templates:
+                self._constants.add((kind, teal.constant_value(ins)))
+            elif token not in self.ops:
+                self.variables.append(token)
+                self.ops[token] = ins.op
+        # Layouts by shape, see _placeholders(): the static chunks of bytecode and
+        # the index of the variable whose value goes after each of them but the last.
+        self._layouts = {}
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls(f.read())
+
+    def _encode(self, name, value):
+        """
+        :return: tuple of the (kind, value) key and the bytes written for a value.
+        """
+        op = self.ops[name]
+        if op == "int":
+            if not isinstance(value, int) or not 0 <= value <= MAX_UINT64:
+                raise teal.TealError("{} must be a uint64".format(name))
+            return ("int", value), teal.encode_varuint(value)
+        if op == "addr" and isinstance(value, str):
+            value = teal.parse_addr(value)
+        return ("byte", value), value
+
+    def _placeholders(self, shape):
+        """
+        :return: template values of the given shape: the encoded size of each value
+            and the index of the variable whose value it shares, or the key of the
+            constant it equals. Other values differ from each other and from the
+            template's constants.
+        """
+        taken = set(self._constants)
+        values = []
+        for name, (size, share) in zip(self.variables, shape):
+            if isinstance(share, tuple):
+                value = share[1]
+            elif share < len(values):
+                value = values[share]
+            elif self.ops[name] == "int":
+                value = 1 << (7 * (size - 1))
+                while ("int", value) in taken:
+                    value += 1
+                taken.add(("int", value))
+            else:
+                n = 1
+                while ("byte", n.to_bytes(size, "big")) in taken:
+                    n += 1
+                value = n.to_bytes(size, "big")
+                taken.add(("byte", value))
+            values.append(value)
+        return dict(zip(self.variables, values))
+
+    def _layout(self, shape):
+        layout = self._layouts.get(shape)
+        if layout is None:
+            slots = []
+            code = teal.assemble(self.program, self._placeholders(shape), slots)
+            index = {name: i for i, name in enumerate(self.variables)}
+            chunks = []
+            order = []
+            position = 0
+            for name, offset, size in slots:
+                chunks.append(code[position:offset])
+                order.append(index[name])
+                position = offset + size
+            chunks.append(code[position:])
+            layout = self._layouts[shape] = (chunks, order)
+        return layout
+
+    def instantiate(self, values):
+        """
+        :param values: dict of template variable name to value (int, bytes, or
+            address string for addr).
+        :return: the bytecode of the template with values filled in.
+        """
+        first = {}
+        shape = []
+        encoded = []
+        for i, name in enumerate(self.variables):
+            if name not in values:
+                raise teal.TealError("unbound template variable {}".format(name))
+            key, value = self._encode(name, values[name])
+            share = key if key in self._constants else first.setdefault(key, i)
+            shape.append((len(value), share))
+            encoded.append(value)
+        chunks, order = self._layout(tuple(shape))
+        parts = [chunks[0]]
+        for i, chunk in zip(order, chunks[1:]):
+            parts.append(encoded[i])
+            parts.append(chunk)
+        return b"".join(parts)
+
+    def instantiate_batch(self, listings):
+        """
+        :param listings: iterable of dicts of template variable name to value.
+        :return: list of (bytecode, address) tuples, one per listing.
+        """
+        results = []
+        for values in listings:
+            program = self.instantiate(values)
+            results.append((program, program_address(program)))
+        return results
+
+
+def _read_listings(path, skeleton):
+    """
+    :return: list of dicts of template variable to value, from a CSV with one
+        column per template variable.
+    """
+    with open(path, newline="") as f:
+        rows = list(csv.DictReader(f))
+    listings = []
+    for row in rows:
+        values = {}
+        for name in skeleton.variables:
+            value = row[name]
+            if skeleton.ops[name] == "int":
+                value = teal.parse_int(value)
+            values[name] = value
+        listings.append(values)
+    return listings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Instantiate a TEAL template.")
+    parser.add_argument("template", help="TEAL template, e.g. nft_3way_txn.teal.tmpl")
+    parser.add_argument("listings", help="CSV with one column per template variable")
+    parser.add_argument("-o", "--output", help="write the results here, not to stdout")
+    args = parser.parse_args(argv)
+
+    skeleton = Skeleton.load(args.template)
+    listings = _read_listings(args.listings, skeleton)
+    results = skeleton.instantiate_batch(listings)
+    out = open(args.output, "w", newline="") if args.output else sys.stdout
+    try:
+        writer = csv.writer(out)
+        writer.writerow(["address", "program"])
+        for program, address in results:
+            writer.writerow([address, base64.b64encode(program).decode()])
+    finally:
+        if args.output:
+            out.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+import pytest
+
+import avm
+
+# Sends 1000 microalgos to arg 0 or, with a second arg, 0 of that asset.
+APPROVAL = """#pragma version 5
+txn ApplicationID
+bz done
+itxn_begin
+txn NumAppArgs
+int 2
+==
+bnz axfer
+int pay
+itxn_field TypeEnum
+txna ApplicationArgs 0
+itxn_field Receiver
+int 1000
+itxn_field Amount
+b submit
+axfer:
+int axfer
+itxn_field TypeEnum
+txna ApplicationArgs 0
+itxn_field AssetReceiver
+txna ApplicationArgs 1
+btoi
+itxn_field XferAsset
+submit:
+itxn_submit
+done:
+int 1
+return
+"""
+CLEAR = "#pragma version 5\nint 1\n"
+
+
+@pytest.fixture
+def ledger():
+    ledger = avm.Ledger()
+    ledger.fund(avm.address("creator"), 10 ** 9)
+    return ledger
+
+
+@pytest.fixture
+def app_id(ledger):
+    result = ledger.execute(
+        avm.app_create(avm.address("creator"), APPROVAL, CLEAR), check=True
+    )
+    app_id = result.txns[0].created_app_id
+    ledger.fund(avm.application_address(app_id), 10 ** 6)
+    return app_id
+
+
+def pay(ledger, app_id, receiver, accounts=()):
+    return ledger.execute(
+        avm.app_call(avm.address("creator"), app_id, [receiver], accounts=accounts)
+    )
+
+
+def test_inner_payment_to_an_account_of_the_call(ledger, app_id):
+    receiver = avm.address("receiver")
+    ledger.fund(receiver, 10 ** 6)
+    assert pay(ledger, app_id, receiver, [receiver]).ok
+    assert ledger.balance(receiver) == 10 ** 6 + 1000
+
+
+@pytest.mark.parametrize("name", ["creator", "app"])
+def test_inner_payment_to_the_sender_or_the_app(ledger, app_id, name):
+    receiver = avm.application_address(app_id) if name == "app" else avm.address(name)
+    assert pay(ledger, app_id, receiver).ok
+
+
+def test_inner_payment_to_an_unavailable_account_is_rejected(ledger, app_id):
+    receiver = avm.address("receiver")
+    result = pay(ledger, app_id, receiver)
+    assert not result.ok
+    assert "invalid Account reference" in str(result.error)
+
+
+@pytest.mark.parametrize("listed", [False, True])
+def test_inner_asset_transfer_needs_the_asset_in_the_call(ledger, app_id, listed):
+    creator = avm.address("creator")
+    asset_id = ledger.create_asset(creator, 10)
+    result = ledger.execute(
+        avm.app_call(
+            creator,
+            app_id,
+            [creator, asset_id],
+            assets=[asset_id] if listed else [],
+        )
+    )
+    assert result.ok == listed
+    if not listed:
+        assert "invalid Asset reference {}".format(asset_id) in str(result.error)
+
+
+def test_txid_is_the_one_the_caller_sets(ledger):
+    sender = avm.address("sender")
+    ledger.fund(sender, 10 ** 6)
+    txid = bytes(range(32))
+    program = "#pragma version 5\ntxn TxID\nbyte 0x{}\n==\n".format(txid.hex())
+    txn = avm.payment(sender, sender, 0, lsig=program, TxID=txid)
+    assert ledger.execute(txn).ok
+    assert not ledger.execute(avm.payment(sender, sender, 0, lsig=program)).ok
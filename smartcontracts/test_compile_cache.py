@@ -0,0 +1,84 @@
+import os
+import time
+
+import build
+from compile_cache import CompileCache, cache_key, source_digest
+
+
+def write(path, text):
+    path.write_text(text)
+    return path
+
+
+def test_put_then_get_is_a_hit(tmp_path):
+    cache = CompileCache(str(tmp_path))
+    assert cache.get("k") is None
+    cache.put("k", "#pragma version 5\nint 1", 2.5, bytecode=b"\x05\x81\x01")
+    entry = cache.get("k")
+    assert (entry.teal, entry.compile_seconds, entry.bytecode) == (
+        "#pragma version 5\nint 1",
+        2.5,
+        b"\x05\x81\x01",
+    )
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert cache.saved_seconds > 0
+
+
+def test_entry_without_metadata_is_a_miss(tmp_path):
+    cache = CompileCache(str(tmp_path))
+    cache.put("k", "int 1", 1.0)
+    os.remove(os.path.join(str(tmp_path), "k.json"))
+    assert cache.get("k") is None
+    assert cache.misses == 1
+
+
+def test_key_covers_the_program_and_options():
+    keys = {
+        cache_key("source", "approval", "Application", 5),
+        cache_key("source", "clear", "Application", 5),
+        cache_key("source", "approval", "Application", 6),
+        cache_key("other", "approval", "Application", 5),
+    }
+    assert len(keys) == 4
+
+
+def test_digest_follows_imported_siblings(tmp_path):
+    write(tmp_path / "contract.py", "import helper\nimport os\n")
+    helper = write(tmp_path / "helper.py", "X = 1\n")
+    write(tmp_path / "unrelated.py", "Y = 1\n")
+    digest = source_digest("contract", str(tmp_path))
+    write(tmp_path / "unrelated.py", "Y = 2\n")
+    assert source_digest("contract", str(tmp_path)) == digest
+    write(helper, "X = 2\n")
+    assert source_digest("contract", str(tmp_path)) != digest
+
+
+def test_evict_drops_old_then_least_recently_used_entries(tmp_path):
+    cache = CompileCache(str(tmp_path), max_age=3600)
+    now = time.time()
+    for age, key in [(7200, "old"), (20, "used"), (10, "new")]:
+        cache.put(key, "x" * 100, 1.0)
+        meta = os.path.join(str(tmp_path), key + ".json")
+        os.utime(meta, (now - age, now - age))
+    assert cache.evict() == 1
+    assert cache.get("old") is None
+    # Getting an entry marks it used.
+    cache.get("used")
+    cache.max_bytes = os.path.getsize(os.path.join(str(tmp_path), "used.json")) + 100
+    assert cache.evict() == 1
+    assert cache.get("used") is not None
+    assert cache.get("new") is None
+
+
+def test_build_serves_unchanged_contracts_from_the_cache(tmp_path):
+    cache = CompileCache(str(tmp_path))
+    first = build.build_contracts(["freeze_escrow"], cache)
+    assert (cache.hits, cache.misses) == (0, len(build.PROGRAMS))
+    second = build.build_contracts(["freeze_escrow"], cache)
+    assert cache.hits == len(build.PROGRAMS)
+    assert {name: teal for name, (teal, _) in second["freeze_escrow"].items()} == {
+        name: teal for name, (teal, _) in first["freeze_escrow"].items()
+    }
+    # Building unoptimized programs is keyed apart.
+    build.build_contracts(["freeze_escrow"], cache, optimize=False)
+    assert cache.misses == 2 * len(build.PROGRAMS)
@@ -0,0 +1,233 @@
+import pytest
+
+import avm
+import build
+import donation_votes
+from donation_votes import AppVariables
+
+START_TIME = 1_700_000_000
+END_TIME = START_TIME + 3600
+
+
+@pytest.fixture(scope="module")
+def compiled():
+    return build.build_contracts(["donation_votes"])["donation_votes"]
+
+
+class Votes:
+    """
+    A donation_votes application with one challenge of three options open from
+    START_TIME to END_TIME, and a voter holding the vote asset.
+    """
+
+    def __init__(self, compiled):
+        self.ledger = avm.Ledger(latest_timestamp=START_TIME - 1)
+        self.creator = avm.address("creator")
+        self.voter = avm.address("voter")
+        self.ledger.fund(self.creator, 10 ** 12)
+        self.ledger.fund(self.voter, 10 ** 6)
+        self.vote_asset = self.ledger.create_asset(self.creator, 10 ** 6)
+        result = self.ledger.execute(
+            avm.app_create(
+                self.creator,
+                compiled["approval"][0],
+                compiled["clear"][0],
+                args=[self.vote_asset],
+                global_ints=donation_votes.GLOBAL_SCHEMA[0],
+                global_bytes=donation_votes.GLOBAL_SCHEMA[1],
+                local_ints=donation_votes.LOCAL_SCHEMA[0],
+                local_bytes=donation_votes.LOCAL_SCHEMA[1],
+            ),
+            check=True,
+        )
+        self.app_id = result.txns[0].created_app_id
+        wallets = [avm.address("option {}".format(i)) for i in range(3)]
+        result = self.call(
+            self.creator,
+            ["open", START_TIME, END_TIME, self.vote_asset, 0, 0, b"".join(wallets)]
+            + ["option {}".format(i) for i in range(3)],
+            check=True,
+        )
+        self.challenge_id = donation_votes.Events.opened.decode(result.txns[0].logs[0])[
+            "challenge_id"
+        ]
+        self.ledger.execute(avm.asset_opt_in(self.voter, self.vote_asset), check=True)
+        self.ledger.execute(
+            avm.asset_transfer(self.creator, self.voter, self.vote_asset, 1),
+            check=True,
+        )
+        self.call(self.voter, on_complete=avm.OPT_IN, check=True)
+        self.ledger.latest_timestamp = START_TIME + 1
+
+    def call(self, sender, args=(), check=False, **fields):
+        return self.ledger.execute(
+            avm.app_call(sender, self.app_id, list(args), **fields), check=check
+        )
+
+    def vote(self, option, challenge_id=None):
+        if challenge_id is None:
+            challenge_id = self.challenge_id
+        return self.call(
+            self.voter, ["vote", challenge_id, option], assets=[self.vote_asset]
+        )
+
+    def counts(self):
+        state = AppVariables.decode(self.ledger.global_state(self.app_id))
+        challenge = state["challenge"][self.challenge_id]
+        return donation_votes.decode_challenge(challenge)["votes"]
+
+
+def test_vote_counts_and_switches(compiled):
+    votes = Votes(compiled)
+    assert votes.vote(1).ok
+    assert votes.counts() == [0, 1, 0]
+    assert votes.vote(1).ok
+    assert votes.counts() == [0, 1, 0]
+    result = votes.vote(2)
+    assert result.ok
+    assert votes.counts() == [0, 0, 1]
+    (log,) = result.txns[0].logs
+    assert donation_votes.Events.voted.decode(log)["previous_ballot"] == 2
+
+
+def test_vote_for_a_challenge_that_is_not_live_is_rejected(compiled):
+    votes = Votes(compiled)
+    assert not votes.vote(0, challenge_id=votes.challenge_id + 1).ok
+
+
+def test_vote_for_an_option_the_challenge_lacks_is_rejected(compiled):
+    votes = Votes(compiled)
+    assert not votes.vote(3).ok
+    assert votes.counts() == [0, 0, 0]
+
+
+@pytest.mark.parametrize("timestamp", [START_TIME, END_TIME])
+def test_vote_outside_the_challenge_is_rejected(compiled, timestamp):
+    votes = Votes(compiled)
+    votes.ledger.latest_timestamp = timestamp
+    assert not votes.vote(0).ok
+
+
+def test_vote_without_the_vote_asset_is_rejected(compiled):
+    votes = Votes(compiled)
+    votes.ledger.execute(
+        avm.asset_transfer(votes.voter, votes.creator, votes.vote_asset, 1),
+        check=True,
+    )
+    assert not votes.vote(0).ok
+
+
+def open_args(options):
+    wallets = [avm.address("option {}".format(i)) for i in range(options)]
+    return ["open", START_TIME, END_TIME, 0, 0, 0, b"".join(wallets)] + [
+        "option {}".format(i) for i in range(options)
+    ]
+
+
+@pytest.mark.parametrize("options", [1, donation_votes.MAX_OPTIONS + 1])
+def test_open_with_too_few_or_too_many_options_is_rejected(compiled, options):
+    votes = Votes(compiled)
+    assert votes.call(votes.creator, open_args(2)).ok
+    assert not votes.call(votes.creator, open_args(options)).ok
+
+
+def test_open_is_only_for_the_creator(compiled):
+    votes = Votes(compiled)
+    assert not votes.call(votes.voter, open_args(2)).ok
+
+
+def test_open_past_the_live_challenges_is_rejected(compiled):
+    votes = Votes(compiled)
+    for _ in range(donation_votes.MAX_CHALLENGES - 1):
+        assert votes.call(votes.creator, open_args(2)).ok
+    assert not votes.call(votes.creator, open_args(2)).ok
+
+
+def test_close_out_removes_the_votes_of_live_challenges(compiled):
+    votes = Votes(compiled)
+    assert votes.vote(2).ok
+    assert votes.call(votes.voter, on_complete=avm.CLOSE_OUT).ok
+    assert votes.counts() == [0, 0, 0]
+
+
+def complete_voting(votes, sender, budget_calls=None):
+    if budget_calls is None:
+        budget_calls = donation_votes.COMPLETE_VOTING_BUDGET_CALLS
+    wallets = [avm.address("option {}".format(i)) for i in range(3)]
+    return votes.ledger.execute(
+        [
+            avm.app_call(
+                sender,
+                votes.app_id,
+                ["completeVoting", votes.challenge_id],
+                assets=[votes.vote_asset],
+                accounts=wallets,
+            )
+        ]
+        + [avm.app_call(votes.creator, votes.app_id, ["budget"])] * budget_calls
+    )
+
+
+def test_complete_voting_removes_the_challenge(compiled):
+    votes = Votes(compiled)
+    assert votes.vote(0).ok
+    votes.ledger.latest_timestamp = END_TIME + 1
+    result = complete_voting(votes, votes.creator)
+    assert result.ok
+    name, completed = donation_votes.Events.decode(result.txns[0].logs[-1])
+    assert (name, completed["total_votes"]) == ("completed", 1)
+    state = AppVariables.decode(votes.ledger.global_state(votes.app_id))
+    assert state["liveChallenges"] == b""
+    assert not complete_voting(votes, votes.creator).ok
+
+
+@pytest.mark.parametrize(
+    "sender, timestamp, budget_calls",
+    [
+        ("creator", END_TIME, None),
+        ("voter", END_TIME + 1, None),
+        ("creator", END_TIME + 1, 0),
+    ],
+)
+def test_complete_voting_reject_paths(compiled, sender, timestamp, budget_calls):
+    votes = Votes(compiled)
+    votes.ledger.latest_timestamp = timestamp
+    assert not complete_voting(votes, getattr(votes, sender), budget_calls).ok
+
+
+def test_complete_voting_pays_the_prize_by_votes(compiled):
+    votes = Votes(compiled)
+    wallets = [avm.address("option {}".format(i)) for i in range(3)]
+    for wallet in wallets:
+        votes.ledger.fund(wallet, 10 ** 6)
+        votes.ledger.execute(avm.asset_opt_in(wallet, votes.vote_asset), check=True)
+    votes.ledger.fund(avm.application_address(votes.app_id), 10 ** 6)
+    votes.call(
+        votes.creator,
+        ["setup", votes.vote_asset],
+        check=True,
+        assets=[votes.vote_asset],
+    )
+    votes.ledger.execute(
+        avm.asset_transfer(
+            votes.creator,
+            avm.application_address(votes.app_id),
+            votes.vote_asset,
+            100,
+        ),
+        check=True,
+    )
+    votes.ledger.latest_timestamp = START_TIME - 1
+    args = open_args(3)
+    args[3:5] = [votes.vote_asset, 100]
+    result = votes.call(votes.creator, args, check=True)
+    votes.challenge_id = donation_votes.Events.opened.decode(result.txns[0].logs[0])[
+        "challenge_id"
+    ]
+    votes.ledger.latest_timestamp = START_TIME + 1
+    assert votes.vote(1).ok
+    votes.ledger.latest_timestamp = END_TIME + 1
+    assert complete_voting(votes, votes.creator).ok
+    assert [
+        votes.ledger.asset_balance(wallet, votes.vote_asset) for wallet in wallets
+    ] == [0, 100, 0]
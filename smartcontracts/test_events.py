@@ -0,0 +1,117 @@
+import base64
+
+import pytest
+from pyteal import *
+
+import avm
+import events
+from events import ADDRESS, UINT8, UINT64, Event, EventError, EventSchema
+
+
+class Events(EventSchema):
+    ping = Event()
+    moved = Event(kind=UINT8, amount=UINT64, to=ADDRESS, flag=UINT8)
+
+
+def run(*logs, args=()):
+    """
+    :return: the avm.TxnResult of an application call logging logs.
+    """
+    approval = compileTeal(
+        Seq(*logs, Approve()), Mode.Application, version=5, assembleConstants=True
+    )
+    ledger = avm.Ledger()
+    creator = avm.address("creator")
+    ledger.fund(creator, 10 ** 9)
+    result = ledger.execute(
+        avm.app_create(creator, approval, "#pragma version 5\nint 1", list(args))
+    )
+    return result
+
+
+def test_tags_follow_declaration_order():
+    assert (Events.ping.tag, Events.moved.tag) == (1, 2)
+    assert Events.moved.size == 1 + 1 + 8 + 32 + 1
+
+
+def test_logged_events_decode_to_their_values():
+    to = avm.address("to")
+    result = run(
+        Events.ping.log(),
+        Events.moved.log(
+            kind=Int(3),
+            amount=Btoi(Txn.application_args[0]),
+            to=Txn.application_args[1],
+            flag=Btoi(Txn.application_args[2]),
+        ),
+        args=[2 ** 64 - 1, to, 255],
+    )
+    assert result.ok
+    ping, moved = result.txns[0].logs
+    assert ping == b"\x01"
+    assert Events.decode(moved) == (
+        "moved",
+        {"kind": 3, "amount": 2 ** 64 - 1, "to": to, "flag": 255},
+    )
+
+
+def test_uint8_values_past_255_fail_the_program():
+    result = run(
+        Events.moved.log(
+            kind=Btoi(Txn.application_args[0]),
+            amount=Int(0),
+            to=Global.zero_address(),
+            flag=Int(0),
+        ),
+        args=[256],
+    )
+    assert not result.ok
+
+
+def test_decode_many_groups_logs_by_event():
+    logs = [
+        b"\x02\x01" + (5).to_bytes(8, "big") + bytes(32) + b"\x00",
+        b"\x01",
+        b"\x02\x02" + (7).to_bytes(8, "big") + bytes(32) + b"\x01",
+    ]
+    decoded = Events.decode_many(logs)
+    assert decoded["moved"]["amount"].tolist() == [5, 7]
+    assert decoded["moved"]["index"].tolist() == [0, 2]
+    assert decoded["ping"]["index"].tolist() == [1]
+    assert [Events.decode(log)[1] for log in logs[::2]] == [
+        {"kind": kind, "amount": amount, "to": bytes(32), "flag": flag}
+        for kind, amount, flag in zip(
+            decoded["moved"]["kind"].tolist(),
+            decoded["moved"]["amount"].tolist(),
+            decoded["moved"]["flag"].tolist(),
+        )
+    ]
+
+
+@pytest.mark.parametrize("log", [b"\x03", b"\x02\x00", b"\x01\x00"])
+def test_logs_of_no_event_are_rejected(log):
+    with pytest.raises(EventError):
+        Events.decode_many([log])
+    with pytest.raises(EventError):
+        Events.decode(log)
+
+
+def test_log_needs_every_field():
+    with pytest.raises(TealInputError):
+        Events.moved.log(kind=Int(1))
+
+
+def test_record_logs_keeps_the_calls_to_one_application():
+    def record(app_id, log):
+        return {
+            "tx-type": "appl",
+            "confirmed-round": 7,
+            "application-transaction": {"application-id": app_id},
+            "logs": [base64.b64encode(log).decode()],
+        }
+
+    logs, positions = events.record_logs(
+        [record(1, b"\x01"), record(2, b"\x01\x02")], app_id=2
+    )
+    assert logs == [b"\x01\x02"]
+    assert positions == [(7, 0)]
@@ -0,0 +1,95 @@
+import pytest
+
+import avm
+import build
+import freeze_escrow
+
+START_TIME = 1_700_000_000
+DAY = 24 * 3600
+
+
+@pytest.fixture(scope="module")
+def compiled():
+    return build.build_contracts(["freeze_escrow"])["freeze_escrow"]
+
+
+class Escrow:
+    """
+    A freeze_escrow locking one asset until START_TIME + 30 days, released in
+    tranches of `amounts`, a day apart from START_TIME.
+    """
+
+    def __init__(self, compiled, amounts, assets=None):
+        self.ledger = avm.Ledger(latest_timestamp=START_TIME - 1)
+        self.receiver = avm.address("receiver")
+        self.ledger.fund(self.receiver, 10 ** 12)
+        self.asset = self.ledger.create_asset(self.receiver, 10 ** 9)
+        tranches = b"".join(
+            value.to_bytes(8, "big")
+            for i, amount in enumerate(amounts)
+            for value in (self.asset, amount, START_TIME + i * DAY)
+        )
+        self.result = self.ledger.execute(
+            avm.app_create(
+                self.receiver,
+                compiled["approval"][0],
+                compiled["clear"][0],
+                args=[self.asset, self.receiver, START_TIME + 30 * DAY, tranches],
+                assets=[self.asset] if assets is None else assets,
+                global_ints=freeze_escrow.GLOBAL_SCHEMA[0],
+                global_bytes=freeze_escrow.GLOBAL_SCHEMA[1],
+            )
+        )
+        if not self.result.ok:
+            return
+        self.app_id = self.result.txns[0].created_app_id
+        self.address = avm.application_address(self.app_id)
+        self.ledger.fund(self.address, 10 ** 6)
+        self.call(["setup"], check=True)
+        self.ledger.execute(
+            avm.asset_transfer(self.receiver, self.address, self.asset, sum(amounts)),
+            check=True,
+        )
+
+    def call(self, args, sender=None, check=False):
+        return self.ledger.execute(
+            avm.app_call(
+                sender or self.receiver, self.app_id, args, assets=[self.asset]
+            ),
+            check=check,
+        )
+
+    def held(self):
+        return self.ledger.asset_balance(self.address, self.asset)
+
+
+def test_release_sends_unlocked_tranches(compiled):
+    escrow = Escrow(compiled, [10, 20, 30])
+    escrow.ledger.latest_timestamp = START_TIME + DAY
+    result = escrow.call(["release"])
+    assert result.ok
+    assert escrow.held() == 30
+    (log,) = result.txns[0].logs
+    name, released = freeze_escrow.Events.decode(log)
+    assert (name, released["first"], released["released_count"]) == ("released", 0, 2)
+
+
+def test_release_is_only_for_the_receiver(compiled):
+    escrow = Escrow(compiled, [10])
+    other = avm.address("other")
+    escrow.ledger.fund(other, 10 ** 6)
+    escrow.ledger.latest_timestamp = START_TIME + DAY
+    assert not escrow.call(["release"], sender=other).ok
+    assert escrow.held() == 10
+
+
+@pytest.mark.parametrize("args", [[], ["relase"]])
+def test_unknown_no_op_calls_are_rejected(compiled, args):
+    escrow = Escrow(compiled, [10])
+    assert not escrow.call(args).ok
+
+
+def test_create_needs_every_tranche_asset_in_its_assets(compiled):
+    escrow = Escrow(compiled, [10], assets=[])
+    assert not escrow.result.ok
+    assert "unavailable asset" in str(escrow.result.error)
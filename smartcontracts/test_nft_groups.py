@@ -0,0 +1,317 @@
+import base64
+import copy
+import re
+
+import pytest
+from algosdk import account, encoding
+from algosdk.future.transaction import (
+    LogicSigTransaction,
+    SuggestedParams,
+    calculate_group_id,
+)
+from nacl.signing import VerifyKey
+
+import algod_stub
+import avm
+import nft_groups
+import nft_split_sale
+
+MIN_FEE = avm.MIN_TXN_FEE
+RECEIVERS = 3
+
+
+def suggested_params():
+    return SuggestedParams(
+        0,
+        1,
+        1000,
+        base64.b64encode(algod_stub.GENESIS_HASH).decode(),
+        algod_stub.GENESIS_ID,
+        min_fee=MIN_FEE,
+    )
+
+
+class Sale:
+    """
+    A split sale logic sig of RECEIVERS receivers on an avm.Ledger, and a stub
+    algod that runs every group submitted to it against the ledger.
+    """
+
+    def __init__(self, fee_pooled):
+        self.fee_pooled = fee_pooled
+        self.ledger = avm.Ledger()
+        self.stub = algod_stub.AlgodStub(ledger=self.ledger)
+        self.keys = {}
+        for name in ["seller", "buyer", "charity", "platform"]:
+            key, address = account.generate_account()
+            self.keys[address] = key
+            self.ledger.fund(encoding.decode_address(address), 10 ** 9)
+            setattr(self, name, address)
+        self.asset_id = self.ledger.create_asset(
+            encoding.decode_address(self.seller), 1
+        )
+        self.payouts = [(self.seller, 10 ** 6), (self.charity, 5), (self.platform, 7)]
+        values = {
+            "TMPL_ASSET_ID": str(self.asset_id),
+            "TMPL_SELLER_ADDR": self.seller,
+            "TMPL_PAYMENT_SELLER_AMOUNT": str(self.payouts[0][1]),
+        }
+        for k, (address, amount) in enumerate(self.payouts[1:], 2):
+            values["TMPL_PAY_RECV{}_ADDR".format(k)] = address
+            values["TMPL_PAYMENT_RECV{}_AMOUNT".format(k)] = str(amount)
+        source = nft_split_sale.compile_logicsig(RECEIVERS, fee_pooled)
+        self.source = re.sub(r"TMPL_\w+", lambda m: values[m.group(0)], source)
+        self.program = self.stub.register_program(self.source)
+        self.escrow = nft_groups.escrow_address(self.program)
+        self.ledger.fund(encoding.decode_address(self.escrow), 10 ** 6)
+
+    def submit(self, txns):
+        """
+        Signs the transactions of the group's wallets and submits it.
+        """
+        signed = [
+            txn
+            if isinstance(txn, LogicSigTransaction)
+            else txn.sign(self.keys[txn.sender])
+            for txn in txns
+        ]
+        self.stub.submit(
+            b"".join(base64.b64decode(encoding.msgpack_encode(s)) for s in signed)
+        )
+
+    def sell(self):
+        self.submit(
+            nft_groups.sell_group(
+                suggested_params(),
+                self.program,
+                self.seller,
+                self.asset_id,
+                self.fee_pooled,
+            )
+        )
+
+    def holds(self, address):
+        return self.ledger.asset_balance(
+            encoding.decode_address(address), self.asset_id
+        )
+
+
+def unsigned(txns):
+    return [
+        txn.transaction if isinstance(txn, LogicSigTransaction) else txn for txn in txns
+    ]
+
+
+def check_group(txns, escrow_index, program):
+    """
+    Checks the group ID, that only the escrow's transaction is under the logic
+    sig, and that the fees add up to the minimum fee of each transaction.
+    """
+    plain = unsigned(txns)
+    ungrouped = [copy.copy(txn) for txn in plain]
+    for txn in ungrouped:
+        txn.group = None
+    group_id = calculate_group_id(ungrouped)
+    assert all(txn.group == group_id for txn in plain)
+    for i, txn in enumerate(txns):
+        assert isinstance(txn, LogicSigTransaction) == (i == escrow_index)
+    assert txns[escrow_index].lsig.logic == program
+    assert sum(txn.fee for txn in plain) == MIN_FEE * len(txns)
+
+
+@pytest.mark.parametrize("fee_pooled", [False, True])
+def test_sell_group_layout(fee_pooled):
+    sale = Sale(fee_pooled)
+    txns = nft_groups.sell_group(
+        suggested_params(), sale.program, sale.seller, sale.asset_id, fee_pooled
+    )
+    assert len(txns) == (2 if fee_pooled else 3)
+    check_group(txns, 0, sale.program)
+    opt_in, transfer = unsigned(txns)[:2]
+    assert (opt_in.sender, opt_in.receiver, opt_in.amount) == (
+        sale.escrow,
+        sale.escrow,
+        0,
+    )
+    assert opt_in.fee == (0 if fee_pooled else MIN_FEE)
+    assert (transfer.sender, transfer.receiver, transfer.amount) == (
+        sale.seller,
+        sale.escrow,
+        1,
+    )
+    if not fee_pooled:
+        repay = txns[2]
+        assert (repay.sender, repay.receiver, repay.amt) == (
+            sale.seller,
+            sale.escrow,
+            MIN_FEE,
+        )
+
+
+@pytest.mark.parametrize("fee_pooled", [False, True])
+def test_buy_group_layout(fee_pooled):
+    sale = Sale(fee_pooled)
+    txns = nft_groups.buy_group(
+        suggested_params(),
+        sale.program,
+        sale.buyer,
+        sale.asset_id,
+        sale.payouts,
+        fee_pooled,
+    )
+    assert len(txns) == RECEIVERS + (2 if fee_pooled else 3)
+    check_group(txns, 1, sale.program)
+    plain = unsigned(txns)
+    assert (plain[0].sender, plain[0].receiver, plain[0].amount) == (
+        sale.buyer,
+        sale.buyer,
+        0,
+    )
+    assert (plain[1].sender, plain[1].receiver, plain[1].amount) == (
+        sale.escrow,
+        sale.buyer,
+        1,
+    )
+    payments = plain[2 : 2 + RECEIVERS]
+    assert [(txn.sender, txn.receiver, txn.amt) for txn in payments] == [
+        (sale.buyer, address, amount) for address, amount in sale.payouts
+    ]
+    if not fee_pooled:
+        assert (plain[-1].receiver, plain[-1].amt) == (sale.escrow, MIN_FEE)
+
+
+def test_withdraw_group_layout():
+    sale = Sale(False)
+    txns = nft_groups.withdraw_group(
+        suggested_params(), sale.program, sale.seller, sale.asset_id
+    )
+    assert len(txns) == 2
+    check_group(txns, 0, sale.program)
+    transfer, repay = unsigned(txns)
+    assert (transfer.sender, transfer.receiver, transfer.amount) == (
+        sale.escrow,
+        sale.seller,
+        1,
+    )
+    assert (repay.sender, repay.receiver, repay.amt) == (
+        sale.seller,
+        sale.escrow,
+        MIN_FEE,
+    )
+
+
+def test_fee_pooled_withdraw_is_signed_by_the_seller():
+    sale = Sale(True)
+    (txn,) = nft_groups.withdraw_group(
+        suggested_params(), sale.program, sale.seller, sale.asset_id, True
+    )
+    assert txn.group is None
+    assert (txn.sender, txn.receiver, txn.close_assets_to, txn.fee) == (
+        sale.escrow,
+        sale.seller,
+        sale.seller,
+        MIN_FEE,
+    )
+    txid = nft_groups.transaction_id(txn)
+    assert len(txid) == 32
+    signed = nft_groups.sign_withdraw(txn, sale.program, sale.keys[sale.seller])
+    (signature,) = signed.lsig.args
+    message = b"ProgData" + encoding.decode_address(sale.escrow) + txid
+    VerifyKey(encoding.decode_address(sale.seller)).verify(message, signature)
+
+
+def test_flat_fee_override():
+    sale = Sale(False)
+    txns = nft_groups.sell_group(
+        suggested_params(), sale.program, sale.seller, sale.asset_id, fee=3000
+    )
+    assert [txn.fee for txn in unsigned(txns)] == [3000, 3000, 3000]
+    assert txns[2].amt == 3000
+
+
+def signed_withdraw(sale, private_key):
+    """
+    :return: the fee pooled withdraw of sale's escrow, signed with private_key, as
+        an avm.Transaction carrying its real transaction ID.
+    """
+    (txn,) = nft_groups.withdraw_group(
+        suggested_params(), sale.program, sale.seller, sale.asset_id, True
+    )
+    signed = nft_groups.sign_withdraw(txn, sale.program, private_key)
+    return avm.asset_transfer(
+        encoding.decode_address(sale.escrow),
+        encoding.decode_address(sale.seller),
+        sale.asset_id,
+        1,
+        close_to=encoding.decode_address(sale.seller),
+        Fee=txn.fee,
+        TxID=nft_groups.transaction_id(txn),
+        lsig=sale.source,
+        lsig_args=signed.lsig.args,
+    )
+
+
+@pytest.mark.parametrize("signer", ["seller", "buyer"])
+def test_logic_sig_checks_the_seller_signed_the_withdraw(signer):
+    sale = Sale(True)
+    escrow = encoding.decode_address(sale.escrow)
+    seller = encoding.decode_address(sale.seller)
+    sale.ledger.execute(
+        [
+            avm.asset_opt_in(escrow, sale.asset_id, Fee=0, lsig=sale.source),
+            avm.asset_transfer(seller, escrow, sale.asset_id, 1, Fee=2 * MIN_FEE),
+        ],
+        check=True,
+    )
+    key = sale.keys[getattr(sale, signer)]
+    result = sale.ledger.execute(signed_withdraw(sale, key))
+    assert result.ok == (signer == "seller")
+    assert sale.holds(sale.seller) == (1 if signer == "seller" else 0)
+
+
+@pytest.mark.parametrize("fee_pooled", [False, True])
+def test_logic_sig_approves_sell_and_buy(fee_pooled):
+    sale = Sale(fee_pooled)
+    sale.sell()
+    assert sale.holds(sale.escrow) == 1
+    before = [sale.ledger.balance(encoding.decode_address(a)) for a, _ in sale.payouts]
+    sale.submit(
+        nft_groups.buy_group(
+            suggested_params(),
+            sale.program,
+            sale.buyer,
+            sale.asset_id,
+            sale.payouts,
+            fee_pooled,
+        )
+    )
+    assert sale.holds(sale.buyer) == 1
+    after = [sale.ledger.balance(encoding.decode_address(a)) for a, _ in sale.payouts]
+    assert [b - a for a, b in zip(before, after)] == [
+        amount for _, amount in sale.payouts
+    ]
+
+
+@pytest.mark.parametrize("fee_pooled", [False, True])
+def test_logic_sig_approves_withdraw(fee_pooled):
+    sale = Sale(fee_pooled)
+    sale.sell()
+    txns = nft_groups.withdraw_group(
+        suggested_params(), sale.program, sale.seller, sale.asset_id, fee_pooled
+    )
+    if fee_pooled:
+        txns = [nft_groups.sign_withdraw(txns[0], sale.program, sale.keys[sale.seller])]
+    sale.submit(txns)
+    assert sale.holds(sale.seller) == 1
+
+
+def test_logic_sig_rejects_payouts_out_of_order():
+    sale = Sale(False)
+    sale.sell()
+    payouts = [sale.payouts[1], sale.payouts[0]] + sale.payouts[2:]
+    txns = nft_groups.buy_group(
+        suggested_params(), sale.program, sale.buyer, sale.asset_id, payouts
+    )
+    with pytest.raises(algod_stub.StubError):
+        sale.submit(txns)
+    assert sale.holds(sale.escrow) == 1
@@ -0,0 +1,140 @@
+import pytest
+
+import avm
+import build
+import periodic_withdrawals
+from periodic_withdrawals import AppVariables
+
+START_TIME = 1_700_000_000
+PERIOD = 7 * 24 * 3600
+UNLOCK_TIME = START_TIME + 10 * PERIOD
+
+
+@pytest.fixture(scope="module")
+def compiled():
+    return build.build_contracts(["periodic_withdrawals"])["periodic_withdrawals"]
+
+
+class Schedule:
+    """
+    A periodic_withdrawals releasing 100 a week to the receiver, from START_TIME to
+    UNLOCK_TIME, holding deposit of its asset.
+    """
+
+    def __init__(self, compiled, deposit):
+        self.ledger = avm.Ledger(latest_timestamp=START_TIME - 1)
+        self.receiver = avm.address("receiver")
+        self.beneficiary = avm.address("beneficiary")
+        self.ledger.fund(self.receiver, 10 ** 12)
+        self.ledger.fund(self.beneficiary, 10 ** 6)
+        self.asset = self.ledger.create_asset(self.receiver, 10 ** 9)
+        result = self.ledger.execute(
+            avm.app_create(
+                self.receiver,
+                compiled["approval"][0],
+                compiled["clear"][0],
+                args=[self.asset, self.receiver, UNLOCK_TIME, PERIOD, START_TIME, 100],
+                global_ints=periodic_withdrawals.GLOBAL_SCHEMA[0],
+                global_bytes=periodic_withdrawals.GLOBAL_SCHEMA[1],
+                local_ints=periodic_withdrawals.LOCAL_SCHEMA[0],
+                local_bytes=periodic_withdrawals.LOCAL_SCHEMA[1],
+            ),
+            check=True,
+        )
+        self.app_id = result.txns[0].created_app_id
+        self.address = avm.application_address(self.app_id)
+        self.ledger.fund(self.address, 10 ** 6)
+        self.call(self.receiver, ["setup"], check=True)
+        self.ledger.execute(
+            avm.asset_transfer(self.receiver, self.address, self.asset, deposit),
+            check=True,
+        )
+        self.ledger.execute(avm.asset_opt_in(self.beneficiary, self.asset), check=True)
+        self.call(self.beneficiary, on_complete=avm.OPT_IN, check=True)
+
+    def call(self, sender, args=(), check=False, **fields):
+        return self.ledger.execute(
+            avm.app_call(
+                sender, self.app_id, list(args), assets=[self.asset], **fields
+            ),
+            check=check,
+        )
+
+    def register(self, beneficiary=None, amount=10):
+        # 11 periods begin by UNLOCK_TIME, committing 11 * amount.
+        return self.call(
+            self.receiver,
+            ["register", PERIOD, START_TIME, amount],
+            accounts=[beneficiary or self.beneficiary],
+        )
+
+    def committed(self):
+        state = AppVariables.decode(self.ledger.global_state(self.app_id))
+        return state["committed_amount"]
+
+    def held(self):
+        return self.ledger.asset_balance(self.address, self.asset)
+
+
+def test_register_commits_the_schedule_until_the_unlock_time(compiled):
+    schedule = Schedule(compiled, 110)
+    assert schedule.register().ok
+    assert schedule.committed() == 110
+
+
+def test_register_the_uncommitted_holding_cannot_cover_is_rejected(compiled):
+    schedule = Schedule(compiled, 109)
+    assert not schedule.register().ok
+    assert schedule.committed() == 0
+
+
+def test_register_the_receiver_is_rejected(compiled):
+    schedule = Schedule(compiled, 10 ** 6)
+    schedule.call(schedule.receiver, on_complete=avm.OPT_IN, check=True)
+    assert not schedule.register(beneficiary=schedule.receiver).ok
+
+
+def test_receiver_cannot_withdraw_or_claim_the_committed_amount(compiled):
+    schedule = Schedule(compiled, 150)
+    assert schedule.register().ok
+    schedule.ledger.latest_timestamp = START_TIME + 1
+    # 40 are uncommitted, less than a withdrawal.
+    assert schedule.call(schedule.receiver, ["withdraw"]).ok
+    assert schedule.held() == 150
+    result = schedule.call(schedule.receiver, ["claim"])
+    assert result.ok
+    assert schedule.held() == 110
+    assert not schedule.call(schedule.receiver, ["claim"]).ok
+
+
+def test_beneficiary_claims_stop_at_the_unlock_time(compiled):
+    schedule = Schedule(compiled, 110)
+    assert schedule.register().ok
+    schedule.ledger.latest_timestamp = START_TIME + PERIOD
+    assert schedule.call(schedule.beneficiary, ["claim"]).ok
+    assert schedule.committed() == 90
+    schedule.ledger.latest_timestamp = UNLOCK_TIME + 5 * PERIOD
+    assert schedule.call(schedule.beneficiary, ["claim"]).ok
+    assert schedule.ledger.asset_balance(schedule.beneficiary, schedule.asset) == 110
+    assert schedule.committed() == 0
+
+
+def test_delete_waits_for_the_committed_amount(compiled):
+    schedule = Schedule(compiled, 200)
+    assert schedule.register().ok
+    schedule.ledger.latest_timestamp = UNLOCK_TIME
+    assert not schedule.call(schedule.receiver, on_complete=avm.DELETE_APPLICATION).ok
+    assert schedule.call(schedule.beneficiary, ["claim"]).ok
+    assert schedule.call(schedule.receiver, on_complete=avm.DELETE_APPLICATION).ok
+    assert schedule.ledger.asset_balance(schedule.receiver, schedule.asset) == (
+        10 ** 9 - 110
+    )
+
+
+def test_clearing_state_gives_up_the_commitment(compiled):
+    schedule = Schedule(compiled, 110)
+    assert schedule.register().ok
+    schedule.ledger.latest_timestamp = START_TIME
+    assert schedule.call(schedule.beneficiary, ["claim"]).ok
+    assert schedule.call(schedule.beneficiary, on_complete=avm.CLEAR_STATE).ok
+    assert schedule.committed() == 0
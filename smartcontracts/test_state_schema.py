@@ -0,0 +1,121 @@
+import base64
+
+import pytest
+from pyteal import *
+
+import avm
+import state_schema
+from state_schema import Field, GlobalSchema, LocalSchema, Schema, StateSchemaError
+
+
+class Shared(Schema):
+    owner = Field(TealType.bytes)
+
+
+class Variables(Shared, GlobalSchema):
+    total = Field(TealType.uint64)
+    name = Field(TealType.bytes, key="name")
+    slot = Field(TealType.uint64, count=3)
+
+
+def test_keys_follow_declaration_order():
+    assert [(name, field.key) for name, field in Variables.fields.items()] == [
+        ("owner", b"a"),
+        ("total", b"b"),
+        ("name", b"name"),
+        ("slot", b"c"),
+    ]
+    assert Variables.slot.entry_key(2) == b"c\x02"
+
+
+def test_state_schema_counts_entries():
+    assert Variables.state_schema() == (4, 2)
+
+
+def test_constant_index_out_of_range():
+    Variables.slot[Int(2)]
+    with pytest.raises(TealInputError):
+        Variables.slot[3]
+    with pytest.raises(TealInputError):
+        Variables.total[0]
+
+
+def test_decode_by_field_name():
+    state = {b"a": b"me", b"b": 7, b"name": b"x", b"c\x00": 1, b"c\x02": 3, b"?": 9}
+    assert Variables.decode(state) == {
+        "owner": b"me",
+        "total": 7,
+        "name": b"x",
+        "slot": {0: 1, 2: 3},
+        b"?": 9,
+    }
+
+
+def test_decode_checks_value_types():
+    with pytest.raises(StateSchemaError):
+        Variables.decode({b"b": b"not a uint"})
+
+
+def test_taken_keys_are_rejected():
+    with pytest.raises(StateSchemaError):
+
+        class Clash(GlobalSchema):
+            first = Field(TealType.uint64, key="a")
+            second = Field(TealType.uint64, key="a")
+
+
+def test_local_state_holds_16_keys():
+    with pytest.raises(StateSchemaError):
+
+        class TooMany(LocalSchema):
+            values = Field(TealType.uint64, count=17)
+
+
+def test_raw_state_decodes_algod_json():
+    entries = [
+        {"key": base64.b64encode(b"b").decode(), "value": {"type": 2, "uint": 5}},
+        {
+            "key": base64.b64encode(b"a").decode(),
+            "value": {"type": 1, "bytes": base64.b64encode(b"me").decode()},
+        },
+    ]
+    assert state_schema.raw_state(entries) == {b"b": 5, b"a": b"me"}
+
+
+class Sparse(GlobalSchema):
+    narrow = Field(TealType.uint64, count=4)
+    wide = Field(TealType.uint64, count=4, indexes=300)
+
+
+def test_sparse_entries_take_two_byte_indexes():
+    assert Sparse.narrow.index_size == 1
+    assert Sparse.wide.entry_key(299) == b"b\x01\x2b"
+    assert Sparse.state_schema() == (8, 0)
+
+
+@pytest.mark.parametrize(
+    "field, index, ok",
+    [
+        ("narrow", 3, True),
+        ("narrow", 256, False),
+        ("narrow", 257, False),
+        ("wide", 299, True),
+        ("wide", 300, False),
+        ("wide", 2 ** 16 + 299, False),
+    ],
+)
+def test_run_time_index_the_key_cannot_hold_fails(field, index, ok):
+    key = getattr(Sparse, field)[Btoi(Txn.application_args[0])]
+    approval = compileTeal(
+        Seq(App.globalPut(key, Int(1)), Approve()), Mode.Application, version=5
+    )
+    ledger = avm.Ledger()
+    creator = avm.address("creator")
+    ledger.fund(creator, 10 ** 9)
+    result = ledger.execute(
+        avm.app_create(creator, approval, "#pragma version 5\nint 1", [index], 8)
+    )
+    assert result.ok == ok
+    if ok:
+        state = ledger.global_state(result.txns[0].created_app_id)
+        assert Sparse.decode(state) == {field: {index: 1}}
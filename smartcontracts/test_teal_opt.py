@@ -0,0 +1,128 @@
+import teal
+import teal_opt
+
+
+def rewrite(rule, source):
+    """
+    :return: tuple of (whether rule changed the program, its lines after the
+        pragma).
+    """
+    program = teal.parse("#pragma version 5\n" + source)
+    changed = rule(program)
+    return changed, program.text().splitlines()[1:]
+
+
+def test_remove_dead_code_drops_unreachable_code_and_labels():
+    source = "int 1\nbnz end\nerr\nend:\nint 1\nreturn\nint 2\nunused:\npop"
+    assert rewrite(teal_opt.remove_dead_code, source) == (
+        True,
+        ["int 1", "bnz end", "err", "end:", "int 1", "return"],
+    )
+
+
+def test_remove_dead_code_keeps_reachable_program():
+    source = "int 1\nbnz end\nerr\nend:\nint 1\nreturn"
+    assert rewrite(teal_opt.remove_dead_code, source) == (
+        False,
+        source.splitlines(),
+    )
+
+
+def test_simplify_jumps_drops_jump_to_next_instruction():
+    source = "b next\nnext:\nint 1\nreturn"
+    assert rewrite(teal_opt.simplify_jumps, source) == (
+        True,
+        ["next:", "int 1", "return"],
+    )
+
+
+def test_simplify_jumps_pops_condition_of_branch_to_next_instruction():
+    source = "txn Fee\nbz next\nnext:\nint 1\nreturn"
+    assert rewrite(teal_opt.simplify_jumps, source) == (
+        True,
+        ["txn Fee", "pop", "next:", "int 1", "return"],
+    )
+
+
+def test_simplify_jumps_threads_jumps_and_copies_return_blocks():
+    source = "int 1\nbnz a\nerr\na:\nb c\nerr\nc:\nint 1\nreturn"
+    assert rewrite(teal_opt.simplify_jumps, source) == (
+        True,
+        ["int 1", "bnz c", "err", "a:", "int 1", "return", "err", "c:", "int 1"]
+        + ["return"],
+    )
+
+
+def test_simplify_jumps_stops_threading_a_jump_cycle():
+    source = "int 1\nbnz a\nerr\na:\nb b\nb:\nb a"
+    assert rewrite(teal_opt.simplify_jumps, source) == (
+        True,
+        ["int 1", "bnz b", "err", "a:", "b a", "b:", "b b"],
+    )
+
+
+def test_fold_assert_return():
+    source = "txn Fee\nassert\nint 1\nreturn"
+    assert rewrite(teal_opt.fold_assert_return, source) == (
+        True,
+        ["txn Fee", "return"],
+    )
+
+
+def test_fold_assert_return_keeps_other_returns():
+    source = "txn Fee\nassert\nint 0\nreturn"
+    assert rewrite(teal_opt.fold_assert_return, source) == (
+        False,
+        source.splitlines(),
+    )
+
+
+def test_eliminate_redundant_loads():
+    source = 'byte "k"\nbyte "k"\nconcat\nstore 1\nload 1\nreturn'
+    assert rewrite(teal_opt.eliminate_redundant_loads, source) == (
+        True,
+        ['byte "k"', "dup", "concat", "dup", "store 1", "return"],
+    )
+
+
+def test_eliminate_redundant_loads_not_across_labels_or_side_effects():
+    source = "load 1\nnext:\nload 1\nitxn_submit\nitxn_submit"
+    assert rewrite(teal_opt.eliminate_redundant_loads, source) == (
+        False,
+        source.splitlines(),
+    )
+
+
+def test_build_constant_blocks_orders_shared_constants_by_use():
+    source = 'int 9\nint 7\nint 7\n+\n+\nbyte "k"\nbyte "k"\nbyte "x"\npop\npop\npop'
+    assert rewrite(teal_opt.build_constant_blocks, source) == (
+        True,
+        ["intcblock 7", 'bytecblock "k"', "pushint 9", "intc_0", "intc_0", "+"]
+        + ["+", "bytec_0", "bytec_0", "pushbytes 0x78", "pop", "pop", "pop"],
+    )
+
+
+def test_build_constant_blocks_past_four_constants():
+    source = "".join("int {0}\nint {0}\n".format(value) for value in range(2, 7))
+    changed, lines = rewrite(teal_opt.build_constant_blocks, source)
+    assert lines[0] == "intcblock 2 3 4 5 6"
+    assert lines[-2:] == ["intc 4", "intc 4"]
+
+
+def test_build_constant_blocks_keeps_templates():
+    source = "addr TMPL_A\nint 2\nint 2\nreturn"
+    assert rewrite(teal_opt.build_constant_blocks, source) == (
+        False,
+        source.splitlines(),
+    )
+
+
+def test_optimize_shrinks_and_keeps_source_lines():
+    source = "#pragma version 5\nint 1\nassert\nint 1\nreturn\nint 5"
+    program = teal.parse(source)
+    optimized = teal_opt.optimize(source)
+    assert optimized.text().splitlines()[1:] == ["pushint 1", "return"]
+    assert [ins.line for ins in optimized.instructions] == [2, 3]
+    assert teal_opt.program_size(optimized) < teal_opt.program_size(program)
+    # The source program is left as it was.
+    assert program.text() == teal.parse(source).text()
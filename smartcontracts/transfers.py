@@ -0,0 +1,357 @@
+"""
+Inner transactions sending and closing out of Algos and assets, shared by the
+contracts.
+
+Create one Transfers per program and call its primitives wherever the program
+pays out or closes out:
+
+    transfers = Transfers()
+    return Seq(
+        ...
+        transfers.send_asset(asset_id, receiver, amount),
+        ...
+        transfers.close_account(receiver),
+        Approve(),
+    )
+
+Every call builds one call site. Whether a site inlines the primitive or calls it
+as a subroutine is decided when the program is compiled, once all of its sites
+have been built. A subroutine holds the primitive once, and calling it takes
+CALLSUB_SIZE bytes and the calling convention on every run: callsub, retsub and a
+store per argument, which inlining saves. A site calls when the bytes it saves
+outweigh those opcodes at BYTES_PER_OPCODE bytes each, and the subroutine is only
+emitted when its callers save more than it takes. A site in a loop passes the
+most times it runs as runs=, so that its opcodes weigh more. An argument the
+primitive reads more than once is computed once into a slot when inlined, unless
+it is a constant or a slot already.
+"""
+from contextlib import contextmanager
+
+from pyteal import *
+
+import teal
+
+# Weight of an opcode against a byte of program: a call runs up to 700 opcodes, an
+# approval program page holds 2048 bytes.
+BYTES_PER_OPCODE = teal.MAX_APP_PROGRAM_LEN / teal.MAX_APP_COST
+# Size of a callsub with its label offset.
+CALLSUB_SIZE = 3
+# Strategies: "auto" decides per call site, "inline" and "call" force one for every
+# site, to compare them.
+STRATEGIES = ["auto", "inline", "call"]
+
+_strategy = "auto"
+
+
+# The primitives, named like subroutines as they become ones.
+
+
+# Sends amount of the asset assetID, or of Algos when assetID is 0, to account.
+def sendTo(assetID: Expr, account: Expr, amount: Expr) -> Expr:
+    return Seq(
+        InnerTxnBuilder.Begin(),
+        If(assetID == Int(0))
+        .Then(
+            InnerTxnBuilder.SetFields(
+                {
+                    TxnField.type_enum: TxnType.Payment,
+                    TxnField.amount: amount,
+                    TxnField.receiver: account,
+                }
+            )
+        )
+        .Else(
+            InnerTxnBuilder.SetFields(
+                {
+                    TxnField.type_enum: TxnType.AssetTransfer,
+                    TxnField.xfer_asset: assetID,
+                    TxnField.asset_amount: amount,
+                    TxnField.asset_receiver: account,
+                }
+            )
+        ),
+        InnerTxnBuilder.Submit(),
+    )
+
+
+# Sends amount of the asset assetID to account.
+def sendAssetsTo(assetID: Expr, account: Expr, amount: Expr) -> Expr:
+    return Seq(
+        InnerTxnBuilder.Begin(),
+        InnerTxnBuilder.SetFields(
+            {
+                TxnField.type_enum: TxnType.AssetTransfer,
+                TxnField.xfer_asset: assetID,
+                TxnField.asset_amount: amount,
+                TxnField.asset_receiver: account,
+            }
+        ),
+        InnerTxnBuilder.Submit(),
+    )
+
+
+# Sends amount of the asset assetID to account, clamped to the balance held by this
+# smart contract, if it holds any.
+def sendHeldAssetsTo(assetID: Expr, account: Expr, amount: Expr) -> Expr:
+    asset_holding = AssetHolding.balance(Global.current_application_address(), assetID)
+    return Seq(
+        asset_holding,
+        If(asset_holding.value() > Int(0)).Then(
+            sendAssetsTo(
+                assetID,
+                account,
+                If(amount < asset_holding.value(), amount, asset_holding.value()),
+            )
+        ),
+    )
+
+
+# Sends all of the asset assetID to account and closes out of it.
+def closeAssetsTo(assetID: Expr, account: Expr) -> Expr:
+    return Seq(
+        InnerTxnBuilder.Begin(),
+        InnerTxnBuilder.SetFields(
+            {
+                TxnField.type_enum: TxnType.AssetTransfer,
+                TxnField.xfer_asset: assetID,
+                TxnField.asset_close_to: account,
+            }
+        ),
+        InnerTxnBuilder.Submit(),
+    )
+
+
+# Closes out of the asset assetID to account if this smart contract opted into it.
+def closeHeldAssetsTo(assetID: Expr, account: Expr) -> Expr:
+    asset_holding = AssetHolding.balance(Global.current_application_address(), assetID)
+    return Seq(
+        asset_holding,
+        If(asset_holding.hasValue()).Then(closeAssetsTo(assetID, account)),
+    )
+
+
+# Sends all of the Algos to account, closing this smart contract's account.
+def closeAccountTo(account: Expr) -> Expr:
+    return Seq(
+        InnerTxnBuilder.Begin(),
+        InnerTxnBuilder.SetFields(
+            {
+                TxnField.type_enum: TxnType.Payment,
+                TxnField.close_remainder_to: account,
+            }
+        ),
+        InnerTxnBuilder.Submit(),
+    )
+
+
+# Closes this smart contract's account to account if it holds any Algos.
+def closeFundedAccountTo(account: Expr) -> Expr:
+    return If(Balance(Global.current_application_address()) != Int(0)).Then(
+        closeAccountTo(account)
+    )
+
+
+# Opts this smart contract into the asset assetID.
+def optInTo(assetID: Expr) -> Expr:
+    return Seq(
+        InnerTxnBuilder.Begin(),
+        InnerTxnBuilder.SetFields(
+            {
+                # Send 0 units of the asset to itself to opt-in.
+                TxnField.type_enum: TxnType.AssetTransfer,
+                TxnField.xfer_asset: assetID,
+                TxnField.asset_receiver: Global.current_application_address(),
+            }
+        ),
+        InnerTxnBuilder.Submit(),
+    )
+
+
+# Times each primitive reads each of its arguments.
+_READS = {
+    sendTo: (2, 2, 2),
+    sendAssetsTo: (1, 1, 1),
+    sendHeldAssetsTo: (2, 1, 2),
+    closeAssetsTo: (1, 1),
+    closeHeldAssetsTo: (2, 1),
+    closeAccountTo: (1,),
+    closeFundedAccountTo: (1,),
+    optInTo: (1,),
+}
+
+# Sizes of the primitives in bytes, by TEAL version, measured once.
+_sizes = {}
+
+
+def _size(primitive, version):
+    """
+    :return: the size in bytes of primitive's body, reading its arguments from
+        slots like a subroutine does.
+    """
+    key = (primitive, version)
+    if key not in _sizes:
+        slots = [ScratchVar(TealType.anytype) for _ in _READS[primitive]]
+        # Both programs store the slots, which leaves only the body to tell apart.
+        stores = [slot.store(Int(0)) for slot in slots]
+        body = primitive(*[slot.load() for slot in slots])
+        with_body = compileTeal(
+            Seq(stores + [body, Approve()]), Mode.Application, version=version
+        )
+        without = compileTeal(
+            Seq(stores + [Approve()]), Mode.Application, version=version
+        )
+        _sizes[key] = len(teal.assemble(with_body)) - len(teal.assemble(without))
+    return _sizes[key]
+
+
+@contextmanager
+def forced(strategy):
+    """
+    Compiles every call site with strategy instead of deciding, see STRATEGIES.
+    """
+    global _strategy
+    if strategy not in STRATEGIES:
+        raise ValueError("unknown strategy {}".format(strategy))
+    previous, _strategy = _strategy, strategy
+    try:
+        yield
+    finally:
+        _strategy = previous
+
+
+def _inline(primitive, args):
+    """
+    :return: primitive applied to args, with the arguments it reads more than once
+        computed once into a slot, unless they are a constant or a slot already.
+    """
+    stores = []
+    loads = []
+    for arg, reads in zip(args, _READS[primitive]):
+        if reads > 1 and not isinstance(arg, (Int, ScratchLoad)):
+            slot = ScratchVar(TealType.anytype)
+            stores.append(slot.store(arg))
+            arg = slot.load()
+        loads.append(arg)
+    return Seq(stores + [primitive(*loads)])
+
+
+class _CallSite(Expr):
+    """
+    Call of a primitive, inlined or not once every call site is known.
+    """
+
+    def __init__(self, transfers, primitive, args, runs):
+        super().__init__()
+        self.transfers = transfers
+        self.primitive = primitive
+        self.args = args
+        self.runs = runs
+        # Built now rather than when compiled, so that its slots are numbered along
+        # with the rest of the program's.
+        self.inlined = _inline(primitive, args)
+
+    def __teal__(self, options):
+        return self.transfers._expand(self, options.version).__teal__(options)
+
+    def __str__(self):
+        return "(transfers {} {})".format(
+            self.primitive.__name__, " ".join(str(arg) for arg in self.args)
+        )
+
+    def type_of(self):
+        return TealType.none
+
+    def has_return(self):
+        return False
+
+
+class Transfers:
+    """
+    The transfer primitives of one program.
+    """
+
+    def __init__(self):
+        self._sites = {}
+        self._subroutines = {}
+
+    def _call(self, primitive, args, runs):
+        site = _CallSite(self, primitive, args, runs)
+        self._sites.setdefault(primitive, []).append(site)
+        return site
+
+    def send(self, asset_id, account, amount, runs=1):
+        """
+        Sends amount of the asset asset_id, or of Algos when asset_id is 0.
+        """
+        return self._call(sendTo, [asset_id, account, amount], runs)
+
+    def send_asset(self, asset_id, account, amount, runs=1):
+        return self._call(sendAssetsTo, [asset_id, account, amount], runs)
+
+    def send_held_asset(self, asset_id, account, amount, runs=1):
+        """
+        Like send_asset(), clamped to the balance held, if any.
+        """
+        return self._call(sendHeldAssetsTo, [asset_id, account, amount], runs)
+
+    def close_asset(self, asset_id, account, runs=1):
+        """
+        Sends all of the asset to account and closes out of it.
+        """
+        return self._call(closeAssetsTo, [asset_id, account], runs)
+
+    def close_held_asset(self, asset_id, account, runs=1):
+        """
+        Like close_asset(), if this smart contract opted into the asset.
+        """
+        return self._call(closeHeldAssetsTo, [asset_id, account], runs)
+
+    def close_account(self, account, runs=1):
+        """
+        Sends all of the Algos to account, closing this smart contract's account.
+        """
+        return self._call(closeAccountTo, [account], runs)
+
+    def close_funded_account(self, account, runs=1):
+        """
+        Like close_account(), if this smart contract holds any Algos.
+        """
+        return self._call(closeFundedAccountTo, [account], runs)
+
+    def opt_in(self, asset_id, runs=1):
+        return self._call(optInTo, [asset_id], runs)
+
+    def calls(self, primitive, version):
+        """
+        :return: the list of primitive's call sites that call it as a subroutine.
+        """
+        sites = self._sites.get(primitive, [])
+        if _strategy != "auto":
+            return list(sites) if _strategy == "call" else []
+        body = _size(primitive, version)
+        arguments = len(_READS[primitive])
+        # callsub, retsub and the store of every argument.
+        convention = 2 + arguments
+        calling = [
+            site
+            for site in sites
+            if body - CALLSUB_SIZE > BYTES_PER_OPCODE * convention * site.runs
+        ]
+        saved = sum(
+            body - CALLSUB_SIZE - BYTES_PER_OPCODE * convention * site.runs
+            for site in calling
+        )
+        # The subroutine: the body, a store per argument and retsub.
+        if saved <= body + 2 * arguments + 1:
+            return []
+        return calling
+
+    def _subroutine(self, primitive):
+        if primitive not in self._subroutines:
+            self._subroutines[primitive] = Subroutine(TealType.none)(primitive)
+        return self._subroutines[primitive]
+
+    def _expand(self, site, version):
+        if any(call is site for call in self.calls(site.primitive, version)):
+            return self._subroutine(site.primitive)(*site.args)
+        return site.inlined
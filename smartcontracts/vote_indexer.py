@@ -0,0 +1,502 @@
+"""
+Streaming off-chain indexer of donation_votes applications.
+
+Reads transaction records as the indexer's /v2/transactions returns them, or block
+records holding them in "transactions", one JSON record per line, and replays the
+calls to every followed application: creation, open, vote, opt in, close out, clear
+state, completeVoting and delete. Only confirmed transactions are ever recorded, so
+every call took effect and replaying the contract's bookkeeping is enough:
+
+    open          starts a challenge with every counter at zero, live alongside
+                  the others, its ID the one after the last challenge's
+    vote          a first vote in a challenge counts for its option, a vote for
+                  another option moves the voter's vote, a vote for the same option
+                  changes nothing
+    close out     removes the voter's votes from every live challenge
+    clear state   forgets the voter but keeps their votes counted, the clear
+                  program does not touch global state
+    completeVoting  pays a challenge out and ends it
+
+Tallies of every challenge, live and past, and the votes of every voter are kept up
+to date as records come in, so queries are dictionary lookups. Every accepted call
+is also appended to its sender's history, which survives the voter closing out.
+
+An application is followed from the record creating it, when its ID is one of
+`apps` or it is created with the `approval` program. index_file() checkpoints the
+whole state with its position in the file every `checkpoint_seconds` and at the
+end, so a restart resumes where the last run stopped. Records at or before the
+position of the checkpoint are skipped, so a feed may also be replayed from an
+earlier round.
+
+    python3 vote_indexer.py records.jsonl --checkpoint indexer.json
+    python3 vote_indexer.py records.jsonl --checkpoint indexer.json --follow
+"""
+import argparse
+import base64
+import json
+import os
+import sys
+import time
+
+from algosdk import encoding
+
+import donation_votes
+
+# Bump to refuse checkpoints written with a different layout.
+CHECKPOINT_FORMAT = 2
+# Seconds between two checkpoints. Writing one takes time proportional to the whole
+# state, so they are spaced in time rather than records.
+DEFAULT_CHECKPOINT_SECONDS = 30.0
+# Seconds between two reads of a followed file that had no new records.
+FOLLOW_INTERVAL = 1.0
+
+# on-completion of application call records.
+NO_OP = "noop"
+OPT_IN = "optin"
+CLOSE_OUT = "closeout"
+CLEAR_STATE = "clear"
+DELETE = "delete"
+
+# Actions recorded in voter histories.
+FIRST_VOTE = "vote"
+SWITCH = "switch"
+REPEAT = "repeat"
+VOTER_CLOSE_OUT = "close_out"
+VOTER_CLEAR = "clear"
+
+
+class IndexerError(Exception):
+    pass
+
+
+class Application:
+    """
+    Global state of a followed application.
+    :ivar challenge_id: ID of the last challenge opened.
+    :ivar live: dict of the ID of every live challenge to its Challenge.
+    """
+
+    def __init__(self, app_id, creator, vote_asset):
+        self.app_id = app_id
+        self.creator = creator
+        self.vote_asset = vote_asset
+        self.challenge_id = 0
+        self.live = {}
+        self.deleted = False
+
+    def as_dict(self):
+        fields = dict(vars(self))
+        fields["live"] = [challenge.as_dict() for challenge in self.live.values()]
+        return fields
+
+    @classmethod
+    def from_dict(cls, fields):
+        application = cls(fields["app_id"], fields["creator"], fields["vote_asset"])
+        vars(application).update(fields)
+        application.live = {
+            challenge["challenge_id"]: Challenge.from_dict(challenge)
+            for challenge in fields["live"]
+        }
+        return application
+
+
+class Challenge:
+    """
+    Parameters of a live challenge.
+    :ivar wallets: wallet address of every option.
+    :ivar names: name of every option.
+    """
+
+    def __init__(self, challenge_id, start_time, end_time, asset_id, wallets, names):
+        self.challenge_id = challenge_id
+        self.start_time = start_time
+        self.end_time = end_time
+        self.asset_id = asset_id
+        self.wallets = wallets
+        self.names = names
+
+    def as_dict(self):
+        return dict(vars(self))
+
+    @classmethod
+    def from_dict(cls, fields):
+        return cls(**fields)
+
+
+def _args(call):
+    return [base64.b64decode(arg) for arg in call.get("application-args", ())]
+
+
+def _btoi(value):
+    return int.from_bytes(value, "big")
+
+
+def _options(wallets, names):
+    """
+    :return: tuple of (wallet addresses, names) of a challenge's options, from the
+        packed wallets argument and the name arguments.
+    """
+    size = donation_votes.ADDRESS_SIZE
+    return (
+        [
+            encoding.encode_address(wallets[i : i + size])
+            for i in range(0, len(wallets), size)
+        ],
+        [name.decode(errors="replace") for name in names],
+    )
+
+
+class Indexer:
+    """
+    State of every followed application, rebuilt from transaction records.
+    :param apps: IDs of applications to follow.
+    :param approval: approval program bytecode; applications created with it are
+        followed too.
+    """
+
+    def __init__(self, apps=(), approval=None):
+        self.follow = set(apps)
+        self.approval = (
+            base64.b64encode(approval).decode() if approval is not None else None
+        )
+        self.apps = {}
+        # (app ID, challenge ID) to the votes of every option.
+        self.tallies = {}
+        # (app ID, challenge ID) to asset ID (0 for Algos) to the amount paid to
+        # every option by completeVoting.
+        self.payouts = {}
+        # (app ID, address) to the dict of challenge ID to the option voted for, of
+        # opted in voters.
+        self.local = {}
+        # Address to [round, app ID, challenge ID, action, option] of every call.
+        self.history = {}
+        # (round, intra round offset) of the last record indexed.
+        self.position = (-1, -1)
+        # Byte offset in the file index_file() reads.
+        self.offset = 0
+        # Records index_file() read, application calls or not.
+        self.records = 0
+
+    def tally(self, app_id, challenge_id):
+        """
+        :return: list of the votes of every option of a challenge.
+        """
+        return self.tallies[(app_id, challenge_id)]
+
+    def choice(self, app_id, address, challenge_id):
+        """
+        :return: the option address votes for in a challenge of the application, or
+            None.
+        """
+        local = self.local.get((app_id, address))
+        if local is None:
+            return None
+        return local.get(challenge_id)
+
+    def voter_history(self, address):
+        return self.history.get(address, [])
+
+    def _record(self, address, round_num, app_id, challenge_id, action, option=None):
+        self.history.setdefault(address, []).append(
+            [round_num, app_id, challenge_id, action, option]
+        )
+
+    def add(self, record):
+        """
+        Indexes one transaction record, or every transaction of a block record.
+        """
+        if "transactions" in record:
+            round_num = record["round"]
+            for intra, txn in enumerate(record["transactions"]):
+                self._add(txn, round_num, txn.get("intra-round-offset", intra))
+        else:
+            self._add(
+                record, record["confirmed-round"], record.get("intra-round-offset", 0)
+            )
+
+    def _add(self, txn, round_num, intra):
+        position = (round_num, intra)
+        if position <= self.position:
+            return
+        self.position = position
+        if txn.get("tx-type") != "appl":
+            return
+        call = txn["application-transaction"]
+        app_id = call.get("application-id", 0)
+        if app_id == 0:
+            self._create(txn, call, round_num)
+            return
+        app = self.apps.get(app_id)
+        if app is None or app.deleted:
+            return
+        sender = txn["sender"]
+        on_completion = call.get("on-completion", NO_OP)
+        if on_completion == NO_OP:
+            args = _args(call)
+            method = args[0] if args else b""
+            if method == b"vote":
+                self._vote(app, sender, _btoi(args[1]), _btoi(args[2]), round_num)
+            elif method == b"open":
+                self._open(app, args)
+            elif method == b"completeVoting":
+                self._complete(app, _btoi(args[1]), txn.get("inner-txns", ()))
+        elif on_completion == OPT_IN:
+            self.local[(app_id, sender)] = {}
+        elif on_completion == CLOSE_OUT:
+            self._close_out(app, sender, round_num)
+        elif on_completion == CLEAR_STATE:
+            self.local.pop((app_id, sender), None)
+            self._record(sender, round_num, app_id, None, VOTER_CLEAR)
+        elif on_completion == DELETE:
+            app.deleted = True
+
+    def _create(self, txn, call, round_num):
+        app_id = txn.get("created-application-index")
+        if app_id is None or (
+            app_id not in self.follow
+            and (self.approval is None or call.get("approval-program") != self.approval)
+        ):
+            return
+        args = _args(call)
+        self.apps[app_id] = Application(app_id, txn["sender"], _btoi(args[0]))
+
+    def _open(self, app, args):
+        # Challenges are numbered in the order they are opened.
+        app.challenge_id += 1
+        wallets, names = _options(args[6], args[7:])
+        start_time, end_time, asset_id = (_btoi(arg) for arg in args[1:4])
+        app.live[app.challenge_id] = Challenge(
+            app.challenge_id, start_time, end_time, asset_id, wallets, names
+        )
+        self.tallies[(app.app_id, app.challenge_id)] = [0] * len(wallets)
+
+    def _vote(self, app, sender, challenge_id, option, round_num):
+        key = (app.app_id, sender)
+        local = self.local.get(key)
+        if local is None:
+            # Opted in before the application was followed.
+            local = self.local[key] = {}
+        tally = self.tallies[(app.app_id, challenge_id)]
+        previous = local.get(challenge_id)
+        if previous is None:
+            tally[option] += 1
+            action = FIRST_VOTE
+        elif previous != option:
+            tally[previous] -= 1
+            tally[option] += 1
+            action = SWITCH
+        else:
+            action = REPEAT
+        local[challenge_id] = option
+        self._record(sender, round_num, app.app_id, challenge_id, action, option)
+
+    def _close_out(self, app, sender, round_num):
+        local = self.local.pop((app.app_id, sender), None) or {}
+        removed = False
+        for challenge_id in app.live:
+            option = local.get(challenge_id)
+            if option is not None:
+                self.tallies[(app.app_id, challenge_id)][option] -= 1
+                self._record(
+                    sender, round_num, app.app_id, challenge_id, VOTER_CLOSE_OUT, option
+                )
+                removed = True
+        if not removed:
+            self._record(sender, round_num, app.app_id, None, VOTER_CLOSE_OUT)
+
+    def _complete(self, app, challenge_id, inner_txns):
+        """
+        Records the payouts of completeVoting: it pays every option in order, the
+        prize asset then Algos, the last option or the creator the rest, and ends
+        the challenge.
+        """
+        app.live.pop(challenge_id, None)
+        payouts = self.payouts.setdefault((app.app_id, challenge_id), {})
+        for inner in inner_txns:
+            if inner.get("tx-type") == "axfer":
+                transfer = inner["asset-transfer-transaction"]
+                asset_id = transfer["asset-id"]
+            elif inner.get("tx-type") == "pay":
+                transfer = inner["payment-transaction"]
+                asset_id = 0
+            else:
+                continue
+            amount = transfer.get("amount", 0) + transfer.get("close-amount", 0)
+            payouts.setdefault(asset_id, []).append(amount)
+
+    def save(self, path):
+        """
+        Writes a checkpoint of the state and position, replacing the file at path
+        only once the checkpoint is complete.
+        """
+        checkpoint = {
+            "format": CHECKPOINT_FORMAT,
+            "follow": sorted(self.follow),
+            "approval": self.approval,
+            "position": list(self.position),
+            "offset": self.offset,
+            "records": self.records,
+            "apps": [app.as_dict() for app in self.apps.values()],
+            "tallies": [[*key, tally] for key, tally in self.tallies.items()],
+            "payouts": [
+                [*key, [[asset_id, amounts] for asset_id, amounts in paid.items()]]
+                for key, paid in self.payouts.items()
+            ],
+            "local": [[*key, list(local.items())] for key, local in self.local.items()],
+            "history": self.history,
+        }
+        tmp = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp, "w") as f:
+            json.dump(checkpoint, f, separators=(",", ":"))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            checkpoint = json.load(f)
+        if checkpoint.get("format") != CHECKPOINT_FORMAT:
+            raise IndexerError(
+                "{}: checkpoint format {}, expected {}".format(
+                    path, checkpoint.get("format"), CHECKPOINT_FORMAT
+                )
+            )
+        indexer = cls(checkpoint["follow"])
+        indexer.approval = checkpoint["approval"]
+        indexer.position = tuple(checkpoint["position"])
+        indexer.offset = checkpoint["offset"]
+        indexer.records = checkpoint["records"]
+        for fields in checkpoint["apps"]:
+            indexer.apps[fields["app_id"]] = Application.from_dict(fields)
+        indexer.tallies = {
+            (app_id, challenge_id): tally
+            for app_id, challenge_id, tally in checkpoint["tallies"]
+        }
+        indexer.payouts = {
+            (app_id, challenge_id): dict(paid)
+            for app_id, challenge_id, paid in checkpoint["payouts"]
+        }
+        indexer.local = {
+            (app_id, address): dict(votes)
+            for app_id, address, votes in checkpoint["local"]
+        }
+        indexer.history = checkpoint["history"]
+        return indexer
+
+    def index_file(
+        self,
+        path,
+        checkpoint=None,
+        checkpoint_seconds=DEFAULT_CHECKPOINT_SECONDS,
+        max_records=None,
+    ):
+        """
+        Indexes the records of a JSONL file from self.offset on, up to its last
+        complete line, so a file still being written can be read again later.
+        :param checkpoint: optional path of the checkpoint to write.
+        :param max_records: optional number of records to stop after.
+        :return: the number of records read.
+        """
+        count = 0
+        saved = time.monotonic()
+        with open(path, "rb") as f:
+            f.seek(self.offset)
+            for line in f:
+                if not line.endswith(b"\n") or (
+                    max_records is not None and count >= max_records
+                ):
+                    break
+                # Most records on a busy network are not application calls.
+                if b'"appl"' in line:
+                    self.add(json.loads(line))
+                self.offset += len(line)
+                self.records += 1
+                count += 1
+                if (
+                    checkpoint is not None
+                    and time.monotonic() - saved >= checkpoint_seconds
+                ):
+                    self.save(checkpoint)
+                    saved = time.monotonic()
+        if checkpoint is not None:
+            self.save(checkpoint)
+        return count
+
+
+def donation_votes_approval():
+    """
+    :return: the approval program bytecode of donation_votes, as the build compiles
+        it.
+    """
+    import teal
+    import votes_lifecycle
+
+    return teal.assemble(votes_lifecycle.compile_programs()[0])
+
+
+def summary(indexer):
+    """
+    :return: lines with the tallies of every challenge of every application.
+    """
+    lines = []
+    for (app_id, challenge_id), tally in sorted(indexer.tallies.items()):
+        app = indexer.apps[app_id]
+        live = app.live.get(challenge_id) if not app.deleted else None
+        line = "app {} challenge {}{}: {}".format(
+            app_id,
+            challenge_id,
+            " (live)" if live else "",
+            "  ".join(
+                "{} {}".format(name, votes) for name, votes in zip(live.names, tally)
+            )
+            if live
+            else "  ".join(str(votes) for votes in tally),
+        )
+        lines.append(line)
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Index donation_votes calls.")
+    parser.add_argument("records", help="JSONL file of transaction or block records")
+    parser.add_argument("--checkpoint", help="checkpoint file to resume from and write")
+    parser.add_argument(
+        "--app",
+        type=int,
+        action="append",
+        default=[],
+        help="application to follow, by default every donation_votes application",
+    )
+    parser.add_argument(
+        "--checkpoint-seconds", type=float, default=DEFAULT_CHECKPOINT_SECONDS
+    )
+    parser.add_argument(
+        "--follow", action="store_true", help="keep reading records appended later"
+    )
+    args = parser.parse_args(argv)
+
+    if args.checkpoint and os.path.exists(args.checkpoint):
+        indexer = Indexer.load(args.checkpoint)
+    else:
+        approval = None if args.app else donation_votes_approval()
+        indexer = Indexer(args.app, approval)
+    while True:
+        start = time.perf_counter()
+        count = indexer.index_file(
+            args.records, args.checkpoint, args.checkpoint_seconds
+        )
+        if count:
+            seconds = time.perf_counter() - start
+            print(
+                "{} records in {:.2f}s, up to round {}".format(
+                    count, seconds, indexer.position[0]
+                )
+            )
+            for line in summary(indexer):
+                print(line)
+        if not args.follow:
+            return 0
+        time.sleep(FOLLOW_INTERVAL)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,545 @@
+"""
+Drives donation_votes challenges against algod, for many campaigns at once.
+
+A campaign is a series of challenges of one creator, run one after the other.
+Campaigns share applications: campaigns of the same creator and vote asset take
+turns creating one, and each application then hosts up to
+donation_votes.MAX_CHALLENGES of them, one live challenge each. For every campaign
+the runner
+
+    1. has the application created and funded, by the campaign's first in it,
+    2. funds the application for the first challenge, opts it into the prize asset,
+       deposits the prize and opens the challenge, in one group,
+    3. waits for the chain to pass the challenge's end time,
+    4. pays the prize out with completeVoting, grouped with the budget calls its
+       worst case needs, and, when another challenge follows, funds the
+       application for it, opts into its prize asset, deposits its prize and opens
+       it, all in one group, so the campaign always has a live challenge,
+
+and repeats 3 and 4 until the last challenge is paid out. The steps of a campaign
+run in order, and campaigns run concurrently, sharing the client's connections,
+suggested params and block watcher.
+
+    async with algod_client.AlgodClient(address, token) as algod:
+        runner = votes_lifecycle.Runner(algod, approval, clear)
+        results = await votes_lifecycle.run_campaigns(runner, campaigns)
+
+Every group is signed once, valid for `validity_rounds` rounds. If sending it times
+out, the same signed group is sent again: algod accepts a transaction once, so a
+resend cannot apply it twice. If it is not confirmed by its last valid round, it can
+no longer be confirmed. The runner then reads the application's state to check
+whether the step took effect before building it again with new params: a challenge
+opened unseen is found by its parameters and options. A create that is retried after
+being applied unseen leaves an extra application behind.
+
+algod_stub.py with an avm.Ledger runs the contract behind the same endpoints, and
+bench_votes_lifecycle.py runs campaigns through it.
+"""
+import asyncio
+import base64
+import copy
+import functools
+import os
+
+from algosdk import account, encoding, error, logic
+from algosdk.future.transaction import (
+    ApplicationCreateTxn,
+    ApplicationNoOpTxn,
+    AssetTransferTxn,
+    OnComplete,
+    PaymentTxn,
+    StateSchema,
+    assign_group_id,
+)
+
+import algod_client
+import build
+import donation_votes
+import state_schema
+import teal
+import teal_cost
+
+# Rounds a group stays valid. A group that is not confirmed by then is built again.
+DEFAULT_VALIDITY_ROUNDS = 10
+# Times a step's group is built and sent before the campaign fails.
+DEFAULT_ATTEMPTS = 3
+# Times the same signed group is sent when sending it times out.
+SEND_ATTEMPTS = 3
+# Minimum balance of an account, and what each asset it holds adds to it.
+MIN_BALANCE = 100000
+ASSET_MIN_BALANCE = 100000
+
+
+class LifecycleError(Exception):
+    pass
+
+
+def _itob(value):
+    return value.to_bytes(8, "big")
+
+
+class Challenge:
+    """
+    Parameters of one challenge.
+    :param options: list of (name, wallet address) of every option, in order.
+    :param asset_id: the prize asset, which the application opts into.
+    :param prize: amount of the prize asset the creator deposits.
+    :param algo_prize: microalgos paid out along with the prize asset.
+    """
+
+    def __init__(self, start_time, end_time, options, asset_id, prize, algo_prize=0):
+        if not 2 <= len(options) <= donation_votes.MAX_OPTIONS:
+            raise ValueError(
+                "a challenge has between 2 and {} options".format(
+                    donation_votes.MAX_OPTIONS
+                )
+            )
+        if end_time <= start_time:
+            raise ValueError("end_time must be after start_time")
+        if asset_id <= 0:
+            raise ValueError(
+                "a prize asset is required, Algos are paid out as algo_prize"
+            )
+        self.start_time = start_time
+        self.end_time = end_time
+        self.names = []
+        self.wallets = []
+        for name, wallet in options:
+            name = name.encode() if isinstance(name, str) else name
+            if len(name) > donation_votes.MAX_NAME_SIZE:
+                raise ValueError("option name {!r} is too long".format(name))
+            self.names.append(name)
+            self.wallets.append(encoding.decode_address(wallet))
+        self.asset_id = asset_id
+        self.prize = prize
+        self.algo_prize = algo_prize
+
+    def payout_fees(self, min_fee):
+        """
+        :return: the fees of the inner transactions completeVoting sends, at most
+            one per option for each of the prize and the Algo prize.
+        """
+        prizes = bool(self.prize) + bool(self.algo_prize)
+        return len(self.wallets) * prizes * min_fee
+
+    def open_args(self):
+        return [
+            b"open",
+            _itob(self.start_time),
+            _itob(self.end_time),
+            _itob(self.asset_id),
+            _itob(self.prize),
+            _itob(self.algo_prize),
+            b"".join(self.wallets),
+        ] + self.names
+
+    def matches(self, fields, options):
+        """
+        :param fields: a challenge's fields, as donation_votes.decode_challenge()
+            returns them.
+        :param options: list of the values of the challenge's options.
+        :return: whether they are this challenge's, before any vote.
+        """
+        return (
+            fields["startTime"] == self.start_time
+            and fields["endTime"] == self.end_time
+            and fields["assetID"] == self.asset_id
+            and fields["prize"] == self.prize
+            and fields["algoPrize"] == self.algo_prize
+            and options == [w + n for w, n in zip(self.wallets, self.names)]
+        )
+
+
+class Campaign:
+    """
+    Challenges run one after the other by one creator.
+    :param creator_key: private key of the creator, base64 as algosdk keeps it. It
+        holds the prize assets and pays every fee.
+    :param vote_asset: asset voters must hold, for every challenge.
+    """
+
+    def __init__(self, creator_key, vote_asset, challenges):
+        if not challenges:
+            raise ValueError("a campaign has at least one challenge")
+        self.creator_key = creator_key
+        self.creator = account.address_from_private_key(creator_key)
+        self.vote_asset = vote_asset
+        self.challenges = list(challenges)
+
+
+class CampaignResult:
+    def __init__(self, app_id):
+        self.app_id = app_id
+        # ID of every challenge opened, in order.
+        self.challenge_ids = []
+        # (step, confirmed round) of every step, in order.
+        self.steps = []
+
+
+def global_state(app_info):
+    """
+    :return: the global state of algod's application info, decoded by
+        donation_votes.AppVariables.
+    """
+    entries = app_info["params"].get("global-state")
+    return donation_votes.AppVariables.decode(state_schema.raw_state(entries))
+
+
+def compile_programs():
+    """
+    :return: tuple of the (approval, clear) TEAL source of donation_votes, as the
+        build writes them.
+    """
+    compiled = build.build_contracts(["donation_votes"])["donation_votes"]
+    return compiled["approval"][0], compiled["clear"][0]
+
+
+@functools.lru_cache(maxsize=None)
+def complete_voting_budget_calls():
+    """
+    :return: the budget calls to group with completeVoting: enough to pool the
+        opcode budget of its worst case as teal_cost.py finds it, and at least the
+        ones donation_votes asserts.
+    """
+    routes = teal_cost.analyze_contract("donation_votes")["routes"]
+    missing = routes["completeVoting"]["max"] - teal.MAX_APP_COST
+    # What a budget call adds, less what it costs itself.
+    added = teal.MAX_APP_COST - routes["budget"]["max"]
+    return max(donation_votes.COMPLETE_VOTING_BUDGET_CALLS, -(-missing // added))
+
+
+class Runner:
+    """
+    Runs campaigns against algod.
+    :param approval: approval program bytecode, e.g. teal.assemble() of the
+        source compile_programs() returns.
+    :param on_step: optional function called with (campaign, result, step) after
+        every confirmed step.
+    :param budget_calls: budget calls grouped with every completeVoting,
+        complete_voting_budget_calls() by default.
+    """
+
+    def __init__(
+        self,
+        algod,
+        approval,
+        clear,
+        validity_rounds=DEFAULT_VALIDITY_ROUNDS,
+        attempts=DEFAULT_ATTEMPTS,
+        on_step=None,
+        budget_calls=None,
+    ):
+        self.algod = algod
+        self.approval = approval
+        self.clear = clear
+        self.validity_rounds = validity_rounds
+        self.attempts = attempts
+        self.on_step = on_step
+        if budget_calls is None:
+            budget_calls = complete_voting_budget_calls()
+        self.budget_calls = budget_calls
+        # (app ID, challenge ID) of every challenge a campaign opened.
+        self.opened = set()
+
+    async def _params(self):
+        """
+        :return: a copy of the suggested params with a flat minimum fee and the
+            validity window shortened to validity_rounds.
+        """
+        params = copy.copy(await self.algod.suggested_params())
+        params.flat_fee = True
+        params.fee = params.min_fee
+        params.last = params.first + self.validity_rounds
+        return params
+
+    async def _send(self, txns):
+        """
+        Sends a signed group, again when sending it times out.
+        """
+        for attempt in range(SEND_ATTEMPTS):
+            try:
+                await self.algod.send_transactions(txns)
+                return
+            except error.AlgodHTTPError as e:
+                # A send that timed out went through after all.
+                if attempt and "already in ledger" in str(e):
+                    return
+                raise
+            except (asyncio.TimeoutError, ConnectionError):
+                if attempt == SEND_ATTEMPTS - 1:
+                    raise
+
+    async def _submit(
+        self, campaign, result, step, build_group, done=None, confirmed=None
+    ):
+        """
+        Builds, signs and sends a step's group until it is confirmed.
+        :param build_group: coroutine function of the suggested params returning the
+            group's unsigned transactions, all sent by the creator.
+        :param done: optional coroutine function telling whether the step took
+            effect, checked before building the group again. A true value it
+            returns stands for the pending transaction info.
+        :param confirmed: optional function called with the info once the step is
+            confirmed, before on_step.
+        :return: the pending transaction info of the group's last transaction.
+        """
+        for attempt in range(self.attempts):
+            if attempt and done is not None:
+                info = await done()
+                if info:
+                    break
+            params = await self._params()
+            txns = await build_group(params)
+            if len(txns) > 1:
+                assign_group_id(txns)
+            signed = [txn.sign(campaign.creator_key) for txn in txns]
+            await self._send(signed)
+            try:
+                # The transactions of a group are confirmed together.
+                info = await self.algod.wait_for_confirmation(
+                    signed[-1].get_txid(), last_valid=params.last
+                )
+                break
+            except error.ConfirmationTimeoutError:
+                continue
+        else:
+            raise LifecycleError(
+                "{} not confirmed after {} attempts".format(step, self.attempts)
+            )
+        if confirmed is not None:
+            confirmed(info)
+        confirmed_round = info["confirmed-round"] if isinstance(info, dict) else None
+        result.steps.append((step, confirmed_round))
+        if self.on_step is not None:
+            self.on_step(campaign, result, step)
+        return info
+
+    async def _state(self, app_id):
+        return global_state(await self.algod.application_info(app_id))
+
+    async def _balance(self, app_id):
+        info = await self.algod.account_info(logic.get_application_address(app_id))
+        return info["amount"]
+
+    async def create(self, campaign, result):
+        """
+        Creates an application for the campaign's creator and vote asset and funds
+        its minimum balance.
+        :return: the application ID.
+        """
+
+        async def create(params):
+            return [
+                ApplicationCreateTxn(
+                    campaign.creator,
+                    params,
+                    OnComplete.NoOpOC,
+                    self.approval,
+                    self.clear,
+                    StateSchema(*donation_votes.GLOBAL_SCHEMA),
+                    StateSchema(*donation_votes.LOCAL_SCHEMA),
+                    [_itob(campaign.vote_asset)],
+                    # Identical campaigns still get distinct transactions.
+                    note=os.urandom(8),
+                )
+            ]
+
+        info = await self._submit(campaign, result, "create", create)
+        app_id = info["application-index"]
+        app_address = logic.get_application_address(app_id)
+
+        async def fund(params):
+            return [PaymentTxn(campaign.creator, params, app_address, MIN_BALANCE)]
+
+        async def fund_done():
+            return await self._balance(app_id) >= MIN_BALANCE
+
+        await self._submit(campaign, result, "fund", fund, fund_done)
+        return app_id
+
+    def _open(self, campaign, app_id, params, challenge):
+        """
+        :return: the transactions that fund the application for a challenge, opt it
+            into the prize asset, deposit the prize and open the challenge.
+        """
+        app_address = logic.get_application_address(app_id)
+        needed = (
+            ASSET_MIN_BALANCE
+            + params.min_fee
+            + challenge.payout_fees(params.min_fee)
+            + challenge.algo_prize
+        )
+        txns = [
+            PaymentTxn(campaign.creator, params, app_address, needed),
+            ApplicationNoOpTxn(
+                campaign.creator,
+                params,
+                app_id,
+                [b"setup", _itob(challenge.asset_id)],
+                foreign_assets=[challenge.asset_id],
+            ),
+        ]
+        if challenge.prize:
+            txns.append(
+                AssetTransferTxn(
+                    campaign.creator,
+                    params,
+                    app_address,
+                    challenge.prize,
+                    challenge.asset_id,
+                )
+            )
+        txns.append(
+            ApplicationNoOpTxn(campaign.creator, params, app_id, challenge.open_args())
+        )
+        return txns
+
+    async def _find(self, app_id, challenge):
+        """
+        :return: the ID of a live challenge with the parameters and options of
+            challenge that no campaign opened yet, or None.
+        """
+        state = await self._state(app_id)
+        options = state.get("option", {})
+        for challenge_id, value in sorted(state.get("challenge", {}).items()):
+            if (app_id, challenge_id) in self.opened:
+                continue
+            first = challenge_id * donation_votes.MAX_OPTIONS
+            values = [
+                options.get(first + i, b"") for i in range(len(challenge.wallets))
+            ]
+            if challenge.matches(donation_votes.decode_challenge(value), values):
+                return challenge_id
+        return None
+
+    def _opened(self, app_id, result, info):
+        """
+        Records the challenge a confirmed group opened, from the opened event its open
+        call logged, or from its ID when the group was found applied.
+        """
+        if isinstance(info, dict):
+            opened = donation_votes.Events.opened.decode(
+                base64.b64decode(info["logs"][0])
+            )
+            challenge_id = opened["challenge_id"]
+        else:
+            challenge_id = info
+        self.opened.add((app_id, challenge_id))
+        result.challenge_ids.append(challenge_id)
+
+    async def run(self, campaign, app_id=None, created=None):
+        """
+        Runs every challenge of a campaign.
+        :param app_id: ID of the application to open the challenges in, or an
+            awaitable of it. By default the campaign creates one.
+        :param created: optional asyncio.Future set to the ID of the application
+            the campaign creates, or to None when creating it fails.
+        :return: CampaignResult
+        """
+        result = CampaignResult(None)
+        if app_id is None:
+            try:
+                app_id = await self.create(campaign, result)
+            finally:
+                if created is not None:
+                    created.set_result(app_id)
+        elif not isinstance(app_id, int):
+            app_id = await app_id
+            if app_id is None:
+                raise LifecycleError("the campaign creating the application failed")
+        result.app_id = app_id
+        first = campaign.challenges[0]
+
+        async def open_first(params):
+            return self._open(campaign, app_id, params, first)
+
+        async def open_done():
+            return await self._find(app_id, first)
+
+        await self._submit(
+            campaign,
+            result,
+            "open 1",
+            open_first,
+            open_done,
+            functools.partial(self._opened, app_id, result),
+        )
+
+        for index, challenge in enumerate(campaign.challenges, 1):
+            challenge_id = result.challenge_ids[-1]
+            following = campaign.challenges[index : index + 1]
+            await self.algod.wait_for_timestamp(challenge.end_time)
+
+            # Each step is confirmed before the next iteration, so the closures
+            # below see this iteration's challenge.
+            async def complete(params):
+                txns = [
+                    ApplicationNoOpTxn(
+                        campaign.creator,
+                        params,
+                        app_id,
+                        [b"completeVoting", _itob(challenge_id)],
+                        accounts=[
+                            encoding.encode_address(w) for w in challenge.wallets
+                        ],
+                        foreign_assets=[challenge.asset_id],
+                    )
+                ] + [
+                    # Numbered, as a group cannot hold the same transaction twice.
+                    ApplicationNoOpTxn(
+                        campaign.creator, params, app_id, [b"budget", _itob(k)]
+                    )
+                    for k in range(self.budget_calls)
+                ]
+                if not following:
+                    return txns
+                return txns + self._open(campaign, app_id, params, following[0])
+
+            async def complete_done():
+                state = await self._state(app_id)
+                if challenge_id in state.get("challenge", {}):
+                    return None
+                if following:
+                    return await self._find(app_id, following[0])
+                return True
+
+            step = "complete {}".format(index)
+            if following:
+                step += " and open {}".format(index + 1)
+            opened = functools.partial(self._opened, app_id, result)
+            await self._submit(
+                campaign,
+                result,
+                step,
+                complete,
+                complete_done,
+                opened if following else None,
+            )
+        return result
+
+
+async def run_campaigns(
+    runner, campaigns, concurrency=algod_client.DEFAULT_CONCURRENCY
+):
+    """
+    Runs campaigns with at most `concurrency` of them in flight. Campaigns of the
+    same creator and vote asset share applications, up to MAX_CHALLENGES to each,
+    the first of them creating it.
+    :return: list of the CampaignResult of every campaign in order, or the
+        exception it raised.
+    """
+    loop = asyncio.get_running_loop()
+    # (creator, vote asset) to [future application ID, campaigns sharing it].
+    shared = {}
+    jobs = []
+    for campaign in campaigns:
+        key = (campaign.creator, campaign.vote_asset)
+        entry = shared.get(key)
+        if entry is None or entry[1] == donation_votes.MAX_CHALLENGES:
+            entry = shared[key] = [loop.create_future(), 0]
+            job = functools.partial(runner.run, campaign, created=entry[0])
+        else:
+            job = functools.partial(runner.run, campaign, entry[0])
+        entry[1] += 1
+        jobs.append(job)
+    return await algod_client.run_concurrently(jobs, concurrency)
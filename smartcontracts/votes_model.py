@@ -0,0 +1,409 @@
+"""
+Vectorized reference model of the donation_votes state machine.
+
+Computes the outcome of one challenge from arrays of events in one batch, for
+populations far larger than replaying transactions allows:
+
+    voter      voter id of each event (any integers)
+    timestamp  latest timestamp of the block the event lands in
+    choice     the option index for a vote, CLOSE_OUT for a close out, any other
+               value for a vote naming an option not in the challenge
+    holds      whether the voter held the vote asset at that time
+
+A vote is accepted when the voter holds the vote asset, the timestamp lies
+strictly between the challenge's start and end time and the option is one of
+the challenge's. A close out is always accepted and removes the voter's
+vote, like handle_close_out. A voter's vote at the end is the one cast by their
+last accepted event, so switching votes (remove_existing_vote) and repeated
+votes fall out of a sort by voter and time.
+
+cross_check() replays a sample of voters through the compiled contract with
+avm.py and compares the tallies, every voter's local state and the payout, to
+catch drift between this model and the contract. The challenge runs alongside a
+second one in the same application, where every voter votes for the mirrored
+option, whose outcome must mirror the first's.
+"""
+import numpy as np
+
+import avm
+import build
+import donation_votes
+
+CLOSE_OUT = -1
+
+UINT64_MAX = 2 ** 64 - 1
+
+
+class ChallengeResult:
+    """
+    Outcome of a challenge.
+    :ivar tallies: int64 array of the votes for every option.
+    :ivar payouts: the amounts on_complete_voting sends to every option's wallet.
+    :ivar refund: the amount it sends back to the creator, the whole prize when
+        there are no votes.
+    :ivar voters: sorted ids of every voter with an accepted event.
+    :ivar final_choice: the vote of each of voters at the end, CLOSE_OUT if none.
+    """
+
+    def __init__(self, **fields):
+        self.tallies = fields["tallies"]
+        self.payouts = fields["payouts"]
+        self.refund = fields["refund"]
+        self.voters = fields["voters"]
+        self.final_choice = fields["final_choice"]
+        # Accepted events by kind, and rejected ones.
+        self.first_votes = fields["first_votes"]
+        self.switches = fields["switches"]
+        self.repeats = fields["repeats"]
+        self.close_outs = fields["close_outs"]
+        self.rejected = fields["rejected"]
+
+    def as_dict(self):
+        return {
+            "tallies": self.tallies.tolist(),
+            "payouts": self.payouts,
+            "refund": self.refund,
+            "first_votes": self.first_votes,
+            "switches": self.switches,
+            "repeats": self.repeats,
+            "close_outs": self.close_outs,
+            "rejected": self.rejected,
+        }
+
+
+def payout(balance, tallies):
+    """
+    Splits a prize like on_complete_voting: every option but the last receives
+    balance * its votes / total votes, rounded down, the last option the rest. The
+    contract takes the product 128 bits wide when needed, so any balance is split
+    exactly. Without votes, the prize goes back to the creator.
+    :return: tuple of (payouts, refund).
+    """
+    tallies = [int(count) for count in tallies]
+    total = sum(tallies)
+    if total == 0:
+        return (0,) * len(tallies), balance
+    payouts = [balance * count // total for count in tallies[:-1]]
+    return tuple(payouts) + (balance - sum(payouts),), 0
+
+
+def simulate(
+    voter, timestamp, choice, holds, start_time, end_time, balance=0, options=2
+):
+    """
+    Runs one challenge.
+    :param balance: the challenge's prize.
+    :param options: number of options in the challenge.
+    :return: ChallengeResult
+    """
+    voter = np.asarray(voter, dtype=np.int64)
+    timestamp = np.asarray(timestamp, dtype=np.int64)
+    choice = np.asarray(choice, dtype=np.int64)
+    holds = np.asarray(holds, dtype=bool)
+
+    is_close = choice == CLOSE_OUT
+    is_option = (choice >= 0) & (choice < options)
+    in_window = (timestamp > start_time) & (timestamp < end_time)
+    accepted = is_close | (is_option & holds & in_window)
+
+    # Accepted events by voter, then time, then arrival order.
+    index = np.flatnonzero(accepted)
+    order = np.lexsort((index, timestamp[index], voter[index]))
+    events = index[order]
+    voters = voter[events]
+    choices = choice[events]
+
+    # State before each event: the previous event of the same voter, if any.
+    same_voter = np.zeros(len(events), dtype=bool)
+    same_voter[1:] = voters[1:] == voters[:-1]
+    previous = np.full(len(events), CLOSE_OUT, dtype=np.int64)
+    previous[1:] = np.where(same_voter[1:], choices[:-1], CLOSE_OUT)
+    is_vote = choices != CLOSE_OUT
+    had_vote = previous != CLOSE_OUT
+
+    last = np.ones(len(events), dtype=bool)
+    last[:-1] = voters[1:] != voters[:-1]
+    final_voters = voters[last]
+    final_choice = choices[last]
+    tallies = np.bincount(
+        final_choice[final_choice != CLOSE_OUT], minlength=options
+    ).astype(np.int64)
+    payouts, refund = payout(balance, tallies)
+    return ChallengeResult(
+        tallies=tallies,
+        payouts=payouts,
+        refund=refund,
+        voters=final_voters,
+        final_choice=final_choice,
+        first_votes=int(np.count_nonzero(is_vote & ~had_vote)),
+        switches=int(np.count_nonzero(is_vote & had_vote & (previous != choices))),
+        repeats=int(np.count_nonzero(is_vote & (previous == choices))),
+        close_outs=int(np.count_nonzero(~is_vote)),
+        rejected=int(len(choice) - len(events)),
+    )
+
+
+def synthetic_events(
+    voters,
+    options=2,
+    events_per_voter=1.3,
+    close_out_rate=0.02,
+    invalid_rate=0.01,
+    non_holder_rate=0.05,
+    start_time=1000,
+    end_time=1000 + 7 * 24 * 3600,
+    seed=0,
+):
+    """
+    Generates a synthetic voter population. Every voter votes once, extra events
+    are re-votes of random voters, and some events are close outs, votes for an
+    unknown option (index options) or votes without the vote asset. About 1% of
+    events land outside the voting window.
+    :return: tuple of (voter, timestamp, choice, holds) arrays.
+    """
+    rng = np.random.default_rng(seed)
+    count = int(voters * events_per_voter)
+    voter = np.concatenate(
+        [np.arange(voters), rng.integers(0, voters, count - voters)]
+    ).astype(np.int64)
+    span = end_time - start_time
+    timestamp = rng.integers(start_time - span // 100, end_time + span // 100, count)
+    choice = rng.integers(0, options, count)
+    roll = rng.random(count)
+    choice[roll < close_out_rate] = CLOSE_OUT
+    choice[(roll >= close_out_rate) & (roll < close_out_rate + invalid_rate)] = options
+    holds = rng.random(count) >= non_holder_rate
+    return voter, timestamp.astype(np.int64), choice.astype(np.int64), holds
+
+
+def sample_voters(voter, size, seed=0):
+    """
+    :return: a boolean mask selecting every event of size random voters.
+    """
+    rng = np.random.default_rng(seed)
+    unique = np.unique(voter)
+    chosen = rng.choice(unique, size=min(size, len(unique)), replace=False)
+    return np.isin(voter, chosen)
+
+
+def mirror(choice, options):
+    """
+    :return: the option counted from the other end for a valid choice, choice
+        itself otherwise.
+    """
+    return options - 1 - choice if 0 <= choice < options else choice
+
+
+class _Deployment:
+    """
+    A donation_votes application deployed on an avm.Ledger with its vote asset,
+    running two challenges with the same window, options and prize at once.
+    """
+
+    def __init__(self, start_time, end_time, balance, options):
+        compiled = build.build_contracts(["donation_votes"])["donation_votes"]
+        self.ledger = avm.Ledger(latest_timestamp=start_time - 1)
+        self.creator = avm.address("creator")
+        self.options = options
+        self.wallets = [avm.address("option {}".format(i)) for i in range(options)]
+        self.ledger.fund(self.creator, 10 ** 15)
+        for wallet in self.wallets:
+            self.ledger.fund(wallet, 10 ** 6)
+        self.prize = self.ledger.create_asset(self.creator, UINT64_MAX)
+        self.vote_asset = self.ledger.create_asset(self.creator, UINT64_MAX)
+        for wallet in self.wallets:
+            self._run(avm.asset_opt_in(wallet, self.prize))
+        result = self._run(
+            avm.app_create(
+                self.creator,
+                compiled["approval"][0],
+                compiled["clear"][0],
+                args=[self.vote_asset],
+                global_ints=donation_votes.GLOBAL_SCHEMA[0],
+                global_bytes=donation_votes.GLOBAL_SCHEMA[1],
+                local_ints=donation_votes.LOCAL_SCHEMA[0],
+                local_bytes=donation_votes.LOCAL_SCHEMA[1],
+            )
+        )
+        self.app_id = result.txns[0].created_app_id
+        self.app_address = avm.application_address(self.app_id)
+        self._run(avm.payment(self.creator, self.app_address, 10 ** 6))
+        setup = avm.app_call(
+            self.creator, self.app_id, ["setup", self.prize], assets=[self.prize]
+        )
+        self._run(setup)
+        if balance:
+            self._run(
+                avm.asset_transfer(
+                    self.creator, self.app_address, self.prize, 2 * balance
+                )
+            )
+        # The challenge and its mirror.
+        self.challenge_ids = []
+        for _ in range(2):
+            result = self._run(
+                avm.app_call(
+                    self.creator,
+                    self.app_id,
+                    [
+                        "open",
+                        start_time,
+                        end_time,
+                        self.prize,
+                        balance,
+                        0,
+                        b"".join(self.wallets),
+                    ]
+                    + ["option {}".format(i) for i in range(options)],
+                )
+            )
+            opened = donation_votes.Events.opened.decode(result.txns[0].logs[0])
+            self.challenge_ids.append(opened["challenge_id"])
+        self.accounts = {}
+
+    def _run(self, group):
+        return self.ledger.execute(group, check=True)
+
+    def account(self, voter_id):
+        account = self.accounts.get(voter_id)
+        if account is None:
+            account = self.accounts[voter_id] = avm.address("voter {}".format(voter_id))
+            self.ledger.fund(account, 10 ** 7)
+            self._run(avm.asset_opt_in(account, self.vote_asset))
+        return account
+
+    def set_holding(self, account, holds):
+        amount = self.ledger.asset_balance(account, self.vote_asset)
+        if holds and amount == 0:
+            self._run(avm.asset_transfer(self.creator, account, self.vote_asset, 1))
+        elif not holds and amount:
+            self._run(
+                avm.asset_transfer(account, self.creator, self.vote_asset, amount)
+            )
+
+    def event(self, voter_id, timestamp, choice, holds):
+        """
+        Sends one event, a vote to both challenges, the mirrored option to the
+        second.
+        :return: whether the contract accepted it.
+        """
+        account = self.account(voter_id)
+        self.ledger.latest_timestamp = timestamp
+        opted_in = self.ledger.local_state(account, self.app_id) is not None
+        if choice == CLOSE_OUT:
+            if not opted_in:
+                return True
+            call = avm.app_call(account, self.app_id, on_complete=avm.CLOSE_OUT)
+            return self.ledger.execute(call).ok
+        self.set_holding(account, holds)
+        if not opted_in:
+            self._run(avm.app_call(account, self.app_id, on_complete=avm.OPT_IN))
+        accepted = True
+        for challenge_id, option in zip(
+            self.challenge_ids, [choice, mirror(choice, self.options)]
+        ):
+            call = avm.app_call(
+                account,
+                self.app_id,
+                ["vote", challenge_id, option],
+                assets=[self.vote_asset],
+            )
+            accepted = self.ledger.execute(call).ok and accepted
+        return accepted
+
+    def final_choice(self, voter_id, challenge_id):
+        state = self.ledger.local_state(self.accounts[voter_id], self.app_id)
+        if state is None:
+            return CLOSE_OUT
+        ballots = donation_votes.LocalVariables.decode(state)["ballots"]
+        return donation_votes.decode_ballots(ballots).get(challenge_id, CLOSE_OUT)
+
+    def tallies(self, challenge_id):
+        state = donation_votes.AppVariables.decode(
+            self.ledger.global_state(self.app_id)
+        )
+        value = state["challenge"][challenge_id]
+        return donation_votes.decode_challenge(value)["votes"]
+
+    def complete(self, end_time, challenge_id):
+        """
+        :return: tuple of (payouts, refund) from running completeVoting, or None
+            and the error when it fails.
+        """
+        self.ledger.latest_timestamp = end_time + 1
+        accounts = self.wallets + [self.creator]
+        before = [self.ledger.asset_balance(a, self.prize) for a in accounts]
+        group = [
+            avm.app_call(
+                self.creator,
+                self.app_id,
+                ["completeVoting", challenge_id],
+                assets=[self.prize],
+                accounts=self.wallets,
+            )
+        ] + [
+            avm.app_call(self.creator, self.app_id, ["budget"])
+            for _ in range(donation_votes.COMPLETE_VOTING_BUDGET_CALLS)
+        ]
+        result = self.ledger.execute(group)
+        if not result.ok:
+            return None, str(result.error)
+        paid = [
+            self.ledger.asset_balance(a, self.prize) - amount
+            for a, amount in zip(accounts, before)
+        ]
+        return tuple(paid[:-1]), paid[-1]
+
+
+def cross_check(
+    voter, timestamp, choice, holds, start_time, end_time, balance=0, options=2
+):
+    """
+    Replays every event through the compiled contract in avm.py, in the model's
+    order, and compares the outcome with simulate(), for the challenge and its
+    mirror. Pass a sample (see sample_voters()), replaying costs tens of
+    microseconds per event.
+    :return: list of mismatch messages, empty when the model and contract agree.
+    """
+    voter = np.asarray(voter, dtype=np.int64)
+    timestamp = np.asarray(timestamp, dtype=np.int64)
+    model = simulate(
+        voter, timestamp, choice, holds, start_time, end_time, balance, options
+    )
+    mirrored = model.tallies[::-1].tolist()
+    expected = [
+        (model.tallies.tolist(), (model.payouts, model.refund), lambda c: c),
+        (mirrored, payout(balance, mirrored), lambda c: mirror(c, options)),
+    ]
+    deployment = _Deployment(start_time, end_time, balance, options)
+
+    mismatches = []
+    # The ledger runs events in time order; ties keep their arrival order.
+    for i in np.lexsort((np.arange(len(voter)), timestamp)):
+        deployment.event(
+            int(voter[i]), int(timestamp[i]), int(choice[i]), bool(holds[i])
+        )
+
+    for challenge_id, (tallies, paid, choose) in zip(
+        deployment.challenge_ids, expected
+    ):
+        name = "challenge {}".format(challenge_id)
+        for voter_id, final in zip(model.voters.tolist(), model.final_choice.tolist()):
+            actual = deployment.final_choice(voter_id, challenge_id)
+            if actual != choose(final):
+                mismatches.append(
+                    "{} voter {}: model {} contract {}".format(
+                        name, voter_id, choose(final), actual
+                    )
+                )
+        actual = deployment.tallies(challenge_id)
+        if actual != tallies:
+            mismatches.append(
+                "{} tallies: model {} contract {}".format(name, tallies, actual)
+            )
+        actual = deployment.complete(end_time, challenge_id)
+        if actual != paid:
+            mismatches.append(
+                "{} payout: model {} contract {}".format(name, paid, actual)
+            )
+    return mismatches